@@ -0,0 +1,798 @@
+#!/usr/bin/env python3
+
+# Benchmarks the board operations against local stand-ins, so that they can run
+# without a board: the UART is a pty pair or a pyserial loop:// port, the clock
+# IC is an emulated Si5351 behind an I2C port and the USB devices are a
+# generated sysfs tree. pyftdi does not ship its virtual USB backend, so the
+# clock IC is programmed through the port instead of an enumerated device.
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from fractions import Fraction
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple
+from loguru import logger
+
+SOFTWARE_DIRECTORY = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SOFTWARE_DIRECTORY))
+
+# The uploads store the bitstreams and record the boards in the cache
+# directory, which the project modules resolve on import. A temporary one keeps
+# the runs from touching the state of the real boards.
+CACHE_DIRECTORY = tempfile.TemporaryDirectory(prefix="fabulous_benchmark_")
+os.environ["XDG_CACHE_HOME"] = CACHE_DIRECTORY.name
+
+from clock_setup.clock_setup import (  # noqa: E402
+    configure_clock_ic,
+    REGISTER_CRYSTAL_INTERNAL_LOAD_CAPACITANCE,
+    REGISTER_PLL_RESET,
+)
+from clock_setup.frequency_planner import plan_frequencies  # noqa: E402
+from clock_setup.read_register_config import (  # noqa: E402
+    compile_register_config,
+    read_register_config,
+    RegisterConfig,
+)
+from modules.bitstream import FABRICS_DIRECTORY, PREAMBLE_SIZE  # noqa: E402
+from modules.board_state import forget_last_bitstream  # noqa: E402
+from modules.usb_topology import UsbTopologyIndex, scan_tty_devices  # noqa: E402
+from upload_bitstream.upload_bitstream import (  # noqa: E402
+    open_bitstream,
+    upload_to_port,
+    UploadOptions,
+    DEFAULT_BAUDRATE,
+)
+
+RESULTS_VERSION = 1
+DEFAULT_BASELINE = SOFTWARE_DIRECTORY / "benchmarks" / "baseline.json"
+DEFAULT_RUNS = 5
+DEFAULT_TOLERANCE = 0.25
+DEFAULT_SYNTHETIC_SIZES = [1 << 20, 16 << 20]
+DEFAULT_DEVICE_COUNT = 64
+
+FABRICS = ["mpw2", "mpw5"]
+REGISTER_CONFIG_FILE = (
+    SOFTWARE_DIRECTORY / "clock_setup" / "Si5351A-RevB-Registers_10_2_20.txt"
+)
+PLANNED_FREQUENCIES = {
+    "10M_2M_20M": (Fraction(10_000_000), Fraction(2_000_000), Fraction(20_000_000)),
+    "13.56M_off_32.768k": (Fraction(13_560_000), None, Fraction(32_768)),
+}
+
+PORT_PTY = "pty"
+PORT_LOOP = "loop"
+PORTS = [PORT_PTY, PORT_LOOP]
+
+GROUP_UPLOAD = "upload"
+GROUP_CLOCK = "clock"
+GROUP_DISCOVERY = "discovery"
+GROUPS = [GROUP_UPLOAD, GROUP_CLOCK, GROUP_DISCOVERY]
+
+# The standard mode clock of the I2C bus of the FTDI adapter
+I2C_BUS_FREQUENCY = 100_000
+# Start and stop condition plus the address byte with its acknowledge
+I2C_TRANSACTION_OVERHEAD_BITS = 2 + 9
+I2C_BITS_PER_BYTE = 9
+
+# Counts and sizes are deterministic, so any increase is a regression
+EXACT_METRICS = {"transactions", "reads", "bytes_written", "total_bytes", "devices"}
+# Timings and memory may deviate by the tolerance plus an absolute slack, which
+# keeps short benchmarks from failing on scheduling noise. The throughput is
+# derived from the wall time and only reported.
+TOLERATED_METRICS = {"wall_time": 0.002, "bus_time": 0.0, "peak_memory": 4096}
+
+
+class BenchmarkResult(NamedTuple):
+    """Defines the metrics of a single benchmark.
+
+    Attributes:
+        name    (str): The name of the benchmark, prefixed with its group.
+        metrics (Dict[str, float]): The measured metrics by name.
+    """
+
+    name: str
+    metrics: Dict[str, float]
+
+
+class Regression(NamedTuple):
+    """Defines a metric that got worse than the baseline.
+
+    Attributes:
+        name     (str): The name of the benchmark.
+        metric   (str): The name of the metric.
+        baseline (float): The value of the baseline.
+        value    (float): The measured value.
+    """
+
+    name: str
+    metric: str
+    baseline: float
+    value: float
+
+
+class EmulatedSi5351:
+    """An I2C port of a Si5351 clock IC backed by a register map.
+
+    It implements the parts of the pyftdi I2cPort used by the clock setup and
+    counts the transactions.
+    """
+
+    # The load capacitance reset value, checked when connecting
+    RESET_VALUES = {REGISTER_CRYSTAL_INTERNAL_LOAD_CAPACITANCE: 0xD2}
+
+    def __init__(self):
+        """Create a clock IC in its reset state."""
+        self.registers = bytearray(256)
+        for address, value in self.RESET_VALUES.items():
+            self.registers[address] = value
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        """Reset the transaction counters."""
+        self.writes = 0
+        self.reads = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    def write_to(self, regaddr: int, out: bytes) -> None:
+        """Write consecutive registers in one transaction.
+
+        :param regaddr: The address of the first register.
+        :type regaddr: int
+        :param out: The register values.
+        :type out: bytes
+        """
+        self.writes += 1
+        self.bytes_written += len(out) + 1
+        self.registers[regaddr : regaddr + len(out)] = out
+        # The PLL reset bits clear themselves
+        self.registers[REGISTER_PLL_RESET] = 0
+
+    def read_from(self, regaddr: int, readlen: int = 0) -> bytes:
+        """Read consecutive registers in one transaction.
+
+        :param regaddr: The address of the first register.
+        :type regaddr: int
+        :param readlen: The number of registers.
+        :type readlen: int
+        :return: The register values.
+        :rtype: bytes
+        """
+        self.reads += 1
+        self.bytes_read += readlen
+        return bytes(self.registers[regaddr : regaddr + readlen])
+
+    @property
+    def bus_time(self) -> float:
+        """The time the transactions take on the I2C bus in seconds, ignoring
+        the USB latency of the adapter."""
+        # A read is a register address write followed by a repeated start
+        transactions = self.writes + 2 * self.reads
+        bits = (
+            transactions * I2C_TRANSACTION_OVERHEAD_BITS
+            + (self.bytes_written + self.reads + self.bytes_read) * I2C_BITS_PER_BYTE
+        )
+        return bits / I2C_BUS_FREQUENCY
+
+
+def __setup_parser() -> argparse.Namespace:
+    """Set up the parser for the command line arguments
+
+    :returns: The parsed arguments.
+    :rtype: argsparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the board operations without hardware"
+    )
+    parser.add_argument(
+        "-g",
+        "--group",
+        help="Only run the given groups of benchmarks. Defaults to all.",
+        choices=GROUPS,
+        action="append",
+    )
+    parser.add_argument(
+        "-r",
+        "--runs",
+        help=f"""The number of runs per benchmark, the fastest one is reported.
+        Defaults to {DEFAULT_RUNS}.""",
+        type=int,
+        default=DEFAULT_RUNS,
+    )
+    parser.add_argument(
+        "-p",
+        "--port",
+        help=f"""The stand-in for the UART of the board. The pty pair goes
+        through the kernel tty driver like a real board, loop:// is slower
+        than the upload itself. Defaults to {PORT_PTY}.""",
+        choices=PORTS,
+        default=PORT_PTY,
+    )
+    parser.add_argument(
+        "-b",
+        "--baudrate",
+        help=f"""The baud rate of the uploads, only relevant with --pace.
+        Defaults to {DEFAULT_BAUDRATE}.""",
+        type=int,
+        default=DEFAULT_BAUDRATE,
+    )
+    parser.add_argument(
+        "--pace",
+        help="""Pace the uploads against the baud rate, which measures the
+        wire instead of the host.""",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-s",
+        "--synthetic_size",
+        help="""The size in bytes of a synthetic bitstream to be uploaded in
+        addition to the shipped ones. Defaults to 1 MiB and 16 MiB.""",
+        type=int,
+        action="append",
+    )
+    parser.add_argument(
+        "-d",
+        "--devices",
+        help=f"""The number of boards in the generated sysfs tree. Defaults to
+        {DEFAULT_DEVICE_COUNT}.""",
+        type=int,
+        default=DEFAULT_DEVICE_COUNT,
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        help="Write the results as JSON to the given file.",
+        type=str,
+    )
+    parser.add_argument(
+        "--baseline",
+        help=f"""The results to compare against. Defaults to
+        {DEFAULT_BASELINE}.""",
+        type=str,
+        default=str(DEFAULT_BASELINE),
+    )
+    parser.add_argument(
+        "--save_baseline",
+        help="Store the results as the new baseline instead of comparing.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--portable",
+        help="""Only store the counts in the baseline, which do not depend on
+        the host, e.g. for a baseline kept in the repository.""",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-t",
+        "--tolerance",
+        help=f"""The relative deviation of a timing or memory metric from the
+        baseline that counts as a regression. Defaults to
+        {DEFAULT_TOLERANCE}.""",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+    )
+    return parser.parse_args()
+
+
+def measure(
+    name: str, benchmark: Callable[[], Dict[str, float]], runs: int
+) -> BenchmarkResult:
+    """Run a benchmark several times and keep the fastest run.
+
+    The peak memory is measured in an additional run, since tracing the
+    allocations slows down the code under test.
+
+    :param name: The name of the benchmark.
+    :type name: str
+    :param benchmark: Runs the code under test once and returns its metrics,
+    including its wall time.
+    :type benchmark: Callable[[], Dict[str, float]]
+    :param runs: The number of timed runs.
+    :type runs: int
+    :return: The metrics of the fastest run and the peak memory.
+    :rtype: BenchmarkResult
+    """
+    best = None
+    for _ in range(runs):
+        metrics = benchmark()
+        if best is None or metrics["wall_time"] < best["wall_time"]:
+            best = metrics
+
+    tracemalloc.start()
+    try:
+        benchmark()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = BenchmarkResult(name, {**best, "peak_memory": peak_memory})
+    logger.info(
+        f"{name}: {result.metrics['wall_time'] * 1000:.3f} ms,"
+        + f" peak {peak_memory / 1024:.1f} KiB"
+    )
+    return result
+
+
+@contextmanager
+def open_pty_port() -> Iterator[str]:
+    """Create a pty pair whose master side is drained by a thread.
+
+    :return: The path of the slave side, valid inside the context.
+    :rtype: Iterator[str]
+    """
+    import pty
+    import tty
+
+    master, slave = pty.openpty()
+    tty.setraw(slave)
+    stop = threading.Event()
+
+    def drain() -> None:
+        while not stop.is_set():
+            try:
+                os.read(master, 1 << 16)
+            except OSError:
+                return
+
+    thread = threading.Thread(target=drain, daemon=True)
+    thread.start()
+    try:
+        yield os.ttyname(slave)
+    finally:
+        stop.set()
+        os.close(slave)
+        os.close(master)
+        thread.join(timeout=1)
+
+
+@contextmanager
+def open_port(port: str) -> Iterator[str]:
+    """Provide a stand-in for the UART of the board.
+
+    :param port: The kind of stand-in, one of PORTS.
+    :type port: str
+    :return: The pyserial URL or device path, valid inside the context.
+    :rtype: Iterator[str]
+    """
+    if port == PORT_PTY:
+        with open_pty_port() as device_path:
+            yield device_path
+    else:
+        yield "loop://"
+
+
+def build_synthetic_bitstream(template: memoryview, size: int) -> bytes:
+    """Build a valid bitstream of at least the given size by repeating the
+    frame records of a template.
+
+    :param template: A bitstream whose records are repeated.
+    :type template: memoryview
+    :param size: The minimum size in bytes.
+    :type size: int
+    :return: The synthetic bitstream.
+    :rtype: bytes
+    """
+    records = bytes(template[PREAMBLE_SIZE:])
+    repetitions = max(1, -(-(size - PREAMBLE_SIZE) // len(records)))
+    return bytes(template[:PREAMBLE_SIZE]) + records * repetitions
+
+
+def benchmark_upload(
+    name: str,
+    data: memoryview,
+    device_path: str,
+    baudrate: int,
+    options: UploadOptions,
+    prepare: Callable[[str], None] | None = None,
+) -> Dict[str, float]:
+    """Upload a bitstream once.
+
+    :param name: The name of the benchmark, used as key of the board.
+    :type name: str
+    :param data: The bitstream.
+    :type data: memoryview
+    :param device_path: The port to upload to.
+    :type device_path: str
+    :param baudrate: The baud rate of the upload.
+    :type baudrate: int
+    :param options: Defines how the bitstream is transmitted.
+    :type options: UploadOptions
+    :param prepare: Called with the key of the board before the upload, e.g.
+    to record a previous upload.
+    :type prepare: Callable[[str], None] | None
+    :return: The metrics of the upload.
+    :rtype: Dict[str, float]
+    """
+    board_key = f"benchmark-{name}"
+    if prepare is not None:
+        prepare(board_key)
+
+    start = time.perf_counter()
+    statistics = upload_to_port(data, device_path, board_key, baudrate, options)
+    wall_time = time.perf_counter() - start
+    forget_last_bitstream(board_key)
+
+    return {
+        "total_bytes": statistics.total_bytes,
+        "wall_time": wall_time,
+        "throughput": len(data) / wall_time,
+    }
+
+
+def run_upload_benchmarks(args: argparse.Namespace) -> List[BenchmarkResult]:
+    """Benchmark the uploads of the shipped and synthetic bitstreams.
+
+    The throughput is given in bitstream bytes per second, so reducing the
+    transmitted data shows up as a higher throughput.
+
+    :param args: The parsed arguments.
+    :type args: argparse.Namespace
+    :return: The results.
+    :rtype: List[BenchmarkResult]
+    """
+    options = UploadOptions(pace=args.pace)
+    results = []
+    with open_port(args.port) as device_path:
+
+        def upload(
+            name: str,
+            data: memoryview,
+            options: UploadOptions,
+            prepare: Callable[[str], None] | None = None,
+        ) -> None:
+            results.append(
+                measure(
+                    f"{GROUP_UPLOAD}/{name}",
+                    lambda: benchmark_upload(
+                        name, data, device_path, args.baudrate, options, prepare
+                    ),
+                    args.runs,
+                )
+            )
+
+        for fabric in FABRICS:
+            bitstream_file = str(FABRICS_DIRECTORY / fabric / f"{fabric}.bin")
+            with open_bitstream(bitstream_file) as data:
+                upload(fabric, data, options)
+                upload(f"{fabric}_sparse", data, options._replace(sparse=True))
+                # A diff against the same bitstream only sends the preamble
+                diff_options = options._replace(diff=True)
+                upload(
+                    f"{fabric}_diff",
+                    data,
+                    diff_options,
+                    lambda board_key: upload_to_port(
+                        data, device_path, board_key, args.baudrate, diff_options
+                    ),
+                )
+                # The board already holds the bitstream, so nothing is sent
+                loaded_options = options._replace(skip_loaded=True)
+                upload(
+                    f"{fabric}_loaded",
+                    data,
+                    loaded_options,
+                    lambda board_key: upload_to_port(
+                        data, device_path, board_key, args.baudrate, loaded_options
+                    ),
+                )
+
+        with open_bitstream(str(FABRICS_DIRECTORY / "mpw2" / "mpw2.bin")) as template:
+            for size in args.synthetic_size or DEFAULT_SYNTHETIC_SIZES:
+                data = memoryview(build_synthetic_bitstream(template, size))
+                upload(f"synthetic_{size}", data, options)
+    return results
+
+
+def benchmark_clock(
+    config: RegisterConfig, incremental: bool, initial: RegisterConfig | None
+) -> Dict[str, float]:
+    """Program an emulated clock IC once.
+
+    :param config: The register configuration to be written.
+    :type config: RegisterConfig
+    :param incremental: Only write the differing registers.
+    :type incremental: bool
+    :param initial: The configuration the clock IC holds before, if any.
+    :type initial: RegisterConfig | None
+    :return: The metrics of the programming.
+    :rtype: Dict[str, float]
+    """
+    clock_ic = EmulatedSi5351()
+    if initial is not None:
+        for register in initial.registers:
+            clock_ic.registers[register.address] = register.value
+    clock_ic.reset_counters()
+
+    start = time.perf_counter()
+    statistics = configure_clock_ic(clock_ic, config, incremental)
+    wall_time = time.perf_counter() - start
+
+    return {
+        "transactions": statistics.transactions,
+        "reads": clock_ic.reads,
+        "bytes_written": clock_ic.bytes_written,
+        "bus_time": clock_ic.bus_time,
+        "wall_time": wall_time,
+    }
+
+
+def run_clock_benchmarks(args: argparse.Namespace) -> List[BenchmarkResult]:
+    """Benchmark programming the clock IC with the shipped export and planned
+    configurations.
+
+    :param args: The parsed arguments.
+    :type args: argparse.Namespace
+    :return: The results.
+    :rtype: List[BenchmarkResult]
+    """
+    configs = {
+        "export": compile_register_config(read_register_config(REGISTER_CONFIG_FILE))
+    }
+    for name, frequencies in PLANNED_FREQUENCIES.items():
+        plan = plan_frequencies(frequencies)
+        configs[f"plan_{name}"] = compile_register_config(list(plan.registers))
+
+    results = []
+    for name, config in configs.items():
+        cases = {
+            "full": (False, None),
+            "incremental_unchanged": (True, config),
+            "incremental_from_export": (True, configs["export"]),
+        }
+        for case, (incremental, initial) in cases.items():
+            if name == "export" and case == "incremental_from_export":
+                continue
+            results.append(
+                measure(
+                    f"{GROUP_CLOCK}/{name}_{case}",
+                    lambda: benchmark_clock(config, incremental, initial),
+                    args.runs,
+                )
+            )
+    return results
+
+
+def create_fake_sysfs(root: Path, device_count: int) -> None:
+    """Create a sysfs and dev tree with FTDI boards behind a chain of hubs.
+
+    Every hub has four ports, the first three of them connect boards and the
+    last one the next hub.
+
+    :param root: The directory containing the sys and dev trees.
+    :type root: Path
+    :param device_count: The number of boards.
+    :type device_count: int
+    """
+    devices = root / "sys" / "devices" / "pci0000:00" / "0000:00:14.0" / "usb1"
+    tty_class = root / "sys" / "class" / "tty"
+    tty_class.mkdir(parents=True)
+    (root / "dev").mkdir()
+
+    def add_usb_device(directory: Path, devnum: int, devpath: str, serial: str = ""):
+        directory.mkdir(parents=True)
+        (directory / "busnum").write_text("1\n")
+        (directory / "devnum").write_text(f"{devnum}\n")
+        (directory / "devpath").write_text(f"{devpath}\n")
+        if serial:
+            (directory / "serial").write_text(f"{serial}\n")
+
+    add_usb_device(devices, 1, "0")
+    hub_directory = devices
+    hub_chain: List[int] = []
+    devnum = 2
+    for index in range(device_count):
+        if index % 3 == 0:
+            hub_chain.append(4 if hub_chain else 1)
+            hub_name = f"1-{'.'.join(str(port) for port in hub_chain)}"
+            hub_directory = hub_directory / hub_name
+            add_usb_device(hub_directory, devnum, ".".join(map(str, hub_chain)))
+            devnum += 1
+
+        port_chain = hub_chain + [index % 3 + 1]
+        devpath = ".".join(str(port) for port in port_chain)
+        device_directory = hub_directory / f"1-{devpath}"
+        add_usb_device(device_directory, devnum, devpath, f"FT{index:06d}")
+        devnum += 1
+
+        tty_name = f"ttyUSB{index}"
+        serial_port = device_directory / f"1-{devpath}:1.0" / tty_name
+        tty_directory = serial_port / "tty" / tty_name
+        tty_directory.mkdir(parents=True)
+        (tty_directory / "device").symlink_to(serial_port)
+        (tty_class / tty_name).symlink_to(tty_directory)
+
+
+def benchmark_discovery(sysfs_root: Path, dev_root: Path) -> Dict[str, float]:
+    """Index the tty devices of a sysfs tree and look up every device once.
+
+    :param sysfs_root: The root of the sysfs tree.
+    :type sysfs_root: Path
+    :param dev_root: The directory containing the device nodes.
+    :type dev_root: Path
+    :return: The metrics of the discovery.
+    :rtype: Dict[str, float]
+    """
+    start = time.perf_counter()
+    index = UsbTopologyIndex(sysfs_root, dev_root)
+    entries = index.entries
+    for entry in entries:
+        index.find_by_address(entry.bus, entry.devnum)
+        index.find_by_location(entry.bus, entry.port_chain)
+    wall_time = time.perf_counter() - start
+    return {"devices": len(entries), "wall_time": wall_time}
+
+
+def run_discovery_benchmarks(args: argparse.Namespace) -> List[BenchmarkResult]:
+    """Benchmark the device discovery on a generated sysfs tree.
+
+    :param args: The parsed arguments.
+    :type args: argparse.Namespace
+    :return: The results.
+    :rtype: List[BenchmarkResult]
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        root = Path(directory)
+        create_fake_sysfs(root, args.devices)
+        sysfs_root = root / "sys"
+        dev_root = root / "dev"
+
+        found = len(scan_tty_devices(sysfs_root, dev_root))
+        if found != args.devices:
+            logger.error(f"Found {found} of {args.devices} devices in the sysfs tree")
+
+        return [
+            measure(
+                f"{GROUP_DISCOVERY}/sysfs_{args.devices}",
+                lambda: benchmark_discovery(sysfs_root, dev_root),
+                args.runs,
+            )
+        ]
+
+
+def compare_results(
+    results: List[BenchmarkResult],
+    baseline: Dict[str, Dict[str, float]],
+    tolerance: float,
+) -> List[Regression]:
+    """Compare the results against a baseline.
+
+    Counts must not increase, timings and memory may deviate by the
+    tolerance. Benchmarks and metrics missing in the baseline are ignored.
+
+    :param results: The results of the benchmarks.
+    :type results: List[BenchmarkResult]
+    :param baseline: The metrics of the baseline by benchmark name.
+    :type baseline: Dict[str, Dict[str, float]]
+    :param tolerance: The relative deviation counting as a regression.
+    :type tolerance: float
+    :return: The regressions.
+    :rtype: List[Regression]
+    """
+    regressions = []
+    for result in results:
+        reference = baseline.get(result.name, {})
+        for metric, value in result.metrics.items():
+            if metric not in reference:
+                continue
+            expected = reference[metric]
+            if metric in EXACT_METRICS:
+                regressed = value > expected
+            elif metric in TOLERATED_METRICS:
+                slack = TOLERATED_METRICS[metric]
+                regressed = value > expected * (1 + tolerance) + slack
+            else:
+                regressed = False
+            if regressed:
+                regressions.append(Regression(result.name, metric, expected, value))
+    return regressions
+
+
+def serialize_results(results: List[BenchmarkResult], portable: bool = False) -> Dict:
+    """Convert the results into a JSON object.
+
+    :param results: The results of the benchmarks.
+    :type results: List[BenchmarkResult]
+    :param portable: Only keep the metrics that do not depend on the host.
+    :type portable: bool
+    :return: The JSON object including a description of the host.
+    :rtype: Dict
+    """
+    if portable:
+        results = [
+            result._replace(
+                metrics={
+                    metric: value
+                    for metric, value in result.metrics.items()
+                    if metric in EXACT_METRICS
+                }
+            )
+            for result in results
+        ]
+    return {
+        "version": RESULTS_VERSION,
+        "host": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+        },
+        "results": {result.name: result.metrics for result in results},
+    }
+
+
+def load_baseline(path: Path) -> Dict[str, Dict[str, float]] | None:
+    """Load the results stored as baseline.
+
+    :param path: The path of the baseline.
+    :type path: Path
+    :return: The metrics by benchmark name, or None if there is no baseline.
+    :rtype: Dict[str, Dict[str, float]] | None
+    """
+    try:
+        content = json.loads(path.read_text())
+    except FileNotFoundError:
+        return None
+    if content.get("version") != RESULTS_VERSION:
+        logger.warning(f"Ignoring the baseline {path} of another version")
+        return None
+    return content["results"]
+
+
+def main() -> None:
+    """The main function containing the application logic."""
+    args = __setup_parser()
+
+    # Only show the results, not the logs of the code under test
+    logger.remove()
+    logger.add(
+        sys.stderr,
+        level="INFO",
+        filter=lambda record: record["name"] == "__main__"
+        or record["level"].no >= logger.level("WARNING").no,
+    )
+
+    benchmarks: Dict[str, Callable[[argparse.Namespace], List[BenchmarkResult]]] = {
+        GROUP_UPLOAD: run_upload_benchmarks,
+        GROUP_CLOCK: run_clock_benchmarks,
+        GROUP_DISCOVERY: run_discovery_benchmarks,
+    }
+    results = []
+    for group in args.group or GROUPS:
+        results += benchmarks[group](args)
+
+    content = serialize_results(results)
+    if args.output:
+        Path(args.output).write_text(json.dumps(content, indent=2) + "\n")
+
+    baseline_path = Path(args.baseline)
+    if args.save_baseline:
+        content = serialize_results(results, args.portable)
+        baseline_path.write_text(json.dumps(content, indent=2) + "\n")
+        logger.info(f"Stored the results as baseline in {baseline_path}")
+        return
+
+    baseline = load_baseline(baseline_path)
+    if baseline is None:
+        logger.info(f"No baseline in {baseline_path}, store one with --save_baseline")
+        return
+
+    regressions = compare_results(results, baseline, args.tolerance)
+    for regression in regressions:
+        logger.error(
+            f"{regression.name}: {regression.metric} regressed from"
+            + f" {regression.baseline:g} to {regression.value:g}"
+        )
+    if regressions:
+        exit(1)
+    logger.info(f"No regressions against {baseline_path}")
+
+
+if __name__ == "__main__":
+    main()
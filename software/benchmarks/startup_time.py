@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+import argparse
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+from loguru import logger
+
+SOFTWARE_DIRECTORY = Path(__file__).resolve().parent.parent
+
+DEFAULT_BUDGET = 200.0
+DEFAULT_RUNS = 5
+
+# Modules that must only be loaded by the commands using them
+DEFAULT_FORBIDDEN_MODULES = ["pyftdi", "pyudev", "inquirer", "numpy", "usb"]
+
+# The modules imported by the commands before they touch any hardware
+SCENARIOS = {
+    "board": ["board"],
+    "upload": ["board", "upload_bitstream.upload_bitstream"],
+    "config_clocks": ["board", "clock_setup.clock_setup"],
+    "serve": ["board", "modules.board_daemon"],
+}
+
+IMPORT_TIME_PATTERN = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)$")
+
+
+class StartupTime(NamedTuple):
+    """Defines the import time of a scenario.
+
+    Attributes:
+        scenario   (str): The name of the scenario.
+        total_time (float): The import time of all modules in milliseconds.
+        modules    (Dict[str, float]): The cumulative import time of every
+                                       loaded module in milliseconds.
+    """
+
+    scenario: str
+    total_time: float
+    modules: Dict[str, float]
+
+
+def __setup_parser() -> argparse.Namespace:
+    """Set up the parser for the command line arguments
+
+    :returns: The parsed arguments.
+    :rtype: argsparse.Namespace
+    """
+    parser = argparse.ArgumentParser(
+        description="Measure the startup time of the command line tools"
+    )
+    parser.add_argument(
+        "-b",
+        "--budget",
+        help=f"""The maximum import time of a scenario in milliseconds.
+        Defaults to {DEFAULT_BUDGET}.""",
+        type=float,
+        default=DEFAULT_BUDGET,
+    )
+    parser.add_argument(
+        "-r",
+        "--runs",
+        help=f"""The number of runs per scenario, the fastest one is reported.
+        Defaults to {DEFAULT_RUNS}.""",
+        type=int,
+        default=DEFAULT_RUNS,
+    )
+    parser.add_argument(
+        "-s",
+        "--scenario",
+        help="Only measure the given scenarios. Defaults to all.",
+        choices=list(SCENARIOS),
+        action="append",
+    )
+    parser.add_argument(
+        "-f",
+        "--forbidden",
+        help=f"""A top level module that must not be loaded by any scenario.
+        Defaults to {", ".join(DEFAULT_FORBIDDEN_MODULES)}.""",
+        action="append",
+    )
+    parser.add_argument(
+        "-t",
+        "--top",
+        help="The number of the slowest modules to be shown per scenario.",
+        type=int,
+        default=5,
+    )
+    return parser.parse_args()
+
+
+def parse_import_time(output: str) -> Tuple[float, Dict[str, float]]:
+    """Parse the output of python -X importtime.
+
+    :param output: The standard error of the interpreter.
+    :type output: str
+    :return: The import time of all modules and the cumulative import time of
+    every module in milliseconds.
+    :rtype: Tuple[float, Dict[str, float]]
+    """
+    total_time = 0.0
+    modules = {}
+    for line in output.splitlines():
+        match = IMPORT_TIME_PATTERN.match(line)
+        if match is None:
+            continue
+        cumulative_time = int(match.group(2)) / 1000
+        modules[match.group(4)] = cumulative_time
+        # Nested imports are indented and already part of their parent
+        if len(match.group(3)) == 1:
+            total_time += cumulative_time
+    return total_time, modules
+
+
+def measure_import_time(modules: List[str]) -> Tuple[float, Dict[str, float]]:
+    """Import modules in a fresh interpreter and record the import times.
+
+    :param modules: The modules to be imported.
+    :type modules: List[str]
+    :return: The import time of all modules and the cumulative import time of
+    every loaded module in milliseconds.
+    :rtype: Tuple[float, Dict[str, float]]
+    :raises subprocess.CalledProcessError: If an import failed.
+    """
+    statements = "; ".join(f"import {module}" for module in modules)
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statements],
+        cwd=SOFTWARE_DIRECTORY,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return parse_import_time(process.stderr)
+
+
+def measure_scenario(scenario: str, runs: int) -> StartupTime:
+    """Measure the fastest of several runs of a scenario.
+
+    :param scenario: The name of the scenario, one of SCENARIOS.
+    :type scenario: str
+    :param runs: The number of runs.
+    :type runs: int
+    :return: The import times of the fastest run.
+    :rtype: StartupTime
+    """
+    best = None
+    for _ in range(runs):
+        total_time, modules = measure_import_time(SCENARIOS[scenario])
+        if best is None or total_time < best.total_time:
+            best = StartupTime(scenario, total_time, modules)
+    return best
+
+
+def find_forbidden_modules(
+    startup_time: StartupTime, forbidden_modules: List[str]
+) -> List[str]:
+    """Find the forbidden modules loaded by a scenario.
+
+    :param startup_time: The import times of the scenario.
+    :type startup_time: StartupTime
+    :param forbidden_modules: The top level modules that must not be loaded.
+    :type forbidden_modules: List[str]
+    :return: The loaded forbidden modules.
+    :rtype: List[str]
+    """
+    return sorted(
+        {module.split(".")[0] for module in startup_time.modules}
+        & set(forbidden_modules)
+    )
+
+
+def main() -> None:
+    """The main function containing the application logic."""
+    args = __setup_parser()
+    scenarios = args.scenario or list(SCENARIOS)
+    forbidden_modules = args.forbidden or DEFAULT_FORBIDDEN_MODULES
+
+    failed = False
+    for scenario in scenarios:
+        startup_time = measure_scenario(scenario, args.runs)
+        logger.info(f"{scenario}: {startup_time.total_time:.1f} ms")
+
+        slowest = sorted(
+            startup_time.modules.items(), key=lambda item: item[1], reverse=True
+        )
+        for module, time in slowest[1 : args.top + 1]:
+            logger.debug(f"    {module}: {time:.1f} ms")
+
+        if startup_time.total_time > args.budget:
+            logger.error(
+                f"{scenario} exceeds the budget of {args.budget:.1f} ms"
+                + f" by {startup_time.total_time - args.budget:.1f} ms"
+            )
+            failed = True
+
+        loaded = find_forbidden_modules(startup_time, forbidden_modules)
+        if loaded:
+            logger.error(f"{scenario} loads {', '.join(loaded)} at startup")
+            failed = True
+
+    if failed:
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,27 +1,46 @@
 #!/usr/bin/env python3
 
+# The modules of a command are imported by the command itself, so that the
+# startup only pays for the command that is run
+from __future__ import annotations
+
 import argparse
+import atexit
+import contextlib
+import os
+import re
+import subprocess
 import sys
-from clock_setup.clock_setup import program_clock_ic, CrystalError
-from upload_bitstream.upload_bitstream import upload_bitstream
-from pyftdi.i2c import I2cController
+from fractions import Fraction
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple, Type, TYPE_CHECKING
 from loguru import logger
-from modules.ftdi_access import (
-    DEFAULT_FTDI_ID,
-    MultipleDevicesError,
-    NoDeviceFoundError,
-)
-from modules.usb_port_power_control import (
-    power_cycle_usb_port,
-    OnlyLinuxSupportedError,
-    ProgramNotInstalledError,
-    OutDatedLinuxKernelVersionError,
+from modules.board_daemon import (
+    BoardDaemon,
+    DaemonAlreadyRunningError,
+    DaemonJobError,
+    DaemonNotRunningError,
+    InsecureSocketDirectoryError,
+    DEFAULT_SOCKET_PATH,
 )
+from modules.ftdi_access import DEFAULT_FTDI_ID
+from modules.metrics import disable_metrics, enable_metrics, DEFAULT_METRICS_DIRECTORY
+
+if TYPE_CHECKING:
+    from pyftdi.ftdi import UsbDeviceDescriptor
+    from clock_setup.read_register_config import RegisterConfig
+    from modules.job_runner import StepResult
+    from modules.uart_capture import CaptureOptions
+    from upload_bitstream.upload_bitstream import UploadOptions
 
 
 class Commands:
     UPLOAD_COMMAND = "upload"
     CONFIG_CLOCKS_COMMAND = "config_clocks"
+    SERVE_COMMAND = "serve"
+    CLOCK_SWEEP_COMMAND = "clock_sweep"
+    RUN_COMMAND = "run"
+    PATCH_COMMAND = "patch"
 
 
 def setup_logger(verbosity: int):
@@ -44,49 +63,59 @@ def setup_logger(verbosity: int):
     logger.add(sys.stdout, format=log_format, level="DEBUG", colorize=True)
 
 
-def setup_parser() -> argparse.Namespace:
-    """Set up the parser for the command line arguments
+def add_clock_arguments(clock_parser: argparse.ArgumentParser) -> None:
+    """Define the arguments of the config_clocks command.
 
-    :returns: The parsed arguments.
-    :rtype: argsparse.Namespace
+    :param clock_parser: The parser of the command.
+    :type clock_parser: argparse.ArgumentParser
     """
-    clock_command = "config_clocks"
-    upload_command = "upload"
-    supported_commands = [clock_command, upload_command]
-    parser = argparse.ArgumentParser(description="FABulous board configuration")
-
-    # Create subparsers for clock and upload
-    subparsers = parser.add_subparsers(dest="command")
-
-    # Define the clock arguments
-    clock_parser = subparsers.add_parser(
-        clock_command, help="Run the clock functionality."
-    )
     clock_parser.add_argument(
         "register_config",
         type=str,
+        nargs="?",
         help="Specifies the register config to be used.",
     )
-    parser.add_argument(
-        "-i",
-        "--device_id",
-        help=f"""Specify the ID of the FDTI board. Find it out using lsusb.
-        Defaults to {DEFAULT_FTDI_ID}""",
+    clock_parser.add_argument(
+        "-f",
+        "--freq",
+        help="""Generate the configuration for the given frequencies of CLK0,
+        CLK1 and CLK2 instead of using a register config, e.g. 10M,2M,20M. An
+        empty entry disables the output.""",
         type=str,
-        default=DEFAULT_FTDI_ID,
     )
-    parser.add_argument(
-        "-v",
-        "--verbose",
-        default=False,
-        action="count",
-        help="Show detailed log information including function and line number",
+    clock_parser.add_argument(
+        "--incremental",
+        help="""Read back the registers of the clock IC and only write the ones
+        that differ. Nothing is written if the configuration is already
+        applied.""",
+        action="store_true",
     )
 
-    # Define the upload arguments
-    upload_parser = subparsers.add_parser(
-        upload_command, help="Run the upload functionality."
+
+def add_upload_arguments(upload_parser: argparse.ArgumentParser) -> None:
+    """Define the arguments of the upload command.
+
+    :param upload_parser: The parser of the command.
+    :type upload_parser: argparse.ArgumentParser
+    """
+    from clock_setup.frequency_planner import parse_frequency
+    from modules.baudrate import (
+        parse_baudrate,
+        BAUDRATE_AUTO,
+        DEFAULT_FABRIC,
+        FABRIC_PROFILES,
+    )
+    from modules.device_readiness import DEFAULT_READY_TIMEOUT
+    from modules.ftdi_uart import DEFAULT_LATENCY_TIMER, DEFAULT_TRANSFER_SIZE
+    from modules.uart_capture import DEFAULT_CAPTURE_BUFFER_SIZE, DEFAULT_CAPTURE_TIME
+    from modules.usb_port_power_control import POWER_SWITCH_NATIVE, POWER_SWITCHES
+    from upload_bitstream.upload_bitstream import (
+        DEFAULT_BOARD_TIMEOUT,
+        DEFAULT_CHUNK_SIZE,
+        TRANSPORT_TTY,
+        TRANSPORTS,
     )
+
     upload_parser.add_argument(
         "bitstream_file",
         type=str,
@@ -95,9 +124,51 @@ def setup_parser() -> argparse.Namespace:
     upload_parser.add_argument(
         "-b",
         "--baudrate",
-        help="Specifies the baudrate. Defaults to 57600 which is the eFPGAs baud rate at 10 MHz.",
+        help=f"""Specifies the baudrate, or {BAUDRATE_AUTO} to select the
+        fastest standard baud rate matching the fabric clock. Defaults to
+        {BAUDRATE_AUTO}.""",
+        type=parse_baudrate,
+        default=BAUDRATE_AUTO,
+    )
+    upload_parser.add_argument(
+        "--fabric",
+        help=f"""The fabric on the board, which defines how its UART derives
+        the baud rate from the fabric clock. Defaults to {DEFAULT_FABRIC}.""",
+        choices=list(FABRIC_PROFILES),
+        default=DEFAULT_FABRIC,
+    )
+    upload_parser.add_argument(
+        "--fabric_clock",
+        help="""The fabric clock used to select the baud rate, e.g. 20M.
+        Defaults to the clock recorded by the last config_clocks, or the
+        reference clock of the fabric.""",
+        type=parse_frequency,
+    )
+    upload_parser.add_argument(
+        "--clock_readback",
+        help="""Read the fabric clock back from the clock IC instead of using
+        the recorded one.""",
+        action="store_true",
+    )
+    upload_parser.add_argument(
+        "--probe",
+        help="""Find the fastest baud rate that loads the bitstream reliably by
+        uploading it at decreasing standard baud rates. Requires
+        --verify_command.""",
+        action="store_true",
+    )
+    upload_parser.add_argument(
+        "--verify_command",
+        help="""A shell command checking that the bitstream was loaded, e.g. a
+        test of the design. A zero exit status counts as success.""",
+        type=str,
+    )
+    upload_parser.add_argument(
+        "--probe_attempts",
+        help="""The number of successful uploads required for a baud rate to
+        count as reliable. Defaults to 3.""",
         type=int,
-        default=57600,
+        default=3,
     )
     upload_parser.add_argument(
         "-r",
@@ -106,12 +177,26 @@ def setup_parser() -> argparse.Namespace:
         type=bool,
         default=False,
     )
+    upload_parser.add_argument(
+        "--reset_timeout",
+        help=f"""The maximum time in seconds to wait for the device to come
+        back after the reset. Defaults to {DEFAULT_READY_TIMEOUT}.""",
+        type=float,
+        default=DEFAULT_READY_TIMEOUT,
+    )
     upload_parser.add_argument(
         "-u",
         "--usb_port",
         help="""The USB port to be turned off for the device reset (required if
         the device should be reset).""",
-        type=str,
+        type=int,
+    )
+    upload_parser.add_argument(
+        "--power_switch",
+        help=f"""Switch the USB port through hub requests sent by the script
+        itself, or through uhubctl. Defaults to {POWER_SWITCH_NATIVE}.""",
+        choices=POWER_SWITCHES,
+        default=POWER_SWITCH_NATIVE,
     )
     upload_parser.add_argument(
         "-p",
@@ -125,16 +210,426 @@ def setup_parser() -> argparse.Namespace:
         help="The location (USB hub) of the USB port to be turned off.",
         type=str,
     )
+    upload_parser.add_argument(
+        "-c",
+        "--chunk_size",
+        help=f"""The maximum number of bytes written to the serial port at once.
+        Defaults to {DEFAULT_CHUNK_SIZE}.""",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+    )
+    upload_parser.add_argument(
+        "--no_pacing",
+        help="Do not pace the writes against the baudrate.",
+        action="store_true",
+    )
+    upload_parser.add_argument(
+        "-t",
+        "--transport",
+        help=f"""Use the kernel tty driver or access the FTDI chip directly
+        through pyftdi. Defaults to {TRANSPORT_TTY}.""",
+        choices=TRANSPORTS,
+        default=TRANSPORT_TTY,
+    )
+    upload_parser.add_argument(
+        "--latency_timer",
+        help=f"""The FTDI latency timer in milliseconds (ftdi transport only).
+        Defaults to {DEFAULT_LATENCY_TIMER}.""",
+        type=int,
+        default=DEFAULT_LATENCY_TIMER,
+    )
+    upload_parser.add_argument(
+        "--transfer_size",
+        help="""The size of a USB write transfer in bytes (ftdi transport
+        only). Defaults to the FIFO size of the chip.""",
+        type=int,
+        default=DEFAULT_TRANSFER_SIZE,
+    )
+    upload_parser.add_argument(
+        "-d",
+        "--diff",
+        help="""Only transmit the frames changed since the last upload to the
+        board. Ignored if the device is reset.""",
+        action="store_true",
+    )
+    upload_parser.add_argument(
+        "-s",
+        "--sparse",
+        help="""Skip the frames that equal the power-on state of the fabric.
+        Requires the device to be reset.""",
+        action="store_true",
+    )
+    upload_parser.add_argument(
+        "--skip_loaded",
+        help="""Skip the upload if the board already holds the bitstream since
+        its last power cycle. Ignored if the device is reset.""",
+        action="store_true",
+    )
+    upload_parser.add_argument(
+        "--capture",
+        help=f"""Keep the port open after the upload and show what the design
+        sends back for the given number of seconds. Defaults to
+        {DEFAULT_CAPTURE_TIME} if no time is given.""",
+        nargs="?",
+        const=DEFAULT_CAPTURE_TIME,
+        type=float,
+    )
+    upload_parser.add_argument(
+        "--trigger",
+        help="""End the capture once the output matches this regular
+        expression, e.g. 'PASS|FAIL' or '\\x55\\xaa'. Fails if it does not
+        match within the capture time. Implies --capture.""",
+        type=str,
+    )
+    upload_parser.add_argument(
+        "--capture_file",
+        help="Write every captured byte to this file. Implies --capture.",
+        type=str,
+    )
+    upload_parser.add_argument(
+        "--capture_buffer",
+        help=f"""The number of captured bytes kept in memory, older ones are
+        dropped. Defaults to {DEFAULT_CAPTURE_BUFFER_SIZE}.""",
+        type=int,
+        default=DEFAULT_CAPTURE_BUFFER_SIZE,
+    )
+    upload_parser.add_argument(
+        "-a",
+        "--all",
+        help="""Upload the bitstream concurrently to every device matching the
+        device ID.""",
+        action="store_true",
+    )
+    upload_parser.add_argument(
+        "--timeout",
+        help=f"""The time in seconds after which an upload to a single device
+        is reported as failed (only with --all). Defaults to
+        {DEFAULT_BOARD_TIMEOUT}.""",
+        type=float,
+        default=DEFAULT_BOARD_TIMEOUT,
+    )
+
+
+def add_serve_arguments(serve_parser: argparse.ArgumentParser) -> None:
+    """Define the arguments of the serve command.
+
+    :param serve_parser: The parser of the command.
+    :type serve_parser: argparse.ArgumentParser
+    """
+    # The socket to listen on is given by the global --socket option
+
+
+def add_clock_sweep_arguments(clock_sweep_parser: argparse.ArgumentParser) -> None:
+    """Define the arguments of the clock_sweep command.
+
+    :param clock_sweep_parser: The parser of the command.
+    :type clock_sweep_parser: argparse.ArgumentParser
+    """
+    from clock_setup.frequency_planner import parse_frequencies, parse_frequency
+
+    clock_sweep_parser.add_argument(
+        "start", type=parse_frequency, help="The first frequency, e.g. 10M."
+    )
+    clock_sweep_parser.add_argument(
+        "stop", type=parse_frequency, help="The last frequency, e.g. 100M."
+    )
+    clock_sweep_parser.add_argument(
+        "step",
+        type=parse_frequency,
+        help="The distance between two frequencies, e.g. 500k. The sweep runs "
+        "downwards if stop is below start.",
+    )
+    clock_sweep_parser.add_argument(
+        "-o",
+        "--output",
+        help="The clock output to be swept. Defaults to 0.",
+        type=int,
+        choices=range(3),
+        default=0,
+    )
+    clock_sweep_parser.add_argument(
+        "-f",
+        "--base_freq",
+        help="""The frequencies of the other outputs in the format of
+        config_clocks --freq, e.g. 10M,2M,20M. Outputs without frequency are
+        disabled.""",
+        type=parse_frequencies,
+        default=(),
+    )
+    clock_sweep_parser.add_argument(
+        "--hook_command",
+        help="""A shell command run at each step, e.g. a test of the design.
+        The frequency in Hz is passed in FABULOUS_CLOCK_FREQUENCY.""",
+        type=str,
+    )
+    clock_sweep_parser.add_argument(
+        "--settle",
+        help="The time in seconds to wait after a PLL reset. Defaults to 0.",
+        type=float,
+        default=0.0,
+    )
+
+
+def add_run_arguments(run_parser: argparse.ArgumentParser) -> None:
+    """Define the arguments of the run command.
+
+    :param run_parser: The parser of the command.
+    :type run_parser: argparse.ArgumentParser
+    """
+    run_parser.add_argument(
+        "manifest",
+        type=str,
+        help="The TOML manifest listing the boards and the steps.",
+    )
+    run_parser.add_argument(
+        "--report",
+        help="Write the timing and the result of every step as JSON.",
+        type=str,
+    )
+
+
+def add_patch_arguments(patch_parser: argparse.ArgumentParser) -> None:
+    """Define the arguments of the patch command.
+
+    :param patch_parser: The parser of the command.
+    :type patch_parser: argparse.ArgumentParser
+    """
+    from clock_setup.frequency_planner import parse_frequency
+    from modules.baudrate import (
+        parse_baudrate,
+        BAUDRATE_AUTO,
+        DEFAULT_FABRIC,
+        FABRIC_PROFILES,
+    )
+    from modules.bitstream_patch import parse_edit
+    from upload_bitstream.upload_bitstream import TRANSPORT_TTY, TRANSPORTS
+
+    patch_parser.add_argument(
+        "base_bitstream",
+        type=str,
+        help="The bitstream the edits are applied to.",
+    )
+    patch_parser.add_argument(
+        "-e",
+        "--edit",
+        help="""An edit in the format X,Y,FRAME,BITS,VALUE, e.g. 1,3,0,15:0,0xBEEF.
+        Y is the row in the fabric grid, BITS is HIGH:LOW or a single bit of
+        the frame word of the tile. Can be given multiple times, the edits form
+        one patch set.""",
+        type=parse_edit,
+        action="append",
+        default=[],
+    )
+    patch_parser.add_argument(
+        "-f",
+        "--patch_file",
+        help="""A TOML file with a list of [[patch_sets]], each having a name
+        and edits, applied one after another to the base bitstream.""",
+        type=str,
+    )
+    patch_parser.add_argument(
+        "--fabric",
+        help=f"""The fabric the bitstream is meant for, which defines the
+        frame geometry. Defaults to {DEFAULT_FABRIC}.""",
+        choices=list(FABRIC_PROFILES),
+        default=DEFAULT_FABRIC,
+    )
+    patch_parser.add_argument(
+        "-o",
+        "--output",
+        help="Write every patched bitstream to NAME.bin in this directory.",
+        type=str,
+    )
+    patch_parser.add_argument(
+        "--frames_only",
+        help="""Only write the edited frames, which can be uploaded to a board
+        holding the base bitstream.""",
+        action="store_true",
+    )
+    patch_parser.add_argument(
+        "--upload",
+        help="""Upload every patched bitstream, transmitting only the frames
+        differing from the bitstream the board holds.""",
+        action="store_true",
+    )
+    patch_parser.add_argument(
+        "-p",
+        "--port",
+        help="The serial port to use for uploading the bitstreams.",
+        type=str,
+    )
+    patch_parser.add_argument(
+        "-b",
+        "--baudrate",
+        help=f"""Specifies the baudrate, or {BAUDRATE_AUTO} to select it from
+        the fabric clock. Defaults to {BAUDRATE_AUTO}.""",
+        type=parse_baudrate,
+        default=BAUDRATE_AUTO,
+    )
+    patch_parser.add_argument(
+        "--fabric_clock",
+        help="""The fabric clock used to select the baud rate, e.g. 20M.
+        Defaults to the clock recorded by the last config_clocks.""",
+        type=parse_frequency,
+    )
+    patch_parser.add_argument(
+        "-t",
+        "--transport",
+        help=f"""Use the kernel tty driver or access the FTDI chip directly
+        through pyftdi. Defaults to {TRANSPORT_TTY}.""",
+        choices=TRANSPORTS,
+        default=TRANSPORT_TTY,
+    )
+    patch_parser.add_argument(
+        "--hook_command",
+        help="""A shell command run after every uploaded patch set, e.g. a test
+        of the design. The name of the patch set is passed in
+        FABULOUS_PATCH_SET.""",
+        type=str,
+    )
+    patch_parser.set_defaults(clock_readback=False)
+
+
+def setup_parser() -> argparse.Namespace:
+    """Set up the parser for the command line arguments
+
+    Only the arguments of the given command are defined, so that only the
+    modules providing their types and defaults are imported.
+
+    :returns: The parsed arguments.
+    :rtype: argsparse.Namespace
+    """
+    # The help of every command and the function defining its arguments
+    commands: Dict[str, Tuple[str, Callable[[argparse.ArgumentParser], None]]] = {
+        Commands.CONFIG_CLOCKS_COMMAND: (
+            "Run the clock functionality.",
+            add_clock_arguments,
+        ),
+        Commands.UPLOAD_COMMAND: (
+            "Run the upload functionality.",
+            add_upload_arguments,
+        ),
+        Commands.SERVE_COMMAND: (
+            """Run a daemon holding the devices open and executing the
+            commands forwarded with --daemon.""",
+            add_serve_arguments,
+        ),
+        Commands.CLOCK_SWEEP_COMMAND: (
+            """Step a clock output through a range of frequencies, retuning
+            only its multisynth.""",
+            add_clock_sweep_arguments,
+        ),
+        Commands.RUN_COMMAND: (
+            """Run the steps of a job manifest on one or more boards in a
+            single process.""",
+            add_run_arguments,
+        ),
+        Commands.PATCH_COMMAND: (
+            """Edit frames of a bitstream in place and write or upload the
+            patched bitstreams.""",
+            add_patch_arguments,
+        ),
+    }
+    parser = argparse.ArgumentParser(description="FABulous board configuration")
+
+    # Create a subparser for every command, only the given one gets arguments
+    subparsers = parser.add_subparsers(dest="command")
+    command = next((argument for argument in sys.argv[1:] if argument in commands), None)
+    for name, (command_help, add_arguments) in commands.items():
+        command_parser = subparsers.add_parser(name, help=command_help)
+        if name == command:
+            add_arguments(command_parser)
+
+    parser.add_argument(
+        "-i",
+        "--device_id",
+        help=f"""Specify the ID of the FDTI board. Find it out using lsusb.
+        Defaults to {DEFAULT_FTDI_ID}""",
+        type=str,
+        default=DEFAULT_FTDI_ID,
+    )
+    parser.add_argument(
+        "-D",
+        "--daemon",
+        help="""Forward the command to a daemon started with the serve
+        command, listening on the socket given by --socket.""",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--socket",
+        help=f"""The Unix domain socket the daemon listens on. Defaults to
+        {DEFAULT_SOCKET_PATH}.""",
+        type=str,
+        default=DEFAULT_SOCKET_PATH,
+    )
+    parser.add_argument(
+        "-m",
+        "--metrics",
+        help="""Record the duration of every phase and the transferred bytes
+        as JSON lines and a Prometheus textfile in the directory given by
+        --metrics_directory.""",
+        default=False,
+        action="store_true",
+    )
+    parser.add_argument(
+        "--metrics_directory",
+        help=f"""The directory the metrics are written to. Defaults to
+        {DEFAULT_METRICS_DIRECTORY}.""",
+        type=str,
+        default=str(DEFAULT_METRICS_DIRECTORY),
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        default=False,
+        action="count",
+        help="Show detailed log information including function and line number",
+    )
 
     # Parse the arguments
     args = parser.parse_args()
 
     # Check the command line parameters
-    if args.command not in supported_commands:
+    if args.command not in commands:
         parser.print_help()
         exit(1)
 
-    if args.command == Commands.UPLOAD_COMMAND and args.reset:
+    if args.command == Commands.CLOCK_SWEEP_COMMAND and args.daemon:
+        parser.error("A clock sweep cannot be forwarded to a daemon!")
+
+    if args.command == Commands.PATCH_COMMAND:
+        if args.daemon:
+            parser.error("Patching cannot be forwarded to a daemon!")
+        if not args.edit and not args.patch_file:
+            parser.error("Either --edit or a --patch_file has to be specified!")
+        if not args.output and not args.upload:
+            parser.error("The patched bitstreams have to be written or uploaded!")
+        if args.hook_command and not args.upload:
+            parser.error("A hook command is only run with --upload!")
+
+    if args.command == Commands.CLOCK_SWEEP_COMMAND:
+        from clock_setup.clock_sweep import sweep_frequencies
+
+        try:
+            args.frequencies = sweep_frequencies(args.start, args.stop, args.step)
+        except ValueError as error:
+            parser.error(str(error))
+
+    if args.command == Commands.CONFIG_CLOCKS_COMMAND and (
+        bool(args.register_config) == bool(args.freq)
+    ):
+        parser.error("Either a register config or --freq has to be specified!")
+
+    if args.command == Commands.CONFIG_CLOCKS_COMMAND and args.freq:
+        from clock_setup.frequency_planner import parse_frequencies
+
+        try:
+            parse_frequencies(args.freq)
+        except ValueError as error:
+            parser.error(str(error))
+
+    if args.command == Commands.UPLOAD_COMMAND and args.reset and not args.all:
         if not bool(args.usb_port) or not bool(args.location):
             parser.error(
                 """If the device should be reset, the USB port and hub it is
@@ -144,44 +639,689 @@ def setup_parser() -> argparse.Namespace:
                  """
             )
 
+    if args.command == Commands.UPLOAD_COMMAND and args.all:
+        if args.port or args.daemon:
+            parser.error(
+                """Uploading to all devices cannot be combined with an explicit
+                 port or a daemon!"""
+            )
+
+    if args.command == Commands.UPLOAD_COMMAND and args.probe:
+        if not args.verify_command:
+            parser.error("Probing the baud rate requires a --verify_command!")
+        if args.all or args.daemon or args.skip_loaded:
+            parser.error(
+                """Probing the baud rate cannot be combined with uploading to
+                 all devices, a daemon or skipping loaded bitstreams!"""
+            )
+
+    if args.command == Commands.UPLOAD_COMMAND and args.clock_readback:
+        if args.fabric_clock or args.daemon:
+            parser.error(
+                """Reading back the clock cannot be combined with --fabric_clock
+                 or a daemon!"""
+            )
+
+    if args.command == Commands.UPLOAD_COMMAND and build_capture_options(args):
+        if args.all or args.probe or args.skip_loaded:
+            parser.error(
+                """Capturing the output cannot be combined with uploading to all
+                 devices, probing the baud rate or skipping loaded bitstreams!"""
+            )
+        if args.trigger:
+            from modules.uart_capture import compile_trigger
+
+            try:
+                compile_trigger(args.trigger)
+            except re.error as error:
+                parser.error(f"Invalid trigger: {error}")
+
+    if args.command == Commands.UPLOAD_COMMAND and args.sparse and not args.reset:
+        parser.error(
+            """Frames can only be skipped if the device is reset before the
+             upload!"""
+        )
+
     return args
 
 
+def build_capture_options(args: argparse.Namespace) -> CaptureOptions | None:
+    """Build the capture options from the command line arguments.
+
+    :param args: The parsed arguments of the upload command.
+    :type args: argparse.Namespace
+    :returns: The capture options, or None if nothing is captured.
+    :rtype: CaptureOptions | None
+    """
+    from modules.uart_capture import CaptureOptions, DEFAULT_CAPTURE_TIME
+
+    if args.capture is None and not args.trigger and not args.capture_file:
+        return None
+    return CaptureOptions(
+        DEFAULT_CAPTURE_TIME if args.capture is None else args.capture,
+        args.trigger,
+        args.capture_file and os.path.abspath(args.capture_file),
+        args.capture_buffer,
+    )
+
+
+def build_upload_options(args: argparse.Namespace) -> UploadOptions:
+    """Build the upload options from the command line arguments.
+
+    :param args: The parsed arguments of the upload command.
+    :type args: argparse.Namespace
+    :returns: The upload options.
+    :rtype: UploadOptions
+    """
+    from upload_bitstream.upload_bitstream import UploadOptions
+
+    return UploadOptions(
+        args.chunk_size,
+        not args.no_pacing,
+        args.transport,
+        args.latency_timer,
+        args.transfer_size,
+        args.diff and not args.reset,
+        args.sparse,
+        skip_loaded=args.skip_loaded and not args.reset,
+    )
+
+
+def plan_clock_config(frequencies: str) -> RegisterConfig:
+    """Generate the register configuration for a set of clock frequencies.
+
+    :param frequencies: The comma separated frequencies of CLK0, CLK1 and CLK2.
+    :type frequencies: str
+    :returns: The register configuration.
+    :rtype: RegisterConfig
+    """
+    from clock_setup.frequency_planner import (
+        log_frequency_plan,
+        parse_frequencies,
+        plan_frequencies,
+    )
+    from clock_setup.read_register_config import compile_register_config
+
+    plan = plan_frequencies(parse_frequencies(frequencies))
+    log_frequency_plan(plan)
+    return compile_register_config(list(plan.registers))
+
+
+def load_upload_fabric_clock(
+    args: argparse.Namespace, devices: List[UsbDeviceDescriptor] | None = None
+) -> Fraction | None:
+    """Load the fabric clock recorded for the boards of an upload.
+
+    Without an explicit port, the given devices are used, else the boards
+    matching the device ID. If they were configured with different clocks,
+    none of them is used.
+
+    :param args: The parsed arguments of the upload command.
+    :type args: argparse.Namespace
+    :param devices: The devices already resolved for the upload.
+    :type devices: List[UsbDeviceDescriptor] | None
+    :returns: The fabric clock in Hz, or None if it is unknown.
+    :rtype: Fraction | None
+    """
+    from modules.board_state import (
+        get_board_key,
+        get_port_board_key,
+        load_fabric_clock,
+    )
+    from modules.ftdi_access import find_devices_matching_id
+
+    if args.port:
+        board_keys = [get_port_board_key(args.port)]
+    else:
+        if devices is None:
+            devices = find_devices_matching_id(args.device_id)
+        board_keys = [get_board_key(device) for device in devices]
+
+    frequencies = {load_fabric_clock(board_key) for board_key in board_keys}
+    if len(frequencies) == 1:
+        return frequencies.pop()
+    if len(frequencies - {None}) > 1:
+        logger.warning("The boards were configured with different fabric clocks.")
+    return None
+
+
+def get_fabric_clock(
+    args: argparse.Namespace, devices: List[UsbDeviceDescriptor] | None = None
+) -> Fraction:
+    """Get the fabric clock the baud rate of an upload is derived from.
+
+    :param args: The parsed arguments of the upload command.
+    :type args: argparse.Namespace
+    :param devices: The devices already resolved for the upload.
+    :type devices: List[UsbDeviceDescriptor] | None
+    :returns: The fabric clock in Hz.
+    :rtype: Fraction
+    """
+    from modules.baudrate import FABRIC_CLOCK_OUTPUT, FABRIC_PROFILES
+
+    if args.fabric_clock:
+        return args.fabric_clock
+
+    if args.clock_readback:
+        from pyftdi.i2c import I2cController
+        from clock_setup.clock_setup import read_output_frequency
+
+        frequency = read_output_frequency(
+            I2cController(), args.device_id, FABRIC_CLOCK_OUTPUT
+        )
+    else:
+        frequency = load_upload_fabric_clock(args, devices)
+    if frequency is not None:
+        return frequency
+
+    reference_clock = FABRIC_PROFILES[args.fabric].reference_clock
+    logger.info(
+        f"The fabric clock is unknown, assuming {float(reference_clock) / 1e6:g} MHz"
+    )
+    return reference_clock
+
+
+def resolve_baudrate(
+    args: argparse.Namespace, devices: List[UsbDeviceDescriptor] | None = None
+) -> int:
+    """Get the baud rate of an upload, selecting it from the fabric clock if
+    the baud rate is auto.
+
+    :param args: The parsed arguments of the upload command.
+    :type args: argparse.Namespace
+    :param devices: The devices already resolved for the upload, so that they
+    are not looked up again.
+    :type devices: List[UsbDeviceDescriptor] | None
+    :returns: The baud rate.
+    :rtype: int
+    """
+    from modules.baudrate import select_baudrate, BAUDRATE_AUTO, FABRIC_PROFILES
+
+    if args.baudrate != BAUDRATE_AUTO:
+        return args.baudrate
+    return select_baudrate(
+        get_fabric_clock(args, devices), FABRIC_PROFILES[args.fabric]
+    )
+
+
+def reset_device(args: argparse.Namespace) -> None:
+    """Power cycle the USB port of the board and wait until it is back.
+
+    :param args: The parsed arguments of the upload command.
+    :type args: argparse.Namespace
+    """
+    from modules.usb_port_power_control import power_cycle_usb_port
+    from upload_bitstream.upload_bitstream import TRANSPORT_TTY
+
+    power_cycle_usb_port(
+        args.location,
+        args.usb_port,
+        args.device_id,
+        args.reset_timeout,
+        args.transport == TRANSPORT_TTY,
+        args.power_switch,
+    )
+
+
+def reset_all_devices(args: argparse.Namespace) -> None:
+    """Power cycle the USB ports of all boards matching the device ID at once
+    and wait until they are back.
+
+    The ports are found from the position of the boards in the hub tree, so no
+    location or port has to be given.
+
+    :param args: The parsed arguments of the upload command.
+    :type args: argparse.Namespace
+    :raises NoDeviceFoundError: If no matching device was found.
+    """
+    from modules.ftdi_access import parse_device_id, NoDeviceFoundError
+    from modules.usb_hub import find_device_ports
+    from modules.usb_port_power_control import power_cycle_usb_ports
+    from upload_bitstream.upload_bitstream import TRANSPORT_TTY
+
+    ports = find_device_ports(parse_device_id(args.device_id))
+    if not ports:
+        logger.error(f"No device with ID {args.device_id} found to be reset.")
+        raise NoDeviceFoundError
+    power_cycle_usb_ports(
+        ports,
+        args.device_id,
+        args.reset_timeout,
+        args.transport == TRANSPORT_TTY,
+        args.power_switch,
+    )
+
+
+def probe_upload_baudrate(args: argparse.Namespace) -> int:
+    """Find the fastest baud rate that loads the bitstream reliably.
+
+    :param args: The parsed arguments of the upload command.
+    :type args: argparse.Namespace
+    :returns: The baud rate.
+    :rtype: int
+    :raises NoBaudrateFoundError: If no baud rate is reliable.
+    """
+    from modules.baudrate import probe_baudrate
+    from upload_bitstream.upload_bitstream import upload_bitstream
+
+    def load(baudrate: int) -> bool:
+        if args.reset:
+            reset_device(args)
+        upload_bitstream(
+            args.bitstream_file,
+            baudrate,
+            args.device_id,
+            args.port,
+            args.chunk_size,
+            not args.no_pacing,
+            args.transport,
+            args.latency_timer,
+            args.transfer_size,
+            False,
+            args.sparse,
+        )
+        return subprocess.run(args.verify_command, shell=True).returncode == 0
+
+    baudrate = probe_baudrate(load, attempts=args.probe_attempts)
+    logger.info(f"The fastest reliable baud rate is {baudrate}")
+    return baudrate
+
+
+def run_manifest(args: argparse.Namespace) -> List[StepResult]:
+    """Run a job manifest, in-process or through a running daemon.
+
+    :param args: The parsed arguments of the run command.
+    :type args: argparse.Namespace
+    :returns: The result of every step.
+    :rtype: List[StepResult]
+    """
+    from modules.board_daemon import send_job
+    from modules.job_runner import (
+        discover_boards,
+        load_manifest,
+        log_step_results,
+        write_step_report,
+        JobRunner,
+    )
+
+    manifest = load_manifest(args.manifest)
+    boards = discover_boards(manifest, args.device_id)
+
+    if args.daemon:
+        daemon = None
+        runner = JobRunner(
+            lambda job, arguments: send_job(job, arguments, args.socket),
+            manifest.directory,
+        )
+    else:
+        # The handlers of the daemon keep the devices open between the steps
+        daemon = BoardDaemon()
+        runner = JobRunner(daemon.run_job, manifest.directory)
+
+    try:
+        results = runner.run(manifest.steps, boards)
+    finally:
+        if daemon is not None:
+            daemon.close_handles()
+
+    log_step_results(results)
+    if args.report:
+        write_step_report(results, args.report)
+    return results
+
+
+def run_patch(args: argparse.Namespace) -> None:
+    """Apply the patch sets to the base bitstream, writing or uploading every
+    patched bitstream.
+
+    The uploads share one open port. Each one only transmits the frames
+    differing from the bitstream the board holds, so after the first upload
+    only the frames edited by the previous and the current patch set are sent.
+
+    :param args: The parsed arguments of the patch command.
+    :type args: argparse.Namespace
+    :raises InvalidPatchError: If an edit or the patch file is invalid.
+    """
+    from modules.bitstream_patch import (
+        load_patch_sets,
+        patch_bitstreams,
+        PatchSet,
+        COMMAND_LINE_PATCH_SET,
+        PATCH_SET_VARIABLE,
+    )
+    from modules.fabric import get_fabric
+    from modules.ftdi_access import get_single_device
+    from upload_bitstream.upload_bitstream import (
+        log_upload_statistics,
+        open_uart,
+        resolve_port,
+        upload_to_open_port,
+        UploadOptions,
+    )
+
+    patch_sets = []
+    if args.edit:
+        patch_sets.append(PatchSet(COMMAND_LINE_PATCH_SET, args.edit))
+    if args.patch_file:
+        patch_sets += load_patch_sets(args.patch_file)
+    geometry = get_fabric(args.fabric).geometry
+
+    output = None
+    if args.output:
+        output = Path(args.output)
+        output.mkdir(parents=True, exist_ok=True)
+
+    with contextlib.ExitStack() as stack:
+        ser = None
+        if args.upload:
+            device = None if args.port else get_single_device(args.device_id)
+            device_path, board_key = resolve_port(
+                args.device_id, args.port, args.transport, device
+            )
+            logger.info(f"Using device at {device_path}")
+            options = UploadOptions(transport=args.transport, diff=True)
+            baudrate = resolve_baudrate(args, device and [device])
+            ser = stack.enter_context(open_uart(device_path, baudrate, options))
+
+        for patch_set, patched in patch_bitstreams(
+            args.base_bitstream, patch_sets, geometry
+        ):
+            logger.info(
+                f"Patch set {patch_set.name}: {len(patch_set.edits)} edits in"
+                + f" {len(patched.touched)} frames"
+            )
+            if output is not None:
+                path = output / f"{patch_set.name}.bin"
+                if args.frames_only:
+                    path.write_bytes(patched.build_touched_stream())
+                else:
+                    path.write_bytes(patched.data)
+                logger.info(f"Written {path}")
+            if ser is not None:
+                log_upload_statistics(
+                    upload_to_open_port(ser, patched.data, board_key, options)
+                )
+            if args.hook_command:
+                environment = {**os.environ, PATCH_SET_VARIABLE: patch_set.name}
+                status = subprocess.run(
+                    args.hook_command, shell=True, env=environment
+                ).returncode
+                logger.info(f"Hook of patch set {patch_set.name} exited with {status}")
+
+
+def forward_to_daemon(args: argparse.Namespace) -> None:
+    """Forward a command to a running daemon.
+
+    :param args: The parsed arguments.
+    :type args: argparse.Namespace
+    """
+    from modules.board_daemon import (
+        send_job,
+        JOB_CONFIG_CLOCKS,
+        JOB_POWER_CYCLE,
+        JOB_UPLOAD,
+    )
+
+    match args.command:
+        case Commands.CONFIG_CLOCKS_COMMAND:
+            send_job(
+                JOB_CONFIG_CLOCKS,
+                {
+                    "register_config": args.register_config
+                    and os.path.abspath(args.register_config),
+                    "frequencies": args.freq,
+                    "device_id": args.device_id,
+                    "incremental": args.incremental,
+                },
+                args.socket,
+            )
+            logger.info("Configuration written!")
+        case Commands.UPLOAD_COMMAND:
+            from upload_bitstream.upload_bitstream import TRANSPORT_TTY
+
+            if args.reset:
+                send_job(
+                    JOB_POWER_CYCLE,
+                    {
+                        "location": args.location,
+                        "port": args.usb_port,
+                        "device_id": args.device_id,
+                        "timeout": args.reset_timeout,
+                        "wait_for_tty": args.transport == TRANSPORT_TTY,
+                        "power_switch": args.power_switch,
+                    },
+                    args.socket,
+                )
+
+            capture = build_capture_options(args)
+            result = send_job(
+                JOB_UPLOAD,
+                {
+                    "bitstream_file": os.path.abspath(args.bitstream_file),
+                    "baudrate": resolve_baudrate(args),
+                    "device_id": args.device_id,
+                    "port": args.port,
+                    "options": build_upload_options(args)._asdict(),
+                    "capture": capture and capture._asdict(),
+                },
+                args.socket,
+            )
+            logger.info(
+                f"Transmitted {result['total_bytes']} bytes to"
+                + f" {result['device_path']} in {result['wall_time']:.3f} s"
+                + f" ({result['throughput']:.0f} B/s)"
+            )
+            if capture is not None:
+                from modules.uart_capture import log_capture_summary, TriggerTimeoutError
+
+                log_capture_summary(result["capture"])
+                if capture.trigger and result["capture"]["match"] is None:
+                    logger.error(f"The output did not match {capture.trigger}.")
+                    raise TriggerTimeoutError
+
+
+def get_known_errors() -> Tuple[Type[Exception], ...]:
+    """Get the errors that are logged where they are raised, so that a command
+    only has to exit on them.
+
+    The errors are imported when an exception is handled, as the modules of a
+    command are only imported by the command.
+
+    :return: The known errors.
+    :rtype: Tuple[Type[Exception], ...]
+    """
+    from clock_setup.clock_setup import CrystalError
+    from clock_setup.frequency_planner import FrequencyPlanError
+    from modules.baudrate import NoBaudrateFoundError
+    from modules.bitstream_patch import InvalidPatchError
+    from modules.device_readiness import DeviceNotReadyError
+    from modules.ftdi_access import MultipleDevicesError, NoDeviceFoundError
+    from modules.job_runner import ManifestError
+    from modules.uart_capture import TriggerTimeoutError
+    from modules.usb_hub import HubAccessError, HubNotFoundError
+    from modules.usb_port_power_control import (
+        OnlyLinuxSupportedError,
+        OutDatedLinuxKernelVersionError,
+        PowerCycleFailedError,
+        ProgramNotInstalledError,
+    )
+
+    return (
+        FrequencyPlanError,
+        OnlyLinuxSupportedError,
+        OutDatedLinuxKernelVersionError,
+        ProgramNotInstalledError,
+        FileNotFoundError,
+        CrystalError,
+        MultipleDevicesError,
+        NoDeviceFoundError,
+        NoBaudrateFoundError,
+        PowerCycleFailedError,
+        DeviceNotReadyError,
+        HubNotFoundError,
+        HubAccessError,
+        ManifestError,
+        TriggerTimeoutError,
+        InvalidPatchError,
+        DaemonAlreadyRunningError,
+        InsecureSocketDirectoryError,
+        DaemonNotRunningError,
+        DaemonJobError,
+    )
+
+
 def main():
     """The main function containing the application logic."""
     args = setup_parser()
-    i2c = I2cController()
     setup_logger(args.verbose)
 
+    if args.metrics:
+        enable_metrics(Path(args.metrics_directory), args.command)
+        # Also written if a command exits early
+        atexit.register(disable_metrics)
+
+    # A manifest run sends its jobs to the daemon itself
+    if args.daemon and args.command not in [
+        Commands.SERVE_COMMAND,
+        Commands.RUN_COMMAND,
+    ]:
+        try:
+            forward_to_daemon(args)
+        except get_known_errors():
+            exit(1)
+        return
+
+    # Hardware objects are only created by the commands using them
+    i2c = None
+
     try:
         match args.command:
             case Commands.CONFIG_CLOCKS_COMMAND:
-                program_clock_ic(args.register_config, i2c, args.device_id)
+                from pyftdi.i2c import I2cController
+                from clock_setup.clock_setup import connect_clock_ic, configure_clock_ic
+                from clock_setup.read_register_config import load_register_config
+                from modules.baudrate import record_fabric_clock
+                from modules.board_state import get_i2c_board_key
+
+                i2c = I2cController()
+                if args.freq:
+                    config = plan_clock_config(args.freq)
+                else:
+                    config = load_register_config(args.register_config)
+                i2c_port = connect_clock_ic(i2c, args.device_id)
+                if i2c_port is not None:
+                    configure_clock_ic(i2c_port, config, args.incremental)
+                    record_fabric_clock(get_i2c_board_key(i2c), config.registers)
+                i2c.close()
+            case Commands.CLOCK_SWEEP_COMMAND:
+                from pyftdi.i2c import I2cController
+                from clock_setup.clock_setup import connect_clock_ic
+                from clock_setup.clock_sweep import (
+                    log_sweep_steps,
+                    run_command_hook,
+                    sweep_clock,
+                )
+                from modules.baudrate import FABRIC_CLOCK_OUTPUT
+                from modules.board_state import get_i2c_board_key, store_fabric_clock
+
+                i2c = I2cController()
+                i2c_port = connect_clock_ic(i2c, args.device_id)
+                if i2c_port is not None:
+                    steps = sweep_clock(
+                        i2c_port,
+                        args.frequencies,
+                        args.output,
+                        args.base_freq,
+                        run_command_hook(args.hook_command)
+                        if args.hook_command
+                        else None,
+                        args.settle,
+                    )
+                    log_sweep_steps(steps)
+                    if args.output == FABRIC_CLOCK_OUTPUT:
+                        fabric_clock = steps[-1].frequency
+                    else:
+                        fabric_clock = next(iter(args.base_freq), None)
+                    store_fabric_clock(get_i2c_board_key(i2c), fabric_clock)
+                i2c.close()
+
+            case Commands.UPLOAD_COMMAND if args.all:
+                from modules.ftdi_access import find_devices_matching_id
+                from upload_bitstream.upload_bitstream import (
+                    log_upload_results,
+                    upload_bitstream_to_all,
+                )
+
+                if args.reset:
+                    reset_all_devices(args)
+                # The devices are resolved once, for their fabric clock and the
+                # uploads
+                devices = find_devices_matching_id(args.device_id)
+                results = upload_bitstream_to_all(
+                    args.bitstream_file,
+                    resolve_baudrate(args, devices),
+                    args.device_id,
+                    build_upload_options(args),
+                    args.timeout,
+                    devices,
+                )
+                log_upload_results(results)
+                if any(result.error is not None for result in results):
+                    exit(1)
+
+            case Commands.UPLOAD_COMMAND if args.probe:
+                probe_upload_baudrate(args)
+
             case Commands.UPLOAD_COMMAND:
+                from modules.ftdi_access import get_single_device
+                from upload_bitstream.upload_bitstream import upload_bitstream
+
+                # The power cycle drops the recorded fabric clock
                 if args.reset:
-                    power_cycle_usb_port(args.location, args.usb_port)
+                    reset_device(args)
+                # The device is resolved once, for its fabric clock and the
+                # upload
+                device = None if args.port else get_single_device(args.device_id)
+                baudrate = resolve_baudrate(args, device and [device])
 
                 upload_bitstream(
-                    args.bitstream_file, args.baudrate, args.device_id, args.port
+                    args.bitstream_file,
+                    baudrate,
+                    args.device_id,
+                    args.port,
+                    args.chunk_size,
+                    not args.no_pacing,
+                    args.transport,
+                    args.latency_timer,
+                    args.transfer_size,
+                    args.diff and not args.reset,
+                    args.sparse,
+                    build_capture_options(args),
+                    args.skip_loaded and not args.reset,
+                    device,
                 )
 
+            case Commands.SERVE_COMMAND:
+                BoardDaemon(args.socket).serve_forever()
+
+            case Commands.RUN_COMMAND:
+                results = run_manifest(args)
+                if any(result.error is not None for result in results):
+                    exit(1)
+
+            case Commands.PATCH_COMMAND:
+                run_patch(args)
+
             case _:
                 # Should already be handled by argparse
                 logger.error(f"Command {args.command} is unknown")
 
     except KeyboardInterrupt:
-        i2c.close()
+        if i2c is not None:
+            i2c.close()
         logger.info("Exiting...")
         # Just catch all known errors and exit
-    except (
-        OnlyLinuxSupportedError,
-        OutDatedLinuxKernelVersionError,
-        ProgramNotInstalledError,
-        FileNotFoundError,
-        CrystalError,
-        MultipleDevicesError,
-        NoDeviceFoundError,
-    ):
+    except get_known_errors():
         exit(1)
 
 
@@ -1,21 +1,50 @@
 #!/usr/bin/env python3
 
+# pyftdi is imported on first use to keep the startup of the command line
+# tools fast
+from __future__ import annotations
+
 import argparse
+import time
 from argparse import Namespace
-from pyftdi.i2c import I2cController, I2cPort, I2cNackError
-from clock_setup.read_register_config import read_register_config, Register
-from typing import List
+from clock_setup.read_register_config import (
+    load_register_config,
+    coalesce_registers,
+    Register,
+    RegisterConfig,
+    RegisterRun,
+)
+from fractions import Fraction
+from typing import List, NamedTuple, TYPE_CHECKING
 from loguru import logger
+from clock_setup.frequency_planner import decode_output_frequency
+from modules import metrics
 from modules.ftdi_access import DEFAULT_FTDI_ID, get_device_url
 
+if TYPE_CHECKING:
+    from pyftdi.i2c import I2cController, I2cPort
+
 DEVICE_I2C_ADDRESS = 0x60
 
 REGISTER_DEVICE_STATUS = 0
 REGISTER_OUTPUT_ENABLE = 3
 REGISTER_CLK0_CONTROL = 16
+REGISTER_PLLA_PARAMETERS = range(26, 34)
+REGISTER_PLLB_PARAMETERS = range(34, 42)
 REGISTER_PLL_RESET = 177
 REGISTER_CRYSTAL_INTERNAL_LOAD_CAPACITANCE = 183
 
+PLL_RESET_PLLA = 1 << 5
+PLL_RESET_PLLB = 1 << 7
+# Set by Clock Builder Pro in every reset
+PLL_RESET_RESERVED = 0x0C
+
+# The registers up to the end of the multisynth parameters of CLK0 to CLK2
+REGISTER_MAP_SIZE = 66
+
+# Rewriting a few unchanged registers is cheaper than another transaction
+MAX_BRIDGED_REGISTERS = 8
+
 LOS_XTAL = 1 << 0x3
 XTAL_CL = 3 << 0x6
 
@@ -28,6 +57,22 @@ class CrystalError(Exception):
     """An exception to be thrown when the crystal loss of signal bit is set."""
 
 
+class ProgrammingStatistics(NamedTuple):
+    """Defines the telemetry of programming the clock IC.
+
+    Attributes:
+        transactions (int): The number of I2C write transactions.
+        registers    (int): The number of registers written.
+        duration     (float): The time spent programming in seconds.
+        reads        (int): The number of I2C read transactions.
+    """
+
+    transactions: int
+    registers: int
+    duration: float
+    reads: int = 0
+
+
 def __setup_parser() -> Namespace:
     """Parse the command line arguments.
 
@@ -53,6 +98,12 @@ def __setup_parser() -> Namespace:
         type=str,
         default=DEFAULT_FTDI_ID,
     )
+    parser.add_argument(
+        "--incremental",
+        help="""Only write the registers differing from the current
+        configuration of the clock IC.""",
+        action="store_true",
+    )
 
     # Parse the arguments
     args = parser.parse_args()
@@ -73,6 +124,7 @@ def __config_i2c(i2c: I2cController, address: int, device_id: str) -> I2cPort |
     :returns: The I2C port that can be used for communication.
     :rtype: I2cPort | None
     """
+    from pyftdi.i2c import I2cNackError
 
     i2c_port = None
     connection_successful = False
@@ -118,9 +170,20 @@ def __check_crystal(i2c_port: I2cPort) -> None:
     """
 
     logger.info("Checking crystal...")
-    status = i2c_port.read_from(REGISTER_DEVICE_STATUS, 1)
+    with metrics.span(metrics.SPAN_CRYSTAL_CHECK):
+        status = i2c_port.read_from(REGISTER_DEVICE_STATUS, 1)
+    metrics.count(metrics.COUNTER_I2C_TRANSACTIONS, 1, direction="read")
+    __check_crystal_status(int.from_bytes(status, byteorder="big"))
 
-    if int.from_bytes(status, byteorder="big") & LOS_XTAL:
+
+def __check_crystal_status(status: int) -> None:
+    """Check the crystal loss of signal bit of the device status.
+
+    :param status: The value of the device status register.
+    :type status: int
+    :raises CrystalError: If the loss of signal bit is set.
+    """
+    if status & LOS_XTAL:
         logger.error(
             "Crystal loss of signal bit set. There seems to be a problem"
             + "with the crystal or its configuration."
@@ -129,41 +192,297 @@ def __check_crystal(i2c_port: I2cPort) -> None:
     logger.info("Crystal OK!")
 
 
-def __programming_procedure(i2c_port: I2cPort, registers: List[Register]) -> None:
+def write_register_runs(i2c_port: I2cPort, runs: List[RegisterRun]) -> None:
+    """Write register runs, one burst transaction per run.
+
+    :param i2c_port: The I2C port to be used.
+    :type i2c_port: I2cPort
+    :param runs: The runs to be written.
+    :type runs: List[RegisterRun]
+    """
+    with metrics.span(metrics.SPAN_REGISTER_WRITE):
+        for run in runs:
+            logger.debug(
+                f"Writing registers {run.address}-{run.address + len(run.values) - 1}"
+            )
+            i2c_port.write_to(run.address, run.values)
+    metrics.count(metrics.COUNTER_I2C_TRANSACTIONS, len(runs), direction="write")
+    metrics.count(
+        metrics.COUNTER_I2C_BYTES,
+        sum(len(run.values) for run in runs),
+        direction="write",
+    )
+
+
+def __programming_procedure(
+    i2c_port: I2cPort, config: RegisterConfig
+) -> ProgrammingStatistics:
     """This implements the programming procedure described in figure 10 of the datasheet
 
     :param i2c_port: The I2C port to be used.
     :type i2c_port: I2cPort
+    :param config: The register configuration to be written.
+    :type config: RegisterConfig
+    :return: The telemetry of the programming.
+    :rtype: ProgrammingStatistics
     """
 
     logger.info("Start writing the configuration...")
-    # Disable outputs
-    i2c_port.write_to(REGISTER_OUTPUT_ENABLE, b"\xFF")
+    start_time = time.perf_counter()
+    registers = config.registers
 
-    # Power down all output drivers
+    # Write config (start after register 3)
+    config_runs = config.runs
+    runs = (
+        # Disable outputs
+        [RegisterRun(REGISTER_OUTPUT_ENABLE, b"\xFF")]
+        # Power down all output drivers, burst write up to register 23
+        + [RegisterRun(REGISTER_CLK0_CONTROL, b"\x80" * 8)]
+        # Set interrupt masks
+        + [RegisterRun(registers[0].address, bytes([registers[0].value]))]
+        + config_runs
+        # Apply PLLA and PLLB soft reset
+        + [RegisterRun(REGISTER_PLL_RESET, b"\xAC")]
+        # Enable outputs for CLK0, CLK1 and CLK2
+        + [RegisterRun(registers[1].address, bytes([registers[1].value]))]
+    )
+    write_register_runs(i2c_port, runs)
 
-    i2c_port.write(
-        [REGISTER_CLK0_CONTROL] + [0x80] * 7
-    )  # Burst write up to register 23
+    statistics = ProgrammingStatistics(
+        len(runs),
+        sum(len(run.values) for run in runs),
+        time.perf_counter() - start_time,
+    )
+    logger.info("Configuration written!")
+    logger.debug(
+        f"Wrote {statistics.registers} registers in {statistics.transactions}"
+        + f" I2C transactions ({len(registers) - 2} configuration registers"
+        + f" in {len(config_runs)} bursts) in {statistics.duration * 1000:.1f} ms"
+    )
+    return statistics
 
-    # Set interrupt masks
-    i2c_port.write_to(registers[0].address, [registers[0].value])
 
-    # Write config (start after register 3)
-    for reg in registers[2:]:
-        i2c_port.write_to(reg.address, [reg.value])
+def read_register_map(i2c_port: I2cPort, size: int) -> bytes:
+    """Read the registers of the clock IC from address 0 in a single burst.
+
+    :param i2c_port: The I2C port to be used.
+    :type i2c_port: I2cPort
+    :param size: The number of registers to be read.
+    :type size: int
+    :return: The register values, indexed by address.
+    :rtype: bytes
+    """
+    with metrics.span(metrics.SPAN_REGISTER_READ):
+        register_map = bytes(i2c_port.read_from(REGISTER_DEVICE_STATUS, size))
+    metrics.count(metrics.COUNTER_I2C_TRANSACTIONS, 1, direction="read")
+    metrics.count(metrics.COUNTER_I2C_BYTES, size, direction="read")
+    return register_map
+
+
+def find_changed_registers(
+    registers: List[Register], register_map: bytes
+) -> List[Register]:
+    """Find the registers whose value differs from the register map.
+
+    :param registers: The register configuration.
+    :type registers: List[Register]
+    :param register_map: The current register values, indexed by address.
+    :type register_map: bytes
+    :return: The differing registers in the order of the configuration.
+    :rtype: List[Register]
+    """
+    return [
+        register
+        for register in registers
+        if register.address >= len(register_map)
+        or register_map[register.address] != register.value
+    ]
+
+
+def bridge_changed_registers(
+    registers: List[Register],
+    changed_registers: List[Register],
+    max_gap: int = MAX_BRIDGED_REGISTERS,
+) -> List[Register]:
+    """Add the unchanged registers of short gaps between changed registers, so
+    that the changed registers can be written in fewer bursts.
+
+    :param registers: The register configuration.
+    :type registers: List[Register]
+    :param changed_registers: The registers to be written.
+    :type changed_registers: List[Register]
+    :param max_gap: The maximum number of unchanged registers in a bridged gap.
+    :type max_gap: int
+    :return: The registers to be written in the order of the configuration.
+    :rtype: List[Register]
+    """
+    changed_addresses = {register.address for register in changed_registers}
+    selected = []
+    gap = []
+    for register in registers:
+        if register.address not in changed_addresses:
+            if selected:
+                gap.append(register)
+            continue
+
+        if (
+            selected
+            and len(gap) <= max_gap
+            and register.address == selected[-1].address + len(gap) + 1
+        ):
+            selected += gap
+        selected.append(register)
+        gap = []
+    return selected
+
+
+def get_pll_reset(changed_registers: List[Register]) -> int:
+    """Get the value of the PLL reset register resetting only the PLLs whose
+    parameters changed.
+
+    :param changed_registers: The registers to be written.
+    :type changed_registers: List[Register]
+    :return: The value of the PLL reset register, 0 if no PLL changed.
+    :rtype: int
+    """
+    reset = 0
+    for register in changed_registers:
+        if register.address in REGISTER_PLLA_PARAMETERS:
+            reset |= PLL_RESET_PLLA
+        elif register.address in REGISTER_PLLB_PARAMETERS:
+            reset |= PLL_RESET_PLLB
+    return reset | PLL_RESET_RESERVED if reset else 0
+
+
+def write_changed_registers(
+    i2c_port: I2cPort, registers: List[Register], changed_registers: List[Register]
+) -> List[RegisterRun]:
+    """Write the changed registers of a configuration in as few bursts as
+    possible.
+
+    A PLL is only reset if its own parameters changed, and the outputs are
+    enabled last.
+
+    :param i2c_port: The I2C port to be used.
+    :type i2c_port: I2cPort
+    :param registers: The complete register configuration.
+    :type registers: List[Register]
+    :param changed_registers: The registers differing from the clock IC.
+    :type changed_registers: List[Register]
+    :return: The written runs, one I2C transaction each.
+    :rtype: List[RegisterRun]
+    """
+    # Enable the outputs only after the PLLs were reset
+    output_enable = [
+        register
+        for register in changed_registers
+        if register.address == REGISTER_OUTPUT_ENABLE
+    ]
+    runs = coalesce_registers(
+        bridge_changed_registers(
+            [register for register in registers if register not in output_enable],
+            changed_registers,
+        )
+    )
+    pll_reset = get_pll_reset(changed_registers)
+    if pll_reset:
+        runs.append(RegisterRun(REGISTER_PLL_RESET, bytes([pll_reset])))
+    runs += coalesce_registers(output_enable)
+    write_register_runs(i2c_port, runs)
+    return runs
+
 
-    # Apply PLLA and PLLB soft reset
-    i2c_port.write_to(REGISTER_PLL_RESET, b"\xAC")
+def __update_procedure(
+    i2c_port: I2cPort, config: RegisterConfig
+) -> ProgrammingStatistics:
+    """Write only the registers differing from the current configuration.
 
-    # Enable outputs for CLK0, CLK1 and CLK2
-    i2c_port.write_to(registers[1].address, [registers[1].value])
+    Outputs are neither disabled nor powered down, and a PLL is only reset if
+    its own parameters changed, so the clocks are not disturbed if the clock
+    IC already holds the configuration.
+
+    :param i2c_port: The I2C port to be used.
+    :type i2c_port: I2cPort
+    :param config: The register configuration to be written.
+    :type config: RegisterConfig
+    :return: The telemetry of the programming.
+    :rtype: ProgrammingStatistics
+    """
+    start_time = time.perf_counter()
+    registers = config.registers
+    size = max(register.address for register in registers) + 1
+    register_map = read_register_map(i2c_port, size)
+    __check_crystal_status(register_map[REGISTER_DEVICE_STATUS])
+
+    changed = find_changed_registers(registers, register_map)
+    if not changed:
+        logger.info(
+            f"The clock IC already holds the configuration {config.digest[:12]}."
+        )
+        return ProgrammingStatistics(0, 0, time.perf_counter() - start_time, 1)
+
+    logger.info(f"Writing {len(changed)} changed registers...")
+    runs = write_changed_registers(i2c_port, registers, changed)
+    pll_reset = get_pll_reset(changed)
+
+    statistics = ProgrammingStatistics(
+        len(runs),
+        sum(len(run.values) for run in runs),
+        time.perf_counter() - start_time,
+        1,
+    )
     logger.info("Configuration written!")
+    logger.debug(
+        f"Wrote {statistics.registers} registers in {statistics.transactions}"
+        + f" I2C transactions (PLL reset {pll_reset:#04x}) in"
+        + f" {statistics.duration * 1000:.1f} ms"
+    )
+    return statistics
+
+
+def connect_clock_ic(i2c: I2cController, device_id: str) -> I2cPort | None:
+    """Connect to the clock IC.
+
+    :param i2c: The I2cController instance to be used.
+    :type i2c: I2cController
+    :param device_id: The device ID of the device to be used for the I2C
+    communication.
+    :type device_id: str
+    :returns: The I2C port of the clock IC.
+    :rtype: I2cPort | None
+    """
+    with metrics.span(metrics.SPAN_I2C_CONNECT):
+        return __config_i2c(i2c, DEVICE_I2C_ADDRESS, device_id)
+
+
+def configure_clock_ic(
+    i2c_port: I2cPort, config: RegisterConfig, incremental: bool = False
+) -> ProgrammingStatistics:
+    """Program a connected clock IC with the given registers.
+
+    :param i2c_port: The I2C port of the clock IC.
+    :type i2c_port: I2cPort
+    :param config: The register configuration to be written.
+    :type config: RegisterConfig
+    :param incremental: Read back the registers and only write the ones that
+    differ, instead of running the full programming procedure.
+    :type incremental: bool
+    :return: The telemetry of the programming.
+    :rtype: ProgrammingStatistics
+    """
+    if incremental:
+        return __update_procedure(i2c_port, config)
+
+    __check_crystal(i2c_port)
+    return __programming_procedure(i2c_port, config)
 
 
 def program_clock_ic(
-    register_config_file: str, i2c: I2cController, device_id: str
-) -> None:
+    register_config_file: str,
+    i2c: I2cController,
+    device_id: str,
+    incremental: bool = False,
+) -> ProgrammingStatistics | None:
     """Program the clock IC with the register config file.
 
     :param register_config_file: The config file containing the register values created by Clock Builder Pro.
@@ -173,23 +492,84 @@ def program_clock_ic(
     :param device_id: The device ID of the device to be used for the I2C
     communication.
     :type device_id: str
+    :param incremental: Only write the registers that differ from the current
+    configuration of the clock IC.
+    :type incremental: bool
+    :return: The telemetry of the programming, or None if the clock IC could
+    not be reached.
+    :rtype: ProgrammingStatistics | None
     """
+    return program_clock_config(
+        load_register_config(register_config_file), i2c, device_id, incremental
+    )
 
-    registers = read_register_config(register_config_file)
 
-    i2c = I2cController()
-    i2c_port = __config_i2c(i2c, DEVICE_I2C_ADDRESS, device_id)
+def program_clock_config(
+    config: RegisterConfig,
+    i2c: I2cController,
+    device_id: str,
+    incremental: bool = False,
+) -> ProgrammingStatistics | None:
+    """Program the clock IC with a register configuration, e.g. one generated
+    by the frequency planner.
+
+    :param config: The register configuration to be written.
+    :type config: RegisterConfig
+    :param i2c: The I2cController instance to be used.
+    :type i2c: I2cController
+    :param device_id: The device ID of the device to be used for the I2C
+    communication.
+    :type device_id: str
+    :param incremental: Only write the registers that differ from the current
+    configuration of the clock IC.
+    :type incremental: bool
+    :return: The telemetry of the programming, or None if the clock IC could
+    not be reached.
+    :rtype: ProgrammingStatistics | None
+    """
+    statistics = None
+    i2c_port = connect_clock_ic(i2c, device_id)
     if i2c_port is not None:
-        __check_crystal(i2c_port)
-        __programming_procedure(i2c_port, registers)
+        statistics = configure_clock_ic(i2c_port, config, incremental)
     i2c.close()
+    return statistics
+
+
+def read_output_frequency(
+    i2c: I2cController, device_id: str, output: int
+) -> Fraction | None:
+    """Read back the frequency of a clock output from the registers of the
+    clock IC.
+
+    :param i2c: The I2cController instance to be used.
+    :type i2c: I2cController
+    :param device_id: The device ID of the device to be used for the I2C
+    communication.
+    :type device_id: str
+    :param output: The index of the output.
+    :type output: int
+    :return: The frequency in Hz, or None if the output is disabled or the
+    clock IC could not be reached.
+    :rtype: Fraction | None
+    """
+    frequency = None
+    i2c_port = connect_clock_ic(i2c, device_id)
+    if i2c_port is not None:
+        register_map = read_register_map(i2c_port, REGISTER_MAP_SIZE)
+        frequency = decode_output_frequency(register_map, output)
+    i2c.close()
+    return frequency
 
 
 def main() -> None:
     """The main function containing the application logic."""
     args = __setup_parser()
 
-    program_clock_ic(args.register_config, I2cController(), "0403:6014")
+    from pyftdi.i2c import I2cController
+
+    program_clock_ic(
+        args.register_config, I2cController(), "0403:6014", args.incremental
+    )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import os
+import subprocess
+import time
+from fractions import Fraction
+from typing import Any, Callable, Dict, List, NamedTuple, Sequence, TYPE_CHECKING
+from loguru import logger
+from clock_setup.clock_setup import (
+    configure_clock_ic,
+    get_pll_reset,
+    write_changed_registers,
+)
+from clock_setup.frequency_planner import (
+    FrequencyPlan,
+    plan_frequencies,
+    retune_output,
+)
+from clock_setup.read_register_config import Register, compile_register_config
+
+if TYPE_CHECKING:
+    from pyftdi.i2c import I2cPort
+
+# The environment variable passing the frequency in Hz to a hook command
+HOOK_FREQUENCY_VARIABLE = "FABULOUS_CLOCK_FREQUENCY"
+
+
+class SweepStep(NamedTuple):
+    """Defines the telemetry of a single step of a clock sweep.
+
+    Attributes:
+        target       (Fraction): The requested frequency in Hz.
+        frequency    (Fraction): The generated frequency in Hz.
+        transactions (int): The number of I2C write transactions.
+        pll_reset    (bool): Whether a PLL had to be reset.
+        program_time (float): The time spent retuning in seconds.
+        hook_time    (float): The time spent in the hook in seconds.
+        result       (Any): The value returned by the hook.
+    """
+
+    target: Fraction
+    frequency: Fraction
+    transactions: int
+    pll_reset: bool
+    program_time: float
+    hook_time: float
+    result: Any
+
+
+def sweep_frequencies(
+    start: Fraction, stop: Fraction, step: Fraction
+) -> List[Fraction]:
+    """Get the frequencies from start to stop, both included.
+
+    :param start: The first frequency in Hz.
+    :type start: Fraction
+    :param stop: The last frequency in Hz.
+    :type stop: Fraction
+    :param step: The distance between two frequencies in Hz. The sweep runs
+    downwards if stop is below start.
+    :type step: Fraction
+    :return: The frequencies.
+    :rtype: List[Fraction]
+    :raises ValueError: If the step is not positive.
+    """
+    if step <= 0:
+        raise ValueError("The step has to be a positive frequency")
+    direction = -1 if stop < start else 1
+    count = int(abs(stop - start) / step) + 1
+    return [start + index * direction * step for index in range(count)]
+
+
+def run_command_hook(command: str) -> Callable[[Fraction], int]:
+    """Create a hook running a shell command at each step.
+
+    The frequency in Hz is passed in the FABULOUS_CLOCK_FREQUENCY environment
+    variable.
+
+    :param command: The shell command.
+    :type command: str
+    :return: The hook, returning the exit status of the command.
+    :rtype: Callable[[Fraction], int]
+    """
+
+    def hook(frequency: Fraction) -> int:
+        environment = {**os.environ, HOOK_FREQUENCY_VARIABLE: f"{float(frequency):.0f}"}
+        return subprocess.run(command, shell=True, env=environment).returncode
+
+    return hook
+
+
+def sweep_clock(
+    i2c_port: I2cPort,
+    frequencies: Sequence[Fraction],
+    output: int = 0,
+    base_frequencies: Sequence[Fraction | None] = (),
+    hook: Callable[[Fraction], Any] | None = None,
+    settle_time: float = 0.0,
+) -> List[SweepStep]:
+    """Step an output of the clock IC through a list of frequencies.
+
+    The clock IC is configured once with an incremental update. At each step,
+    only the registers differing from the previous step are written, which is
+    usually the parameter block of the multisynth of the output. A PLL is only
+    reset if its VCO frequency has to change.
+
+    :param i2c_port: The I2C port of the clock IC, kept open for the sweep.
+    :type i2c_port: I2cPort
+    :param frequencies: The frequencies of the output in Hz.
+    :type frequencies: Sequence[Fraction]
+    :param output: The index of the swept output.
+    :type output: int
+    :param base_frequencies: The frequencies of the other outputs in Hz, None
+    if disabled.
+    :type base_frequencies: Sequence[Fraction | None]
+    :param hook: Called with the requested frequency after each step, e.g. to
+    run a test of the design.
+    :type hook: Callable[[Fraction], Any] | None
+    :param settle_time: The time to wait after a PLL reset in seconds.
+    :type settle_time: float
+    :return: The telemetry of every step.
+    :rtype: List[SweepStep]
+    :raises FrequencyPlanError: If a frequency cannot be generated.
+    """
+    initial = list(base_frequencies) + [None] * (output + 1 - len(base_frequencies))
+    initial[output] = frequencies[0]
+    plan = plan_frequencies(initial)
+    configure_clock_ic(i2c_port, compile_register_config(list(plan.registers)), True)
+    state: Dict[int, int] = dict(plan.registers)
+
+    steps = []
+    for target in frequencies:
+        start_time = time.perf_counter()
+        plan = retune_output(plan, output, target)
+        changed = __find_changed_registers(plan, state)
+        runs = []
+        pll_reset = 0
+        if changed:
+            runs = write_changed_registers(i2c_port, list(plan.registers), changed)
+            pll_reset = get_pll_reset(changed)
+            state.update(changed)
+        if pll_reset:
+            time.sleep(settle_time)
+        program_time = time.perf_counter() - start_time
+
+        result = None
+        if hook is not None:
+            result = hook(target)
+        hook_time = time.perf_counter() - start_time - program_time
+
+        step = SweepStep(
+            target,
+            plan.outputs[output].frequency,
+            len(runs),
+            bool(pll_reset),
+            program_time,
+            hook_time,
+            result,
+        )
+        logger.debug(
+            f"{float(step.frequency) / 1e6:.6f} MHz: {step.transactions} transactions"
+            + f"{', PLL reset' if step.pll_reset else ''}"
+            + f" in {step.program_time * 1000:.2f} ms,"
+            + f" hook {step.hook_time * 1000:.2f} ms"
+        )
+        steps.append(step)
+    return steps
+
+
+def __find_changed_registers(
+    plan: FrequencyPlan, state: Dict[int, int]
+) -> List[Register]:
+    """Find the registers of a plan differing from the known state of the
+    clock IC.
+
+    :param plan: The plan of the step.
+    :type plan: FrequencyPlan
+    :param state: The register values of the clock IC, indexed by address.
+    :type state: Dict[int, int]
+    :return: The differing registers in the order of the plan.
+    :rtype: List[Register]
+    """
+    return [
+        register
+        for register in plan.registers
+        if state.get(register.address) != register.value
+    ]
+
+
+def log_sweep_steps(steps: List[SweepStep]) -> None:
+    """Log a table with the telemetry of a clock sweep.
+
+    :param steps: The telemetry of every step.
+    :type steps: List[SweepStep]
+    """
+    logger.info(
+        f"{'Frequency':>16} {'Transactions':>12} {'PLL reset':>9}"
+        + f" {'Program':>10} {'Hook':>10} Result"
+    )
+    for step in steps:
+        logger.info(
+            f"{float(step.frequency) / 1e6:>12.6f} MHz {step.transactions:>12}"
+            + f" {'yes' if step.pll_reset else 'no':>9}"
+            + f" {step.program_time * 1000:>7.2f} ms {step.hook_time * 1000:>7.2f} ms"
+            + f" {step.result if step.result is not None else ''}"
+        )
+
+    program_time = sum(step.program_time for step in steps)
+    hook_time = sum(step.hook_time for step in steps)
+    logger.info(
+        f"Swept {len(steps)} frequencies, {program_time:.3f} s retuning and"
+        + f" {hook_time:.3f} s in the hook"
+    )
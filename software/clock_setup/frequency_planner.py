@@ -0,0 +1,657 @@
+#!/usr/bin/env python3
+
+# NumPy is imported by the search on first use, so that the command line tools
+# do not load it at startup
+import functools
+import itertools
+import math
+import re
+from fractions import Fraction
+from typing import Dict, List, Mapping, NamedTuple, Sequence, Tuple
+from loguru import logger
+from clock_setup.read_register_config import Register
+
+CRYSTAL_FREQUENCY = Fraction(25_000_000)
+
+VCO_MIN_FREQUENCY = 600_000_000
+VCO_MAX_FREQUENCY = 900_000_000
+MIN_OUTPUT_FREQUENCY = 2_500
+MAX_OUTPUT_FREQUENCY = 200_000_000
+
+PLL_MIN_MULTIPLIER = 15
+PLL_MAX_MULTIPLIER = 90
+MULTISYNTH_MIN_DIVIDER = 8
+MULTISYNTH_MAX_DIVIDER = 2048
+# Dividers below the fractional range only work as exact integers
+MULTISYNTH_SPECIAL_DIVIDERS = [4, 6]
+MAX_DENOMINATOR = 1_048_575
+MAX_R_DIVIDER = 128
+
+OUTPUT_COUNT = 3
+PLL_COUNT = 2
+
+# The number of best ranked candidates evaluated with exact arithmetic
+EXACT_CANDIDATES = 16
+
+# The relative error up to which a retuned output keeps its PLL
+RETUNE_MAX_ERROR = 1e-6
+
+REGISTER_OUTPUT_ENABLE = 3
+REGISTER_CLK0_CONTROL = 16
+REGISTER_PLLA_PARAMETERS = 26
+REGISTER_PLLB_PARAMETERS = 34
+REGISTER_MS0_PARAMETERS = 42
+PARAMETER_BLOCK_SIZE = 8
+
+CLK_POWER_DOWN = 1 << 7
+CLK_INTEGER_MODE = 1 << 6
+CLK_SOURCE_PLLB = 1 << 5
+CLK_SOURCE_MULTISYNTH = 3 << 2
+CLK_DRIVE_STRENGTH_8MA = 3
+# The control registers of the unused CLK6 and CLK7 hold the integer mode bits
+# of the PLL feedback dividers
+PLL_INTEGER_MODE_REGISTERS = [22, 23]
+MS_DIVIDE_BY_4 = 3 << 2
+
+# The registers of a Clock Builder Pro export that are not derived from the
+# frequencies, with the values of the export shipped in clock_setup
+FIXED_REGISTERS_BEFORE = [(2, 0x53), (4, 0x20), (7, 0x00), (15, 0x00)]
+FIXED_REGISTERS_AFTER = (
+    [(90, 0x00), (91, 0x00)]
+    + [(address, 0x00) for address in range(149, 156)]
+    + [(address, 0x00) for address in range(162, 168)]
+    + [(183, 0xD2)]
+)
+
+FREQUENCY_PATTERN = re.compile(r"^\s*([0-9]*\.?[0-9]+)\s*([kKMG]?)(?:Hz)?\s*$")
+FREQUENCY_UNITS = {"": 1, "k": 10**3, "K": 10**3, "M": 10**6, "G": 10**9}
+
+
+class FrequencyPlanError(Exception):
+    """An exception to be thrown when no configuration generates the requested
+    frequencies."""
+
+
+class PllPlan(NamedTuple):
+    """Defines the configuration of a PLL.
+
+    Attributes:
+        multiplier (Fraction): The feedback multiplier of the crystal.
+        vco        (Fraction): The VCO frequency in Hz.
+    """
+
+    multiplier: Fraction
+    vco: Fraction
+
+
+class OutputPlan(NamedTuple):
+    """Defines the configuration of a clock output.
+
+    Attributes:
+        target    (Fraction): The requested frequency in Hz.
+        frequency (Fraction): The generated frequency in Hz.
+        pll       (int): The index of the PLL, 0 for PLLA and 1 for PLLB.
+        divider   (Fraction): The multisynth divider.
+        r_divider (int): The output divider, a power of two.
+    """
+
+    target: Fraction
+    frequency: Fraction
+    pll: int
+    divider: Fraction
+    r_divider: int
+
+    @property
+    def error(self) -> float:
+        """The relative error of the generated frequency."""
+        return float(abs(self.frequency - self.target) / self.target)
+
+
+class FrequencyPlan(NamedTuple):
+    """Defines a configuration of the clock IC generating a set of frequencies.
+
+    Attributes:
+        outputs   (Tuple[OutputPlan | None, ...]): The configuration of every
+                                                  output, None if disabled.
+        plls      (Tuple[PllPlan | None, ...]): The configuration of PLLA and
+                                               PLLB, None if unused.
+        registers (Tuple[Register, ...]): The registers in the order of a
+                                          Clock Builder Pro export.
+    """
+
+    outputs: Tuple[OutputPlan | None, ...]
+    plls: Tuple[PllPlan | None, ...]
+    registers: Tuple[Register, ...]
+
+    @property
+    def max_error(self) -> float:
+        """The largest relative error of all outputs."""
+        return max(output.error for output in self.outputs if output is not None)
+
+
+class PllGroupPlan(NamedTuple):
+    """Defines the configuration of a PLL and the multisynths it drives.
+
+    Attributes:
+        key      (Tuple[float, int, int, float]): The ranking of the plan, the
+                                                  error, the number of
+                                                  fractional multisynths, a
+                                                  fractional PLL and the
+                                                  negated VCO frequency.
+        pll      (PllPlan): The configuration of the PLL.
+        dividers (Tuple[Fraction, ...]): The multisynth dividers.
+    """
+
+    key: Tuple[float, int, int, float]
+    pll: PllPlan
+    dividers: Tuple[Fraction, ...]
+
+
+def parse_frequency(text: str) -> Fraction:
+    """Parse a frequency like 10M, 12.5MHz or 32768.
+
+    :param text: The frequency with an optional k, M or G suffix.
+    :type text: str
+    :return: The frequency in Hz.
+    :rtype: Fraction
+    :raises ValueError: If the frequency is malformed.
+    """
+    match = FREQUENCY_PATTERN.match(text)
+    if match is None:
+        raise ValueError(f"Invalid frequency {text}")
+    return Fraction(match.group(1)) * FREQUENCY_UNITS[match.group(2)]
+
+
+def parse_frequencies(text: str) -> Tuple[Fraction | None, ...]:
+    """Parse a comma separated list of frequencies for CLK0, CLK1 and CLK2.
+
+    An empty entry disables the output, e.g. 10M,,20M.
+
+    :param text: The frequencies.
+    :type text: str
+    :return: The frequency in Hz of every output, None if disabled.
+    :rtype: Tuple[Fraction | None, ...]
+    :raises ValueError: If a frequency is malformed or too many are given.
+    """
+    entries = text.split(",")
+    if len(entries) > OUTPUT_COUNT:
+        raise ValueError(f"At most {OUTPUT_COUNT} frequencies can be generated")
+    return tuple(parse_frequency(entry) if entry.strip() else None for entry in entries)
+
+
+def __get_r_divider(target: Fraction) -> int:
+    """Get the smallest output divider bringing a frequency into the range of
+    the multisynth dividers.
+
+    :param target: The requested frequency in Hz.
+    :type target: Fraction
+    :return: The output divider.
+    :rtype: int
+    """
+    r_divider = 1
+    while (
+        target * r_divider * MULTISYNTH_MAX_DIVIDER < VCO_MAX_FREQUENCY
+        and r_divider < MAX_R_DIVIDER
+    ):
+        r_divider *= 2
+    return r_divider
+
+
+def __is_valid_divider(divider: Fraction) -> bool:
+    """Check if the multisynth can divide by a ratio.
+
+    :param divider: The divider.
+    :type divider: Fraction
+    :return: True if the divider is supported.
+    :rtype: bool
+    """
+    if divider in MULTISYNTH_SPECIAL_DIVIDERS:
+        return True
+    return (
+        MULTISYNTH_MIN_DIVIDER <= divider <= MULTISYNTH_MAX_DIVIDER
+        and divider.denominator <= MAX_DENOMINATOR
+    )
+
+
+def __rank_vco_candidates(
+    targets: Tuple[Fraction, ...], crystal: Fraction
+) -> List[Fraction]:
+    """Rank the VCO frequencies for a group of outputs sharing a PLL.
+
+    The candidates are the integer multiples of the crystal and the integer
+    multiples of every target, so that either the PLL or a multisynth runs in
+    integer mode. They are ranked by the number of fractional multisynths,
+    then by a fractional PLL, preferring high VCO frequencies.
+
+    :param targets: The frequencies in Hz at the multisynth outputs.
+    :type targets: Tuple[Fraction, ...]
+    :param crystal: The crystal frequency in Hz.
+    :type crystal: Fraction
+    :return: The best ranked VCO frequencies in Hz.
+    :rtype: List[Fraction]
+    """
+    import numpy as np
+
+    bases = [crystal, *targets]
+    base_indices = []
+    multipliers = []
+    for index, base in enumerate(bases):
+        if index == 0:
+            low, high = PLL_MIN_MULTIPLIER, PLL_MAX_MULTIPLIER
+        else:
+            low, high = MULTISYNTH_SPECIAL_DIVIDERS[0], MULTISYNTH_MAX_DIVIDER
+        low = max(low, math.ceil(VCO_MIN_FREQUENCY / base))
+        high = min(high, math.floor(VCO_MAX_FREQUENCY / base))
+        if low > high:
+            continue
+        multipliers.append(np.arange(low, high + 1, dtype=np.int64))
+        base_indices.append(np.full(high - low + 1, index))
+
+    if not multipliers:
+        return []
+
+    multiplier = np.concatenate(multipliers)
+    base_index = np.concatenate(base_indices)
+    vco = np.array([float(base) for base in bases])[base_index] * multiplier
+
+    # The divider of every target for every candidate
+    ratio = vco[:, None] / np.array([float(target) for target in targets])[None, :]
+    nearest = np.rint(ratio)
+    integer = np.abs(ratio - nearest) <= 1e-9 * ratio
+    valid = (
+        (ratio >= MULTISYNTH_MIN_DIVIDER) & (ratio <= MULTISYNTH_MAX_DIVIDER)
+    ) | (integer & np.isin(nearest, MULTISYNTH_SPECIAL_DIVIDERS))
+
+    pll_ratio = vco / float(crystal)
+    pll_integer = np.abs(pll_ratio - np.rint(pll_ratio)) <= 1e-9 * pll_ratio
+    fractional_count = np.count_nonzero(~integer, axis=1)
+
+    candidates = np.flatnonzero(valid.all(axis=1))
+    # The last key is the primary one
+    order = np.lexsort(
+        (-vco[candidates], ~pll_integer[candidates], fractional_count[candidates])
+    )
+    return [
+        bases[base_index[candidate]] * int(multiplier[candidate])
+        for candidate in candidates[order]
+    ]
+
+
+def __plan_group(
+    targets: Tuple[Fraction, ...], crystal: Fraction
+) -> PllGroupPlan | None:
+    """Find the best configuration of a PLL driving a group of outputs.
+
+    :param targets: The frequencies in Hz at the multisynth outputs.
+    :type targets: Tuple[Fraction, ...]
+    :param crystal: The crystal frequency in Hz.
+    :type crystal: Fraction
+    :return: The best configuration, or None if there is none.
+    :rtype: PllGroupPlan | None
+    """
+    best = None
+    ranked = __rank_vco_candidates(targets, crystal)
+    # Remove duplicates but keep the ranking
+    candidates = list(dict.fromkeys(ranked))[:EXACT_CANDIDATES]
+    for vco in candidates:
+        multiplier = (vco / crystal).limit_denominator(MAX_DENOMINATOR)
+        vco = crystal * multiplier
+        if not PLL_MIN_MULTIPLIER <= multiplier <= PLL_MAX_MULTIPLIER:
+            continue
+
+        dividers = tuple(
+            (vco / target).limit_denominator(MAX_DENOMINATOR) for target in targets
+        )
+        if not all(__is_valid_divider(divider) for divider in dividers):
+            continue
+
+        error = max(
+            float(abs(vco / divider - target) / target)
+            for divider, target in zip(dividers, targets)
+        )
+        key = (
+            error,
+            sum(divider.denominator != 1 for divider in dividers),
+            int(multiplier.denominator != 1),
+            -float(vco),
+        )
+        if best is None or key < best.key:
+            best = PllGroupPlan(key, PllPlan(multiplier, vco), dividers)
+    return best
+
+
+def encode_parameters(ratio: Fraction) -> bytes:
+    """Encode a PLL multiplier or multisynth divider into a parameter block.
+
+    :param ratio: The ratio a + b / c.
+    :type ratio: Fraction
+    :return: The eight parameter registers, without the output divider bits.
+    :rtype: bytes
+    """
+    a, remainder = divmod(ratio.numerator, ratio.denominator)
+    b, c = remainder, ratio.denominator
+    floor = 128 * b // c
+    p1 = 128 * a + floor - 512
+    p2 = 128 * b - c * floor
+    p3 = c
+    return bytes(
+        [
+            (p3 >> 8) & 0xFF,
+            p3 & 0xFF,
+            (p1 >> 16) & 0x03,
+            (p1 >> 8) & 0xFF,
+            p1 & 0xFF,
+            ((p3 >> 16) & 0x0F) << 4 | (p2 >> 16) & 0x0F,
+            (p2 >> 8) & 0xFF,
+            p2 & 0xFF,
+        ]
+    )
+
+
+def encode_multisynth(divider: Fraction, r_divider: int) -> bytes:
+    """Encode the parameter block of an output multisynth.
+
+    :param divider: The multisynth divider.
+    :type divider: Fraction
+    :param r_divider: The output divider, a power of two.
+    :type r_divider: int
+    :return: The eight parameter registers.
+    :rtype: bytes
+    """
+    if divider == 4:
+        # Divide by 4 has a dedicated mode with all parameters cleared
+        parameters = bytearray([0, 1, MS_DIVIDE_BY_4, 0, 0, 0, 0, 0])
+    else:
+        parameters = bytearray(encode_parameters(divider))
+    parameters[2] |= (r_divider.bit_length() - 1) << 4
+    return bytes(parameters)
+
+
+def decode_parameters(block: Sequence[int]) -> Fraction:
+    """Decode a PLL multiplier or multisynth divider from a parameter block.
+
+    :param block: The eight parameter registers.
+    :type block: Sequence[int]
+    :return: The ratio a + b / c.
+    :rtype: Fraction
+    """
+    p1 = (block[2] & 0x03) << 16 | block[3] << 8 | block[4]
+    p2 = (block[5] & 0x0F) << 16 | block[6] << 8 | block[7]
+    p3 = (block[5] >> 4) << 16 | block[0] << 8 | block[1]
+    if block[2] & MS_DIVIDE_BY_4 == MS_DIVIDE_BY_4:
+        return Fraction(4)
+    return (p1 + 512 + Fraction(p2, p3 or 1)) / 128
+
+
+def decode_output_frequency(
+    register_map: Mapping[int, int] | bytes,
+    index: int,
+    crystal: Fraction = CRYSTAL_FREQUENCY,
+) -> Fraction | None:
+    """Decode the frequency of a clock output from the registers of the clock
+    IC.
+
+    :param register_map: The register values, indexed by address.
+    :type register_map: Mapping[int, int] | bytes
+    :param index: The index of the output.
+    :type index: int
+    :param crystal: The crystal frequency in Hz.
+    :type crystal: Fraction
+    :return: The frequency in Hz, or None if the output is disabled or not
+    driven by its multisynth.
+    :rtype: Fraction | None
+    """
+    control = register_map[REGISTER_CLK0_CONTROL + index]
+    if register_map[REGISTER_OUTPUT_ENABLE] & (1 << index) or control & CLK_POWER_DOWN:
+        return None
+    if control & CLK_SOURCE_MULTISYNTH != CLK_SOURCE_MULTISYNTH:
+        return None
+
+    if control & CLK_SOURCE_PLLB:
+        pll_address = REGISTER_PLLB_PARAMETERS
+    else:
+        pll_address = REGISTER_PLLA_PARAMETERS
+    ms_address = REGISTER_MS0_PARAMETERS + index * PARAMETER_BLOCK_SIZE
+    pll_block = [register_map[pll_address + offset] for offset in range(8)]
+    ms_block = [register_map[ms_address + offset] for offset in range(8)]
+
+    r_divider = 1 << ((ms_block[2] >> 4) & 0x07)
+    vco = crystal * decode_parameters(pll_block)
+    return vco / decode_parameters(ms_block) / r_divider
+
+
+def __build_registers(
+    outputs: Tuple[OutputPlan | None, ...], plls: Tuple[PllPlan | None, ...]
+) -> Tuple[Register, ...]:
+    """Build the registers of a plan in the order of a Clock Builder Pro
+    export.
+
+    :param outputs: The configuration of every output.
+    :type outputs: Tuple[OutputPlan | None, ...]
+    :param plls: The configuration of PLLA and PLLB.
+    :type plls: Tuple[PllPlan | None, ...]
+    :return: The registers.
+    :rtype: Tuple[Register, ...]
+    """
+    values: Dict[int, int] = dict(FIXED_REGISTERS_BEFORE)
+
+    output_enable = 0
+    for index in range(OUTPUT_COUNT):
+        output = outputs[index] if index < len(outputs) else None
+        address = REGISTER_CLK0_CONTROL + index
+        parameters = REGISTER_MS0_PARAMETERS + index * PARAMETER_BLOCK_SIZE
+        if output is None:
+            output_enable |= 1 << index
+            values[address] = CLK_POWER_DOWN | CLK_SOURCE_MULTISYNTH
+            block = encode_multisynth(Fraction(MULTISYNTH_MAX_DIVIDER), 1)
+        else:
+            values[address] = (
+                CLK_SOURCE_MULTISYNTH
+                | CLK_DRIVE_STRENGTH_8MA
+                | (CLK_INTEGER_MODE if output.divider.denominator == 1 else 0)
+                | (CLK_SOURCE_PLLB if output.pll == 1 else 0)
+            )
+            block = encode_multisynth(output.divider, output.r_divider)
+        values.update(enumerate(block, parameters))
+    values[REGISTER_OUTPUT_ENABLE] = output_enable
+
+    for address in range(REGISTER_CLK0_CONTROL + OUTPUT_COUNT, 24):
+        values[address] = CLK_POWER_DOWN | CLK_SOURCE_MULTISYNTH
+
+    for index, (pll, address) in enumerate(
+        zip(plls, [REGISTER_PLLA_PARAMETERS, REGISTER_PLLB_PARAMETERS])
+    ):
+        if pll is None:
+            continue
+        values.update(enumerate(encode_parameters(pll.multiplier), address))
+        if pll.multiplier.denominator == 1:
+            values[PLL_INTEGER_MODE_REGISTERS[index]] |= CLK_INTEGER_MODE
+
+    values.update(FIXED_REGISTERS_AFTER)
+
+    # The interrupt masks and output enable come first, as in an export
+    order = [2, REGISTER_OUTPUT_ENABLE] + sorted(
+        address for address in values if address not in (2, REGISTER_OUTPUT_ENABLE)
+    )
+    return tuple(Register(address, values[address]) for address in order)
+
+
+@functools.lru_cache(maxsize=256)
+def __plan_frequencies(
+    frequencies: Tuple[Fraction | None, ...], crystal: Fraction
+) -> FrequencyPlan:
+    """Plan the configuration for a set of frequencies, memoized.
+
+    :param frequencies: The frequency in Hz of every output, None if disabled.
+    :type frequencies: Tuple[Fraction | None, ...]
+    :param crystal: The crystal frequency in Hz.
+    :type crystal: Fraction
+    :return: The plan with the lowest error.
+    :rtype: FrequencyPlan
+    :raises FrequencyPlanError: If a frequency cannot be generated.
+    """
+    enabled = [index for index, target in enumerate(frequencies) if target is not None]
+    if not enabled:
+        logger.error("At least one output frequency has to be given.")
+        raise FrequencyPlanError
+
+    r_dividers = {}
+    for index in enabled:
+        target = frequencies[index]
+        if not MIN_OUTPUT_FREQUENCY <= target <= MAX_OUTPUT_FREQUENCY:
+            logger.error(
+                f"CLK{index}: {float(target):.0f} Hz is outside of the range from"
+                + f" {MIN_OUTPUT_FREQUENCY} Hz to {MAX_OUTPUT_FREQUENCY} Hz."
+            )
+            raise FrequencyPlanError
+        r_dividers[index] = __get_r_divider(target)
+
+    group_plans: Dict[Tuple[int, ...], PllGroupPlan | None] = {}
+    best = None
+    # The first output is always driven by PLLA, the others by either PLL
+    for assignment in itertools.product(range(PLL_COUNT), repeat=len(enabled) - 1):
+        assignment = (0, *assignment)
+        groups = [
+            tuple(index for index, pll in zip(enabled, assignment) if pll == group)
+            for group in range(PLL_COUNT)
+        ]
+        plans = []
+        for group in groups:
+            if group and group not in group_plans:
+                group_plans[group] = __plan_group(
+                    tuple(frequencies[index] * r_dividers[index] for index in group),
+                    crystal,
+                )
+            plans.append(group_plans[group] if group else None)
+        if any(plan is None for plan, group in zip(plans, groups) if group):
+            continue
+
+        used = [plan for plan in plans if plan is not None]
+        key = (
+            max(plan.key[0] for plan in used),
+            sum(plan.key[1] for plan in used),
+            sum(plan.key[2] for plan in used),
+            len(used),
+        )
+        if best is None or key < best[0]:
+            best = (key, groups, plans)
+
+    if best is None:
+        logger.error("No configuration of the clock IC generates the frequencies.")
+        raise FrequencyPlanError
+
+    _, groups, plans = best
+    outputs: List[OutputPlan | None] = [None] * len(frequencies)
+    for pll_index, (group, plan) in enumerate(zip(groups, plans)):
+        for index, divider in zip(group, plan.dividers if plan else []):
+            outputs[index] = OutputPlan(
+                frequencies[index],
+                plan.pll.vco / divider / r_dividers[index],
+                pll_index,
+                divider,
+                r_dividers[index],
+            )
+
+    plls = tuple(plan.pll if plan else None for plan in plans)
+    return FrequencyPlan(tuple(outputs), plls, __build_registers(tuple(outputs), plls))
+
+
+def plan_frequencies(
+    frequencies: Sequence[Fraction | None], crystal: Fraction = CRYSTAL_FREQUENCY
+) -> FrequencyPlan:
+    """Plan the configuration of the clock IC for a set of output frequencies.
+
+    The PLL multipliers and multisynth dividers are searched for the lowest
+    error, preferring integer modes. Plans are memoized per frequency set.
+
+    :param frequencies: The frequency in Hz of CLK0, CLK1 and CLK2, None if
+    the output is disabled.
+    :type frequencies: Sequence[Fraction | None]
+    :param crystal: The crystal frequency in Hz.
+    :type crystal: Fraction
+    :return: The plan with the lowest error.
+    :rtype: FrequencyPlan
+    :raises FrequencyPlanError: If a frequency cannot be generated.
+    """
+    frequencies = tuple(
+        Fraction(frequency) if frequency is not None else None
+        for frequency in frequencies
+    )
+    if len(frequencies) > OUTPUT_COUNT:
+        logger.error(f"At most {OUTPUT_COUNT} frequencies can be generated.")
+        raise FrequencyPlanError
+    return __plan_frequencies(frequencies, Fraction(crystal))
+
+
+def retune_output(
+    plan: FrequencyPlan,
+    index: int,
+    frequency: Fraction,
+    max_error: float = RETUNE_MAX_ERROR,
+) -> FrequencyPlan:
+    """Plan a new frequency of a single output.
+
+    The PLLs are kept if the multisynth of the output can generate the
+    frequency from its current VCO, so that only the parameters of the
+    multisynth change and no PLL has to be reset. Otherwise, the whole
+    configuration is planned again.
+
+    :param plan: The current plan.
+    :type plan: FrequencyPlan
+    :param index: The index of the output to be retuned.
+    :type index: int
+    :param frequency: The new frequency in Hz.
+    :type frequency: Fraction
+    :param max_error: The maximum relative error when keeping the PLL.
+    :type max_error: float
+    :return: The new plan.
+    :rtype: FrequencyPlan
+    :raises FrequencyPlanError: If the frequency cannot be generated.
+    """
+    frequency = Fraction(frequency)
+    frequencies = [output.target if output else None for output in plan.outputs]
+    frequencies += [None] * (index + 1 - len(frequencies))
+    frequencies[index] = frequency
+
+    current = plan.outputs[index] if index < len(plan.outputs) else None
+    in_range = MIN_OUTPUT_FREQUENCY <= frequency <= MAX_OUTPUT_FREQUENCY
+    if current is not None and in_range:
+        vco = plan.plls[current.pll].vco
+        r_divider = __get_r_divider(frequency)
+        divider = (vco / (frequency * r_divider)).limit_denominator(MAX_DENOMINATOR)
+        if __is_valid_divider(divider):
+            output = OutputPlan(
+                frequency, vco / divider / r_divider, current.pll, divider, r_divider
+            )
+            if output.error <= max_error:
+                outputs = list(plan.outputs)
+                outputs[index] = output
+                outputs = tuple(outputs)
+                return FrequencyPlan(
+                    outputs, plan.plls, __build_registers(outputs, plan.plls)
+                )
+
+    return plan_frequencies(frequencies)
+
+
+def log_frequency_plan(plan: FrequencyPlan) -> None:
+    """Log the PLL and output configuration of a plan.
+
+    :param plan: The plan to be logged.
+    :type plan: FrequencyPlan
+    """
+    for name, pll in zip(["PLLA", "PLLB"], plan.plls):
+        if pll is not None:
+            logger.debug(
+                f"{name}: VCO {float(pll.vco) / 1e6:.6f} MHz"
+                + f" (multiplier {float(pll.multiplier):.6f})"
+            )
+    for index, output in enumerate(plan.outputs):
+        if output is None:
+            logger.debug(f"CLK{index}: disabled")
+            continue
+        logger.info(
+            f"CLK{index}: {float(output.frequency) / 1e6:.6f} MHz from"
+            + f" PLL{'AB'[output.pll]} / {float(output.divider):.6f}"
+            + f" / {output.r_divider} (error {output.error * 1e6:.3f} ppm)"
+        )
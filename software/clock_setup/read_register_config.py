@@ -1,7 +1,24 @@
 #!/usr/bin/env python3
 
 import csv
-from typing import List, NamedTuple
+import hashlib
+import io
+import struct
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+from loguru import logger
+from modules.board_state import DEFAULT_STATE_DIRECTORY
+
+REGISTER_CONFIG_CACHE_DIRECTORY = DEFAULT_STATE_DIRECTORY / "register_configs"
+
+# The interrupt mask and output enable registers at the start of a Clock
+# Builder Pro export are written separately by the programming procedure
+PROGRAMMING_PROCEDURE_REGISTERS = 2
+
+COMPILED_MAGIC = b"FREG"
+COMPILED_VERSION = 1
+# Magic, version, register count, run count, source mtime, source hash, digest
+COMPILED_HEADER = struct.Struct("<4sHHHq32s32s")
 
 
 class Register(NamedTuple):
@@ -16,6 +33,60 @@ class Register(NamedTuple):
     value: int
 
 
+class RegisterRun(NamedTuple):
+    """Defines registers with contiguous addresses written in a single burst.
+
+    Attributes:
+        address (int): The address of the first register.
+        values  (bytes): The values of the registers.
+    """
+
+    address: int
+    values: bytes
+
+
+class RegisterConfig(NamedTuple):
+    """Defines a compiled register configuration.
+
+    Attributes:
+        registers (List[Register]): The registers in the order of the export.
+        runs      (List[RegisterRun]): The bursts written in the configuration
+                                       step of the programming procedure.
+        digest    (str): The SHA-256 of the addresses and values, identifying
+                         the configuration independent of its formatting.
+    """
+
+    registers: List[Register]
+    runs: List[RegisterRun]
+    digest: str
+
+
+class InvalidRegisterConfigError(Exception):
+    """An exception to be thrown when a compiled register configuration is
+    malformed."""
+
+
+def __parse_register_config(config: io.TextIOBase) -> List[Register]:
+    """Parse a register config exported by Clock Builder Pro.
+
+    :param config: The opened register config.
+    :type config: io.TextIOBase
+    :return: The registers in the order of the export.
+    :rtype: List[Register]
+    """
+    values = []
+    config_reader = csv.reader(config)
+    for row in config_reader:
+        # exclude any header lines
+        if not row[0].startswith("#"):
+            address = int(row[0])
+            value = int(row[1][:-1], 16)  # strip the 'h' from the number
+            register = Register(address, value)
+            values.append(register)
+
+    return values
+
+
 def read_register_config(register_config: str) -> List[Register]:
     """Read the register config from the given file
 
@@ -23,15 +94,229 @@ def read_register_config(register_config: str) -> List[Register]:
     :type register_config: str
     :return: A list containing the register configuration given as a tuple of address and value.
     """
-    values = []
     with open(register_config, newline="") as config:
-        config_reader = csv.reader(config)
-        for row in config_reader:
-            # exclude any header lines
-            if not row[0].startswith("#"):
-                address = int(row[0])
-                value = int(row[1][:-1], 16)  # strip the 'h' from the number
-                register = Register(address, value)
-                values.append(register)
+        return __parse_register_config(config)
 
-    return values
+
+def coalesce_registers(registers: List[Register]) -> List[RegisterRun]:
+    """Coalesce registers into runs of contiguous addresses.
+
+    The order of the registers is kept, a run only grows while each register
+    directly follows the previous one. The Si5351 auto-increments the register
+    address during a write, so each run can be written in a single transaction.
+
+    :param registers: The registers to be written.
+    :type registers: List[Register]
+    :return: The runs in the order of the registers.
+    :rtype: List[RegisterRun]
+    """
+    runs = []
+    start = 0
+    values = bytearray()
+    for register in registers:
+        if values and register.address == start + len(values):
+            values.append(register.value)
+            continue
+
+        if values:
+            runs.append(RegisterRun(start, bytes(values)))
+        start = register.address
+        values = bytearray([register.value])
+
+    if values:
+        runs.append(RegisterRun(start, bytes(values)))
+    return runs
+
+
+def compile_register_config(registers: List[Register]) -> RegisterConfig:
+    """Compile a register configuration.
+
+    :param registers: The registers in the order of the export.
+    :type registers: List[Register]
+    :return: The compiled configuration.
+    :rtype: RegisterConfig
+    """
+    pairs = bytes(byte for register in registers for byte in register)
+    return RegisterConfig(
+        list(registers),
+        coalesce_registers(registers[PROGRAMMING_PROCEDURE_REGISTERS:]),
+        hashlib.sha256(pairs).hexdigest(),
+    )
+
+
+def serialize_register_config(
+    config: RegisterConfig, source_mtime: int = 0, source_hash: bytes = bytes(32)
+) -> bytes:
+    """Serialize a compiled register configuration.
+
+    The registers are stored as an address array followed by a value array,
+    the runs as pairs of start address and length.
+
+    :param config: The compiled configuration.
+    :type config: RegisterConfig
+    :param source_mtime: The modification time of the export in nanoseconds.
+    :type source_mtime: int
+    :param source_hash: The SHA-256 of the export.
+    :type source_hash: bytes
+    :return: The serialized configuration.
+    :rtype: bytes
+    """
+    header = COMPILED_HEADER.pack(
+        COMPILED_MAGIC,
+        COMPILED_VERSION,
+        len(config.registers),
+        len(config.runs),
+        source_mtime,
+        source_hash,
+        bytes.fromhex(config.digest),
+    )
+    addresses = bytes(register.address for register in config.registers)
+    values = bytes(register.value for register in config.registers)
+    runs = bytes(byte for run in config.runs for byte in (run.address, len(run.values)))
+    return header + addresses + values + runs
+
+
+def deserialize_register_config(data: bytes) -> Tuple[RegisterConfig, int, bytes]:
+    """Deserialize a compiled register configuration.
+
+    :param data: The serialized configuration.
+    :type data: bytes
+    :return: The compiled configuration, the modification time and the
+    SHA-256 of the export.
+    :rtype: Tuple[RegisterConfig, int, bytes]
+    :raises InvalidRegisterConfigError: If the data is malformed.
+    """
+    if len(data) < COMPILED_HEADER.size:
+        raise InvalidRegisterConfigError("The compiled configuration is truncated.")
+
+    magic, version, count, run_count, source_mtime, source_hash, digest = (
+        COMPILED_HEADER.unpack_from(data)
+    )
+    if magic != COMPILED_MAGIC or version != COMPILED_VERSION:
+        raise InvalidRegisterConfigError("The compiled configuration is unsupported.")
+    if len(data) != COMPILED_HEADER.size + 2 * count + 2 * run_count:
+        raise InvalidRegisterConfigError("The compiled configuration is truncated.")
+
+    offset = COMPILED_HEADER.size
+    addresses = data[offset : offset + count]
+    values = data[offset + count : offset + 2 * count]
+    registers = [Register(address, value) for address, value in zip(addresses, values)]
+
+    # The values of the runs follow the configuration registers in order
+    runs = []
+    run_data = data[offset + 2 * count :]
+    value_offset = PROGRAMMING_PROCEDURE_REGISTERS
+    for index in range(run_count):
+        address, length = run_data[2 * index], run_data[2 * index + 1]
+        runs.append(RegisterRun(address, values[value_offset : value_offset + length]))
+        value_offset += length
+
+    return RegisterConfig(registers, runs, digest.hex()), source_mtime, source_hash
+
+
+# Compilations already loaded by this process, keyed by path and mtime
+__loaded_configs: Dict[Tuple[Path, int], RegisterConfig] = {}
+
+
+def __get_cache_path(register_config: Path, cache_directory: Path) -> Path:
+    """Get the path of the cached compilation of a register config.
+
+    :param register_config: The resolved path of the register config.
+    :type register_config: Path
+    :param cache_directory: The directory of the cache.
+    :type cache_directory: Path
+    :return: The path of the cached compilation.
+    :rtype: Path
+    """
+    name = hashlib.sha256(str(register_config).encode()).hexdigest()[:32]
+    return cache_directory / f"{name}.bin"
+
+
+def __read_cache(cache_path: Path) -> Tuple[RegisterConfig, int, bytes] | None:
+    """Read a cached compilation.
+
+    :param cache_path: The path of the cached compilation.
+    :type cache_path: Path
+    :return: The compiled configuration, the modification time and the
+    SHA-256 of the export, or None if there is no valid compilation.
+    :rtype: Tuple[RegisterConfig, int, bytes] | None
+    """
+    try:
+        return deserialize_register_config(cache_path.read_bytes())
+    except FileNotFoundError:
+        return None
+    except InvalidRegisterConfigError:
+        logger.debug(f"Ignoring the invalid cached compilation {cache_path}")
+        return None
+
+
+def load_register_config(
+    register_config: str, cache_directory: Path = REGISTER_CONFIG_CACHE_DIRECTORY
+) -> RegisterConfig:
+    """Load a register config, compiling it only if it changed since the last
+    time it was loaded.
+
+    The cached compilation is used directly if the modification time of the
+    export did not change. Otherwise, the export is hashed and only parsed
+    again if its content changed. Within a process, a configuration is only
+    read from the cache once.
+
+    :param register_config: The file where the register configuration is defined.
+    :type register_config: str
+    :param cache_directory: The directory of the cache.
+    :type cache_directory: Path
+    :return: The compiled configuration.
+    :rtype: RegisterConfig
+    """
+    path = Path(register_config).resolve()
+    source_mtime = path.stat().st_mtime_ns
+    loaded = __loaded_configs.get((path, source_mtime))
+    if loaded is not None:
+        return loaded
+
+    cache_path = __get_cache_path(path, cache_directory)
+    cached = __read_cache(cache_path)
+    if cached is not None and cached[1] == source_mtime:
+        __loaded_configs[(path, source_mtime)] = cached[0]
+        return cached[0]
+
+    source = path.read_bytes()
+    source_hash = hashlib.sha256(source).digest()
+    if cached is not None and cached[2] == source_hash:
+        config = cached[0]
+    else:
+        logger.debug(f"Compiling the register config {path}")
+        config = compile_register_config(
+            __parse_register_config(io.StringIO(source.decode(), newline=""))
+        )
+
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so that a compilation is never truncated
+        temporary_path = cache_path.with_suffix(".tmp")
+        temporary_path.write_bytes(
+            serialize_register_config(config, source_mtime, source_hash)
+        )
+        temporary_path.replace(cache_path)
+    except OSError as error:
+        logger.debug(f"Could not cache the compiled register config: {error}")
+
+    __loaded_configs[(path, source_mtime)] = config
+    return config
+
+
+def load_register_configs(
+    register_configs: List[str],
+    cache_directory: Path = REGISTER_CONFIG_CACHE_DIRECTORY,
+) -> List[RegisterConfig]:
+    """Load many register configs, e.g. for a frequency sweep.
+
+    :param register_configs: The files where the register configurations are
+    defined.
+    :type register_configs: List[str]
+    :param cache_directory: The directory of the cache.
+    :type cache_directory: Path
+    :return: The compiled configurations in the given order.
+    :rtype: List[RegisterConfig]
+    """
+    return [load_register_config(path, cache_directory) for path in register_configs]
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+# pyftdi is imported by the clock programming on first use, so that importing
+# the facade does not load it
+from __future__ import annotations
+
+import asyncio
+from contextlib import AsyncExitStack
+from typing import Dict, Sequence
+from clock_setup.clock_setup import (
+    connect_clock_ic,
+    configure_clock_ic,
+    ProgrammingStatistics,
+)
+from clock_setup.frequency_planner import parse_frequencies, plan_frequencies
+from clock_setup.read_register_config import (
+    compile_register_config,
+    load_register_config,
+)
+from modules.async_io import DEFAULT_OFFLOAD_WORKERS, OffloadPool
+from modules.baudrate import record_fabric_clock
+from modules.board_state import get_i2c_board_key
+from modules.device_readiness import DEFAULT_READY_TIMEOUT, get_port_location
+from modules.ftdi_access import DEFAULT_FTDI_ID, NoDeviceFoundError
+from modules.usb_hub import HubPort, DEFAULT_POWER_OFF_TIME
+from modules.usb_port_power_control import (
+    power_cycle_usb_ports_async,
+    POWER_SWITCH_NATIVE,
+)
+from upload_bitstream.upload_bitstream import (
+    upload_bitstream_async,
+    UploadOptions,
+    UploadStatistics,
+    DEFAULT_BAUDRATE,
+    DEFAULT_BOARD_TIMEOUT,
+)
+
+DEFAULT_CLOCK_TIMEOUT = 10.0
+
+
+class AsyncBoardApi:
+    """An asyncio facade over the upload, the clock programming and the USB
+    power cycling.
+
+    Uploads through a tty are written on the event loop itself, so driving
+    many boards does not need a thread per board. The FTDI and I2C transfers
+    run in a bounded thread pool, and the power cycle awaits the off time and
+    the udev events instead of sleeping. Calls for the same board, clock
+    adapter or hub port are serialized. Every call can be cancelled, e.g.
+    with asyncio.timeout, and the calls with a timeout raise TimeoutError once
+    it expired.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_OFFLOAD_WORKERS):
+        """Create the facade.
+
+        :param max_workers: The maximum number of concurrent blocking calls,
+        e.g. I2C transfers.
+        :type max_workers: int
+        """
+        self.pool = OffloadPool(max_workers)
+        self.__locks: Dict[str, asyncio.Lock] = {}
+
+    async def __aenter__(self) -> "AsyncBoardApi":
+        return self
+
+    async def __aexit__(self, *exception) -> None:
+        self.close()
+
+    def close(self) -> None:
+        """Wait for the running blocking calls and stop the thread pool."""
+        self.pool.close()
+
+    def __get_lock(self, resource: str) -> asyncio.Lock:
+        """Get the lock serializing the calls for a resource.
+
+        :param resource: The resource, e.g. a device path.
+        :type resource: str
+        :return: The lock of the resource.
+        :rtype: asyncio.Lock
+        """
+        return self.__locks.setdefault(resource, asyncio.Lock())
+
+    async def upload_bitstream(
+        self,
+        bitstream_file: str,
+        baudrate: int = DEFAULT_BAUDRATE,
+        ftdi_name: str = DEFAULT_FTDI_ID,
+        port: str | None = None,
+        options: UploadOptions = UploadOptions(),
+        timeout: float | None = DEFAULT_BOARD_TIMEOUT,
+    ) -> UploadStatistics:
+        """Upload a bitstream to a board.
+
+        :param bitstream_file: The bitstream file to be uploaded.
+        :type bitstream_file: str
+        :param baudrate: The baudrate to be used for the upload.
+        :type baudrate: int
+        :param ftdi_name: The name of the FTDI chip to be used.
+        :type ftdi_name: str
+        :param port: The serial port, pyserial URL or FTDI URL to be used. If
+        not given, the port of the FTDI chip is looked up.
+        :type port: str | None
+        :param options: Defines how the bitstream is transmitted.
+        :type options: UploadOptions
+        :param timeout: The maximum time in seconds for the upload including
+        the wait for other uploads to the board, None to wait forever.
+        :type timeout: float | None
+        :return: The telemetry of the upload.
+        :rtype: UploadStatistics
+        :raises TimeoutError: If the upload did not finish in time.
+        """
+        async with asyncio.timeout(timeout):
+            async with self.__get_lock(f"uart:{port or ftdi_name}"):
+                return await upload_bitstream_async(
+                    bitstream_file,
+                    baudrate,
+                    ftdi_name,
+                    port,
+                    options,
+                    self.pool.run,
+                )
+
+    async def program_clock_ic(
+        self,
+        register_config: str | None = None,
+        frequencies: str | None = None,
+        device_id: str = DEFAULT_FTDI_ID,
+        incremental: bool = False,
+        timeout: float | None = DEFAULT_CLOCK_TIMEOUT,
+    ) -> ProgrammingStatistics:
+        """Program the clock IC with a register config file or frequencies.
+
+        :param register_config: The register config file created by Clock
+        Builder Pro.
+        :type register_config: str | None
+        :param frequencies: The frequencies of the outputs instead of a file,
+        e.g. 10M,2M,20M.
+        :type frequencies: str | None
+        :param device_id: The device ID of the I2C adapter.
+        :type device_id: str
+        :param incremental: Only write the registers that differ from the
+        current configuration of the clock IC.
+        :type incremental: bool
+        :param timeout: The maximum time in seconds for the programming, None
+        to wait forever.
+        :type timeout: float | None
+        :return: The telemetry of the programming.
+        :rtype: ProgrammingStatistics
+        :raises ValueError: If neither a file nor frequencies are given.
+        :raises NoDeviceFoundError: If the clock IC could not be reached.
+        :raises TimeoutError: If the programming did not finish in time.
+        """
+        if not register_config and not frequencies:
+            raise ValueError("Either a register config or frequencies are needed.")
+
+        async with asyncio.timeout(timeout):
+            async with self.__get_lock(f"i2c:{device_id}"):
+                return await self.pool.run(
+                    self.__program_clock_ic,
+                    register_config,
+                    frequencies,
+                    device_id,
+                    incremental,
+                )
+
+    def __program_clock_ic(
+        self,
+        register_config: str | None,
+        frequencies: str | None,
+        device_id: str,
+        incremental: bool,
+    ) -> ProgrammingStatistics:
+        """Program the clock IC, blocking until it is done.
+
+        :param register_config: The register config file.
+        :type register_config: str | None
+        :param frequencies: The frequencies of the outputs instead of a file.
+        :type frequencies: str | None
+        :param device_id: The device ID of the I2C adapter.
+        :type device_id: str
+        :param incremental: Only write the differing registers.
+        :type incremental: bool
+        :return: The telemetry of the programming.
+        :rtype: ProgrammingStatistics
+        :raises NoDeviceFoundError: If the clock IC could not be reached.
+        """
+        from pyftdi.i2c import I2cController
+
+        if frequencies:
+            plan = plan_frequencies(parse_frequencies(frequencies))
+            config = compile_register_config(list(plan.registers))
+        else:
+            config = load_register_config(register_config)
+
+        i2c = I2cController()
+        try:
+            i2c_port = connect_clock_ic(i2c, device_id)
+            if i2c_port is None:
+                raise NoDeviceFoundError(f"No I2C port found for {device_id}.")
+            statistics = configure_clock_ic(i2c_port, config, incremental)
+            record_fabric_clock(get_i2c_board_key(i2c), config.registers)
+        finally:
+            i2c.close()
+        return statistics
+
+    async def power_cycle_usb_ports(
+        self,
+        ports: Sequence[HubPort],
+        device_id: str | None = None,
+        timeout: float = DEFAULT_READY_TIMEOUT,
+        wait_for_tty: bool = True,
+        power_switch: str = POWER_SWITCH_NATIVE,
+        off_time: float = DEFAULT_POWER_OFF_TIME,
+    ) -> Dict[str, str | None]:
+        """Power cycle a set of USB ports at once and wait until their devices
+        are back.
+
+        :param ports: The ports to be power cycled.
+        :type ports: Sequence[HubPort]
+        :param device_id: The expected device ID of the devices, e.g.
+        0403:6014.
+        :type device_id: str | None
+        :param timeout: The maximum time in seconds to wait for the devices.
+        :type timeout: float
+        :param wait_for_tty: Wait until the tty nodes of the devices answer,
+        else only until the USB devices are back.
+        :type wait_for_tty: bool
+        :param power_switch: Switch the ports natively or through uhubctl.
+        :type power_switch: str
+        :param off_time: The time in seconds the ports stay unpowered.
+        :type off_time: float
+        :return: The tty node of the device behind every port, keyed by the
+        location of the device.
+        :rtype: Dict[str, str | None]
+        :raises DeviceNotReadyError: If a device did not come back in time.
+        """
+        async with AsyncExitStack() as stack:
+            # Locked in a fixed order, so that batches cannot deadlock
+            for location in sorted(
+                {get_port_location(port.location, str(port.port)) for port in ports}
+            ):
+                await stack.enter_async_context(self.__get_lock(f"port:{location}"))
+            return await power_cycle_usb_ports_async(
+                ports,
+                device_id,
+                timeout,
+                wait_for_tty,
+                power_switch,
+                off_time,
+                self.pool.run,
+            )
+
+    async def power_cycle_usb_port(
+        self,
+        location: str,
+        port: int,
+        device_id: str | None = None,
+        timeout: float = DEFAULT_READY_TIMEOUT,
+        wait_for_tty: bool = True,
+        power_switch: str = POWER_SWITCH_NATIVE,
+    ) -> str | None:
+        """Power cycle a single USB port and wait until its device is back.
+
+        :param location: The USB hub on which the port is located.
+        :type location: str
+        :param port: The port to be power cycled.
+        :type port: int
+        :param device_id: The expected device ID of the device.
+        :type device_id: str | None
+        :param timeout: The maximum time in seconds to wait for the device.
+        :type timeout: float
+        :param wait_for_tty: Wait until the tty node of the device answers.
+        :type wait_for_tty: bool
+        :param power_switch: Switch the port natively or through uhubctl.
+        :type power_switch: str
+        :return: The tty node of the device, or None if only the USB device
+        was waited for.
+        :rtype: str | None
+        :raises DeviceNotReadyError: If the device did not come back in time.
+        """
+        device_nodes = await self.power_cycle_usb_ports(
+            [HubPort(location, int(port))],
+            device_id,
+            timeout,
+            wait_for_tty,
+            power_switch,
+        )
+        return next(iter(device_nodes.values()))
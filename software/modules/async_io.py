@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+
+import asyncio
+import functools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, TypeVar
+
+# The number of threads running blocking calls, e.g. FTDI and I2C transfers
+DEFAULT_OFFLOAD_WORKERS = 8
+
+T = TypeVar("T")
+
+# Runs a blocking function with its arguments without blocking the event loop
+BlockingRunner = Callable[..., Awaitable[Any]]
+
+
+async def __wait_for_fd(fileno: int, writable: bool, timeout: float | None) -> bool:
+    """Wait until a file descriptor is ready without blocking the event loop.
+
+    The descriptor is only watched while waiting, so that a descriptor which
+    stays ready does not keep the event loop busy.
+
+    :param fileno: The file descriptor.
+    :type fileno: int
+    :param writable: Wait until it is writable instead of readable.
+    :type writable: bool
+    :param timeout: The maximum time to wait in seconds, None to wait forever.
+    :type timeout: float | None
+    :return: True if the descriptor is ready, False on a timeout.
+    :rtype: bool
+    """
+    loop = asyncio.get_running_loop()
+    ready = loop.create_future()
+    add, remove = (
+        (loop.add_writer, loop.remove_writer)
+        if writable
+        else (loop.add_reader, loop.remove_reader)
+    )
+    add(fileno, lambda: ready.done() or ready.set_result(True))
+    try:
+        return await asyncio.wait_for(ready, timeout)
+    except TimeoutError:
+        return False
+    finally:
+        remove(fileno)
+
+
+async def wait_readable(fileno: int, timeout: float | None = None) -> bool:
+    """Wait until a file descriptor is readable.
+
+    :param fileno: The file descriptor.
+    :type fileno: int
+    :param timeout: The maximum time to wait in seconds, None to wait forever.
+    :type timeout: float | None
+    :return: True if the descriptor is readable, False on a timeout.
+    :rtype: bool
+    """
+    return await __wait_for_fd(fileno, False, timeout)
+
+
+async def wait_writable(fileno: int, timeout: float | None = None) -> bool:
+    """Wait until a file descriptor is writable.
+
+    :param fileno: The file descriptor.
+    :type fileno: int
+    :param timeout: The maximum time to wait in seconds, None to wait forever.
+    :type timeout: float | None
+    :return: True if the descriptor is writable, False on a timeout.
+    :rtype: bool
+    """
+    return await __wait_for_fd(fileno, True, timeout)
+
+
+async def write_all(fileno: int, data: memoryview) -> None:
+    """Write all data to a non-blocking file descriptor, e.g. a tty opened by
+    pyserial, waiting for room in the output buffer in between.
+
+    :param fileno: The file descriptor.
+    :type fileno: int
+    :param data: The data to be written.
+    :type data: memoryview
+    """
+    # Slices are only held during the write, so that a cancelled write does
+    # not keep the underlying buffer, e.g. a mapped bitstream, exported
+    written = 0
+    while written < len(data):
+        try:
+            written += os.write(fileno, data[written:])
+        except BlockingIOError:
+            pass
+        if written < len(data):
+            await wait_writable(fileno)
+
+
+async def run_to_completion(awaitable: Awaitable[T]) -> T:
+    """Await a call running in a thread to its end even if the caller is
+    cancelled, so that the device it uses is released before the cancellation
+    propagates.
+
+    :param awaitable: The call.
+    :type awaitable: Awaitable[T]
+    :return: The result of the call.
+    :rtype: T
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        return await asyncio.shield(task)
+    except asyncio.CancelledError:
+        # The thread cannot be interrupted, so it is waited for
+        while not task.done():
+            try:
+                await asyncio.wait([task])
+            except asyncio.CancelledError:
+                pass
+        if not task.cancelled():
+            # The cancellation takes precedence over an error of the call
+            task.exception()
+        raise
+
+
+class OffloadPool:
+    """Runs blocking calls in a bounded number of threads.
+
+    Calls exceeding the number of threads are queued, so that driving many
+    boards from one event loop does not need a thread per board.
+    """
+
+    def __init__(self, max_workers: int = DEFAULT_OFFLOAD_WORKERS):
+        """Create the pool, the threads are started on demand.
+
+        :param max_workers: The maximum number of concurrent calls.
+        :type max_workers: int
+        """
+        self.max_workers = max_workers
+        self.__executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="offload"
+        )
+
+    async def run(self, function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Run a blocking function in the pool.
+
+        A cancelled call still waits for the function to return, since the
+        thread cannot be interrupted.
+
+        :param function: The function to be called.
+        :type function: Callable[..., T]
+        :param args: The positional arguments of the function.
+        :type args: Any
+        :param kwargs: The keyword arguments of the function.
+        :type kwargs: Any
+        :return: The result of the function.
+        :rtype: T
+        """
+        loop = asyncio.get_running_loop()
+        return await run_to_completion(
+            loop.run_in_executor(
+                self.__executor, functools.partial(function, *args, **kwargs)
+            )
+        )
+
+    def close(self) -> None:
+        """Wait for the running calls and stop the threads."""
+        self.__executor.shutdown(wait=True, cancel_futures=True)
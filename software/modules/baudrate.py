@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+
+from fractions import Fraction
+from typing import Callable, Dict, List, NamedTuple, Sequence
+from loguru import logger
+from clock_setup.frequency_planner import decode_output_frequency
+from clock_setup.read_register_config import Register
+from modules.board_state import store_fabric_clock
+
+# The rates supported by common UART hosts, in ascending order
+STANDARD_BAUDRATES = [
+    9600,
+    19200,
+    38400,
+    57600,
+    115200,
+    230400,
+    460800,
+    500000,
+    576000,
+    921600,
+    1000000,
+    1152000,
+    1500000,
+    2000000,
+    3000000,
+]
+
+# The receiver samples in the middle of a bit, so the accumulated drift over
+# the ten bits of a frame has to stay well below half a bit
+DEFAULT_UART_TOLERANCE = 0.02
+
+BAUDRATE_AUTO = "auto"
+
+# The output of the clock IC driving the fabric
+FABRIC_CLOCK_OUTPUT = 0
+
+
+class FabricProfile(NamedTuple):
+    """Defines how the configuration UART of a fabric derives its baud rate.
+
+    The UART counts a fixed number of fabric clock cycles per bit, so its baud
+    rate scales with the fabric clock.
+
+    Attributes:
+        reference_clock    (Fraction): A fabric clock frequency in Hz.
+        reference_baudrate (int): The baud rate at the reference clock.
+        tolerance          (float): The relative baud rate error accepted by
+                                    the UART.
+    """
+
+    reference_clock: Fraction
+    reference_baudrate: int
+    tolerance: float = DEFAULT_UART_TOLERANCE
+
+    @property
+    def cycles_per_bit(self) -> Fraction:
+        """The fabric clock cycles per transmitted bit."""
+        return self.reference_clock / self.reference_baudrate
+
+
+FABRIC_PROFILES: Dict[str, FabricProfile] = {
+    # Both tape-outs use the configuration UART with the same divider
+    "mpw2": FabricProfile(Fraction(10_000_000), 57600),
+    "mpw5": FabricProfile(Fraction(10_000_000), 57600),
+}
+DEFAULT_FABRIC = "mpw2"
+
+
+class NoBaudrateFoundError(Exception):
+    """An exception to be thrown when no baud rate loads the bitstream
+    reliably."""
+
+
+def parse_baudrate(text: str) -> int | str:
+    """Parse a baud rate given on the command line.
+
+    :param text: The baud rate or auto.
+    :type text: str
+    :return: The baud rate, or auto to derive it from the fabric clock.
+    :rtype: int | str
+    :raises ValueError: If the baud rate is malformed.
+    """
+    if text == BAUDRATE_AUTO:
+        return text
+    return int(text)
+
+
+def record_fabric_clock(
+    board_key: str, registers: Sequence[Register]
+) -> Fraction | None:
+    """Record the fabric clock generated by a register configuration, so that
+    later uploads to the board can derive their baud rate from it.
+
+    :param board_key: The key of the board whose clock IC was configured.
+    :type board_key: str
+    :param registers: The register configuration written to the clock IC.
+    :type registers: Sequence[Register]
+    :return: The recorded fabric clock in Hz, None if the configuration does
+    not define it.
+    :rtype: Fraction | None
+    """
+    register_map = {register.address: register.value for register in registers}
+    try:
+        frequency = decode_output_frequency(register_map, FABRIC_CLOCK_OUTPUT)
+    except KeyError:
+        logger.debug("The register configuration does not define the fabric clock")
+        frequency = None
+    store_fabric_clock(board_key, frequency)
+    return frequency
+
+
+def get_fabric_baudrate(fabric_clock: Fraction, profile: FabricProfile) -> Fraction:
+    """Get the baud rate of the configuration UART at a fabric clock.
+
+    :param fabric_clock: The fabric clock frequency in Hz.
+    :type fabric_clock: Fraction
+    :param profile: The profile of the fabric.
+    :type profile: FabricProfile
+    :return: The exact baud rate of the UART.
+    :rtype: Fraction
+    """
+    return Fraction(fabric_clock) / profile.cycles_per_bit
+
+
+def select_baudrate(
+    fabric_clock: Fraction,
+    profile: FabricProfile,
+    baudrates: List[int] = STANDARD_BAUDRATES,
+) -> int:
+    """Select the fastest standard baud rate within the tolerance of the UART.
+
+    If no standard rate is close enough, the exact rate is used, which FTDI
+    chips can generate as well.
+
+    :param fabric_clock: The fabric clock frequency in Hz.
+    :type fabric_clock: Fraction
+    :param profile: The profile of the fabric.
+    :type profile: FabricProfile
+    :param baudrates: The standard baud rates.
+    :type baudrates: List[int]
+    :return: The baud rate.
+    :rtype: int
+    """
+    exact = get_fabric_baudrate(fabric_clock, profile)
+    matching = [
+        baudrate
+        for baudrate in baudrates
+        if abs(baudrate - exact) <= exact * Fraction(profile.tolerance)
+    ]
+    if matching:
+        baudrate = max(matching)
+    else:
+        baudrate = round(exact)
+        logger.warning(
+            f"No standard baud rate matches {float(exact):.0f} baud, using the"
+            + " exact rate."
+        )
+
+    logger.info(
+        f"Using {baudrate} baud for a fabric clock of {float(fabric_clock) / 1e6:g} MHz"
+    )
+    return baudrate
+
+
+def probe_baudrate(
+    load: Callable[[int], bool],
+    baudrates: List[int] = STANDARD_BAUDRATES,
+    attempts: int = 3,
+) -> int:
+    """Find the fastest baud rate loading the bitstream reliably.
+
+    The baud rates are tried from the fastest to the slowest until one loads
+    the bitstream successfully in every attempt.
+
+    :param load: Uploads the bitstream with the given baud rate and verifies
+    it, returning True on success.
+    :type load: Callable[[int], bool]
+    :param baudrates: The baud rates to be tried.
+    :type baudrates: List[int]
+    :param attempts: The number of successful uploads required.
+    :type attempts: int
+    :return: The fastest reliable baud rate.
+    :rtype: int
+    :raises NoBaudrateFoundError: If no baud rate is reliable.
+    """
+    for baudrate in sorted(baudrates, reverse=True):
+        for attempt in range(attempts):
+            if not load(baudrate):
+                logger.info(f"{baudrate} baud failed in attempt {attempt + 1}")
+                break
+        else:
+            logger.info(f"{baudrate} baud loaded the bitstream {attempts} times")
+            return baudrate
+
+    logger.error("No baud rate loaded the bitstream reliably.")
+    raise NoBaudrateFoundError
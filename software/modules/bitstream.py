@@ -0,0 +1,427 @@
+#!/usr/bin/env python3
+
+import mmap
+import numpy as np
+from pathlib import Path
+from typing import NamedTuple
+from loguru import logger
+
+HEADER_SIZE = 16
+HEADER_MAGIC = b"\x00\xAA\xFF\x01"
+SYNC_WORD = b"\xFA\xB0\xFA\xB1"
+PREAMBLE_SIZE = HEADER_SIZE + len(SYNC_WORD)
+
+FRAME_ADDRESS_SIZE = 4
+FRAME_BYTES_PER_ROW = 4
+MAX_FRAMES_PER_COLUMN = 20
+# The column is encoded in the upper bits of the frame address
+FRAME_SELECT_WIDTH = 5
+FRAME_ADDRESS_COLUMN_SHIFT = 8 * FRAME_ADDRESS_SIZE - FRAME_SELECT_WIDTH
+MAX_COLUMNS = 1 << FRAME_SELECT_WIDTH
+
+# Upper bound for the number of rows when inferring the frame size
+MAX_ROWS = 64
+
+FABRICS_DIRECTORY = Path(__file__).resolve().parent.parent / "fabrics"
+
+FRAME_ADDRESS_DTYPE = np.dtype(">u4")
+
+
+class InvalidBitstreamError(Exception):
+    """An exception to be thrown when the data is not a valid frame based
+    bitstream."""
+
+
+class BitstreamLayout(NamedTuple):
+    """Defines the layout of the frame records of a bitstream.
+
+    Attributes:
+        record_size  (int): The size of a frame address and its frame data.
+        record_count (int): The number of frame records.
+    """
+
+    record_size: int
+    record_count: int
+
+
+class FabricGeometry(NamedTuple):
+    """Defines the configuration frame geometry of a fabric.
+
+    Attributes:
+        columns               (int): The number of columns of the fabric.
+        rows                  (int): The number of rows covered by a frame.
+        frame_bits_per_row    (int): The number of frame bits per row.
+        max_frames_per_column (int): The number of frames per column.
+    """
+
+    columns: int
+    rows: int
+    frame_bits_per_row: int = 8 * FRAME_BYTES_PER_ROW
+    max_frames_per_column: int = MAX_FRAMES_PER_COLUMN
+
+    @property
+    def frame_size(self) -> int:
+        """The size of the data of a frame in bytes."""
+        return self.rows * self.frame_bits_per_row // 8
+
+    @property
+    def record_size(self) -> int:
+        """The size of a frame address and its frame data in bytes."""
+        return FRAME_ADDRESS_SIZE + self.frame_size
+
+    @property
+    def frame_count(self) -> int:
+        """The number of frames of the fabric."""
+        return self.columns * self.max_frames_per_column
+
+
+def read_fabric_geometry(fabric_csv: str | Path) -> FabricGeometry:
+    """Read the configuration frame geometry from a fabric CSV.
+
+    The frames cover the rows between the north and south terminal rows. The
+    geometry is taken from the cached fabric model, so the CSV is only parsed
+    after it changed.
+
+    :param fabric_csv: The fabric CSV file.
+    :type fabric_csv: str | Path
+    :return: The geometry of the fabric.
+    :rtype: FabricGeometry
+    """
+    from modules.fabric import load_fabric
+
+    return load_fabric(fabric_csv).geometry
+
+
+def get_fabric_geometry(fabric: str) -> FabricGeometry:
+    """Get the geometry of a fabric shipped in the fabrics directory.
+
+    :param fabric: The name of the fabric, e.g. mpw5.
+    :type fabric: str
+    :return: The geometry of the fabric.
+    :rtype: FabricGeometry
+    """
+    return read_fabric_geometry(FABRICS_DIRECTORY / fabric / f"{fabric}.csv")
+
+
+def is_frame_address(address: int) -> bool:
+    """Check if a word is a valid frame address.
+
+    A frame address selects exactly one frame of a column (one-hot) and
+    encodes the column in the upper FRAME_SELECT_WIDTH bits.
+
+    :param address: The word to be checked.
+    :type address: int
+    :return: True if the word is a valid frame address, else False.
+    :rtype: bool
+    """
+    return bool(__are_frame_addresses(np.array([address], dtype=np.uint32)))
+
+
+def __are_frame_addresses(addresses: np.ndarray) -> bool:
+    """Check if all words are valid frame addresses.
+
+    :param addresses: The words to be checked.
+    :type addresses: np.ndarray
+    :return: True if all words are valid frame addresses, else False.
+    :rtype: bool
+    """
+    frame_select = addresses & ((1 << FRAME_ADDRESS_COLUMN_SHIFT) - 1)
+    return bool(
+        np.all(frame_select != 0)
+        and np.all(frame_select >> MAX_FRAMES_PER_COLUMN == 0)
+        and np.all(frame_select & (frame_select - 1) == 0)
+    )
+
+
+def view_frame_addresses(data: memoryview, layout: BitstreamLayout) -> np.ndarray:
+    """Get a strided view of the frame addresses without copying them.
+
+    :param data: The bitstream data.
+    :type data: memoryview
+    :param layout: The layout of the frame records.
+    :type layout: BitstreamLayout
+    :return: The frame addresses.
+    :rtype: np.ndarray
+    """
+    return np.ndarray(
+        (layout.record_count,),
+        dtype=FRAME_ADDRESS_DTYPE,
+        buffer=data,
+        offset=PREAMBLE_SIZE,
+        strides=(layout.record_size,),
+    )
+
+
+def check_preamble(data: memoryview) -> None:
+    """Check the header and the sync word of a bitstream.
+
+    :param data: The bitstream data.
+    :type data: memoryview
+    :raises InvalidBitstreamError: If the header or the sync word is invalid.
+    """
+    if len(data) < PREAMBLE_SIZE or data[: len(HEADER_MAGIC)] != HEADER_MAGIC:
+        logger.error("The bitstream does not start with a valid header.")
+        raise InvalidBitstreamError
+    if data[HEADER_SIZE:PREAMBLE_SIZE] != SYNC_WORD:
+        logger.error("The bitstream does not contain a sync word.")
+        raise InvalidBitstreamError
+
+
+def get_bitstream_layout(
+    data: memoryview, geometry: FabricGeometry | None = None
+) -> BitstreamLayout:
+    """Get the layout of the frame records of a bitstream.
+
+    Without a fabric geometry, the frame size is inferred from the length of
+    the bitstream and the positions of valid frame addresses.
+
+    :param data: The bitstream data.
+    :type data: memoryview
+    :param geometry: The geometry of the fabric the bitstream is meant for.
+    :type geometry: FabricGeometry | None
+    :return: The layout of the frame records.
+    :rtype: BitstreamLayout
+    :raises InvalidBitstreamError: If no valid layout was found.
+    """
+    check_preamble(data)
+
+    body_size = len(data) - PREAMBLE_SIZE
+    if geometry is not None:
+        record_sizes = [geometry.record_size]
+    else:
+        record_sizes = [
+            FRAME_ADDRESS_SIZE + rows * FRAME_BYTES_PER_ROW
+            for rows in range(1, MAX_ROWS + 1)
+        ]
+
+    for record_size in record_sizes:
+        if body_size % record_size != 0:
+            continue
+
+        layout = BitstreamLayout(record_size, body_size // record_size)
+        if __are_frame_addresses(view_frame_addresses(data, layout)):
+            return layout
+
+    logger.error("The frame records of the bitstream could not be identified.")
+    raise InvalidBitstreamError
+
+
+class Bitstream:
+    """A frame based bitstream with an index of its frames.
+
+    All arrays are views into the bitstream data, no frame is copied. The
+    bitstream has to be closed before the underlying buffer is released.
+
+    Attributes:
+        data            (memoryview): The bitstream data.
+        layout          (BitstreamLayout): The layout of the frame records.
+        records         (np.ndarray): The frame records (address and data),
+                                      one row per record.
+        frame_addresses (np.ndarray): The frame address of every record.
+        columns         (np.ndarray): The column of every record.
+        frames          (np.ndarray): The frame index within the column of
+                                      every record.
+        frame_table     (np.ndarray): The record index for every column and
+                                      frame index, -1 if not present.
+    """
+
+    def __init__(self, data: memoryview, geometry: FabricGeometry | None = None):
+        """Parse and index a bitstream.
+
+        :param data: The bitstream data.
+        :type data: memoryview
+        :param geometry: The geometry to validate the bitstream against.
+        :type geometry: FabricGeometry | None
+        :raises InvalidBitstreamError: If the bitstream is invalid or does
+        not match the geometry.
+        """
+        self.__mapped = None
+        self.data = memoryview(data)
+        self.layout = get_bitstream_layout(self.data, geometry)
+
+        self.records = np.ndarray(
+            (self.layout.record_count, self.layout.record_size),
+            dtype=np.uint8,
+            buffer=self.data,
+            offset=PREAMBLE_SIZE,
+        )
+        self.frame_addresses = view_frame_addresses(self.data, self.layout)
+        self.columns = (self.frame_addresses >> FRAME_ADDRESS_COLUMN_SHIFT).astype(
+            np.intp
+        )
+        frame_select = self.frame_addresses & ((1 << MAX_FRAMES_PER_COLUMN) - 1)
+        # The exponent of a power of two is its bit position plus one
+        self.frames = np.frexp(frame_select.astype(np.float64))[1].astype(np.intp) - 1
+
+        self.frame_table = np.full((MAX_COLUMNS, MAX_FRAMES_PER_COLUMN), -1, np.intp)
+        self.frame_table[self.columns, self.frames] = np.arange(
+            self.layout.record_count
+        )
+
+        if geometry is not None:
+            self.__check_geometry(geometry)
+
+    @classmethod
+    def open(cls, bitstream_file: str | Path, geometry: FabricGeometry | None = None):
+        """Memory-map and index a bitstream file.
+
+        :param bitstream_file: The bitstream file.
+        :type bitstream_file: str | Path
+        :param geometry: The geometry to validate the bitstream against.
+        :type geometry: FabricGeometry | None
+        :return: The indexed bitstream.
+        :rtype: Bitstream
+        :raises InvalidBitstreamError: If the bitstream is invalid or does
+        not match the geometry.
+        """
+        with open(bitstream_file, "rb") as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            bitstream = cls(memoryview(mapped), geometry)
+        except InvalidBitstreamError:
+            bitstream = None
+        # The views of a failed index are only released with its traceback
+        if bitstream is None:
+            mapped.close()
+            raise InvalidBitstreamError
+        bitstream.__mapped = mapped
+        return bitstream
+
+    def close(self) -> None:
+        """Release the views and unmap the file if it was opened."""
+        self.records = None
+        self.frame_addresses = None
+        self.data.release()
+        if self.__mapped is not None:
+            self.__mapped.close()
+            self.__mapped = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def __check_geometry(self, geometry: FabricGeometry) -> None:
+        """Check that the frames match the geometry of the fabric.
+
+        :param geometry: The geometry of the fabric.
+        :type geometry: FabricGeometry
+        :raises InvalidBitstreamError: If the frames do not match.
+        """
+        if self.layout.record_count != geometry.frame_count:
+            logger.error(
+                f"The bitstream contains {self.layout.record_count} frames,"
+                + f" the fabric has {geometry.frame_count}."
+            )
+            raise InvalidBitstreamError
+        if np.any(self.columns >= geometry.columns) or np.any(
+            self.frames >= geometry.max_frames_per_column
+        ):
+            logger.error("The bitstream addresses frames outside of the fabric.")
+            raise InvalidBitstreamError
+
+    @property
+    def preamble(self) -> memoryview:
+        """The header and the sync word."""
+        return self.data[:PREAMBLE_SIZE]
+
+    def get_record_index(self, column: int, frame: int) -> int:
+        """Get the index of the record of a frame.
+
+        :param column: The column of the frame.
+        :type column: int
+        :param frame: The frame index within the column.
+        :type frame: int
+        :return: The record index, or -1 if the frame is not present.
+        :rtype: int
+        """
+        return int(self.frame_table[column, frame])
+
+    def get_frame_data(self, column: int, frame: int) -> memoryview:
+        """Get the data of a frame without copying it.
+
+        :param column: The column of the frame.
+        :type column: int
+        :param frame: The frame index within the column.
+        :type frame: int
+        :return: The frame data.
+        :rtype: memoryview
+        :raises KeyError: If the frame is not present.
+        """
+        index = self.get_record_index(column, frame)
+        if index < 0:
+            raise KeyError((column, frame))
+        offset = PREAMBLE_SIZE + index * self.layout.record_size
+        return self.data[offset + FRAME_ADDRESS_SIZE : offset + self.layout.record_size]
+
+
+def build_differential_stream(
+    previous: memoryview, current: memoryview
+) -> bytearray | None:
+    """Build a stream containing only the frames that differ between two
+    bitstreams.
+
+    Every frame record is applied independently by the configuration logic,
+    so a stream of the preamble followed by a subset of the records is valid.
+
+    :param previous: The bitstream currently loaded on the board.
+    :type previous: memoryview
+    :param current: The bitstream to be loaded.
+    :type current: memoryview
+    :return: The differential stream, or None if the bitstreams have a
+    different preamble or layout and cannot be compared.
+    :rtype: bytearray | None
+    """
+    try:
+        previous_bitstream = Bitstream(previous)
+        current_bitstream = Bitstream(current)
+    except InvalidBitstreamError:
+        return None
+
+    with previous_bitstream, current_bitstream:
+        if (
+            previous_bitstream.layout != current_bitstream.layout
+            or previous_bitstream.preamble != current_bitstream.preamble
+        ):
+            return None
+
+        changed = np.any(previous_bitstream.records != current_bitstream.records, axis=1)
+        stream = bytearray(current_bitstream.preamble)
+        stream += current_bitstream.records[changed].tobytes()
+
+        logger.info(
+            f"{np.count_nonzero(changed)} of"
+            + f" {current_bitstream.layout.record_count} frames changed."
+        )
+    return stream
+
+
+def build_sparse_stream(data: memoryview) -> bytearray | None:
+    """Build a stream without the frames that equal the power-on state.
+
+    The configuration memory of the fabric is cleared at power-on, so frames
+    containing only zeros do not have to be transmitted to a freshly power
+    cycled board.
+
+    :param data: The bitstream to be loaded.
+    :type data: memoryview
+    :return: The sparse stream, or None if the data is not a valid bitstream.
+    :rtype: bytearray | None
+    """
+    try:
+        bitstream = Bitstream(data)
+    except InvalidBitstreamError:
+        return None
+
+    with bitstream:
+        configured = np.any(bitstream.records[:, FRAME_ADDRESS_SIZE:] != 0, axis=1)
+        stream = bytearray(bitstream.preamble)
+        stream += bitstream.records[configured].tobytes()
+
+        logger.info(
+            f"{bitstream.layout.record_count - np.count_nonzero(configured)} of"
+            + f" {bitstream.layout.record_count} frames are in the power-on"
+            + " state and skipped."
+        )
+    return stream
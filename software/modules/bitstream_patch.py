@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+# The frame index needs NumPy, which is only imported once a bitstream is
+# patched, so that the edits can be parsed by the command line
+from __future__ import annotations
+
+import mmap
+import tomllib
+from pathlib import Path
+from typing import Iterator, List, NamedTuple, Sequence, Set, Tuple, TYPE_CHECKING
+from loguru import logger
+
+if TYPE_CHECKING:
+    from modules.bitstream import FabricGeometry
+
+# The name of the patch set formed by the edits given on the command line
+COMMAND_LINE_PATCH_SET = "edits"
+# The environment variable passing the name of the patch set to a hook command
+PATCH_SET_VARIABLE = "FABULOUS_PATCH_SET"
+
+
+class FrameEdit(NamedTuple):
+    """Defines the new value of a bit range of a frame within a tile.
+
+    The bits of a tile in a frame form one word of the frame data, the word
+    of the first row below the north terminal row comes first. Bit 0 is the
+    least significant bit of the big-endian word (FrameData[0]).
+
+    Attributes:
+        x        (int): The column of the tile.
+        y        (int): The row of the tile in the fabric grid, the north
+                        terminal row being 0.
+        frame    (int): The frame index within the column.
+        low_bit  (int): The lowest bit of the range.
+        high_bit (int): The highest bit of the range, included.
+        value    (int): The value written to the range.
+    """
+
+    x: int
+    y: int
+    frame: int
+    low_bit: int
+    high_bit: int
+    value: int
+
+
+class PatchSet(NamedTuple):
+    """Defines the edits of one variant of a design.
+
+    Attributes:
+        name  (str): The name of the variant, used for its output file.
+        edits (List[FrameEdit]): The edits applied to the base bitstream.
+    """
+
+    name: str
+    edits: List[FrameEdit]
+
+
+class InvalidPatchError(Exception):
+    """An exception to be thrown when an edit or a patch file is invalid."""
+
+
+def parse_bit_range(text: str | int) -> Tuple[int, int]:
+    """Parse a bit range in the format HIGH:LOW or a single bit.
+
+    :param text: The bit range, e.g. 15:0 or 7.
+    :type text: str | int
+    :return: The lowest and the highest bit.
+    :rtype: Tuple[int, int]
+    :raises ValueError: If the range is malformed.
+    """
+    if isinstance(text, int):
+        return text, text
+    high, _, low = text.partition(":")
+    high_bit = int(high, 0)
+    low_bit = int(low, 0) if low else high_bit
+    if low_bit > high_bit:
+        raise ValueError(f"The bit range {text} has to be given as HIGH:LOW")
+    return low_bit, high_bit
+
+
+def parse_edit(text: str) -> FrameEdit:
+    """Parse an edit in the format X,Y,FRAME,BITS,VALUE.
+
+    :param text: The edit, e.g. 1,3,0,15:0,0xBEEF.
+    :type text: str
+    :return: The edit.
+    :rtype: FrameEdit
+    :raises ValueError: If the edit is malformed.
+    """
+    fields = text.split(",")
+    if len(fields) != 5:
+        raise ValueError(f"The edit {text} has to be given as X,Y,FRAME,BITS,VALUE")
+    x, y, frame = (int(field, 0) for field in fields[:3])
+    return FrameEdit(x, y, frame, *parse_bit_range(fields[3]), int(fields[4], 0))
+
+
+def load_patch_sets(patch_file: str) -> List[PatchSet]:
+    """Load the patch sets of a TOML file.
+
+    Every [[patch_sets]] table has a name and a list of edits, each with the
+    keys x, y, frame, bits (HIGH:LOW or a single bit) and value.
+
+    :param patch_file: The path of the patch file.
+    :type patch_file: str
+    :return: The patch sets in the order of the file.
+    :rtype: List[PatchSet]
+    :raises FileNotFoundError: If the file does not exist.
+    :raises InvalidPatchError: If the file is malformed.
+    """
+    try:
+        with open(patch_file, "rb") as file:
+            document = tomllib.load(file)
+    except tomllib.TOMLDecodeError as error:
+        logger.error(f"The patch file {patch_file} is malformed: {error}")
+        raise InvalidPatchError
+
+    patch_sets = []
+    for index, table in enumerate(document.get("patch_sets", []), 1):
+        name = str(table.get("name", f"patch_{index}"))
+        edits = []
+        for edit in table.get("edits", []):
+            try:
+                edits.append(
+                    FrameEdit(
+                        int(edit["x"]),
+                        int(edit["y"]),
+                        int(edit["frame"]),
+                        *parse_bit_range(edit["bits"]),
+                        int(edit["value"]),
+                    )
+                )
+            except (KeyError, TypeError, ValueError) as error:
+                logger.error(f"An edit of the patch set {name} is malformed: {error}")
+                raise InvalidPatchError
+        patch_sets.append(PatchSet(name, edits))
+
+    if not patch_sets:
+        logger.error(f"The patch file {patch_file} has no patch sets.")
+        raise InvalidPatchError
+    if len({patch_set.name for patch_set in patch_sets}) != len(patch_sets):
+        logger.error(f"The patch sets of {patch_file} do not have unique names.")
+        raise InvalidPatchError
+    return patch_sets
+
+
+def check_edit(edit: FrameEdit, geometry: FabricGeometry) -> None:
+    """Check that an edit addresses bits within the fabric.
+
+    :param edit: The edit to be checked.
+    :type edit: FrameEdit
+    :param geometry: The geometry of the fabric.
+    :type geometry: FabricGeometry
+    :raises InvalidPatchError: If the edit is outside of the fabric.
+    """
+    if not 0 <= edit.x < geometry.columns or not 1 <= edit.y <= geometry.rows:
+        logger.error(f"The tile X{edit.x}Y{edit.y} is not configured by frames.")
+        raise InvalidPatchError
+    if not 0 <= edit.frame < geometry.max_frames_per_column:
+        logger.error(f"The fabric has no frame {edit.frame} per column.")
+        raise InvalidPatchError
+    if not 0 <= edit.low_bit <= edit.high_bit < geometry.frame_bits_per_row:
+        logger.error(
+            f"The bits {edit.high_bit}:{edit.low_bit} are outside of the"
+            + f" {geometry.frame_bits_per_row} frame bits of a tile."
+        )
+        raise InvalidPatchError
+    if not 0 <= edit.value < 1 << (edit.high_bit - edit.low_bit + 1):
+        logger.error(
+            f"The value {edit.value:#x} does not fit the bits"
+            + f" {edit.high_bit}:{edit.low_bit}."
+        )
+        raise InvalidPatchError
+
+
+class PatchedBitstream:
+    """A base bitstream with frame edits applied copy-on-write.
+
+    The base file is mapped privately, so only the pages of the edited frames
+    are copied and the file itself is never modified.
+
+    Attributes:
+        geometry  (FabricGeometry): The geometry of the fabric.
+        bitstream (Bitstream): The index of the patched frames.
+        touched   (Set[int]): The indices of the edited frame records.
+    """
+
+    def __init__(self, base_file: str | Path, geometry: FabricGeometry):
+        """Map a base bitstream for patching.
+
+        :param base_file: The base bitstream file.
+        :type base_file: str | Path
+        :param geometry: The geometry to validate the bitstream against.
+        :type geometry: FabricGeometry
+        :raises InvalidPatchError: If the bitstream does not match the
+        geometry.
+        """
+        from modules.bitstream import Bitstream, InvalidBitstreamError
+
+        with open(base_file, "rb") as f:
+            self.__mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+        try:
+            bitstream = Bitstream(memoryview(self.__mapped), geometry)
+        except InvalidBitstreamError:
+            bitstream = None
+        # The views of a failed index are only released with its traceback
+        if bitstream is None:
+            self.__mapped.close()
+            logger.error(f"The bitstream {base_file} does not match the fabric.")
+            raise InvalidPatchError
+        self.bitstream = bitstream
+        self.geometry = geometry
+        self.touched: Set[int] = set()
+
+    def close(self) -> None:
+        """Release the index and drop the copied pages."""
+        self.bitstream.close()
+        self.__mapped.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @property
+    def data(self) -> memoryview:
+        """The full patched bitstream."""
+        return self.bitstream.data
+
+    def apply(self, edits: Sequence[FrameEdit]) -> None:
+        """Apply edits to the frames.
+
+        :param edits: The edits, checked with check_edit.
+        :type edits: Sequence[FrameEdit]
+        :raises InvalidPatchError: If a frame is missing in the bitstream.
+        """
+        from modules.bitstream import FRAME_ADDRESS_SIZE
+
+        row_size = self.geometry.frame_bits_per_row // 8
+        for edit in edits:
+            index = self.bitstream.get_record_index(edit.x, edit.frame)
+            if index < 0:
+                logger.error(
+                    f"The bitstream has no frame {edit.frame} in column {edit.x}."
+                )
+                raise InvalidPatchError
+
+            start = FRAME_ADDRESS_SIZE + (edit.y - 1) * row_size
+            row = self.bitstream.records[index, start : start + row_size]
+            mask = ((1 << (edit.high_bit - edit.low_bit + 1)) - 1) << edit.low_bit
+            word = int.from_bytes(row.tobytes(), "big") & ~mask
+            word |= edit.value << edit.low_bit
+            row[:] = tuple(word.to_bytes(row_size, "big"))
+            self.touched.add(index)
+
+    def build_touched_stream(self) -> bytearray:
+        """Build a stream of only the edited frames.
+
+        :return: The preamble followed by the edited frame records, valid for
+        a board holding the base bitstream.
+        :rtype: bytearray
+        """
+        stream = bytearray(self.bitstream.preamble)
+        stream += self.bitstream.records[sorted(self.touched)].tobytes()
+        return stream
+
+
+def patch_bitstreams(
+    base_file: str | Path, patch_sets: Sequence[PatchSet], geometry: FabricGeometry
+) -> Iterator[Tuple[PatchSet, PatchedBitstream]]:
+    """Apply each patch set to its own copy-on-write mapping of the base.
+
+    All edits are checked before the first patch set is applied. A patched
+    bitstream is only valid until the next one is requested.
+
+    :param base_file: The base bitstream file.
+    :type base_file: str | Path
+    :param patch_sets: The patch sets.
+    :type patch_sets: Sequence[PatchSet]
+    :param geometry: The geometry of the fabric.
+    :type geometry: FabricGeometry
+    :return: Each patch set with its patched bitstream.
+    :rtype: Iterator[Tuple[PatchSet, PatchedBitstream]]
+    :raises InvalidPatchError: If an edit is outside of the fabric or the base
+    does not match the geometry.
+    """
+    for patch_set in patch_sets:
+        for edit in patch_set.edits:
+            check_edit(edit, geometry)
+
+    for patch_set in patch_sets:
+        with PatchedBitstream(base_file, geometry) as patched:
+            patched.apply(patch_set.edits)
+            logger.debug(
+                f"Patch set {patch_set.name} touches {len(patched.touched)} frames."
+            )
+            yield patch_set, patched
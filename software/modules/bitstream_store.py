@@ -0,0 +1,359 @@
+#!/usr/bin/env python3
+
+# NumPy is only needed to index a bitstream that is not stored yet and
+# imported on first use
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple
+from loguru import logger
+from modules.board_state import DEFAULT_STATE_DIRECTORY
+
+BITSTREAM_STORE_DIRECTORY = DEFAULT_STATE_DIRECTORY / "bitstreams"
+DEFAULT_STORE_SIZE = 256 << 20
+
+DATA_SUFFIX = ".bin"
+METADATA_SUFFIX = ".json"
+# The stream without the frames in the power-on state, derived on first use
+SPARSE_SUFFIX = ".sparse"
+STORE_SUFFIXES = [DATA_SUFFIX, METADATA_SUFFIX, SPARSE_SUFFIX]
+
+
+class StoredBitstream(NamedTuple):
+    """Defines a bitstream held by the store and a summary of its frames.
+
+    Attributes:
+        digest            (str): The SHA-256 of the bitstream as hex string.
+        size              (int): The size of the bitstream in bytes.
+        source            (str | None): The file the bitstream was first
+                                        stored from, if known.
+        fabric            (str | None): The shipped fabric whose geometry the
+                                        frames match, if any.
+        record_size       (int | None): The size of a frame address and its
+                                        frame data, None if the bitstream is
+                                        not frame based.
+        record_count      (int | None): The number of frame records.
+        configured_frames (int | None): The number of frames differing from
+                                        the power-on state.
+    """
+
+    digest: str
+    size: int
+    source: str | None
+    fabric: str | None
+    record_size: int | None
+    record_count: int | None
+    configured_frames: int | None
+
+
+def hash_bitstream(data: memoryview) -> str:
+    """Get the digest a bitstream is stored under.
+
+    :param data: The bitstream data.
+    :type data: memoryview
+    :return: The SHA-256 of the data as hex string.
+    :rtype: str
+    """
+    return hashlib.sha256(data).hexdigest()
+
+
+def __find_fabric(record_size: int, record_count: int) -> str | None:
+    """Find the shipped fabric with a matching frame geometry.
+
+    :param record_size: The size of a frame address and its frame data.
+    :type record_size: int
+    :param record_count: The number of frame records.
+    :type record_count: int
+    :return: The name of the fabric, or None if no fabric matches.
+    :rtype: str | None
+    """
+    from modules.baudrate import FABRIC_PROFILES
+    from modules.bitstream import get_fabric_geometry
+
+    for fabric in FABRIC_PROFILES:
+        try:
+            geometry = get_fabric_geometry(fabric)
+        except OSError:
+            continue
+        if (geometry.record_size, geometry.frame_count) == (record_size, record_count):
+            return fabric
+    return None
+
+
+def index_bitstream(
+    data: memoryview, digest: str, source: str | None = None
+) -> StoredBitstream:
+    """Summarize the frames of a bitstream in the metadata kept by the store.
+
+    :param data: The bitstream data.
+    :type data: memoryview
+    :param digest: The digest of the data.
+    :type digest: str
+    :param source: The file the bitstream was read from.
+    :type source: str | None
+    :return: The metadata, without the frame summary if the data is not a
+    frame based bitstream.
+    :rtype: StoredBitstream
+    """
+    from modules.bitstream import (
+        Bitstream,
+        InvalidBitstreamError,
+        FRAME_ADDRESS_SIZE,
+        HEADER_MAGIC,
+    )
+
+    if bytes(data[: len(HEADER_MAGIC)]) != HEADER_MAGIC:
+        return StoredBitstream(digest, len(data), source, None, None, None, None)
+    try:
+        bitstream = Bitstream(data)
+    except InvalidBitstreamError:
+        return StoredBitstream(digest, len(data), source, None, None, None, None)
+
+    import numpy as np
+
+    with bitstream:
+        layout = bitstream.layout
+        configured = np.any(bitstream.records[:, FRAME_ADDRESS_SIZE:] != 0, axis=1)
+        return StoredBitstream(
+            digest,
+            len(data),
+            source,
+            __find_fabric(layout.record_size, layout.record_count),
+            layout.record_size,
+            layout.record_count,
+            int(np.count_nonzero(configured)),
+        )
+
+
+class BitstreamStore:
+    """A local store of bitstreams keyed by their content.
+
+    Every bitstream is stored once together with its fabric and a summary of
+    its frames, so that boards recording what they hold only keep its digest.
+    The frames themselves are parsed again from the stored data when needed.
+    The store is bounded in size: the least recently used bitstreams are
+    evicted first, using the modification time of their data as the time of
+    the last use.
+    """
+
+    def __init__(
+        self,
+        directory: Path = BITSTREAM_STORE_DIRECTORY,
+        max_size: int = DEFAULT_STORE_SIZE,
+    ):
+        """Create a store, the directory is created on the first write.
+
+        :param directory: The directory of the store.
+        :type directory: Path
+        :param max_size: The maximum size of the store in bytes.
+        :type max_size: int
+        """
+        self.directory = Path(directory)
+        self.max_size = max_size
+        self.__lock = threading.Lock()
+
+    def __get_path(self, digest: str, suffix: str) -> Path:
+        """Get the path of a file of a stored bitstream.
+
+        :param digest: The digest of the bitstream.
+        :type digest: str
+        :param suffix: The kind of file, one of STORE_SUFFIXES.
+        :type suffix: str
+        :return: The path of the file.
+        :rtype: Path
+        """
+        return self.directory / f"{digest}{suffix}"
+
+    def __write(self, path: Path, data: bytes | memoryview) -> None:
+        """Write a file through a unique temporary file, so that concurrent
+        writers and readers never see a truncated file.
+
+        :param path: The path of the file.
+        :type path: Path
+        :param data: The content of the file.
+        :type data: bytes | memoryview
+        """
+        descriptor, temporary_path = tempfile.mkstemp(
+            dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                file.write(data)
+            os.replace(temporary_path, path)
+        except BaseException:
+            os.unlink(temporary_path)
+            raise
+
+    def __touch(self, digest: str) -> None:
+        """Mark a bitstream as used.
+
+        :param digest: The digest of the bitstream.
+        :type digest: str
+        """
+        try:
+            os.utime(self.__get_path(digest, DATA_SUFFIX))
+        except OSError:
+            pass
+
+    def get(self, digest: str) -> StoredBitstream | None:
+        """Get the metadata of a stored bitstream and mark it as used.
+
+        :param digest: The digest of the bitstream.
+        :type digest: str
+        :return: The metadata, or None if the bitstream is not stored.
+        :rtype: StoredBitstream | None
+        """
+        try:
+            metadata: Dict[str, Any] = json.loads(
+                self.__get_path(digest, METADATA_SUFFIX).read_text()
+            )
+            stored = StoredBitstream(**metadata)
+        except (OSError, ValueError, TypeError):
+            return None
+        if not self.__get_path(digest, DATA_SUFFIX).is_file():
+            return None
+        self.__touch(digest)
+        return stored
+
+    def read(self, digest: str) -> bytes | None:
+        """Read a stored bitstream and mark it as used.
+
+        :param digest: The digest of the bitstream.
+        :type digest: str
+        :return: The bitstream, or None if it is not stored.
+        :rtype: bytes | None
+        """
+        try:
+            data = self.__get_path(digest, DATA_SUFFIX).read_bytes()
+        except OSError:
+            return None
+        self.__touch(digest)
+        return data
+
+    def add(
+        self, data: memoryview, source: str | None = None, digest: str | None = None
+    ) -> StoredBitstream:
+        """Store a bitstream if it is not stored yet.
+
+        :param data: The bitstream data.
+        :type data: memoryview
+        :param source: The file the bitstream was read from.
+        :type source: str | None
+        :param digest: The digest of the data, if already known.
+        :type digest: str | None
+        :return: The metadata of the stored bitstream.
+        :rtype: StoredBitstream
+        """
+        digest = digest or hash_bitstream(data)
+        stored = self.get(digest)
+        if stored is not None:
+            return stored
+
+        stored = index_bitstream(data, digest, source and str(Path(source).resolve()))
+        if len(data) > self.max_size:
+            logger.debug(f"The bitstream {digest[:12]} exceeds the store size")
+            return stored
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.__write(self.__get_path(digest, DATA_SUFFIX), data)
+            self.__write(
+                self.__get_path(digest, METADATA_SUFFIX),
+                json.dumps(stored._asdict()).encode(),
+            )
+        except OSError as error:
+            logger.debug(f"Could not store the bitstream {digest[:12]}: {error}")
+            return stored
+        logger.debug(f"Stored the bitstream {digest[:12]} ({len(data)} bytes)")
+        self.evict(keep=digest)
+        return stored
+
+    def get_sparse_stream(self, data: memoryview, digest: str) -> bytes | None:
+        """Get the stream without the frames in the power-on state.
+
+        The stream is derived once and kept next to the bitstream.
+
+        :param data: The bitstream data.
+        :type data: memoryview
+        :param digest: The digest of the data.
+        :type digest: str
+        :return: The sparse stream, or None if the data is not a frame based
+        bitstream.
+        :rtype: bytes | None
+        """
+        path = self.__get_path(digest, SPARSE_SUFFIX)
+        stored = self.get(digest)
+        if stored is not None and stored.record_count is not None:
+            try:
+                stream = path.read_bytes()
+            except OSError:
+                pass
+            else:
+                logger.info(
+                    f"{stored.record_count - stored.configured_frames} of"
+                    + f" {stored.record_count} frames are in the power-on state"
+                    + " and skipped."
+                )
+                return stream
+
+        from modules.bitstream import build_sparse_stream
+
+        stream = build_sparse_stream(data)
+        if stream is not None and stored is not None:
+            try:
+                self.__write(path, stream)
+            except OSError as error:
+                logger.debug(f"Could not store the sparse stream: {error}")
+        return stream
+
+    def evict(self, keep: str | None = None) -> None:
+        """Remove the least recently used bitstreams until the store fits its
+        maximum size.
+
+        :param keep: The digest of a bitstream that is never evicted, e.g. the
+        one just stored.
+        :type keep: str | None
+        """
+        with self.__lock:
+            entries: Dict[str, List[os.stat_result]] = {}
+            try:
+                for path in self.directory.iterdir():
+                    if path.suffix in STORE_SUFFIXES:
+                        try:
+                            entries.setdefault(path.stem, []).append(path.stat())
+                        except FileNotFoundError:
+                            pass
+            except FileNotFoundError:
+                return
+
+            total = sum(stat.st_size for stats in entries.values() for stat in stats)
+            # The data of a bitstream is touched on every use
+            by_last_use = sorted(
+                entries, key=lambda digest: max(s.st_mtime for s in entries[digest])
+            )
+            for digest in by_last_use:
+                if total <= self.max_size:
+                    break
+                if digest == keep:
+                    continue
+                for suffix in STORE_SUFFIXES:
+                    self.__get_path(digest, suffix).unlink(missing_ok=True)
+                total -= sum(stat.st_size for stat in entries[digest])
+                logger.debug(f"Evicted the bitstream {digest[:12]} from the store")
+
+
+__store: BitstreamStore | None = None
+
+
+def get_bitstream_store() -> BitstreamStore:
+    """Get the store shared by all uploads of the process.
+
+    :return: The store.
+    :rtype: BitstreamStore
+    """
+    global __store
+    if __store is None:
+        __store = BitstreamStore()
+    return __store
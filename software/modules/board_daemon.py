@@ -0,0 +1,631 @@
+#!/usr/bin/env python3
+
+# The jobs import the modules they need, including pyftdi, on first use, so
+# that clients forwarding a job do not pay for loading them
+from __future__ import annotations
+
+import json
+import os
+import re
+import socket
+import socketserver
+import stat
+import tempfile
+import threading
+import time
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Set, Tuple, TYPE_CHECKING
+from loguru import logger
+from modules import metrics
+
+if TYPE_CHECKING:
+    from pyftdi.i2c import I2cController, I2cPort
+    from serial import SerialBase
+    from modules.uart_capture import CaptureOptions
+    from modules.usb_hub import HubPort
+    from upload_bitstream.upload_bitstream import UploadOptions, UploadStatistics
+
+# The runtime directory is private to the user, the fallback in the shared
+# temporary directory is created with the same permissions by the daemon
+DEFAULT_SOCKET_PATH = str(
+    Path(
+        os.environ.get("XDG_RUNTIME_DIR")
+        or Path(tempfile.gettempdir()) / f"fabulous_board-{os.getuid()}"
+    )
+    / "fabulous_board.sock"
+)
+SOCKET_DIRECTORY_MODE = 0o700
+SOCKET_MODE = 0o600
+
+JOB_UPLOAD = "upload"
+JOB_CONFIG_CLOCKS = "config_clocks"
+JOB_POWER_CYCLE = "power_cycle"
+JOBS = [JOB_UPLOAD, JOB_CONFIG_CLOCKS, JOB_POWER_CYCLE]
+
+# The bus and address of the device of an FTDI URL
+FTDI_URL_PATTERN = re.compile(
+    r"^ftdi://0x[0-9a-f]+:0x[0-9a-f]+:0x([0-9a-f]+):0x([0-9a-f]+)/"
+)
+
+
+class DaemonNotRunningError(Exception):
+    """An exception to be thrown when no daemon is listening on the socket."""
+
+
+class DaemonAlreadyRunningError(Exception):
+    """An exception to be thrown when another daemon is listening on the
+    socket."""
+
+
+class InsecureSocketDirectoryError(Exception):
+    """An exception to be thrown when the directory of the socket is owned by
+    another user."""
+
+
+class DaemonJobError(Exception):
+    """An exception to be thrown when the daemon failed to execute a job."""
+
+
+class JobRequestHandler(socketserver.StreamRequestHandler):
+    """Handles a client connection, one JSON job per line."""
+
+    def handle(self) -> None:
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                result = self.server.board_daemon.run_job(
+                    request["job"], request.get("arguments", {})
+                )
+                response = {"ok": True, "result": result}
+            except Exception as error:
+                logger.error(f"Job failed: {error!r}")
+                response = {"ok": False, "error": str(error) or type(error).__name__}
+
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class BoardDaemon:
+    """Executes board jobs received over a Unix domain socket.
+
+    The daemon keeps the serial ports, the I2C connections and the USB
+    topology index open between jobs, so a job does not pay for process
+    startup and device enumeration. Jobs for the same device are serialized.
+    """
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH):
+        """Create a daemon.
+
+        :param socket_path: The path of the Unix domain socket.
+        :type socket_path: str
+        """
+        self.socket_path = socket_path
+        self.__server = None
+        self.__ports: Dict[Tuple[str, int, str], SerialBase] = {}
+        self.__i2c: Dict[str, Tuple[I2cController, I2cPort]] = {}
+        # Guards the caches of the handles, a handle itself is only used under
+        # the lock of its resource
+        self.__handles_lock = threading.Lock()
+        self.__locks: Dict[str, threading.Lock] = {}
+        self.__locks_lock = threading.Lock()
+        self.__jobs: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+            JOB_UPLOAD: self.__upload,
+            JOB_CONFIG_CLOCKS: self.__config_clocks,
+            JOB_POWER_CYCLE: self.__power_cycle,
+        }
+
+    def __get_lock(self, resource: str) -> threading.Lock:
+        """Get the lock serializing the jobs for a resource.
+
+        :param resource: The resource, e.g. a device path.
+        :type resource: str
+        :return: The lock of the resource.
+        :rtype: threading.Lock
+        """
+        with self.__locks_lock:
+            return self.__locks.setdefault(resource, threading.Lock())
+
+    def run_job(self, job: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Execute a single job.
+
+        :param job: The name of the job, one of JOBS.
+        :type job: str
+        :param arguments: The arguments of the job.
+        :type arguments: Dict[str, Any]
+        :return: The result of the job.
+        :rtype: Dict[str, Any]
+        :raises ValueError: If the job is unknown.
+        """
+        if job not in self.__jobs:
+            raise ValueError(f"Job {job} is unknown.")
+        logger.info(f"Running job {job}")
+        try:
+            return self.__jobs[job](arguments)
+        finally:
+            metrics.flush_metrics()
+
+    def __resolve_device(self, device_id: str, transport: str) -> Tuple[str, str]:
+        """Resolve the port and the key of the single board matching the ID.
+
+        :param device_id: The device ID of the board.
+        :type device_id: str
+        :param transport: The transport to be used.
+        :type transport: str
+        :return: The port and the key of the board.
+        :rtype: Tuple[str, str]
+        :raises MultipleDevicesError: If the ID matches multiple devices.
+        :raises NoDeviceFoundError: If no port was found for the device.
+        """
+        from modules.board_state import get_board_key
+        from modules.ftdi_access import (
+            find_devices_matching_id,
+            MultipleDevicesError,
+            NoDeviceFoundError,
+        )
+        from upload_bitstream.upload_bitstream import get_port_for_device
+
+        devices = find_devices_matching_id(device_id)
+        if len(devices) > 1:
+            raise MultipleDevicesError(
+                f"{len(devices)} devices match {device_id}, specify the port."
+            )
+
+        device_path = get_port_for_device(devices[0], transport)
+        if device_path is None:
+            raise NoDeviceFoundError(f"No port found for {device_id}.")
+        return device_path, get_board_key(devices[0])
+
+    def __upload(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Upload a bitstream through a cached serial port.
+
+        :param arguments: bitstream_file, baudrate, device_id, port and the
+        fields of UploadOptions, optionally the board_key of the port and the
+        fields of CaptureOptions as capture.
+        :type arguments: Dict[str, Any]
+        :return: The telemetry of the upload.
+        :rtype: Dict[str, Any]
+        """
+        from modules.ftdi_access import DEFAULT_FTDI_ID
+        from modules.uart_capture import CaptureOptions
+        from upload_bitstream.upload_bitstream import (
+            open_bitstream,
+            open_uart,
+            upload_to_open_port,
+            UploadOptions,
+        )
+
+        options = UploadOptions(**arguments.get("options", {}))
+        baudrate = arguments["baudrate"]
+        port = arguments.get("port")
+        if port:
+            device_path, board_key = port, arguments.get("board_key") or port
+        else:
+            device_path, board_key = self.__resolve_device(
+                arguments.get("device_id", DEFAULT_FTDI_ID), options.transport
+            )
+
+        key = (device_path, baudrate, options.transport)
+        with self.__get_lock(device_path):
+            with self.__handles_lock:
+                ser = self.__ports.get(key)
+            if ser is None:
+                ser = open_uart(device_path, baudrate, options)
+                with self.__handles_lock:
+                    self.__ports[key] = ser
+
+            capture = None
+            try:
+                with open_bitstream(arguments["bitstream_file"]) as data:
+                    if arguments.get("capture"):
+                        statistics, capture = self.__upload_and_capture(
+                            ser,
+                            data,
+                            board_key,
+                            options,
+                            CaptureOptions(**arguments["capture"]),
+                            arguments["bitstream_file"],
+                        )
+                    else:
+                        statistics = upload_to_open_port(
+                            ser, data, board_key, options, arguments["bitstream_file"]
+                        )
+            except Exception:
+                # Reopen the port for the next job
+                with self.__handles_lock:
+                    self.__ports.pop(key, None)
+                ser.close()
+                raise
+
+        return {
+            "device_path": device_path,
+            "total_bytes": statistics.total_bytes,
+            "chunks": len(statistics.chunks),
+            "transmit_time": statistics.transmit_time,
+            "drain_time": statistics.drain_time,
+            "wall_time": statistics.wall_time,
+            "throughput": statistics.throughput,
+            "capture": capture,
+        }
+
+    def __upload_and_capture(
+        self,
+        ser: SerialBase,
+        data: memoryview,
+        board_key: str,
+        options: UploadOptions,
+        capture_options: CaptureOptions,
+        source: str,
+    ) -> Tuple[UploadStatistics, Dict[str, Any]]:
+        """Upload a bitstream while capturing what the design sends back.
+
+        A trigger not matching in time is reported in the summary instead of
+        failing the job, so that the captured output is not lost.
+
+        :param ser: The cached serial port.
+        :type ser: SerialBase
+        :param data: The bitstream data.
+        :type data: memoryview
+        :param board_key: The key of the board.
+        :type board_key: str
+        :param options: Defines how the bitstream is transmitted.
+        :type options: UploadOptions
+        :param capture_options: Defines how the output is captured.
+        :type capture_options: CaptureOptions
+        :param source: The bitstream file, kept as metadata in the store.
+        :type source: str
+        :return: The telemetry of the upload and the summary of the capture.
+        :rtype: Tuple[UploadStatistics, Dict[str, Any]]
+        """
+        from modules.uart_capture import (
+            compile_trigger,
+            summarize_capture,
+            TriggerTimeoutError,
+            UartCapture,
+        )
+        from upload_bitstream.upload_bitstream import upload_to_open_port
+
+        trigger = None
+        if capture_options.trigger:
+            trigger = compile_trigger(capture_options.trigger)
+
+        with ExitStack() as stack:
+            tee = None
+            if capture_options.tee_file:
+                tee = stack.enter_context(open(capture_options.tee_file, "wb"))
+            capture = stack.enter_context(
+                UartCapture(ser, capture_options.buffer_size, tee)
+            )
+            statistics = upload_to_open_port(
+                ser, data, board_key, options._replace(capturing=True), source
+            )
+            upload_end = time.perf_counter()
+
+            match = None
+            try:
+                with metrics.span(metrics.SPAN_CAPTURE):
+                    match = capture.wait_for(trigger, capture_options.timeout)
+            except TriggerTimeoutError:
+                pass
+            capture.stop()
+        return statistics, summarize_capture(capture, match, upload_end)
+
+    def __config_clocks(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Program the clock IC through a cached I2C connection.
+
+        :param arguments: register_config or frequencies, device_id and
+        incremental.
+        :type arguments: Dict[str, Any]
+        :return: The telemetry of the programming and the fabric clock in Hz
+        as a fraction string, None if the configuration does not define it.
+        :rtype: Dict[str, Any]
+        """
+        from clock_setup.clock_setup import connect_clock_ic, configure_clock_ic
+        from clock_setup.frequency_planner import parse_frequencies, plan_frequencies
+        from clock_setup.read_register_config import (
+            compile_register_config,
+            load_register_config,
+        )
+        from modules.baudrate import record_fabric_clock
+        from modules.board_state import get_i2c_board_key
+        from modules.ftdi_access import DEFAULT_FTDI_ID, NoDeviceFoundError
+
+        device_id = arguments.get("device_id", DEFAULT_FTDI_ID)
+        if arguments.get("frequencies"):
+            plan = plan_frequencies(parse_frequencies(arguments["frequencies"]))
+            config = compile_register_config(list(plan.registers))
+        else:
+            config = load_register_config(arguments["register_config"])
+
+        with self.__get_lock(f"i2c:{device_id}"):
+            with self.__handles_lock:
+                handle = self.__i2c.get(device_id)
+            if handle is None:
+                from pyftdi.i2c import I2cController
+
+                i2c = I2cController()
+                i2c_port = connect_clock_ic(i2c, device_id)
+                if i2c_port is None:
+                    raise NoDeviceFoundError(f"No I2C port found for {device_id}.")
+                handle = (i2c, i2c_port)
+                with self.__handles_lock:
+                    self.__i2c[device_id] = handle
+
+            i2c, i2c_port = handle
+            try:
+                statistics = configure_clock_ic(
+                    i2c_port, config, arguments.get("incremental", False)
+                )
+            except Exception:
+                with self.__handles_lock:
+                    self.__i2c.pop(device_id, None)
+                i2c.close()
+                raise
+            fabric_clock = record_fabric_clock(
+                get_i2c_board_key(i2c), config.registers
+            )
+        return {
+            **statistics._asdict(),
+            "digest": config.digest,
+            "fabric_clock": fabric_clock and str(fabric_clock),
+        }
+
+    def __find_devices_behind(
+        self, ports: List[HubPort]
+    ) -> Tuple[Set[Tuple[int, int]], Set[str]]:
+        """Find the USB devices that lose power with a set of hub ports.
+
+        :param ports: The hub ports.
+        :type ports: List[HubPort]
+        :return: The bus and address of every device, and their tty nodes.
+        :rtype: Tuple[Set[Tuple[int, int]], Set[str]]
+        """
+        from modules.device_readiness import get_port_location
+        from modules.usb_topology import (
+            get_topology_index,
+            list_devices_behind,
+            read_device_attribute,
+        )
+
+        index = get_topology_index()
+        locations = [get_port_location(port.location, str(port.port)) for port in ports]
+        addresses = set()
+        for location in list_devices_behind(locations, index.sysfs_root):
+            busnum = read_device_attribute(location, "busnum", index.sysfs_root)
+            devnum = read_device_attribute(location, "devnum", index.sysfs_root)
+            if busnum and devnum:
+                addresses.add((int(busnum), int(devnum)))
+        tty_nodes = {
+            entry.device_node
+            for entry in index.entries
+            if (entry.bus, entry.devnum) in addresses
+        }
+        return addresses, tty_nodes
+
+    def __find_handles(
+        self, addresses: Set[Tuple[int, int]], tty_nodes: Set[str]
+    ) -> Tuple[List[Tuple[str, int, str]], List[str]]:
+        """Find the cached handles of a set of USB devices.
+
+        :param addresses: The bus and address of every device.
+        :type addresses: Set[Tuple[int, int]]
+        :param tty_nodes: The tty nodes of the devices.
+        :type tty_nodes: Set[str]
+        :return: The keys of the serial ports and the device IDs of the I2C
+        connections.
+        :rtype: Tuple[List[Tuple[str, int, str]], List[str]]
+        """
+        port_keys = []
+        i2c_ids = []
+        with self.__handles_lock:
+            for key in self.__ports:
+                match = FTDI_URL_PATTERN.match(key[0])
+                if key[0] in tty_nodes or (
+                    match is not None
+                    and (int(match[1], 16), int(match[2], 16)) in addresses
+                ):
+                    port_keys.append(key)
+            for device_id, (i2c, _) in self.__i2c.items():
+                device = i2c.ftdi.usb_dev
+                if device is not None and (device.bus, device.address) in addresses:
+                    i2c_ids.append(device_id)
+        return port_keys, i2c_ids
+
+    def __power_cycle(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Power cycle USB ports and drop the handles invalidated by it.
+
+        The jobs using a device behind the ports finish before the cycle, and
+        the handles of the devices are closed, as they re-enumerate with new
+        handles. The handles of the other devices stay open.
+
+        :param arguments: location and port of the USB hub port, or ports as
+        a list of locations and ports to be cycled at once, optionally
+        device_id, timeout, wait_for_tty and power_switch.
+        :type arguments: Dict[str, Any]
+        :return: The tty node of every device, keyed by its location.
+        :rtype: Dict[str, Any]
+        """
+        from modules.device_readiness import DEFAULT_READY_TIMEOUT
+        from modules.usb_hub import HubPort
+        from modules.usb_port_power_control import (
+            power_cycle_usb_ports,
+            POWER_SWITCH_NATIVE,
+        )
+        from modules.usb_topology import get_topology_index
+
+        if "ports" in arguments:
+            ports = [
+                HubPort(location, int(port)) for location, port in arguments["ports"]
+            ]
+        else:
+            ports = [HubPort(arguments["location"], int(arguments["port"]))]
+
+        with ExitStack() as stack:
+            # Locked in a fixed order, so that batches cannot deadlock
+            for location in sorted({port.location for port in ports}):
+                stack.enter_context(self.__get_lock(f"hub:{location}"))
+
+            addresses, tty_nodes = self.__find_devices_behind(ports)
+            port_keys, i2c_ids = self.__find_handles(addresses, tty_nodes)
+            resources = tty_nodes | {key[0] for key in port_keys}
+            resources |= {f"i2c:{device_id}" for device_id in i2c_ids}
+            for resource in sorted(resources):
+                stack.enter_context(self.__get_lock(resource))
+
+            # Handles opened meanwhile are only closed if their jobs are held
+            port_keys, i2c_ids = self.__find_handles(addresses, tty_nodes)
+            self.__close_handles(
+                [key for key in port_keys if key[0] in resources],
+                [
+                    device_id
+                    for device_id in i2c_ids
+                    if f"i2c:{device_id}" in resources
+                ],
+            )
+            device_nodes = power_cycle_usb_ports(
+                ports,
+                arguments.get("device_id"),
+                arguments.get("timeout", DEFAULT_READY_TIMEOUT),
+                arguments.get("wait_for_tty", True),
+                arguments.get("power_switch", POWER_SWITCH_NATIVE),
+            )
+
+        get_topology_index().invalidate()
+        return {"device_nodes": device_nodes}
+
+    def __close_handles(
+        self, port_keys: List[Tuple[str, int, str]], i2c_ids: List[str]
+    ) -> None:
+        """Close cached serial ports and I2C connections.
+
+        :param port_keys: The keys of the serial ports.
+        :type port_keys: List[Tuple[str, int, str]]
+        :param i2c_ids: The device IDs of the I2C connections.
+        :type i2c_ids: List[str]
+        """
+        with self.__handles_lock:
+            ports = [self.__ports.pop(key, None) for key in port_keys]
+            i2c_handles = [self.__i2c.pop(device_id, None) for device_id in i2c_ids]
+        for ser in ports:
+            if ser is not None:
+                ser.close()
+        for handle in i2c_handles:
+            if handle is not None:
+                handle[0].close()
+
+    def close_handles(self) -> None:
+        """Close all cached serial ports and I2C connections."""
+        with self.__handles_lock:
+            port_keys = list(self.__ports)
+            i2c_ids = list(self.__i2c)
+        self.__close_handles(port_keys, i2c_ids)
+
+    def __prepare_socket_path(self) -> None:
+        """Create the directory of the socket and remove a stale socket.
+
+        The directory is created private to the user. An existing directory
+        must be owned by the user or be sticky like /tmp, so that no other
+        user can replace the socket.
+
+        :raises DaemonAlreadyRunningError: If a daemon is listening on the
+        socket.
+        :raises InsecureSocketDirectoryError: If the directory is owned by
+        another user.
+        """
+        directory = Path(self.socket_path).parent
+        directory.mkdir(mode=SOCKET_DIRECTORY_MODE, parents=True, exist_ok=True)
+        status = directory.stat()
+        if status.st_uid != os.getuid() and not status.st_mode & stat.S_ISVTX:
+            logger.error(
+                f"The socket directory {directory} is owned by another user."
+            )
+            raise InsecureSocketDirectoryError
+
+        if not os.path.exists(self.socket_path):
+            return
+
+        client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            client.connect(self.socket_path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            # Remove a stale socket of a daemon that did not shut down cleanly
+            os.unlink(self.socket_path)
+            return
+        finally:
+            client.close()
+
+        logger.error(f"A daemon is already listening on {self.socket_path}.")
+        raise DaemonAlreadyRunningError
+
+    def serve_forever(self) -> None:
+        """Serve jobs until interrupted.
+
+        The socket is only accessible by the user running the daemon.
+
+        :raises DaemonAlreadyRunningError: If a daemon is listening on the
+        socket.
+        :raises InsecureSocketDirectoryError: If the directory of the socket
+        is owned by another user.
+        """
+        from modules.usb_topology import get_topology_index
+
+        self.__prepare_socket_path()
+
+        self.__server = socketserver.ThreadingUnixStreamServer(
+            self.socket_path, JobRequestHandler
+        )
+        os.chmod(self.socket_path, SOCKET_MODE)
+        get_topology_index().start_monitoring()
+        self.__server.daemon_threads = True
+        self.__server.board_daemon = self
+        logger.info(f"Listening on {self.socket_path}")
+
+        try:
+            self.__server.serve_forever()
+        finally:
+            self.__server.server_close()
+            os.unlink(self.socket_path)
+            get_topology_index().stop_monitoring()
+            self.close_handles()
+
+    def shutdown(self) -> None:
+        """Stop serving jobs, may be called from another thread."""
+        if self.__server is not None:
+            self.__server.shutdown()
+
+
+def send_job(
+    job: str, arguments: Dict[str, Any], socket_path: str = DEFAULT_SOCKET_PATH
+) -> Dict[str, Any]:
+    """Send a job to the daemon and wait for its result.
+
+    :param job: The name of the job, one of JOBS.
+    :type job: str
+    :param arguments: The arguments of the job.
+    :type arguments: Dict[str, Any]
+    :param socket_path: The path of the Unix domain socket of the daemon.
+    :type socket_path: str
+    :return: The result of the job.
+    :rtype: Dict[str, Any]
+    :raises DaemonNotRunningError: If no daemon is listening on the socket.
+    :raises DaemonJobError: If the job failed.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+    except (FileNotFoundError, ConnectionRefusedError):
+        client.close()
+        logger.error(f"No daemon is listening on {socket_path}.")
+        raise DaemonNotRunningError
+
+    with client, client.makefile("rwb") as stream:
+        stream.write(json.dumps({"job": job, "arguments": arguments}).encode() + b"\n")
+        stream.flush()
+        response = json.loads(stream.readline())
+
+    if not response["ok"]:
+        logger.error(f"The daemon failed to run {job}: {response['error']}")
+        raise DaemonJobError(response["error"])
+    return response["result"]
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+
+from __future__ import annotations
+
+import os
+import re
+from fractions import Fraction
+from pathlib import Path
+from typing import Sequence, TYPE_CHECKING
+from loguru import logger
+from modules.usb_topology import (
+    get_topology_index,
+    parse_port_chain,
+    read_device_attribute,
+    SYSFS_ROOT,
+)
+
+if TYPE_CHECKING:
+    from pyftdi.ftdi import UsbDeviceDescriptor
+    from pyftdi.i2c import I2cController
+
+DEFAULT_STATE_DIRECTORY = (
+    Path(os.environ.get("XDG_CACHE_HOME", Path.home() / ".cache")) / "fabulous_board"
+)
+LAST_BITSTREAM_DIRECTORY = "last_bitstream"
+FABRIC_CLOCK_DIRECTORY = "fabric_clock"
+
+
+def get_board_key(device: UsbDeviceDescriptor) -> str:
+    """Get the key identifying a board.
+
+    The serial number of the FTDI chip is used if it has one, else the bus and
+    address of the USB device.
+
+    :param device: The FTDI device of the board.
+    :type device: UsbDeviceDescriptor
+    :return: The key of the board.
+    :rtype: str
+    """
+    if device.sn:
+        return device.sn
+    return f"{device.bus}-{device.address}"
+
+
+def get_i2c_board_key(i2c: I2cController) -> str:
+    """Get the key of the board whose FTDI chip a configured I2C controller
+    uses.
+
+    :param i2c: The I2C controller, configured for a device.
+    :type i2c: I2cController
+    :return: The key of the board, the same as get_board_key returns.
+    :rtype: str
+    """
+    from pyftdi.usbtools import UsbTools
+
+    device = i2c.ftdi.usb_dev
+    serial = UsbTools.get_string(device, device.iSerialNumber)
+    if serial:
+        return serial
+    return f"{device.bus}-{device.address}"
+
+
+def get_port_board_key(port: str) -> str:
+    """Get the key of the board behind a tty node.
+
+    :param port: The tty node, e.g. /dev/ttyUSB0, or any other port.
+    :type port: str
+    :return: The key of the board, the same as get_board_key returns, or the
+    port itself if it is not the tty node of a USB device.
+    :rtype: str
+    """
+    for entry in get_topology_index().entries:
+        if entry.device_node == port:
+            return entry.serial or f"{entry.bus}-{entry.devnum}"
+    return port
+
+
+def __get_record_name(key: str) -> str:
+    """Get a file name for a key that may contain path separators.
+
+    :param key: The key of the record.
+    :type key: str
+    :return: The file name without suffix.
+    :rtype: str
+    """
+    return re.sub(r"[^A-Za-z0-9_.-]", "_", key)
+
+
+def __get_last_bitstream_path(board_key: str, state_directory: Path) -> Path:
+    """Get the path of the file recording the last bitstream of a board.
+
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param state_directory: The directory where the board state is stored.
+    :type state_directory: Path
+    :return: The path of the record.
+    :rtype: Path
+    """
+    file_name = __get_record_name(board_key) + ".sha256"
+    return state_directory / LAST_BITSTREAM_DIRECTORY / file_name
+
+
+def load_last_digest(
+    board_key: str, state_directory: Path = DEFAULT_STATE_DIRECTORY
+) -> str | None:
+    """Load the digest of the bitstream that was last loaded onto a board.
+
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param state_directory: The directory where the board state is stored.
+    :type state_directory: Path
+    :return: The digest in the bitstream store, or None if there is no record.
+    :rtype: str | None
+    """
+    path = __get_last_bitstream_path(board_key, state_directory)
+    try:
+        return path.read_text().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def store_last_digest(
+    board_key: str, digest: str, state_directory: Path = DEFAULT_STATE_DIRECTORY
+) -> None:
+    """Record the bitstream that was loaded onto a board by its digest.
+
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param digest: The digest of the bitstream in the bitstream store.
+    :type digest: str
+    :param state_directory: The directory where the board state is stored.
+    :type state_directory: Path
+    """
+    path = __get_last_bitstream_path(board_key, state_directory)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    # Write to a temporary file first so that a record is never truncated
+    temporary_path = path.with_suffix(".tmp")
+    temporary_path.write_text(f"{digest}\n")
+    temporary_path.replace(path)
+    logger.debug(f"Recorded the bitstream {digest[:12]} for board {board_key}")
+
+
+def forget_last_bitstream(
+    board_key: str, state_directory: Path = DEFAULT_STATE_DIRECTORY
+) -> None:
+    """Remove the record of the last bitstream of a board.
+
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param state_directory: The directory where the board state is stored.
+    :type state_directory: Path
+    """
+    __get_last_bitstream_path(board_key, state_directory).unlink(missing_ok=True)
+
+
+def forget_boards_at(
+    locations: Sequence[str],
+    state_directory: Path = DEFAULT_STATE_DIRECTORY,
+    sysfs_root: Path = SYSFS_ROOT,
+) -> None:
+    """Remove the records of the boards at a set of USB locations, e.g.
+    before they are power cycled and lose their configuration and their
+    fabric clock.
+
+    A board is recorded under the serial number of its FTDI chip, or its USB
+    bus and address, or under its tty node if it was given explicitly.
+
+    :param locations: The locations of the USB devices, e.g. 1-1.2.
+    :type locations: Sequence[str]
+    :param state_directory: The directory where the board state is stored.
+    :type state_directory: Path
+    :param sysfs_root: The root of the sysfs tree.
+    :type sysfs_root: Path
+    """
+    index = get_topology_index()
+    for location in locations:
+        busnum = read_device_attribute(location, "busnum", sysfs_root)
+        devnum = read_device_attribute(location, "devnum", sysfs_root)
+        serial = read_device_attribute(location, "serial", sysfs_root)
+        board_keys = []
+        if serial:
+            board_keys.append(serial)
+        elif busnum and devnum:
+            board_keys.append(f"{busnum}-{devnum}")
+
+        bus, _, devpath = location.partition("-")
+        entry = index.find_by_location(int(bus), parse_port_chain(devpath))
+        if entry is not None:
+            board_keys.append(entry.device_node)
+
+        for board_key in board_keys:
+            forget_last_bitstream(board_key, state_directory)
+            __get_fabric_clock_path(board_key, state_directory).unlink(
+                missing_ok=True
+            )
+
+
+def __get_fabric_clock_path(board_key: str, state_directory: Path) -> Path:
+    """Get the path of the file recording the fabric clock of a board.
+
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param state_directory: The directory where the board state is stored.
+    :type state_directory: Path
+    :return: The path of the record.
+    :rtype: Path
+    """
+    file_name = __get_record_name(board_key) + ".txt"
+    return state_directory / FABRIC_CLOCK_DIRECTORY / file_name
+
+
+def load_fabric_clock(
+    board_key: str, state_directory: Path = DEFAULT_STATE_DIRECTORY
+) -> Fraction | None:
+    """Load the fabric clock that was last configured for a board.
+
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param state_directory: The directory where the board state is stored.
+    :type state_directory: Path
+    :return: The frequency in Hz, or None if there is no valid record.
+    :rtype: Fraction | None
+    """
+    path = __get_fabric_clock_path(board_key, state_directory)
+    try:
+        return Fraction(path.read_text().strip())
+    except (FileNotFoundError, ValueError, ZeroDivisionError):
+        return None
+
+
+def store_fabric_clock(
+    board_key: str,
+    frequency: Fraction | None,
+    state_directory: Path = DEFAULT_STATE_DIRECTORY,
+) -> None:
+    """Record the fabric clock configured for a board.
+
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param frequency: The frequency in Hz, None removes the record.
+    :type frequency: Fraction | None
+    :param state_directory: The directory where the board state is stored.
+    :type state_directory: Path
+    """
+    path = __get_fabric_clock_path(board_key, state_directory)
+    if frequency is None:
+        path.unlink(missing_ok=True)
+        return
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_suffix(".tmp")
+    temporary_path.write_text(f"{Fraction(frequency)}\n")
+    temporary_path.replace(path)
+    logger.debug(
+        f"Recorded the fabric clock {float(frequency) / 1e6:g} MHz of board"
+        + f" {board_key}"
+    )
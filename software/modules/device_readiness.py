@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+
+# pyudev is imported when the events are monitored, so that importing the
+# waiter does not load it
+from __future__ import annotations
+
+import os
+import re
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import (
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterator,
+    NamedTuple,
+    Sequence,
+    TYPE_CHECKING,
+)
+from loguru import logger
+from modules.async_io import wait_readable
+from modules.ftdi_access import Device
+
+if TYPE_CHECKING:
+    import pyudev
+
+DEFAULT_READY_TIMEOUT = 10.0
+# How often a device node that appeared but does not answer yet is retried
+READY_POLL_INTERVAL = 0.05
+
+MONITORED_SUBSYSTEMS = ["usb", "tty"]
+READY_ACTIONS = ["add", "bind", "change"]
+
+USB_LOCATION_PATTERN = re.compile(r"^\d+-\d+(\.\d+)*$")
+
+# Returns the next device event, or None if there was none within the timeout
+EventPoller = Callable[[float], "DeviceEvent | None"]
+AsyncEventPoller = Callable[[float], Awaitable["DeviceEvent | None"]]
+
+
+class DeviceNotReadyError(Exception):
+    """An exception to be thrown when a device does not come back after a
+    power cycle."""
+
+
+class DeviceEvent(NamedTuple):
+    """Defines a udev event of a USB device or one of its tty nodes.
+
+    Attributes:
+        action      (str): The udev action, e.g. add or remove.
+        subsystem   (str): The subsystem of the device, usb or tty.
+        location    (str): The location of the USB device, e.g. 1-1.2.
+        vendor_id   (int | None): The vendor ID of the USB device, if known.
+        product_id  (int | None): The product ID of the USB device, if known.
+        device_node (str | None): The device node, e.g. /dev/ttyUSB0.
+    """
+
+    action: str
+    subsystem: str
+    location: str
+    vendor_id: int | None
+    product_id: int | None
+    device_node: str | None
+
+
+def get_port_location(location: str, port: str) -> str:
+    """Get the location of the device connected to a hub port.
+
+    :param location: The location of the hub as used by uhubctl, e.g. 1-1, or
+    the bus number for a root hub.
+    :type location: str
+    :param port: The port of the hub.
+    :type port: str
+    :return: The location of the device, e.g. 1-1.2.
+    :rtype: str
+    """
+    if "-" in location:
+        return f"{location}.{port}"
+    return f"{location}-{port}"
+
+
+def __parse_hex(value: str | None) -> int | None:
+    """Parse a hexadecimal ID of a udev property.
+
+    :param value: The value of the property.
+    :type value: str | None
+    :return: The ID, or None if the property is missing or malformed.
+    :rtype: int | None
+    """
+    try:
+        return int(value, 16)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_device_event(device: pyudev.Device) -> DeviceEvent | None:
+    """Convert a udev device received from a monitor into an event.
+
+    Only the path and the properties of the event are used, since the sysfs
+    attributes of a removed device are gone.
+
+    :param device: The device of the event.
+    :type device: pyudev.Device
+    :return: The event, or None if the device does not belong to a USB device.
+    :rtype: DeviceEvent | None
+    """
+    locations = [
+        part
+        for part in device.device_path.split("/")
+        if USB_LOCATION_PATTERN.match(part)
+    ]
+    if not locations:
+        return None
+
+    properties = device.properties
+    vendor_id = __parse_hex(properties.get("ID_VENDOR_ID"))
+    product_id = __parse_hex(properties.get("ID_MODEL_ID"))
+    if vendor_id is None and "PRODUCT" in properties:
+        # The kernel describes USB devices as vendor/product/revision
+        product = properties["PRODUCT"].split("/")
+        if len(product) >= 2:
+            vendor_id, product_id = __parse_hex(product[0]), __parse_hex(product[1])
+
+    return DeviceEvent(
+        device.action,
+        device.subsystem,
+        locations[-1],
+        vendor_id,
+        product_id,
+        device.device_node,
+    )
+
+
+@contextmanager
+def monitor_device_events(
+    context: pyudev.Context | None = None,
+) -> Iterator[EventPoller]:
+    """Monitor the udev events of USB and tty devices.
+
+    The monitor is started on entering, so events of a power cycle started
+    inside the context are not missed.
+
+    :param context: The udev context to be used.
+    :type context: pyudev.Context | None
+    :return: A function returning the next event.
+    :rtype: Iterator[EventPoller]
+    """
+    import pyudev
+
+    monitor = pyudev.Monitor.from_netlink(context or pyudev.Context())
+    for subsystem in MONITORED_SUBSYSTEMS:
+        monitor.filter_by(subsystem)
+    monitor.start()
+
+    def poll(timeout: float) -> DeviceEvent | None:
+        deadline = time.monotonic() + timeout
+        while True:
+            device = monitor.poll(max(0.0, deadline - time.monotonic()))
+            if device is None:
+                return None
+            event = get_device_event(device)
+            if event is not None:
+                return event
+
+    yield poll
+
+
+@asynccontextmanager
+async def monitor_device_events_async(
+    context: pyudev.Context | None = None,
+) -> AsyncIterator[AsyncEventPoller]:
+    """Monitor the udev events of USB and tty devices from an event loop.
+
+    The socket of the monitor is watched by the event loop, so waiting for an
+    event does not block it.
+
+    :param context: The udev context to be used.
+    :type context: pyudev.Context | None
+    :return: A coroutine function returning the next event.
+    :rtype: AsyncIterator[AsyncEventPoller]
+    """
+    import pyudev
+
+    monitor = pyudev.Monitor.from_netlink(context or pyudev.Context())
+    for subsystem in MONITORED_SUBSYSTEMS:
+        monitor.filter_by(subsystem)
+    monitor.start()
+
+    async def poll(timeout: float) -> DeviceEvent | None:
+        deadline = time.monotonic() + timeout
+        while True:
+            device = monitor.poll(0)
+            if device is None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not await wait_readable(
+                    monitor.fileno(), remaining
+                ):
+                    return None
+                continue
+            event = get_device_event(device)
+            if event is not None:
+                return event
+
+    yield poll
+
+
+def is_node_ready(device_node: str) -> bool:
+    """Check whether a device node can be opened.
+
+    :param device_node: The path of the node, e.g. /dev/ttyUSB0.
+    :type device_node: str
+    :return: True if the node answers.
+    :rtype: bool
+    """
+    try:
+        descriptor = os.open(device_node, os.O_RDWR | os.O_NOCTTY | os.O_NONBLOCK)
+    except OSError:
+        return False
+    os.close(descriptor)
+    return True
+
+
+class DeviceWaiter:
+    """Tracks the USB devices expected back after a power cycle.
+
+    The udev events are fed in by the caller, so that the same tracking serves
+    the blocking and the asyncio waits. With wait_for_tty, a device is ready
+    once its tty node appeared and can be opened. Otherwise, it is ready once
+    the USB device was added, which is enough for pyftdi to open it.
+    """
+
+    def __init__(
+        self,
+        locations: Sequence[str],
+        device: Device | None = None,
+        timeout: float = DEFAULT_READY_TIMEOUT,
+        wait_for_tty: bool = True,
+        is_ready: Callable[[str], bool] = is_node_ready,
+    ):
+        """Start waiting for a set of devices.
+
+        :param locations: The locations of the USB devices, e.g. 1-1.2.
+        :type locations: Sequence[str]
+        :param device: The expected vendor and product ID, if any.
+        :type device: Device | None
+        :param timeout: The maximum time to wait in seconds for all devices.
+        :type timeout: float
+        :param wait_for_tty: Wait for the tty nodes instead of the USB devices.
+        :type wait_for_tty: bool
+        :param is_ready: Checks whether a device node answers.
+        :type is_ready: Callable[[str], bool]
+        """
+        self.device = device
+        self.timeout = timeout
+        self.wait_for_tty = wait_for_tty
+        self.is_ready = is_ready
+        self.start = time.monotonic()
+        self.waiting = set(locations)
+        # The tty node of every device that is ready, None without wait_for_tty
+        self.ready: Dict[str, str | None] = {}
+        self.__pending_nodes: Dict[str, str] = {}
+
+    def get_poll_timeout(self) -> float:
+        """Get the time to wait for the next event.
+
+        :return: The time in seconds.
+        :rtype: float
+        :raises DeviceNotReadyError: If the devices are not ready within the
+        timeout.
+        """
+        remaining = self.start + self.timeout - time.monotonic()
+        if remaining <= 0:
+            logger.error(
+                f"The devices at {', '.join(sorted(self.waiting))} did not come"
+                + f" back within {self.timeout:g} s after the power cycle. Check"
+                + " the hub locations and ports."
+            )
+            raise DeviceNotReadyError
+        if self.__pending_nodes:
+            return min(remaining, READY_POLL_INTERVAL)
+        return remaining
+
+    def __matches(self, event: DeviceEvent) -> bool:
+        """Check whether an event belongs to the expected kind of device.
+
+        :param event: The event.
+        :type event: DeviceEvent
+        :return: True if the event belongs to the device.
+        :rtype: bool
+        """
+        if self.device is None or event.vendor_id is None:
+            return True
+        return (event.vendor_id, event.product_id) == (
+            self.device.vendor_id,
+            self.device.product_id,
+        )
+
+    def handle(self, event: DeviceEvent | None) -> None:
+        """Handle an event and check whether the appeared tty nodes answer.
+
+        :param event: The event, or None if the poll timed out.
+        :type event: DeviceEvent | None
+        """
+        if event is not None and event.location in self.waiting:
+            if self.__matches(event):
+                logger.debug(
+                    f"{event.action} {event.subsystem} {event.device_node or ''}"
+                )
+                if event.action == "remove":
+                    self.__pending_nodes.pop(event.location, None)
+                elif event.action in READY_ACTIONS:
+                    if not self.wait_for_tty and event.subsystem == "usb":
+                        logger.info(
+                            f"Device at {event.location} ready after"
+                            + f" {time.monotonic() - self.start:.3f} s"
+                        )
+                        self.ready[event.location] = None
+                        self.waiting.discard(event.location)
+                    elif event.subsystem == "tty" and event.device_node:
+                        self.__pending_nodes[event.location] = event.device_node
+
+        for location, device_node in list(self.__pending_nodes.items()):
+            if self.is_ready(device_node):
+                logger.info(
+                    f"{device_node} ready after"
+                    + f" {time.monotonic() - self.start:.3f} s"
+                )
+                self.ready[location] = device_node
+                self.waiting.discard(location)
+                del self.__pending_nodes[location]
+
+
+def wait_for_devices(
+    poll_event: EventPoller,
+    locations: Sequence[str],
+    device: Device | None = None,
+    timeout: float = DEFAULT_READY_TIMEOUT,
+    wait_for_tty: bool = True,
+    is_ready: Callable[[str], bool] = is_node_ready,
+) -> Dict[str, str | None]:
+    """Wait until a set of USB devices has enumerated after a power cycle.
+
+    With wait_for_tty, a device is ready once its tty node appeared and can be
+    opened. Otherwise, it is ready once the USB device was added, which is
+    enough for pyftdi to open it.
+
+    :param poll_event: Returns the next device event, e.g. from
+    monitor_device_events.
+    :type poll_event: EventPoller
+    :param locations: The locations of the USB devices, e.g. 1-1.2.
+    :type locations: Sequence[str]
+    :param device: The expected vendor and product ID, if any.
+    :type device: Device | None
+    :param timeout: The maximum time to wait in seconds for all devices.
+    :type timeout: float
+    :param wait_for_tty: Wait for the tty nodes instead of the USB devices.
+    :type wait_for_tty: bool
+    :param is_ready: Checks whether a device node answers.
+    :type is_ready: Callable[[str], bool]
+    :return: The tty node of every location, or None if only the USB device
+    was waited for.
+    :rtype: Dict[str, str | None]
+    :raises DeviceNotReadyError: If a device is not ready within the timeout.
+    """
+    waiter = DeviceWaiter(locations, device, timeout, wait_for_tty, is_ready)
+    while waiter.waiting:
+        waiter.handle(poll_event(waiter.get_poll_timeout()))
+    return waiter.ready
+
+
+async def wait_for_devices_async(
+    poll_event: AsyncEventPoller,
+    locations: Sequence[str],
+    device: Device | None = None,
+    timeout: float = DEFAULT_READY_TIMEOUT,
+    wait_for_tty: bool = True,
+    is_ready: Callable[[str], bool] = is_node_ready,
+) -> Dict[str, str | None]:
+    """Wait until a set of USB devices has enumerated after a power cycle,
+    without blocking the event loop.
+
+    :param poll_event: Returns the next device event, e.g. from
+    monitor_device_events_async.
+    :type poll_event: AsyncEventPoller
+    :param locations: The locations of the USB devices, e.g. 1-1.2.
+    :type locations: Sequence[str]
+    :param device: The expected vendor and product ID, if any.
+    :type device: Device | None
+    :param timeout: The maximum time to wait in seconds for all devices.
+    :type timeout: float
+    :param wait_for_tty: Wait for the tty nodes instead of the USB devices.
+    :type wait_for_tty: bool
+    :param is_ready: Checks whether a device node answers.
+    :type is_ready: Callable[[str], bool]
+    :return: The tty node of every location, or None if only the USB device
+    was waited for.
+    :rtype: Dict[str, str | None]
+    :raises DeviceNotReadyError: If a device is not ready within the timeout.
+    """
+    waiter = DeviceWaiter(locations, device, timeout, wait_for_tty, is_ready)
+    while waiter.waiting:
+        waiter.handle(await poll_event(waiter.get_poll_timeout()))
+    return waiter.ready
+
+
+def wait_for_device(
+    poll_event: EventPoller,
+    location: str,
+    device: Device | None = None,
+    timeout: float = DEFAULT_READY_TIMEOUT,
+    wait_for_tty: bool = True,
+    is_ready: Callable[[str], bool] = is_node_ready,
+) -> str | None:
+    """Wait until a USB device has enumerated after a power cycle.
+
+    :param poll_event: Returns the next device event, e.g. from
+    monitor_device_events.
+    :type poll_event: EventPoller
+    :param location: The location of the USB device, e.g. 1-1.2.
+    :type location: str
+    :param device: The expected vendor and product ID, if any.
+    :type device: Device | None
+    :param timeout: The maximum time to wait in seconds.
+    :type timeout: float
+    :param wait_for_tty: Wait for the tty node instead of the USB device.
+    :type wait_for_tty: bool
+    :param is_ready: Checks whether a device node answers.
+    :type is_ready: Callable[[str], bool]
+    :return: The tty node, or None if only the USB device was waited for.
+    :rtype: str | None
+    :raises DeviceNotReadyError: If the device is not ready within the
+    timeout.
+    """
+    return wait_for_devices(
+        poll_event, [location], device, timeout, wait_for_tty, is_ready
+    )[location]
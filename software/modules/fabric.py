@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+
+import csv
+import hashlib
+import io
+import json
+import struct
+import numpy as np
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Tuple
+from loguru import logger
+from modules.bitstream import (
+    FabricGeometry,
+    FABRICS_DIRECTORY,
+    FRAME_BYTES_PER_ROW,
+    MAX_FRAMES_PER_COLUMN,
+)
+from modules.board_state import DEFAULT_STATE_DIRECTORY
+
+FABRIC_CACHE_DIRECTORY = DEFAULT_STATE_DIRECTORY / "fabrics"
+
+# The tile type of the empty corners of the grid, always the first type
+EMPTY_TILE = "NULL"
+DIRECTIONS = ["NORTH", "EAST", "SOUTH", "WEST", "JUMP"]
+
+# One wire definition of a tile type, the names index the wire name table
+WIRE_DTYPE = np.dtype(
+    [
+        ("direction", "u1"),
+        ("x_offset", "i1"),
+        ("y_offset", "i1"),
+        ("source", "<u2"),
+        ("destination", "<u2"),
+        ("count", "<u2"),
+    ]
+)
+GRID_DTYPE = np.dtype("<u2")
+OFFSET_DTYPE = np.dtype("<u4")
+
+COMPILED_MAGIC = b"FFAB"
+COMPILED_VERSION = 1
+# Magic, version, source mtime, source hash, name table size, rows, columns,
+# tile type count, wire count
+COMPILED_HEADER = struct.Struct("<4sHq32sIHHHI")
+
+
+class FabricModel(NamedTuple):
+    """Defines the tile grid and the wires of a fabric.
+
+    Attributes:
+        tile_types   (List[str]): The names of the tile types, EMPTY_TILE first.
+        grid         (np.ndarray): The tile type index of every tile, one row
+                                   per fabric row.
+        wire_names   (List[str]): The names of the wire sources and
+                                  destinations.
+        wires        (np.ndarray): The wire definitions of all tile types as
+                                   WIRE_DTYPE, grouped by tile type.
+        wire_offsets (np.ndarray): The first wire of every tile type, followed
+                                   by the number of wires.
+        bel_counts   (np.ndarray): The number of BELs of every tile type.
+        parameters   (Dict[str, str]): The parameters of the fabric.
+        geometry     (FabricGeometry): The configuration frame geometry.
+    """
+
+    tile_types: List[str]
+    grid: np.ndarray
+    wire_names: List[str]
+    wires: np.ndarray
+    wire_offsets: np.ndarray
+    bel_counts: np.ndarray
+    parameters: Dict[str, str]
+    geometry: FabricGeometry
+
+    def get_tile_wires(self, tile_type: str) -> np.ndarray:
+        """Get the wire definitions of a tile type.
+
+        :param tile_type: The name of the tile type, e.g. LUT4AB.
+        :type tile_type: str
+        :return: The wires as WIRE_DTYPE, a view into the wire table.
+        :rtype: np.ndarray
+        :raises ValueError: If the tile type is unknown.
+        """
+        index = self.tile_types.index(tile_type)
+        return self.wires[self.wire_offsets[index] : self.wire_offsets[index + 1]]
+
+    def get_frame_tiles(self, column: int) -> List[str]:
+        """Get the tiles configured by the frames of a column.
+
+        The frames cover the rows between the north and south terminal rows.
+
+        :param column: The column of the frames.
+        :type column: int
+        :return: The tile types from north to south.
+        :rtype: List[str]
+        """
+        return [self.tile_types[index] for index in self.grid[1:-1, column]]
+
+
+class InvalidFabricError(Exception):
+    """An exception to be thrown when a compiled fabric model is malformed."""
+
+
+def __get_geometry(grid: np.ndarray, parameters: Dict[str, str]) -> FabricGeometry:
+    """Get the configuration frame geometry of a tile grid.
+
+    :param grid: The tile type index of every tile.
+    :type grid: np.ndarray
+    :param parameters: The parameters of the fabric.
+    :type parameters: Dict[str, str]
+    :return: The geometry of the fabric.
+    :rtype: FabricGeometry
+    """
+    return FabricGeometry(
+        grid.shape[1],
+        max(grid.shape[0] - 2, 0),
+        int(parameters.get("FrameBitsPerRow", 8 * FRAME_BYTES_PER_ROW)),
+        int(parameters.get("MaxFramesPerCol", MAX_FRAMES_PER_COLUMN)),
+    )
+
+
+def __parse_fabric(fabric_csv: io.TextIOBase) -> FabricModel:
+    """Parse a fabric CSV into a fabric model.
+
+    :param fabric_csv: The opened fabric CSV.
+    :type fabric_csv: io.TextIOBase
+    :return: The fabric model.
+    :rtype: FabricModel
+    """
+    fabric_rows = []
+    parameters = {}
+    # The wires and the number of BELs of every TILE block
+    tiles: Dict[str, Tuple[List[Tuple[int, int, int, str, str, int]], int]] = {}
+    block = None
+    tile = None
+    for row in csv.reader(fabric_csv):
+        if not row or row[0].startswith("#"):
+            continue
+        keyword = row[0]
+        if block is None:
+            if keyword in ("FabricBegin", "ParametersBegin", "SuperTILE"):
+                block = keyword
+            elif keyword == "TILE":
+                block = keyword
+                tile = tiles.setdefault(row[1], ([], 0))
+                tile_name = row[1]
+        elif keyword in ("FabricEnd", "ParametersEnd", "EndSuperTILE", "EndTILE"):
+            block = None
+        elif block == "FabricBegin":
+            fabric_rows.append(row)
+        elif block == "ParametersBegin" and len(row) > 1:
+            parameters[keyword] = row[1]
+        elif block == "TILE" and keyword in DIRECTIONS:
+            tile[0].append(
+                (
+                    DIRECTIONS.index(keyword),
+                    int(row[2]),
+                    int(row[3]),
+                    row[1],
+                    row[4],
+                    int(row[5]),
+                )
+            )
+        elif block == "TILE" and keyword == "BEL":
+            tile = tiles[tile_name] = (tile[0], tile[1] + 1)
+
+    columns = 0
+    if fabric_rows:
+        cells = fabric_rows[0]
+        while columns < len(cells) and cells[columns] not in ("", "#"):
+            columns += 1
+
+    tile_types = [EMPTY_TILE]
+    grid = np.zeros((len(fabric_rows), columns), dtype=GRID_DTYPE)
+    for y, row in enumerate(fabric_rows):
+        for x, name in enumerate(row[:columns]):
+            name = name or EMPTY_TILE
+            if name not in tile_types:
+                tile_types.append(name)
+            grid[y, x] = tile_types.index(name)
+    tile_types += [name for name in tiles if name not in tile_types]
+
+    wire_names: List[str] = []
+    name_indices: Dict[str, int] = {}
+    wires = []
+    wire_offsets = [0]
+    for name in tile_types:
+        for direction, x_offset, y_offset, source, destination, count in tiles.get(
+            name, ([], 0)
+        )[0]:
+            for wire_name in (source, destination):
+                if wire_name not in name_indices:
+                    name_indices[wire_name] = len(wire_names)
+                    wire_names.append(wire_name)
+            wires.append(
+                (
+                    direction,
+                    x_offset,
+                    y_offset,
+                    name_indices[source],
+                    name_indices[destination],
+                    count,
+                )
+            )
+        wire_offsets.append(len(wires))
+
+    return FabricModel(
+        tile_types,
+        grid,
+        wire_names,
+        np.array(wires, dtype=WIRE_DTYPE),
+        np.array(wire_offsets, dtype=OFFSET_DTYPE),
+        np.array([tiles.get(name, ([], 0))[1] for name in tile_types], GRID_DTYPE),
+        parameters,
+        __get_geometry(grid, parameters),
+    )
+
+
+def read_fabric(fabric_csv: str | Path) -> FabricModel:
+    """Read a fabric model from a fabric CSV without using the cache.
+
+    :param fabric_csv: The fabric CSV file.
+    :type fabric_csv: str | Path
+    :return: The fabric model.
+    :rtype: FabricModel
+    """
+    with open(fabric_csv, newline="") as fabric_file:
+        return __parse_fabric(fabric_file)
+
+
+def serialize_fabric(
+    model: FabricModel, source_mtime: int = 0, source_hash: bytes = bytes(32)
+) -> bytes:
+    """Serialize a fabric model.
+
+    The name tables and the parameters are stored as JSON, followed by the
+    grid, the wire offsets, the BEL counts and the wire table as arrays.
+
+    :param model: The fabric model.
+    :type model: FabricModel
+    :param source_mtime: The modification time of the CSV in nanoseconds.
+    :type source_mtime: int
+    :param source_hash: The SHA-256 of the CSV.
+    :type source_hash: bytes
+    :return: The serialized model.
+    :rtype: bytes
+    """
+    names = json.dumps(
+        [model.tile_types, model.wire_names, model.parameters]
+    ).encode()
+    header = COMPILED_HEADER.pack(
+        COMPILED_MAGIC,
+        COMPILED_VERSION,
+        source_mtime,
+        source_hash,
+        len(names),
+        *model.grid.shape,
+        len(model.tile_types),
+        len(model.wires),
+    )
+    return b"".join(
+        [
+            header,
+            names,
+            model.grid.astype(GRID_DTYPE).tobytes(),
+            model.wire_offsets.astype(OFFSET_DTYPE).tobytes(),
+            model.bel_counts.astype(GRID_DTYPE).tobytes(),
+            model.wires.tobytes(),
+        ]
+    )
+
+
+def deserialize_fabric(data: bytes) -> Tuple[FabricModel, int, bytes]:
+    """Deserialize a fabric model.
+
+    The arrays are views into the data, so nothing is parsed but the names.
+
+    :param data: The serialized model.
+    :type data: bytes
+    :return: The fabric model, the modification time and the SHA-256 of the
+    CSV.
+    :rtype: Tuple[FabricModel, int, bytes]
+    :raises InvalidFabricError: If the data is malformed.
+    """
+    if len(data) < COMPILED_HEADER.size:
+        raise InvalidFabricError("The compiled fabric is truncated.")
+
+    (
+        magic,
+        version,
+        source_mtime,
+        source_hash,
+        names_size,
+        rows,
+        columns,
+        type_count,
+        wire_count,
+    ) = COMPILED_HEADER.unpack_from(data)
+    if magic != COMPILED_MAGIC or version != COMPILED_VERSION:
+        raise InvalidFabricError("The compiled fabric is unsupported.")
+
+    sizes = [
+        names_size,
+        rows * columns * GRID_DTYPE.itemsize,
+        (type_count + 1) * OFFSET_DTYPE.itemsize,
+        type_count * GRID_DTYPE.itemsize,
+        wire_count * WIRE_DTYPE.itemsize,
+    ]
+    if len(data) != COMPILED_HEADER.size + sum(sizes):
+        raise InvalidFabricError("The compiled fabric is truncated.")
+
+    offset = COMPILED_HEADER.size
+    try:
+        tile_types, wire_names, parameters = json.loads(data[offset : offset + names_size])
+    except ValueError:
+        raise InvalidFabricError("The compiled fabric is malformed.")
+    offset += names_size
+
+    arrays = []
+    for dtype, count in [
+        (GRID_DTYPE, rows * columns),
+        (OFFSET_DTYPE, type_count + 1),
+        (GRID_DTYPE, type_count),
+        (WIRE_DTYPE, wire_count),
+    ]:
+        arrays.append(np.frombuffer(data, dtype, count, offset))
+        offset += count * dtype.itemsize
+    grid, wire_offsets, bel_counts, wires = arrays
+    grid = grid.reshape(rows, columns)
+
+    model = FabricModel(
+        tile_types,
+        grid,
+        wire_names,
+        wires,
+        wire_offsets,
+        bel_counts,
+        parameters,
+        __get_geometry(grid, parameters),
+    )
+    return model, source_mtime, source_hash
+
+
+# Models already loaded by this process, keyed by path and mtime
+__loaded_fabrics: Dict[Tuple[Path, int], FabricModel] = {}
+
+
+def __get_cache_path(fabric_csv: Path, cache_directory: Path) -> Path:
+    """Get the path of the cached model of a fabric CSV.
+
+    :param fabric_csv: The resolved path of the fabric CSV.
+    :type fabric_csv: Path
+    :param cache_directory: The directory of the cache.
+    :type cache_directory: Path
+    :return: The path of the cached model.
+    :rtype: Path
+    """
+    name = hashlib.sha256(str(fabric_csv).encode()).hexdigest()[:32]
+    return cache_directory / f"{name}.bin"
+
+
+def __read_cache(cache_path: Path) -> Tuple[FabricModel, int, bytes] | None:
+    """Read a cached model.
+
+    :param cache_path: The path of the cached model.
+    :type cache_path: Path
+    :return: The fabric model, the modification time and the SHA-256 of the
+    CSV, or None if there is no valid model.
+    :rtype: Tuple[FabricModel, int, bytes] | None
+    """
+    try:
+        return deserialize_fabric(cache_path.read_bytes())
+    except FileNotFoundError:
+        return None
+    except InvalidFabricError:
+        logger.debug(f"Ignoring the invalid cached fabric {cache_path}")
+        return None
+
+
+def load_fabric(
+    fabric_csv: str | Path, cache_directory: Path = FABRIC_CACHE_DIRECTORY
+) -> FabricModel:
+    """Load a fabric model, parsing the CSV only if it changed since the last
+    time it was loaded.
+
+    The cached model is used directly if the modification time of the CSV did
+    not change. Otherwise, the CSV is hashed and only parsed again if its
+    content changed. Within a process, a model is only read from the cache
+    once.
+
+    :param fabric_csv: The fabric CSV file.
+    :type fabric_csv: str | Path
+    :param cache_directory: The directory of the cache.
+    :type cache_directory: Path
+    :return: The fabric model.
+    :rtype: FabricModel
+    """
+    path = Path(fabric_csv).resolve()
+    source_mtime = path.stat().st_mtime_ns
+    loaded = __loaded_fabrics.get((path, source_mtime))
+    if loaded is not None:
+        return loaded
+
+    cache_path = __get_cache_path(path, cache_directory)
+    cached = __read_cache(cache_path)
+    if cached is not None and cached[1] == source_mtime:
+        __loaded_fabrics[(path, source_mtime)] = cached[0]
+        return cached[0]
+
+    source = path.read_bytes()
+    source_hash = hashlib.sha256(source).digest()
+    if cached is not None and cached[2] == source_hash:
+        model = cached[0]
+    else:
+        logger.debug(f"Parsing the fabric {path}")
+        model = __parse_fabric(io.StringIO(source.decode(), newline=""))
+
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temporary file first so that a model is never truncated
+        temporary_path = cache_path.with_suffix(".tmp")
+        temporary_path.write_bytes(serialize_fabric(model, source_mtime, source_hash))
+        temporary_path.replace(cache_path)
+    except OSError as error:
+        logger.debug(f"Could not cache the fabric model: {error}")
+
+    __loaded_fabrics[(path, source_mtime)] = model
+    return model
+
+
+def get_fabric(fabric: str) -> FabricModel:
+    """Get the model of a fabric shipped in the fabrics directory.
+
+    :param fabric: The name of the fabric, e.g. mpw5.
+    :type fabric: str
+    :return: The fabric model.
+    :rtype: FabricModel
+    """
+    return load_fabric(FABRICS_DIRECTORY / fabric / f"{fabric}.csv")
@@ -1,19 +1,18 @@
 #!/usr/bin/env python3
 
+# pyftdi and inquirer are imported on first use to keep the startup of the
+# command line tools fast
+from __future__ import annotations
+
 import serial
 import serial.tools.list_ports
-from typing import NamedTuple, List
-from pyftdi.ftdi import UsbDeviceDescriptor
-from pyftdi.usbtools import UsbTools
+from typing import NamedTuple, List, TYPE_CHECKING
 from loguru import logger
-import inquirer
-import pyudev
-import os
-import re
-from collections import namedtuple
+from modules import metrics
+from modules.usb_topology import get_topology_index
 
-# Define a named tuple to store bus and port values
-USBTopology = namedtuple('USBTopology', ['bus', 'port'])
+if TYPE_CHECKING:
+    from pyftdi.ftdi import UsbDeviceDescriptor
 
 DEFAULT_FTDI_ID = "0403:6014"
 INQUIRER_LIST_NAME = "Device"
@@ -71,10 +70,13 @@ def find_devices_matching_id(device_id: str) -> List[UsbDeviceDescriptor]:
     :rtype: List[UsbDeviceDescriptor]
     :raises NoDeviceFoundError: If no matching device was found.
     """
-    vendor_id, product_id = __extract_vendor_and_product_id_from_device_id(device_id)
+    from pyftdi.usbtools import UsbTools
+
+    vendor_id, product_id = parse_device_id(device_id)
     matching_devices = []
     # Find all FTDI devices
-    devices = UsbTools.find_all([(vendor_id, product_id)])
+    with metrics.span(metrics.SPAN_DEVICE_ENUMERATION):
+        devices = UsbTools.find_all([(vendor_id, product_id)])
 
     # Filter devices by VID and PID
     for dev, _ in devices:
@@ -113,6 +115,8 @@ def select_device(devices: List[UsbDeviceDescriptor]) -> UsbDeviceDescriptor:
     elif len(devices) == 1:
         selected_device = devices[0]
     else:
+        import inquirer
+
         device_list = []
         for index, dev in enumerate(devices):
             device = (
@@ -175,6 +179,17 @@ def get_device_url(device_id: str) -> str:
     return url
 
 
+def get_url_for_device(device: UsbDeviceDescriptor) -> str:
+    """Get the FTDI URL of a given device.
+
+    :param device: The device to get the URL for.
+    :type device: UsbDeviceDescriptor
+    :return: The FTDI URL of the device.
+    :rtype: str
+    """
+    return __build_device_url(device)
+
+
 def get_device_path_for_device_id(device_id: str) -> str | None:
     """Get the device path for a given device ID
 
@@ -190,78 +205,39 @@ def get_device_path_for_device_id(device_id: str) -> str | None:
    
     if device != None:
         if device.address != None:
-            device_path = get_path_for_address(device.address)
+            device_path = get_path_for_address(device.address, device.bus)
     else:
         raise ValueError
     return device_path
 
-def get_path_for_address(address: int) -> str | None:
-    """
-    Check  if the given path is the correct path for the given address.
+def get_path_for_address(address: int, bus: int | None = None) -> str | None:
+    """Get the tty device path of the USB device with the given address.
 
-    :return: True if the given path is the correct path for the given address,
-    else False.
-    """
-    context = pyudev.Context()
-
-    device_path = None
-    for device in context.list_devices(subsystem="tty"):
-        # Extract the USB bus/port topology from the parent's device_path
-        usb_topology = extract_bus_and_port_from_full_path(device.properties.device.device_path)
-        if usb_topology is not None:
-            device_number = get_device_number_from_topology(usb_topology.bus,
-                                                     usb_topology.port)
-            if device_number == address:
-                device_path = device.device_node  # e.g., "/dev/ttyUSB0"
-    return device_path
-
-def extract_bus_and_port_from_full_path(path: str) -> USBTopology | None:
-    """
-    Extract port and address values from a USB device path.
-    
-    :param path: The USB device path string.
-    :return: A tuple (port, address) as integers, or None if not found.
-    """
-    match = re.search(r'/usb(\d+)/(\d+)-(\d+)', path)
-    if match:
-        bus, port = match.group(2), match.group(3)
-        return USBTopology(bus=bus, port=port)
-    return None
+    The lookup uses the USB topology index, which is built once per process.
 
-def get_device_number_from_topology(bus: str, port: str) -> int | None:
-    """
-    Translate USB topology (bus-port, e.g., '1-3') to the dynamic device number.
-    :param bus: USB bus number as a string (e.g., "1").
-    :param port: USB topology path (e.g., "1-3").
-    :return: The dynamic device number (e.g., "5"), or None if not found.
-    :rtype: int
+    :param address: The dynamic device number of the USB device.
+    :type address: int
+    :param bus: The USB bus of the device. If not given, the first device with
+    the address on any bus is used.
+    :type bus: int | None
+    :return: The device path (e.g. /dev/ttyUSB0), or None if not found.
+    :rtype: str | None
     """
-    usb_base_path = "/sys/bus/usb/devices"
-
-    # Topology path as it would appear under /sys/bus/usb/devices (e.g., "1-3")
-    topology_path = f"{bus}-{port}"
-
-    # Full path to the device in the USB sysfs tree
-    full_path = os.path.join(usb_base_path, topology_path)
+    with metrics.span(metrics.SPAN_TTY_RESOLUTION):
+        entry = get_topology_index().find_by_address(bus, address)
+    if entry is None:
+        return None
+    return entry.device_node
 
-    if os.path.exists(full_path):
-        try:
-            # Read the dynamic device number (devnum) from the device attributes
-            with open(os.path.join(full_path, "devnum"), "r") as f:
-                device_number = int(f.read().strip())
-            return device_number
-        except FileNotFoundError:
-            return None
-    return None
 
-def __extract_vendor_and_product_id_from_device_id(device_id: str) -> NamedTuple:
+def parse_device_id(device_id: str) -> Device:
     """Extract the vendor and product ID from the device ID.
 
     :param device_id: The device ID where to extract the vendor and product ID
-    from.
+    from, e.g. 0403:6014.
     :type device_id: str
     :return: The extracted vendor and device ID.
-    :rtype: Tuple[int, int]
+    :rtype: Device
     """
     vendor_id = int(device_id.split(":")[0], 16)
     product_id = int(device_id.split(":")[1], 16)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+
+# pyftdi is imported on first use, so that the defaults can be imported
+# without loading the USB stack
+from __future__ import annotations
+
+import time
+from typing import TYPE_CHECKING
+from serial import SerialBase
+from loguru import logger
+
+if TYPE_CHECKING:
+    from pyftdi.ftdi import Ftdi
+
+# The FTDI default of 16 ms delays every partially filled USB transfer
+DEFAULT_LATENCY_TIMER = 1
+
+# 0 lets pyftdi choose the FIFO size of the chip
+DEFAULT_TRANSFER_SIZE = 0
+
+DRAIN_POLL_INTERVAL = 0.001
+
+
+class DrainTimeoutError(Exception):
+    """An exception to be thrown when the FTDI transmitter does not become
+    empty in time."""
+
+
+def open_ftdi_uart(
+    device_url: str,
+    baudrate: int,
+    latency_timer: int = DEFAULT_LATENCY_TIMER,
+    transfer_size: int = DEFAULT_TRANSFER_SIZE,
+    write_timeout: float | None = None,
+) -> SerialBase:
+    """Open the UART of an FTDI chip directly through pyftdi, bypassing the
+    kernel tty driver.
+
+    :param device_url: The FTDI URL of the device (ftdi://...).
+    :type device_url: str
+    :param baudrate: The baudrate to be used.
+    :type baudrate: int
+    :param latency_timer: The FTDI latency timer in milliseconds.
+    :type latency_timer: int
+    :param transfer_size: The size of a single USB write transfer in bytes. 0
+    selects the FIFO size of the chip.
+    :type transfer_size: int
+    :param write_timeout: The timeout of a single USB write transfer in
+    seconds, the pyftdi default if not given.
+    :type write_timeout: float | None
+    :return: The opened pyserial compatible port.
+    :rtype: SerialBase
+    """
+    import pyftdi.serialext
+
+    port = pyftdi.serialext.serial_for_url(device_url, baudrate=baudrate)
+    ftdi = port.ftdi
+    ftdi.set_latency_timer(latency_timer)
+    ftdi.write_data_set_chunksize(transfer_size)
+    if write_timeout is not None:
+        read_timeout, _ = ftdi.timeouts
+        ftdi.timeouts = (read_timeout, max(int(write_timeout * 1000), 1))
+    logger.debug(
+        f"Opened {device_url} with latency timer {latency_timer} ms and"
+        + f" transfer size {ftdi.write_data_get_chunksize()} bytes"
+    )
+    return port
+
+
+def drain_ftdi_uart(port: SerialBase, timeout: float = 10.0) -> None:
+    """Wait until the transmitter of the FTDI chip is empty.
+
+    pyftdi returns from a write as soon as the data was handed over to the
+    chip, so the FIFO of the chip has to be polled to know when the last byte
+    has left the UART.
+
+    :param port: The port opened with open_ftdi_uart.
+    :type port: SerialBase
+    :param timeout: The maximum time to wait in seconds.
+    :type timeout: float
+    :raises DrainTimeoutError: If the transmitter is not empty in time.
+    """
+    from pyftdi.ftdi import Ftdi
+
+    ftdi: Ftdi = port.ftdi
+    deadline = time.perf_counter() + timeout
+    while not ftdi.poll_modem_status() & Ftdi.MODEM_TEMT:
+        if time.perf_counter() > deadline:
+            logger.error("The FTDI transmitter did not drain in time.")
+            raise DrainTimeoutError
+        time.sleep(DRAIN_POLL_INTERVAL)
@@ -0,0 +1,745 @@
+#!/usr/bin/env python3
+
+# The jobs are executed by the handlers of the daemon, which import pyftdi on
+# first use
+from __future__ import annotations
+
+import glob
+import json
+import os
+import subprocess
+import time
+import tomllib
+from fractions import Fraction
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Set
+from loguru import logger
+from clock_setup.frequency_planner import parse_frequency
+from modules.baudrate import (
+    select_baudrate,
+    BAUDRATE_AUTO,
+    DEFAULT_FABRIC,
+    FABRIC_PROFILES,
+)
+from modules.board_daemon import JOB_CONFIG_CLOCKS, JOB_POWER_CYCLE, JOB_UPLOAD
+from modules.board_state import (
+    get_board_key,
+    get_port_board_key,
+    load_fabric_clock,
+    store_fabric_clock,
+)
+from modules.device_readiness import get_port_location, DEFAULT_READY_TIMEOUT
+from modules.ftdi_access import find_devices_matching_id, DEFAULT_FTDI_ID
+from modules.uart_capture import CaptureOptions, DEFAULT_CAPTURE_TIME
+from modules.usb_hub import find_port_of_device, HubPort
+from modules.usb_port_power_control import POWER_SWITCH_NATIVE, POWER_SWITCHES
+from upload_bitstream.upload_bitstream import (
+    get_port_for_device,
+    UploadOptions,
+    TRANSPORT_TTY,
+    TRANSPORTS,
+)
+
+# Runs a shell command for every board, e.g. to capture a result
+STEP_COMMAND = "command"
+STEPS = [JOB_CONFIG_CLOCKS, JOB_POWER_CYCLE, JOB_UPLOAD, STEP_COMMAND]
+
+# The settings a step may define, the ones of other steps are ignored
+COMMON_KEYS = {"device_id", "clock_device_id", "transport", "continue_on_error"}
+STEP_KEYS = {
+    JOB_CONFIG_CLOCKS: {"register_config", "freq", "incremental"},
+    JOB_POWER_CYCLE: {"reset_timeout", "power_switch"},
+    JOB_UPLOAD: {
+        "bitstream",
+        "baudrate",
+        "fabric",
+        "fabric_clock",
+        "verify_command",
+        "capture",
+        "trigger",
+        *UploadOptions._fields,
+    },
+    STEP_COMMAND: {"command"},
+}
+BOARD_KEYS = {"name", "port", "location", "usb_port", "clock_device_id"}
+
+# The environment of the commands run by the steps
+BOARD_VARIABLE = "FABULOUS_BOARD"
+DEVICE_PATH_VARIABLE = "FABULOUS_DEVICE_PATH"
+BITSTREAM_VARIABLE = "FABULOUS_BITSTREAM"
+
+SKIPPED = "Skipped"
+
+# Executes a job of the daemon, either in-process or through its socket
+JobExecutor = Callable[[str, Dict[str, Any]], Dict[str, Any]]
+
+
+class ManifestError(Exception):
+    """An exception to be thrown when a job manifest is malformed."""
+
+
+class Step(NamedTuple):
+    """Defines a step of a job manifest.
+
+    Attributes:
+        job       (str): The job of the step, one of STEPS.
+        arguments (Dict[str, Any]): The settings of the step, including the
+                                    defaults of the manifest.
+    """
+
+    job: str
+    arguments: Dict[str, Any]
+
+
+class Manifest(NamedTuple):
+    """Defines a job manifest.
+
+    Attributes:
+        directory (Path): The directory relative paths are resolved against
+                          and commands are run in.
+        defaults  (Dict[str, Any]): The settings shared by all steps.
+        boards    (List[Dict[str, Any]]): The boards, all boards matching the
+                                          device ID if empty.
+        steps     (List[Step]): The steps in the order they are run.
+    """
+
+    directory: Path
+    defaults: Dict[str, Any]
+    boards: List[Dict[str, Any]]
+    steps: List[Step]
+
+
+class Board(NamedTuple):
+    """Defines a board the steps of a manifest are run on.
+
+    Attributes:
+        name            (str): The name of the board in the report.
+        device_path     (str): The tty device path or FTDI URL of the board.
+        board_key       (str): The key the upload state of the board is
+                               stored under.
+        hub_port        (HubPort | None): The hub port the board is connected
+                                          to, needed for a power cycle.
+        clock_device_id (str): The device ID of the adapter configuring the
+                               clock IC of the board.
+    """
+
+    name: str
+    device_path: str
+    board_key: str
+    hub_port: HubPort | None
+    clock_device_id: str
+
+
+class StepResult(NamedTuple):
+    """The result of a step on one board.
+
+    Attributes:
+        step      (int): The number of the step, starting at 1.
+        job       (str): The job of the step.
+        board     (str): The name of the board.
+        target    (str): The bitstream, configuration or command of the step.
+        error     (str | None): The reason of the failure, if it failed.
+        wall_time (float): The time in seconds spent on the step.
+        result    (Dict[str, Any]): The result of the job.
+    """
+
+    step: int
+    job: str
+    board: str
+    target: str
+    error: str | None
+    wall_time: float
+    result: Dict[str, Any]
+
+
+def __check_keys(table: Dict[str, Any], allowed: Set[str], name: str) -> None:
+    """Check that a table of the manifest only holds known settings.
+
+    :param table: The table of the manifest.
+    :type table: Dict[str, Any]
+    :param allowed: The known settings.
+    :type allowed: Set[str]
+    :param name: The name of the table in the error message.
+    :type name: str
+    :raises ManifestError: If the table holds an unknown setting.
+    """
+    unknown = sorted(set(table) - allowed)
+    if unknown:
+        logger.error(f"Unknown settings in {name}: {', '.join(unknown)}")
+        raise ManifestError
+
+
+def __expand_bitstreams(patterns: str | List[str], directory: Path) -> List[str]:
+    """Expand the bitstream patterns of an upload step.
+
+    :param patterns: A path or glob pattern, or a list of them.
+    :type patterns: str | List[str]
+    :param directory: The directory relative patterns are resolved against.
+    :type directory: Path
+    :return: The absolute paths of the bitstreams.
+    :rtype: List[str]
+    :raises ManifestError: If a pattern matches no file.
+    """
+    if isinstance(patterns, str):
+        patterns = [patterns]
+
+    bitstreams = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(str(directory / pattern), recursive=True))
+        if not matches:
+            logger.error(f"No bitstream matches {pattern}")
+            raise ManifestError
+        bitstreams += [os.path.abspath(match) for match in matches]
+    return bitstreams
+
+
+def load_manifest(manifest_file: str) -> Manifest:
+    """Load a job manifest from a TOML file.
+
+    :param manifest_file: The path of the manifest.
+    :type manifest_file: str
+    :return: The manifest.
+    :rtype: Manifest
+    :raises FileNotFoundError: If the manifest does not exist.
+    :raises ManifestError: If the manifest is malformed.
+    """
+    try:
+        with open(manifest_file, "rb") as file:
+            document = tomllib.load(file)
+    except tomllib.TOMLDecodeError as error:
+        logger.error(f"The manifest {manifest_file} is malformed: {error}")
+        raise ManifestError
+
+    directory = Path(manifest_file).resolve().parent
+    all_keys = COMMON_KEYS.union(*STEP_KEYS.values())
+    defaults = document.get("defaults", {})
+    __check_keys(defaults, all_keys, "defaults")
+    boards = document.get("boards", [])
+    for board in boards:
+        __check_keys(board, BOARD_KEYS, "boards")
+        if "port" not in board:
+            logger.error("Every board of the manifest needs a port.")
+            raise ManifestError
+
+    steps = []
+    for index, table in enumerate(document.get("steps", []), 1):
+        job = table.get("job")
+        if job not in STEPS:
+            logger.error(f"Step {index} has no job of {', '.join(STEPS)}.")
+            raise ManifestError
+        __check_keys(table, {"job"} | COMMON_KEYS | STEP_KEYS[job], f"step {index}")
+
+        arguments = {**defaults, **table}
+        del arguments["job"]
+        if job == JOB_UPLOAD:
+            if "bitstream" not in table:
+                logger.error(f"The upload of step {index} needs a bitstream.")
+                raise ManifestError
+            arguments["bitstream"] = __expand_bitstreams(table["bitstream"], directory)
+        elif job == JOB_CONFIG_CLOCKS:
+            if not arguments.get("register_config") and not arguments.get("freq"):
+                logger.error(f"Step {index} needs a register_config or freq.")
+                raise ManifestError
+            if arguments.get("register_config"):
+                arguments["register_config"] = str(
+                    directory / arguments["register_config"]
+                )
+        elif job == STEP_COMMAND and "command" not in table:
+            logger.error(f"Step {index} needs a command.")
+            raise ManifestError
+
+        if arguments.get("transport", TRANSPORT_TTY) not in TRANSPORTS:
+            logger.error(f"Step {index} has an unknown transport.")
+            raise ManifestError
+        if arguments.get("power_switch", POWER_SWITCH_NATIVE) not in POWER_SWITCHES:
+            logger.error(f"Step {index} has an unknown power switch.")
+            raise ManifestError
+        steps.append(Step(job, arguments))
+
+    if not steps:
+        logger.error(f"The manifest {manifest_file} has no steps.")
+        raise ManifestError
+    return Manifest(directory, defaults, boards, steps)
+
+
+def discover_boards(
+    manifest: Manifest, device_id: str = DEFAULT_FTDI_ID
+) -> List[Board]:
+    """Resolve the boards of a manifest in a single discovery pass.
+
+    Boards given with a port are used as they are. If the manifest lists no
+    boards, every board matching the device ID is used.
+
+    :param manifest: The manifest.
+    :type manifest: Manifest
+    :param device_id: The device ID used if the manifest defines none.
+    :type device_id: str
+    :return: The boards.
+    :rtype: List[Board]
+    :raises NoDeviceFoundError: If no matching device was found.
+    """
+    device_id = manifest.defaults.get("device_id", device_id)
+    clock_device_id = manifest.defaults.get("clock_device_id", device_id)
+    transport = manifest.defaults.get("transport", TRANSPORT_TTY)
+
+    if manifest.boards:
+        boards = []
+        for board in manifest.boards:
+            hub_port = None
+            if "location" in board and "usb_port" in board:
+                hub_port = HubPort(str(board["location"]), int(board["usb_port"]))
+            boards.append(
+                Board(
+                    board.get("name", board["port"]),
+                    board["port"],
+                    board["port"],
+                    hub_port,
+                    board.get("clock_device_id", clock_device_id),
+                )
+            )
+        return boards
+
+    needs_hub_port = any(step.job == JOB_POWER_CYCLE for step in manifest.steps)
+    boards = []
+    for device in find_devices_matching_id(device_id):
+        board_key = get_board_key(device)
+        device_path = get_port_for_device(device, transport)
+        if device_path is None:
+            logger.warning(f"No port found for board {board_key}, skipping it.")
+            continue
+        hub_port = None
+        if needs_hub_port:
+            hub_port = find_port_of_device(device.bus, device.address)
+        boards.append(
+            Board(board_key, device_path, board_key, hub_port, clock_device_id)
+        )
+    logger.info(f"Running the manifest on {len(boards)} boards")
+    return boards
+
+
+class JobRunner:
+    """Runs the steps of a job manifest on a set of boards.
+
+    The steps are run in order, each one on all boards in parallel. The jobs
+    are executed by a daemon, in-process or through its socket, so the serial
+    ports and I2C connections stay open between the steps. A board failing a
+    step is skipped for the remaining steps, unless the step sets
+    continue_on_error.
+    """
+
+    def __init__(self, run_job: JobExecutor, directory: Path = Path(".")):
+        """Create a runner.
+
+        :param run_job: Executes a job of the daemon.
+        :type run_job: JobExecutor
+        :param directory: The directory the commands are run in.
+        :type directory: Path
+        """
+        self.run_job = run_job
+        self.directory = directory
+        self.__boards: Dict[str, Board] = {}
+        self.__failed: Set[str] = set()
+        # Boards reset since their last upload hold the power-on configuration
+        self.__reset: Set[str] = set()
+
+    def run(self, steps: List[Step], boards: List[Board]) -> List[StepResult]:
+        """Run the steps on the boards.
+
+        :param steps: The steps.
+        :type steps: List[Step]
+        :param boards: The boards.
+        :type boards: List[Board]
+        :return: The result of every step on every board.
+        :rtype: List[StepResult]
+        """
+        self.__boards = {board.name: board for board in boards}
+        self.__failed.clear()
+        self.__reset.clear()
+        results = []
+        with ThreadPoolExecutor(max_workers=max(len(boards), 1)) as executor:
+            for number, step in enumerate(steps, 1):
+                logger.info(f"Step {number}: {step.job}")
+                active = [
+                    board
+                    for board in self.__boards.values()
+                    if board.name not in self.__failed
+                ]
+                results += [
+                    StepResult(number, step.job, name, "", SKIPPED, 0.0, {})
+                    for name in sorted(self.__failed)
+                ]
+                if not active:
+                    continue
+
+                if step.job == JOB_CONFIG_CLOCKS:
+                    step_results = self.__config_clocks(number, step, active)
+                elif step.job == JOB_POWER_CYCLE:
+                    step_results = self.__power_cycle(number, step, active)
+                else:
+                    run_on_board = (
+                        self.__upload if step.job == JOB_UPLOAD else self.__run_command
+                    )
+                    futures = [
+                        executor.submit(run_on_board, number, step, board)
+                        for board in active
+                    ]
+                    step_results = [
+                        result for future in futures for result in future.result()
+                    ]
+
+                if not step.arguments.get("continue_on_error", False):
+                    self.__failed.update(
+                        result.board
+                        for result in step_results
+                        if result.error is not None
+                    )
+                results += step_results
+        return results
+
+    def __get_target(self, step: Step) -> str:
+        """Get a short description of what a step works on for the report.
+
+        :param step: The step.
+        :type step: Step
+        :return: The configuration or command of the step.
+        :rtype: str
+        """
+        if step.job == JOB_CONFIG_CLOCKS:
+            return step.arguments.get("freq") or Path(
+                step.arguments["register_config"]
+            ).name
+        if step.job == STEP_COMMAND:
+            return step.arguments["command"]
+        return ""
+
+    def __describe_error(self, error: Exception) -> str:
+        """Describe an exception in the report.
+
+        :param error: The exception.
+        :type error: Exception
+        :return: The message of the exception, or its type.
+        :rtype: str
+        """
+        return str(error) or type(error).__name__
+
+    def __config_clocks(
+        self, number: int, step: Step, boards: List[Board]
+    ) -> List[StepResult]:
+        """Configure the clock ICs of the boards, once per clock adapter, and
+        record the fabric clock of every board behind the adapter.
+
+        :param number: The number of the step.
+        :type number: int
+        :param step: The step.
+        :type step: Step
+        :param boards: The boards the step is run on.
+        :type boards: List[Board]
+        :return: The result for every board.
+        :rtype: List[StepResult]
+        """
+        results = []
+        for clock_device_id in sorted({board.clock_device_id for board in boards}):
+            start = time.perf_counter()
+            error = None
+            result = {}
+            try:
+                result = self.run_job(
+                    JOB_CONFIG_CLOCKS,
+                    {
+                        "register_config": step.arguments.get("register_config"),
+                        "frequencies": step.arguments.get("freq"),
+                        "device_id": clock_device_id,
+                        "incremental": step.arguments.get("incremental", False),
+                    },
+                )
+            except Exception as exception:
+                error = self.__describe_error(exception)
+            wall_time = time.perf_counter() - start
+
+            if error is None:
+                # The adapter may configure the clock ICs of other boards
+                fabric_clock = result.get("fabric_clock")
+                for board in boards:
+                    if board.clock_device_id == clock_device_id:
+                        store_fabric_clock(
+                            get_port_board_key(board.board_key),
+                            fabric_clock and Fraction(fabric_clock),
+                        )
+
+            results += [
+                StepResult(
+                    number,
+                    step.job,
+                    board.name,
+                    self.__get_target(step),
+                    error,
+                    wall_time,
+                    result,
+                )
+                for board in boards
+                if board.clock_device_id == clock_device_id
+            ]
+        return results
+
+    def __power_cycle(
+        self, number: int, step: Step, boards: List[Board]
+    ) -> List[StepResult]:
+        """Power cycle the hub ports of all boards at once.
+
+        :param number: The number of the step.
+        :type number: int
+        :param step: The step.
+        :type step: Step
+        :param boards: The boards the step is run on.
+        :type boards: List[Board]
+        :return: The result for every board.
+        :rtype: List[StepResult]
+        """
+        results = [
+            StepResult(number, step.job, board.name, "", "No hub port", 0.0, {})
+            for board in boards
+            if board.hub_port is None
+        ]
+        boards = [board for board in boards if board.hub_port is not None]
+        if not boards:
+            return results
+
+        transport = step.arguments.get("transport", TRANSPORT_TTY)
+        start = time.perf_counter()
+        error = None
+        device_nodes = {}
+        try:
+            device_nodes = self.run_job(
+                JOB_POWER_CYCLE,
+                {
+                    "ports": [list(board.hub_port) for board in boards],
+                    "device_id": step.arguments.get("device_id"),
+                    "timeout": step.arguments.get(
+                        "reset_timeout", DEFAULT_READY_TIMEOUT
+                    ),
+                    "wait_for_tty": transport == TRANSPORT_TTY,
+                    "power_switch": step.arguments.get(
+                        "power_switch", POWER_SWITCH_NATIVE
+                    ),
+                },
+            )["device_nodes"]
+        except Exception as exception:
+            error = self.__describe_error(exception)
+        wall_time = time.perf_counter() - start
+
+        for board in boards:
+            if error is None:
+                self.__reset.add(board.name)
+                # The tty node may change when the device enumerates again
+                device_node = device_nodes.get(
+                    get_port_location(board.hub_port.location, str(board.hub_port.port))
+                )
+                if device_node and device_node != board.device_path:
+                    logger.info(f"Board {board.name} is now at {device_node}")
+                    self.__boards[board.name] = board._replace(device_path=device_node)
+            results.append(
+                StepResult(
+                    number,
+                    step.job,
+                    board.name,
+                    board.hub_port.location + f".{board.hub_port.port}",
+                    error,
+                    wall_time,
+                    {},
+                )
+            )
+        return results
+
+    def __get_baudrate(self, step: Step, board: Board) -> int:
+        """Get the baud rate of the uploads of a step to a board.
+
+        :param step: The upload step.
+        :type step: Step
+        :param board: The board.
+        :type board: Board
+        :return: The baud rate, selected from the fabric clock if auto.
+        :rtype: int
+        """
+        baudrate = step.arguments.get("baudrate", BAUDRATE_AUTO)
+        if baudrate != BAUDRATE_AUTO:
+            return int(baudrate)
+
+        profile = FABRIC_PROFILES[step.arguments.get("fabric", DEFAULT_FABRIC)]
+        if "fabric_clock" in step.arguments:
+            fabric_clock = parse_frequency(str(step.arguments["fabric_clock"]))
+        else:
+            fabric_clock = load_fabric_clock(get_port_board_key(board.board_key))
+        return select_baudrate(fabric_clock or profile.reference_clock, profile)
+
+    def __run_shell(self, command: str, board: Board, bitstream: str = "") -> int:
+        """Run a shell command for a board.
+
+        :param command: The shell command.
+        :type command: str
+        :param board: The board, passed in the environment.
+        :type board: Board
+        :param bitstream: The last uploaded bitstream, passed in the
+        environment.
+        :type bitstream: str
+        :return: The exit status of the command.
+        :rtype: int
+        """
+        environment = {
+            **os.environ,
+            BOARD_VARIABLE: board.name,
+            DEVICE_PATH_VARIABLE: board.device_path,
+            BITSTREAM_VARIABLE: bitstream,
+        }
+        return subprocess.run(
+            command, shell=True, cwd=self.directory, env=environment
+        ).returncode
+
+    def __upload(self, number: int, step: Step, board: Board) -> List[StepResult]:
+        """Upload the bitstreams of a step to a board one after another.
+
+        :param number: The number of the step.
+        :type number: int
+        :param step: The step.
+        :type step: Step
+        :param board: The board.
+        :type board: Board
+        :return: The result of every bitstream.
+        :rtype: List[StepResult]
+        """
+        board = self.__boards[board.name]
+        options = UploadOptions(
+            **{
+                field: step.arguments[field]
+                for field in UploadOptions._fields
+                if field in step.arguments
+            }
+        )
+        capture = None
+        if "capture" in step.arguments or "trigger" in step.arguments:
+            capture = CaptureOptions(
+                step.arguments.get("capture", DEFAULT_CAPTURE_TIME),
+                step.arguments.get("trigger"),
+            )._asdict()
+        continue_on_error = step.arguments.get("continue_on_error", False)
+        results = []
+        try:
+            baudrate = self.__get_baudrate(step, board)
+        except Exception as exception:
+            error = self.__describe_error(exception)
+            return [StepResult(number, step.job, board.name, "", error, 0.0, {})]
+
+        for bitstream in step.arguments["bitstream"]:
+            start = time.perf_counter()
+            reset = board.name in self.__reset
+            if options.sparse and not reset:
+                logger.warning(
+                    f"Board {board.name} was not reset, the power-on frames of"
+                    + f" {Path(bitstream).name} are not skipped"
+                )
+            error = None
+            result = {}
+            try:
+                result = self.run_job(
+                    JOB_UPLOAD,
+                    {
+                        "bitstream_file": bitstream,
+                        "baudrate": baudrate,
+                        "port": board.device_path,
+                        "board_key": board.board_key,
+                        "options": options._replace(
+                            diff=options.diff and not reset,
+                            sparse=options.sparse and reset,
+                            skip_loaded=options.skip_loaded
+                            and not reset
+                            and capture is None,
+                        )._asdict(),
+                        "capture": capture,
+                    },
+                )
+                self.__reset.discard(board.name)
+                if capture and capture["trigger"] and not result["capture"]["match"]:
+                    error = "Trigger not matched"
+                if error is None and step.arguments.get("verify_command"):
+                    status = self.__run_shell(
+                        step.arguments["verify_command"], board, bitstream
+                    )
+                    if status != 0:
+                        error = f"Verification exited with {status}"
+            except Exception as exception:
+                error = self.__describe_error(exception)
+
+            results.append(
+                StepResult(
+                    number,
+                    step.job,
+                    board.name,
+                    Path(bitstream).name,
+                    error,
+                    time.perf_counter() - start,
+                    result,
+                )
+            )
+            if error is not None and not continue_on_error:
+                break
+        return results
+
+    def __run_command(self, number: int, step: Step, board: Board) -> List[StepResult]:
+        """Run the command of a step for a board.
+
+        :param number: The number of the step.
+        :type number: int
+        :param step: The step.
+        :type step: Step
+        :param board: The board.
+        :type board: Board
+        :return: The result of the command.
+        :rtype: List[StepResult]
+        """
+        board = self.__boards[board.name]
+        start = time.perf_counter()
+        status = self.__run_shell(step.arguments["command"], board)
+        return [
+            StepResult(
+                number,
+                step.job,
+                board.name,
+                self.__get_target(step),
+                f"Exited with {status}" if status != 0 else None,
+                time.perf_counter() - start,
+                {"status": status},
+            )
+        ]
+
+
+def log_step_results(results: List[StepResult]) -> None:
+    """Log the results of a manifest run as a table.
+
+    :param results: The results to be logged.
+    :type results: List[StepResult]
+    """
+    logger.info(
+        f"{'Step':>4} {'Job':<14} {'Board':<20} {'Target':<28} {'Time [s]':>9}  Status"
+    )
+    for result in results:
+        logger.info(
+            f"{result.step:>4} {result.job:<14} {result.board:<20}"
+            + f" {result.target[:28]:<28} {result.wall_time:>9.3f}"
+            + f"  {result.error or 'OK'}"
+        )
+
+    failed = sum(result.error is not None for result in results)
+    logger.info(f"{len(results) - failed} of {len(results)} steps succeeded")
+
+
+def write_step_report(results: List[StepResult], report_file: str) -> None:
+    """Write the results of a manifest run as JSON.
+
+    :param results: The results to be written.
+    :type results: List[StepResult]
+    :param report_file: The path of the report.
+    :type report_file: str
+    """
+    with open(report_file, "w") as file:
+        json.dump([result._asdict() for result in results], file, indent=2)
+    logger.info(f"Report written to {report_file}")
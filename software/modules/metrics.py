@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+
+import contextlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import ContextManager, Dict, Iterator, Tuple
+from loguru import logger
+from modules.board_state import DEFAULT_STATE_DIRECTORY
+
+DEFAULT_METRICS_DIRECTORY = DEFAULT_STATE_DIRECTORY / "metrics"
+JSONL_FILE_NAME = "board_metrics.jsonl"
+# The node exporter textfile collector only reads files with this suffix
+TEXTFILE_FILE_NAME = "fabulous_board.prom"
+METRIC_PREFIX = "fabulous_board"
+
+# Phases of the board operations
+SPAN_DEVICE_ENUMERATION = "device_enumeration"
+SPAN_TTY_RESOLUTION = "tty_resolution"
+SPAN_USB_POWER_CYCLE = "usb_power_cycle"
+SPAN_USB_SETTLE = "usb_settle"
+SPAN_PORT_OPEN = "port_open"
+SPAN_TRANSMIT = "transmit"
+SPAN_DRAIN = "drain"
+SPAN_I2C_CONNECT = "i2c_connect"
+SPAN_CRYSTAL_CHECK = "crystal_check"
+SPAN_REGISTER_READ = "register_read"
+SPAN_REGISTER_WRITE = "register_write"
+SPAN_CAPTURE = "capture"
+
+# Counted quantities
+COUNTER_BYTES_TRANSMITTED = "bytes_transmitted"
+COUNTER_I2C_TRANSACTIONS = "i2c_transactions"
+COUNTER_I2C_BYTES = "i2c_bytes"
+COUNTER_BYTES_CAPTURED = "bytes_captured"
+
+# Labels are stored as sorted tuples so that they can be used as keys
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class MetricsRecorder:
+    """Records the timing spans and counters of one invocation.
+
+    Every finished span is appended to a JSON lines file right away, so that
+    long running processes like the daemon stream their data. The aggregated
+    durations and counters are written to a Prometheus textfile on flush.
+    """
+
+    def __init__(self, directory: Path, command: str):
+        """Create a recorder.
+
+        :param directory: The directory of the JSON lines and textfile.
+        :type directory: Path
+        :param command: The command of the invocation, used as label.
+        :type command: str
+        """
+        self.directory = Path(directory)
+        self.command = command
+        self.run_id = os.urandom(6).hex()
+        self.start_time = time.time()
+        self.__lock = threading.Lock()
+        # Serializes the flushes, so that the newest textfile is kept
+        self.__textfile_lock = threading.Lock()
+        self.__durations: Dict[Tuple[str, Labels], float] = defaultdict(float)
+        self.__span_counts: Dict[Tuple[str, Labels], int] = defaultdict(int)
+        self.__counters: Dict[Tuple[str, Labels], float] = defaultdict(float)
+
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.__jsonl = open(self.directory / JSONL_FILE_NAME, "a", buffering=1)
+
+    def __write_event(self, event: Dict) -> None:
+        """Append an event to the JSON lines file.
+
+        :param event: The event, the time, run and command are added.
+        :type event: Dict
+        """
+        line = json.dumps(
+            {"time": time.time(), "run": self.run_id, "command": self.command, **event}
+        )
+        with self.__lock:
+            self.__jsonl.write(line + "\n")
+
+    def observe(
+        self, name: str, duration: float, labels: Dict[str, str], error: bool = False
+    ) -> None:
+        """Record the duration of a finished span.
+
+        :param name: The name of the span.
+        :type name: str
+        :param duration: The duration in seconds.
+        :type duration: float
+        :param labels: Additional labels, e.g. the device.
+        :type labels: Dict[str, str]
+        :param error: Whether the span was left with an exception.
+        :type error: bool
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__durations[key] += duration
+            self.__span_counts[key] += 1
+        self.__write_event(
+            {"span": name, "duration": duration, "error": error, **labels}
+        )
+
+    def count(self, name: str, value: float, labels: Dict[str, str]) -> None:
+        """Increase a counter.
+
+        :param name: The name of the counter.
+        :type name: str
+        :param value: The increment.
+        :type value: float
+        :param labels: Additional labels, e.g. the device.
+        :type labels: Dict[str, str]
+        """
+        key = (name, tuple(sorted(labels.items())))
+        with self.__lock:
+            self.__counters[key] += value
+
+    @contextlib.contextmanager
+    def span(self, name: str, labels: Dict[str, str]) -> Iterator[None]:
+        """Measure the duration of a block.
+
+        :param name: The name of the span.
+        :type name: str
+        :param labels: Additional labels, e.g. the device.
+        :type labels: Dict[str, str]
+        """
+        start = time.perf_counter()
+        error = False
+        try:
+            yield
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.observe(name, time.perf_counter() - start, labels, error)
+
+    def __format_labels(self, labels: Labels) -> str:
+        """Format the labels of a sample including the command.
+
+        :param labels: The labels of the sample.
+        :type labels: Labels
+        :return: The label set in the Prometheus text format.
+        :rtype: str
+        """
+        formatted = []
+        for key, value in [("command", self.command)] + list(labels):
+            value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+            formatted.append(f'{key}="{value}"'.replace("\n", "\\n"))
+        return "{" + ",".join(formatted) + "}"
+
+    def format_textfile(self) -> str:
+        """Format the aggregated metrics in the Prometheus text format.
+
+        :return: The content of the textfile.
+        :rtype: str
+        """
+        with self.__lock:
+            durations = dict(self.__durations)
+            span_counts = dict(self.__span_counts)
+            counters = dict(self.__counters)
+
+        lines = [
+            f"# HELP {METRIC_PREFIX}_phase_seconds Time spent in a phase by the"
+            + " last run.",
+            f"# TYPE {METRIC_PREFIX}_phase_seconds gauge",
+        ]
+        for (name, labels), duration in sorted(durations.items()):
+            phase_labels = (("phase", name),) + labels
+            lines.append(
+                f"{METRIC_PREFIX}_phase_seconds{self.__format_labels(phase_labels)}"
+                + f" {duration:.9f}"
+            )
+        lines += [
+            f"# HELP {METRIC_PREFIX}_phase_count Times a phase was entered by"
+            + " the last run.",
+            f"# TYPE {METRIC_PREFIX}_phase_count gauge",
+        ]
+        for (name, labels), count in sorted(span_counts.items()):
+            phase_labels = (("phase", name),) + labels
+            lines.append(
+                f"{METRIC_PREFIX}_phase_count{self.__format_labels(phase_labels)}"
+                + f" {count}"
+            )
+        for name in sorted({name for name, _ in counters}):
+            lines += [
+                f"# HELP {METRIC_PREFIX}_{name} Counted by the last run.",
+                f"# TYPE {METRIC_PREFIX}_{name} gauge",
+            ]
+            for (counter, labels), value in sorted(counters.items()):
+                if counter == name:
+                    lines.append(
+                        f"{METRIC_PREFIX}_{name}{self.__format_labels(labels)}"
+                        + f" {float(value)!r}"
+                    )
+        lines += [
+            f"# HELP {METRIC_PREFIX}_last_run_timestamp_seconds Start of the last"
+            + " run.",
+            f"# TYPE {METRIC_PREFIX}_last_run_timestamp_seconds gauge",
+            f"{METRIC_PREFIX}_last_run_timestamp_seconds{self.__format_labels(())}"
+            + f" {self.start_time:.3f}",
+            f"# HELP {METRIC_PREFIX}_last_run_duration_seconds Duration of the"
+            + " last run.",
+            f"# TYPE {METRIC_PREFIX}_last_run_duration_seconds gauge",
+            f"{METRIC_PREFIX}_last_run_duration_seconds{self.__format_labels(())}"
+            + f" {time.time() - self.start_time:.6f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def __write_textfile(self) -> None:
+        """Replace the textfile with the current totals.
+
+        The collector must never see a partially written file, so the textfile
+        is written to a unique temporary file first.
+        """
+        path = self.directory / TEXTFILE_FILE_NAME
+        with self.__textfile_lock:
+            descriptor, temporary_path = tempfile.mkstemp(
+                dir=self.directory, prefix=f".{path.name}.", suffix=".tmp"
+            )
+            try:
+                with os.fdopen(descriptor, "w") as file:
+                    file.write(self.format_textfile())
+                os.replace(temporary_path, path)
+            except BaseException:
+                os.unlink(temporary_path)
+                raise
+
+    def flush(self) -> None:
+        """Write the aggregated counters to the JSON lines file and replace the
+        textfile.
+
+        A failure to write the metrics is logged, it never fails the operation
+        that was measured.
+        """
+        with self.__lock:
+            counters = {
+                name + "".join(f",{key}={value}" for key, value in labels): value
+                for (name, labels), value in self.__counters.items()
+            }
+        try:
+            self.__write_event({"counters": counters})
+            self.__write_textfile()
+        except OSError as error:
+            logger.warning(f"Could not write the metrics to {self.directory}: {error}")
+            return
+        logger.debug(f"Metrics written to {self.directory}")
+
+    def close(self) -> None:
+        """Flush the metrics and close the JSON lines file."""
+        self.flush()
+        with self.__lock:
+            self.__jsonl.close()
+
+
+__recorder: MetricsRecorder | None = None
+__disabled_span = contextlib.nullcontext()
+
+
+def enable_metrics(directory: Path, command: str) -> MetricsRecorder:
+    """Start recording metrics for the rest of the process.
+
+    :param directory: The directory of the JSON lines and textfile.
+    :type directory: Path
+    :param command: The command of the invocation, used as label.
+    :type command: str
+    :return: The recorder.
+    :rtype: MetricsRecorder
+    """
+    global __recorder
+    __recorder = MetricsRecorder(directory, command)
+    return __recorder
+
+
+def disable_metrics() -> None:
+    """Stop recording metrics, the recorded ones are written."""
+    global __recorder
+    if __recorder is not None:
+        __recorder.close()
+        __recorder = None
+
+
+def span(name: str, **labels: str) -> ContextManager[None]:
+    """Measure the duration of a block if metrics are enabled.
+
+    :param name: The name of the span, e.g. SPAN_TRANSMIT.
+    :type name: str
+    :param labels: Additional labels, e.g. the device.
+    :type labels: str
+    :return: A context manager measuring the block.
+    :rtype: ContextManager[None]
+    """
+    if __recorder is None:
+        return __disabled_span
+    return __recorder.span(name, labels)
+
+
+def observe(name: str, duration: float, **labels: str) -> None:
+    """Record the duration of a span measured by the caller if metrics are
+    enabled.
+
+    :param name: The name of the span, e.g. SPAN_TRANSMIT.
+    :type name: str
+    :param duration: The duration in seconds.
+    :type duration: float
+    :param labels: Additional labels, e.g. the device.
+    :type labels: str
+    """
+    if __recorder is not None:
+        __recorder.observe(name, duration, labels)
+
+
+def count(name: str, value: float = 1, **labels: str) -> None:
+    """Increase a counter if metrics are enabled.
+
+    :param name: The name of the counter, e.g. COUNTER_BYTES_TRANSMITTED.
+    :type name: str
+    :param value: The increment.
+    :type value: float
+    :param labels: Additional labels, e.g. the device.
+    :type labels: str
+    """
+    if __recorder is not None:
+        __recorder.count(name, value, labels)
+
+
+def flush_metrics() -> None:
+    """Write the recorded metrics if metrics are enabled, e.g. after a job of
+    the daemon."""
+    if __recorder is not None:
+        __recorder.flush()
@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+
+import bisect
+import re
+import threading
+import time
+from typing import Any, BinaryIO, Dict, List, NamedTuple, Tuple
+from serial import SerialBase, SerialException
+from loguru import logger
+from modules import metrics
+
+DEFAULT_CAPTURE_BUFFER_SIZE = 1 << 20
+DEFAULT_CAPTURE_TIME = 5.0
+
+# Bounds the time the reader needs to notice that it was stopped
+READ_TIMEOUT = 0.05
+
+# A trigger is searched again in this many already searched bytes, so that it
+# is found if it spans multiple reads
+TRIGGER_LOOKBACK = 4096
+
+
+class TriggerTimeoutError(Exception):
+    """An exception to be thrown when the output of the design does not match
+    the trigger in time."""
+
+
+class CaptureOptions(NamedTuple):
+    """Defines how the output of the design is captured after an upload.
+
+    Attributes:
+        timeout     (float): The time in seconds to capture after the upload,
+                             or to wait for the trigger.
+        trigger     (str | None): A regular expression ending the capture
+                                  once the output matches it, e.g. PASS|FAIL
+                                  or \\x55\\xaa for raw bytes.
+        tee_file    (str | None): A file every received byte is written to.
+        buffer_size (int): The number of received bytes kept in memory.
+    """
+
+    timeout: float = DEFAULT_CAPTURE_TIME
+    trigger: str | None = None
+    tee_file: str | None = None
+    buffer_size: int = DEFAULT_CAPTURE_BUFFER_SIZE
+
+
+class CaptureMatch(NamedTuple):
+    """Defines where the output matched a trigger.
+
+    Attributes:
+        offset    (int): The offset of the match in the received stream.
+        timestamp (float): The performance counter time the first byte of the
+                           match was received at.
+        data      (bytes): The matched bytes.
+    """
+
+    offset: int
+    timestamp: float
+    data: bytes
+
+
+def compile_trigger(pattern: str) -> re.Pattern:
+    """Compile a trigger matching the received bytes.
+
+    :param pattern: The regular expression, raw bytes can be given as \\xNN.
+    :type pattern: str
+    :return: The compiled trigger.
+    :rtype: re.Pattern
+    :raises re.error: If the pattern is malformed.
+    """
+    return re.compile(pattern.encode())
+
+
+class UartCapture:
+    """Streams the bytes received on a port into a bounded ring buffer.
+
+    A background thread reads the port from start to stop, so the capture can
+    be started before an upload and nothing the design sends right after its
+    configuration is lost. Every read is timestamped. Once the buffer is full,
+    the oldest bytes are dropped, but every byte is still written to the tee
+    file if one is given.
+    """
+
+    def __init__(
+        self,
+        port: SerialBase,
+        buffer_size: int = DEFAULT_CAPTURE_BUFFER_SIZE,
+        tee: BinaryIO | None = None,
+    ):
+        """Create a capture, the port is not read until it is started.
+
+        :param port: The opened port, it is not closed by the capture.
+        :type port: SerialBase
+        :param buffer_size: The number of received bytes kept in memory.
+        :type buffer_size: int
+        :param tee: A binary file every received byte is written to.
+        :type tee: BinaryIO | None
+        """
+        self.port = port
+        self.buffer_size = buffer_size
+        self.tee = tee
+        self.error: Exception | None = None
+        self.__buffer = bytearray()
+        # The stream offset of the first byte in the buffer
+        self.__buffer_offset = 0
+        # The stream offset and the receive time of every read
+        self.__read_offsets: List[int] = []
+        self.__read_times: List[float] = []
+        self.__condition = threading.Condition()
+        self.__stopped = threading.Event()
+        self.__thread: threading.Thread | None = None
+        self.__timeout = None
+
+    def __enter__(self) -> "UartCapture":
+        self.start()
+        return self
+
+    def __exit__(self, *exception) -> None:
+        self.stop()
+
+    @property
+    def received(self) -> int:
+        """The number of bytes received since the start."""
+        with self.__condition:
+            return self.__buffer_offset + len(self.__buffer)
+
+    @property
+    def dropped(self) -> int:
+        """The number of received bytes dropped from the buffer."""
+        with self.__condition:
+            return self.__buffer_offset
+
+    def start(self, discard_pending: bool = True) -> None:
+        """Start reading the port in the background.
+
+        :param discard_pending: Discard the bytes received before the start,
+        e.g. the output of a previous design.
+        :type discard_pending: bool
+        """
+        if discard_pending:
+            self.port.reset_input_buffer()
+        self.__timeout = self.port.timeout
+        self.port.timeout = READ_TIMEOUT
+        self.__stopped.clear()
+        self.__thread = threading.Thread(
+            target=self.__read, name="uart-capture", daemon=True
+        )
+        self.__thread.start()
+
+    def stop(self) -> None:
+        """Stop reading the port and restore its timeout."""
+        if self.__thread is None:
+            return
+        self.__stopped.set()
+        self.__thread.join()
+        self.__thread = None
+        self.port.timeout = self.__timeout
+        if self.tee is not None:
+            self.tee.flush()
+        if self.dropped:
+            logger.warning(
+                f"Dropped the first {self.dropped} captured bytes, the capture"
+                + f" buffer holds {self.buffer_size} bytes"
+            )
+
+    def __read(self) -> None:
+        """Read the port until the capture is stopped."""
+        while not self.__stopped.is_set():
+            try:
+                data = self.port.read(self.port.in_waiting or 1)
+            except (SerialException, OSError) as error:
+                logger.error(f"Capturing the UART output failed: {error}")
+                self.error = error
+                break
+            if not data:
+                continue
+
+            timestamp = time.perf_counter()
+            if self.tee is not None:
+                self.tee.write(data)
+            metrics.count(metrics.COUNTER_BYTES_CAPTURED, len(data))
+            with self.__condition:
+                self.__read_offsets.append(self.__buffer_offset + len(self.__buffer))
+                self.__read_times.append(timestamp)
+                self.__buffer += data
+                # Trimmed in batches, so that not every read moves the buffer
+                if len(self.__buffer) > self.buffer_size * 5 // 4:
+                    self.__trim()
+                self.__condition.notify_all()
+
+        with self.__condition:
+            self.__stopped.set()
+            self.__condition.notify_all()
+
+    def __trim(self) -> None:
+        """Drop the oldest bytes exceeding the buffer size."""
+        excess = len(self.__buffer) - self.buffer_size
+        del self.__buffer[:excess]
+        self.__buffer_offset += excess
+        # Keep the read containing the first byte of the buffer
+        index = bisect.bisect_right(self.__read_offsets, self.__buffer_offset) - 1
+        del self.__read_offsets[:index]
+        del self.__read_times[:index]
+
+    def __get_timestamp(self, offset: int) -> float:
+        """Get the time the byte at a stream offset was received at.
+
+        :param offset: The offset of the byte in the stream.
+        :type offset: int
+        :return: The performance counter time of the read.
+        :rtype: float
+        """
+        index = bisect.bisect_right(self.__read_offsets, offset) - 1
+        return self.__read_times[max(index, 0)]
+
+    def get_data(self) -> bytes:
+        """Get the received bytes still held in the buffer.
+
+        :return: The bytes.
+        :rtype: bytes
+        """
+        with self.__condition:
+            return bytes(self.__buffer)
+
+    def get_lines(self) -> List[Tuple[float, bytes]]:
+        """Get the received lines still held in the buffer.
+
+        :return: The time the first byte of each line was received at and the
+        line without its line ending.
+        :rtype: List[Tuple[float, bytes]]
+        """
+        with self.__condition:
+            lines = []
+            start = 0
+            for line in bytes(self.__buffer).splitlines(keepends=True):
+                timestamp = self.__get_timestamp(self.__buffer_offset + start)
+                lines.append((timestamp, line.rstrip(b"\r\n")))
+                start += len(line)
+            return lines
+
+    def wait_for(
+        self, trigger: re.Pattern | None, timeout: float
+    ) -> CaptureMatch | None:
+        """Wait until the received bytes match a trigger.
+
+        The bytes received since the start are searched, so a match received
+        before the call is found as well.
+
+        :param trigger: The trigger, or None to capture for the whole timeout.
+        :type trigger: re.Pattern | None
+        :param timeout: The maximum time to wait in seconds.
+        :type timeout: float
+        :return: The match, or None if no trigger was given.
+        :rtype: CaptureMatch | None
+        :raises TriggerTimeoutError: If the trigger did not match in time.
+        """
+        deadline = time.perf_counter() + timeout
+        search_offset = 0
+        with self.__condition:
+            while True:
+                if trigger is not None:
+                    start = max(search_offset - self.__buffer_offset, 0)
+                    match = trigger.search(self.__buffer, start)
+                    if match is not None:
+                        offset = self.__buffer_offset + match.start()
+                        return CaptureMatch(
+                            offset, self.__get_timestamp(offset), match.group()
+                        )
+                    search_offset = max(
+                        self.__buffer_offset + len(self.__buffer) - TRIGGER_LOOKBACK,
+                        search_offset,
+                    )
+
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0 or self.__stopped.is_set():
+                    break
+                self.__condition.wait(remaining)
+
+        if trigger is None:
+            return None
+        logger.error(
+            f"The output did not match {trigger.pattern.decode(errors='replace')}"
+            + f" within {timeout:.1f} s."
+        )
+        raise TriggerTimeoutError
+
+
+def summarize_capture(
+    capture: UartCapture, match: CaptureMatch | None, reference_time: float
+) -> Dict[str, Any]:
+    """Summarize a capture in a JSON compatible form, e.g. for a report.
+
+    :param capture: The stopped capture.
+    :type capture: UartCapture
+    :param match: The match of the trigger, if it matched.
+    :type match: CaptureMatch | None
+    :param reference_time: The performance counter time the timestamps are
+    relative to, e.g. the end of the upload.
+    :type reference_time: float
+    :return: The received and dropped bytes, the lines with their time and the
+    trigger match.
+    :rtype: Dict[str, Any]
+    """
+    return {
+        "received": capture.received,
+        "dropped": capture.dropped,
+        "lines": [
+            [timestamp - reference_time, line.decode(errors="replace")]
+            for timestamp, line in capture.get_lines()
+        ],
+        "match": match and match.data.decode(errors="replace"),
+        "match_time": match and match.timestamp - reference_time,
+    }
+
+
+def log_capture_summary(summary: Dict[str, Any]) -> None:
+    """Log the captured lines with their time relative to the upload.
+
+    :param summary: The summary of the capture.
+    :type summary: Dict[str, Any]
+    """
+    logger.info(
+        f"Captured {summary['received']} bytes in {len(summary['lines'])} lines"
+    )
+    for time_offset, line in summary["lines"]:
+        logger.info(f"{time_offset:+9.3f} s | {line}")
+    if summary["match"] is not None:
+        logger.info(
+            f"Trigger matched {summary['match']!r} {summary['match_time']:.3f} s"
+            + " after the upload"
+        )
+
+
+def capture_after_upload(
+    capture: UartCapture, options: CaptureOptions, upload_end: float
+) -> CaptureMatch | None:
+    """Capture the output of the design after its upload.
+
+    :param capture: The capture started before the upload.
+    :type capture: UartCapture
+    :param options: Defines how long to capture and the trigger.
+    :type options: CaptureOptions
+    :param upload_end: The performance counter time the upload ended at.
+    :type upload_end: float
+    :return: The match of the trigger, or None if no trigger was given.
+    :rtype: CaptureMatch | None
+    :raises TriggerTimeoutError: If the trigger did not match in time.
+    """
+    trigger = compile_trigger(options.trigger) if options.trigger else None
+    remaining = options.timeout - (time.perf_counter() - upload_end)
+    match = None
+    try:
+        with metrics.span(metrics.SPAN_CAPTURE):
+            match = capture.wait_for(trigger, max(remaining, 0.0))
+    finally:
+        capture.stop()
+        log_capture_summary(summarize_capture(capture, match, upload_end))
+    return match
@@ -0,0 +1,401 @@
+#!/usr/bin/env python3
+
+# pyusb is imported on first use, so that importing the module does not load
+# the USB stack
+from __future__ import annotations
+
+import asyncio
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Sequence, Tuple, TYPE_CHECKING
+from loguru import logger
+from modules.async_io import BlockingRunner, run_to_completion
+from modules.ftdi_access import Device
+from modules.usb_topology import parse_port_chain, SYSFS_ROOT
+
+if TYPE_CHECKING:
+    import usb.core
+
+HUB_DEVICE_CLASS = 0x09
+
+# Host to device, class request, addressed to a port of the hub
+HUB_PORT_REQUEST_TYPE = 0x23
+CLEAR_FEATURE = 0x01
+SET_FEATURE = 0x03
+PORT_POWER = 8
+
+CONTROL_TIMEOUT = 1000  # ms
+
+# The time the ports stay unpowered, the same as the default of uhubctl
+DEFAULT_POWER_OFF_TIME = 2.0
+
+# The sysfs directory of a hub port is named after the hub, e.g. 1-1-port2 or
+# usb1-port2 for a root hub
+PORT_DIRECTORY_PATTERN = re.compile(r"^(.+)-port(\d+)$")
+ROOT_HUB_PREFIX = "usb"
+
+
+class HubNotFoundError(Exception):
+    """An exception to be thrown when no USB hub exists at a location."""
+
+
+class HubAccessError(Exception):
+    """An exception to be thrown when a request to a USB hub fails, e.g. due to
+    missing permissions."""
+
+
+class HubPort(NamedTuple):
+    """Defines a downstream port of a USB hub.
+
+    Attributes:
+        location (str): The location of the hub as used by uhubctl, e.g. 1-1,
+                        or the bus number for a root hub.
+        port     (int): The port of the hub, starting at 1.
+    """
+
+    location: str
+    port: int
+
+
+def parse_hub_location(location: str) -> Tuple[int, Tuple[int, ...]]:
+    """Parse the location of a hub.
+
+    :param location: The location of the hub, e.g. 1-1.4, or the bus number
+    for a root hub.
+    :type location: str
+    :return: The bus number and the ports from the root hub to the hub.
+    :rtype: Tuple[int, Tuple[int, ...]]
+    :raises ValueError: If the location is malformed.
+    """
+    bus, _, devpath = location.partition("-")
+    return int(bus), parse_port_chain(devpath)
+
+
+def get_device_port(bus: int, port_chain: Sequence[int]) -> HubPort:
+    """Get the hub port a USB device is connected to.
+
+    :param bus: The USB bus number of the device.
+    :type bus: int
+    :param port_chain: The ports from the root hub to the device.
+    :type port_chain: Sequence[int]
+    :return: The port of the parent hub.
+    :rtype: HubPort
+    :raises ValueError: If the device is a root hub.
+    """
+    if not port_chain:
+        raise ValueError("A root hub is not connected to a port")
+    if len(port_chain) == 1:
+        return HubPort(str(bus), port_chain[0])
+    location = f"{bus}-{'.'.join(str(port) for port in port_chain[:-1])}"
+    return HubPort(location, port_chain[-1])
+
+
+def __get_port_chain(device: usb.core.Device) -> Tuple[int, ...]:
+    """Get the ports from the root hub to a device.
+
+    :param device: The USB device.
+    :type device: usb.core.Device
+    :return: The ports, empty for a root hub.
+    :rtype: Tuple[int, ...]
+    """
+    try:
+        return tuple(device.port_numbers or ())
+    except NotImplementedError:
+        # Backends without port information expose the port of the device only
+        return (device.port_number,) if device.port_number else ()
+
+
+def __find_devices(backend, **match: int) -> List[usb.core.Device]:
+    """Find all USB devices with matching descriptor fields.
+
+    :param backend: The pyusb backend to be used, the default one if None.
+    :param match: The values of the descriptor fields, e.g. idVendor.
+    :type match: int
+    :return: The matching devices.
+    :rtype: List[usb.core.Device]
+    :raises HubAccessError: If no USB backend like libusb is available.
+    """
+    import usb.core
+
+    try:
+        return list(usb.core.find(find_all=True, backend=backend, **match))
+    except usb.core.NoBackendError:
+        logger.error("No USB backend available, please install libusb.")
+        raise HubAccessError
+
+
+def find_hub(location: str, backend=None) -> usb.core.Device:
+    """Find the USB hub at a location.
+
+    :param location: The location of the hub, e.g. 1-1.4, or the bus number
+    for a root hub.
+    :type location: str
+    :param backend: The pyusb backend to be used, the default one if None.
+    :return: The hub.
+    :rtype: usb.core.Device
+    :raises HubNotFoundError: If there is no hub at the location.
+    :raises HubAccessError: If no USB backend is available.
+    """
+    bus, port_chain = parse_hub_location(location)
+    for hub in __find_devices(backend, bDeviceClass=HUB_DEVICE_CLASS):
+        if hub.bus == bus and __get_port_chain(hub) == port_chain:
+            return hub
+
+    logger.error(f"No USB hub found at {location}. Check the location with lsusb -t.")
+    raise HubNotFoundError
+
+
+def find_device_ports(device: Device, backend=None) -> List[HubPort]:
+    """Find the hub ports of all USB devices with a vendor and product ID.
+
+    :param device: The vendor and product ID of the devices.
+    :type device: Device
+    :param backend: The pyusb backend to be used, the default one if None.
+    :return: The ports the devices are connected to, sorted by location.
+    :rtype: List[HubPort]
+    :raises HubAccessError: If no USB backend is available.
+    """
+    ports = [
+        get_device_port(found.bus, __get_port_chain(found))
+        for found in __find_devices(
+            backend, idVendor=device.vendor_id, idProduct=device.product_id
+        )
+    ]
+    return sorted(ports)
+
+
+def find_port_of_device(bus: int, address: int, backend=None) -> HubPort | None:
+    """Find the hub port of the USB device with a bus and address.
+
+    :param bus: The USB bus number of the device.
+    :type bus: int
+    :param address: The address of the device on the bus.
+    :type address: int
+    :param backend: The pyusb backend to be used, the default one if None.
+    :return: The port the device is connected to, or None if it was not found.
+    :rtype: HubPort | None
+    :raises HubAccessError: If no USB backend is available.
+    """
+    for found in __find_devices(backend, bus=bus, address=address):
+        return get_device_port(found.bus, __get_port_chain(found))
+    return None
+
+
+def set_port_power(hub: usb.core.Device, port: int, power: bool) -> None:
+    """Switch the power of a hub port with a PORT_POWER feature request.
+
+    :param hub: The hub.
+    :type hub: usb.core.Device
+    :param port: The port of the hub, starting at 1.
+    :type port: int
+    :param power: Whether the port is powered on or off.
+    :type power: bool
+    :raises HubAccessError: If the hub rejected the request.
+    """
+    import usb.core
+
+    try:
+        hub.ctrl_transfer(
+            HUB_PORT_REQUEST_TYPE,
+            SET_FEATURE if power else CLEAR_FEATURE,
+            PORT_POWER,
+            port,
+            None,
+            CONTROL_TIMEOUT,
+        )
+    except usb.core.USBError as error:
+        location = get_device_port(hub.bus, __get_port_chain(hub) + (port,))
+        logger.error(
+            f"Could not switch port {port} of hub {location.location}"
+            + f" {'on' if power else 'off'}: {error}"
+        )
+        raise HubAccessError
+
+
+def find_companion_port(
+    port: HubPort, sysfs_root: Path = SYSFS_ROOT
+) -> HubPort | None:
+    """Find the port of the USB 3 companion hub sharing the power of a port.
+
+    A USB 3 hub enumerates as a USB 2 and a SuperSpeed hub, and a port only
+    loses its power once both of them switched it off. The kernel links the
+    two ports through the peer attribute of the port.
+
+    :param port: The port.
+    :type port: HubPort
+    :param sysfs_root: The root of the sysfs tree.
+    :type sysfs_root: Path
+    :return: The companion port, or None if the hub has no companion.
+    :rtype: HubPort | None
+    """
+    if "-" in port.location:
+        hub, interface = port.location, f"{port.location}:1.0"
+    else:
+        hub, interface = f"{ROOT_HUB_PREFIX}{port.location}", f"{port.location}-0:1.0"
+    peer = (
+        sysfs_root
+        / "bus"
+        / "usb"
+        / "devices"
+        / hub
+        / interface
+        / f"{hub}-port{port.port}"
+        / "peer"
+    )
+    try:
+        match = PORT_DIRECTORY_PATTERN.match(peer.resolve(strict=True).name)
+    except OSError:
+        return None
+    if match is None:
+        return None
+    return HubPort(match[1].removeprefix(ROOT_HUB_PREFIX), int(match[2]))
+
+
+def add_companion_ports(
+    ports: Sequence[HubPort], sysfs_root: Path = SYSFS_ROOT
+) -> List[HubPort]:
+    """Add the USB 3 companion ports to a set of ports, as uhubctl does.
+
+    :param ports: The ports.
+    :type ports: Sequence[HubPort]
+    :param sysfs_root: The root of the sysfs tree.
+    :type sysfs_root: Path
+    :return: The ports followed by their companion ports, without duplicates.
+    :rtype: List[HubPort]
+    """
+    companions = [find_companion_port(port, sysfs_root) for port in ports]
+    switched = list(dict.fromkeys(ports))
+    for companion in companions:
+        if companion is not None and companion not in switched:
+            logger.debug(
+                f"Switching the companion port {companion.port} of hub"
+                + f" {companion.location} as well"
+            )
+            switched.append(companion)
+    return switched
+
+
+def find_hubs(ports: Sequence[HubPort], backend=None) -> Dict[str, usb.core.Device]:
+    """Find the hubs of a set of ports.
+
+    :param ports: The ports.
+    :type ports: Sequence[HubPort]
+    :param backend: The pyusb backend to be used, the default one if None.
+    :return: The hub of every location.
+    :rtype: Dict[str, usb.core.Device]
+    :raises HubNotFoundError: If a hub does not exist.
+    :raises HubAccessError: If no USB backend is available.
+    """
+    return {
+        location: find_hub(location, backend)
+        for location in sorted({port.location for port in ports})
+    }
+
+
+def switch_ports_off(
+    hubs: Dict[str, usb.core.Device],
+    ports: Sequence[HubPort],
+    switched_off: List[HubPort],
+) -> None:
+    """Switch a set of ports off.
+
+    :param hubs: The hub of every location, from find_hubs.
+    :type hubs: Dict[str, usb.core.Device]
+    :param ports: The ports to be switched off.
+    :type ports: Sequence[HubPort]
+    :param switched_off: Receives every port that was switched off, so that
+    they can be switched on again if a later one fails.
+    :type switched_off: List[HubPort]
+    :raises HubAccessError: If a hub rejected a request.
+    """
+    for port in ports:
+        set_port_power(hubs[port.location], port.port, False)
+        switched_off.append(port)
+    logger.debug(f"Switched off {len(switched_off)} ports")
+
+
+def switch_ports_on(
+    hubs: Dict[str, usb.core.Device], ports: Sequence[HubPort]
+) -> None:
+    """Switch a set of ports on, trying every port even if one fails.
+
+    :param hubs: The hub of every location, from find_hubs.
+    :type hubs: Dict[str, usb.core.Device]
+    :param ports: The ports to be switched on.
+    :type ports: Sequence[HubPort]
+    :raises HubAccessError: If a hub rejected a request.
+    """
+    failed = False
+    for port in ports:
+        try:
+            set_port_power(hubs[port.location], port.port, True)
+        except HubAccessError:
+            failed = True
+    if failed:
+        raise HubAccessError
+
+
+def power_cycle_ports(
+    ports: Sequence[HubPort],
+    off_time: float = DEFAULT_POWER_OFF_TIME,
+    backend=None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> None:
+    """Power cycle a set of hub ports at once.
+
+    All ports are switched off, the off time is waited once, and all ports are
+    switched on again, so that cycling many ports costs a single off time.
+    Ports that were switched off are switched on again even if switching a
+    later one failed.
+
+    :param ports: The ports to be power cycled.
+    :type ports: Sequence[HubPort]
+    :param off_time: The time in seconds the ports stay unpowered.
+    :type off_time: float
+    :param backend: The pyusb backend to be used, the default one if None.
+    :param sleep: Waits for the given number of seconds.
+    :type sleep: Callable[[float], None]
+    :raises HubNotFoundError: If a hub does not exist.
+    :raises HubAccessError: If a hub rejected a request.
+    """
+    hubs = find_hubs(ports, backend)
+    switched_off: List[HubPort] = []
+    try:
+        switch_ports_off(hubs, ports, switched_off)
+        sleep(off_time)
+    finally:
+        switch_ports_on(hubs, switched_off)
+
+
+async def power_cycle_ports_async(
+    ports: Sequence[HubPort],
+    off_time: float = DEFAULT_POWER_OFF_TIME,
+    backend=None,
+    run_blocking: BlockingRunner = asyncio.to_thread,
+) -> None:
+    """Power cycle a set of hub ports at once without blocking the event loop.
+
+    The USB requests run through run_blocking, and the off time is awaited.
+    If the call is cancelled, the ports that were switched off are switched
+    on again before the cancellation propagates.
+
+    :param ports: The ports to be power cycled.
+    :type ports: Sequence[HubPort]
+    :param off_time: The time in seconds the ports stay unpowered.
+    :type off_time: float
+    :param backend: The pyusb backend to be used, the default one if None.
+    :param run_blocking: Runs the blocking USB requests, e.g. in a thread.
+    :type run_blocking: BlockingRunner
+    :raises HubNotFoundError: If a hub does not exist.
+    :raises HubAccessError: If a hub rejected a request.
+    """
+    hubs = await run_blocking(find_hubs, ports, backend)
+    switched_off: List[HubPort] = []
+    try:
+        await run_to_completion(
+            run_blocking(switch_ports_off, hubs, ports, switched_off)
+        )
+        await asyncio.sleep(off_time)
+    finally:
+        await run_to_completion(run_blocking(switch_ports_on, hubs, switched_off))
@@ -1,13 +1,48 @@
+import asyncio
 import subprocess
-import time
 import platform
 from shutil import which
+from typing import (
+    AsyncContextManager,
+    Callable,
+    ContextManager,
+    Dict,
+    List,
+    Sequence,
+)
 from loguru import logger
+from modules import metrics
+from modules.async_io import BlockingRunner
+from modules.board_state import forget_boards_at
+from modules.device_readiness import (
+    get_port_location,
+    monitor_device_events,
+    monitor_device_events_async,
+    wait_for_devices,
+    wait_for_devices_async,
+    AsyncEventPoller,
+    EventPoller,
+    DEFAULT_READY_TIMEOUT,
+)
+from modules.ftdi_access import parse_device_id
+from modules.usb_hub import (
+    add_companion_ports,
+    power_cycle_ports,
+    power_cycle_ports_async,
+    HubPort,
+    DEFAULT_POWER_OFF_TIME,
+)
+from modules.usb_topology import get_topology_index
+
+# Hub class requests sent through pyusb, or the external uhubctl program
+POWER_SWITCH_NATIVE = "native"
+POWER_SWITCH_UHUBCTL = "uhubctl"
+POWER_SWITCHES = [POWER_SWITCH_NATIVE, POWER_SWITCH_UHUBCTL]
 
 
 class OutDatedLinuxKernelVersionError(Exception):
-    """An exception to be thrown when the Linux kernel version is too old to be
-    used with uhubctl."""
+    """An exception to be thrown when the Linux kernel version is too old to
+    switch the power of USB ports reliably."""
 
 
 class OnlyLinuxSupportedError(Exception):
@@ -19,40 +54,297 @@ class ProgramNotInstalledError(Exception):
     """An exception to be thrown when a necessary program is not installed"""
 
 
-def power_cycle_usb_port(location: str, port: str) -> None:
-    """Power cycle the specified USB port at the specified location (USB hub).
+class PowerCycleFailedError(Exception):
+    """An exception to be thrown when uhubctl could not power cycle a port."""
 
-    :param location: The USB hub on which the port is located.
-    :type location: str
-    :param port: The port to be power cylced.
-    :type port: str
+
+def power_cycle_usb_ports(
+    ports: Sequence[HubPort],
+    device_id: str | None = None,
+    timeout: float = DEFAULT_READY_TIMEOUT,
+    wait_for_tty: bool = True,
+    power_switch: str = POWER_SWITCH_NATIVE,
+    off_time: float = DEFAULT_POWER_OFF_TIME,
+    monitor: Callable[[], ContextManager[EventPoller]] = monitor_device_events,
+) -> Dict[str, str | None]:
+    """Power cycle a set of USB ports and wait until their devices are back.
+
+    With the native power switch, all ports are switched off at once through
+    hub class requests, so that the off time is only waited once. Like with
+    uhubctl, the ports of USB 3 companion hubs are switched as well. Instead of
+    sleeping for a fixed time afterwards, the udev events are monitored until
+    the devices behind the ports have enumerated again.
+
+    :param ports: The ports to be power cycled.
+    :type ports: Sequence[HubPort]
+    :param device_id: The expected device ID of the devices, e.g. 0403:6014.
+    :type device_id: str | None
+    :param timeout: The maximum time in seconds to wait for the devices.
+    :type timeout: float
+    :param wait_for_tty: Wait until the tty nodes of the devices answer, else
+    only until the USB devices are back, e.g. for the ftdi transport.
+    :type wait_for_tty: bool
+    :param power_switch: Switch the ports natively or through uhubctl.
+    :type power_switch: str
+    :param off_time: The time in seconds the ports stay unpowered.
+    :type off_time: float
+    :param monitor: Opens the source of the device events.
+    :type monitor: Callable[[], ContextManager[EventPoller]]
+    :return: The tty node of the device behind every port, keyed by the
+    location of the device, or None if only the USB device was waited for.
+    :rtype: Dict[str, str | None]
+    :raises ValueError: If the power switch is unknown.
+    :raises HubNotFoundError: If a hub does not exist.
+    :raises HubAccessError: If a hub rejected a request.
+    :raises PowerCycleFailedError: If uhubctl failed.
+    :raises DeviceNotReadyError: If a device did not come back in time.
+    """
+    __check_power_switch(power_switch)
+    locations = [get_port_location(port.location, str(port.port)) for port in ports]
+    # The boards lose their configuration, so their records become invalid
+    forget_boards_at(locations)
+    for port in ports:
+        logger.info(f"Power cycling port {port.port} of hub {port.location}...")
+    # Listen before the cycle so that no event is missed
+    with monitor() as poll_event:
+        with metrics.span(metrics.SPAN_USB_POWER_CYCLE):
+            if power_switch == POWER_SWITCH_NATIVE:
+                sysfs_root = get_topology_index().sysfs_root
+                power_cycle_ports(add_companion_ports(ports, sysfs_root), off_time)
+            else:
+                for port in ports:
+                    __run_uhubctl(port, off_time)
+
+        with metrics.span(metrics.SPAN_USB_SETTLE):
+            device_nodes = wait_for_devices(
+                poll_event,
+                locations,
+                parse_device_id(device_id) if device_id else None,
+                timeout,
+                wait_for_tty,
+            )
+
+    # The devices re-enumerated with new addresses
+    get_topology_index().invalidate()
+    return device_nodes
+
+
+async def power_cycle_usb_ports_async(
+    ports: Sequence[HubPort],
+    device_id: str | None = None,
+    timeout: float = DEFAULT_READY_TIMEOUT,
+    wait_for_tty: bool = True,
+    power_switch: str = POWER_SWITCH_NATIVE,
+    off_time: float = DEFAULT_POWER_OFF_TIME,
+    run_blocking: BlockingRunner = asyncio.to_thread,
+    monitor: Callable[
+        [], AsyncContextManager[AsyncEventPoller]
+    ] = monitor_device_events_async,
+) -> Dict[str, str | None]:
+    """Power cycle a set of USB ports and wait until their devices are back,
+    without blocking the event loop.
+
+    The off time and the udev events are awaited, and the USB requests run
+    through run_blocking. With uhubctl, the ports are cycled concurrently.
+
+    :param ports: The ports to be power cycled.
+    :type ports: Sequence[HubPort]
+    :param device_id: The expected device ID of the devices, e.g. 0403:6014.
+    :type device_id: str | None
+    :param timeout: The maximum time in seconds to wait for the devices.
+    :type timeout: float
+    :param wait_for_tty: Wait until the tty nodes of the devices answer, else
+    only until the USB devices are back, e.g. for the ftdi transport.
+    :type wait_for_tty: bool
+    :param power_switch: Switch the ports natively or through uhubctl.
+    :type power_switch: str
+    :param off_time: The time in seconds the ports stay unpowered.
+    :type off_time: float
+    :param run_blocking: Runs the blocking USB requests, e.g. in a thread.
+    :type run_blocking: BlockingRunner
+    :param monitor: Opens the source of the device events.
+    :type monitor: Callable[[], AsyncContextManager[AsyncEventPoller]]
+    :return: The tty node of the device behind every port, keyed by the
+    location of the device, or None if only the USB device was waited for.
+    :rtype: Dict[str, str | None]
+    :raises ValueError: If the power switch is unknown.
+    :raises HubNotFoundError: If a hub does not exist.
+    :raises HubAccessError: If a hub rejected a request.
+    :raises PowerCycleFailedError: If uhubctl failed.
+    :raises DeviceNotReadyError: If a device did not come back in time.
     """
-    if which("uhubctl") is not None:
-        # Check if the system is Linux
-        if platform.system() == "Linux":
-            if __check_linux_kernel_version_is_at_least_6():
-                logger.info(f"Power cycling port {port} of hub {location}...")
-                subprocess.run(
-                    ["uhubctl", "-l", location, "-a", "cycle", "-p", port],
-                    stdout=subprocess.DEVNULL,
+    __check_power_switch(power_switch)
+    locations = [get_port_location(port.location, str(port.port)) for port in ports]
+    # The boards lose their configuration, so their records become invalid
+    forget_boards_at(locations)
+    for port in ports:
+        logger.info(f"Power cycling port {port.port} of hub {port.location}...")
+    # Listen before the cycle so that no event is missed
+    async with monitor() as poll_event:
+        with metrics.span(metrics.SPAN_USB_POWER_CYCLE):
+            if power_switch == POWER_SWITCH_NATIVE:
+                sysfs_root = get_topology_index().sysfs_root
+                await power_cycle_ports_async(
+                    add_companion_ports(ports, sysfs_root),
+                    off_time,
+                    run_blocking=run_blocking,
                 )
-                time.sleep(5)
             else:
-                logger.error(
-                    "USB port power switching is working reliably only"
-                    + " with version 6.0 or later."
+                await asyncio.gather(
+                    *(__run_uhubctl_async(port, off_time) for port in ports)
                 )
 
-                logger.warning(f"You are running {platform.release()}.")
-                logger.warning(
-                    "Either switch to a newer kernel or power cycle the device"
-                    + " manually."
-                )
-                raise OutDatedLinuxKernelVersionError
-        else:
-            logger.error("USB port power switching is only supported on Linux.")
-            raise OnlyLinuxSupportedError
-    else:
+        with metrics.span(metrics.SPAN_USB_SETTLE):
+            device_nodes = await wait_for_devices_async(
+                poll_event,
+                locations,
+                parse_device_id(device_id) if device_id else None,
+                timeout,
+                wait_for_tty,
+            )
+
+    get_topology_index().invalidate()
+    return device_nodes
+
+
+def power_cycle_usb_port(
+    location: str,
+    port: int,
+    device_id: str | None = None,
+    timeout: float = DEFAULT_READY_TIMEOUT,
+    wait_for_tty: bool = True,
+    power_switch: str = POWER_SWITCH_NATIVE,
+    monitor: Callable[[], ContextManager[EventPoller]] = monitor_device_events,
+) -> str | None:
+    """Power cycle the specified USB port at the specified location (USB hub)
+    and wait until its device is back.
+
+    :param location: The USB hub on which the port is located.
+    :type location: str
+    :param port: The port to be power cylced.
+    :type port: int
+    :param device_id: The expected device ID of the device, e.g. 0403:6014.
+    :type device_id: str | None
+    :param timeout: The maximum time in seconds to wait for the device.
+    :type timeout: float
+    :param wait_for_tty: Wait until the tty node of the device answers, else
+    only until the USB device is back, e.g. for the ftdi transport.
+    :type wait_for_tty: bool
+    :param power_switch: Switch the port natively or through uhubctl.
+    :type power_switch: str
+    :param monitor: Opens the source of the device events.
+    :type monitor: Callable[[], ContextManager[EventPoller]]
+    :return: The tty node of the device, or None if only the USB device was
+    waited for.
+    :rtype: str | None
+    """
+    device_nodes = power_cycle_usb_ports(
+        [HubPort(location, int(port))],
+        device_id,
+        timeout,
+        wait_for_tty,
+        power_switch,
+        monitor=monitor,
+    )
+    return next(iter(device_nodes.values()))
+
+
+def __get_uhubctl_command(port: HubPort, off_time: float) -> List[str]:
+    """Get the uhubctl command power cycling a single port.
+
+    :param port: The port to be power cycled.
+    :type port: HubPort
+    :param off_time: The time in seconds the port stays unpowered.
+    :type off_time: float
+    :return: The command line.
+    :rtype: List[str]
+    """
+    return [
+        "uhubctl",
+        "-l",
+        port.location,
+        "-a",
+        "cycle",
+        "-d",
+        f"{off_time:g}",
+        "-p",
+        str(port.port),
+    ]
+
+
+def __check_uhubctl_result(port: HubPort, returncode: int, stderr: str) -> None:
+    """Check whether uhubctl power cycled a port.
+
+    :param port: The port that was power cycled.
+    :type port: HubPort
+    :param returncode: The exit status of uhubctl.
+    :type returncode: int
+    :param stderr: The error output of uhubctl.
+    :type stderr: str
+    :raises PowerCycleFailedError: If uhubctl failed.
+    """
+    if returncode != 0:
+        logger.error(
+            f"uhubctl failed to power cycle port {port.port} of hub"
+            + f" {port.location}: {stderr.strip()}"
+        )
+        raise PowerCycleFailedError
+
+
+def __run_uhubctl(port: HubPort, off_time: float) -> None:
+    """Power cycle a single port using uhubctl.
+
+    :param port: The port to be power cycled.
+    :type port: HubPort
+    :param off_time: The time in seconds the port stays unpowered.
+    :type off_time: float
+    :raises PowerCycleFailedError: If uhubctl failed.
+    """
+    result = subprocess.run(
+        __get_uhubctl_command(port, off_time),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    __check_uhubctl_result(port, result.returncode, result.stderr)
+
+
+async def __run_uhubctl_async(port: HubPort, off_time: float) -> None:
+    """Power cycle a single port using uhubctl, awaiting its exit.
+
+    :param port: The port to be power cycled.
+    :type port: HubPort
+    :param off_time: The time in seconds the port stays unpowered.
+    :type off_time: float
+    :raises PowerCycleFailedError: If uhubctl failed.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *__get_uhubctl_command(port, off_time),
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    try:
+        _, stderr = await process.communicate()
+    except asyncio.CancelledError:
+        # Terminating uhubctl could leave the port switched off
+        await process.wait()
+        raise
+    __check_uhubctl_result(port, process.returncode, stderr.decode(errors="replace"))
+
+
+def __check_power_switch(power_switch: str) -> None:
+    """Check that a power switch can be used on this system.
+
+    :param power_switch: The power switch, one of POWER_SWITCHES.
+    :type power_switch: str
+    :raises ValueError: If the power switch is unknown.
+    :raises ProgramNotInstalledError: If uhubctl is not installed.
+    :raises OnlyLinuxSupportedError: If the system is not Linux.
+    :raises OutDatedLinuxKernelVersionError: If the kernel is older than 6.0.
+    """
+    if power_switch not in POWER_SWITCHES:
+        raise ValueError(f"Unknown power switch {power_switch}")
+    if power_switch == POWER_SWITCH_UHUBCTL and which("uhubctl") is None:
         logger.error(
             f"""The program uhubctl is not installed.
 
@@ -61,6 +353,30 @@ def power_cycle_usb_port(location: str, port: str) -> None:
         """
         )
         raise ProgramNotInstalledError
+    __check_platform()
+
+
+def __check_platform() -> None:
+    """Check that USB ports can be power switched reliably on this system.
+
+    :raises OnlyLinuxSupportedError: If the system is not Linux.
+    :raises OutDatedLinuxKernelVersionError: If the kernel is older than 6.0.
+    """
+    if platform.system() != "Linux":
+        logger.error("USB port power switching is only supported on Linux.")
+        raise OnlyLinuxSupportedError
+
+    if not __check_linux_kernel_version_is_at_least_6():
+        logger.error(
+            "USB port power switching is working reliably only"
+            + " with version 6.0 or later."
+        )
+
+        logger.warning(f"You are running {platform.release()}.")
+        logger.warning(
+            "Either switch to a newer kernel or power cycle the device manually."
+        )
+        raise OutDatedLinuxKernelVersionError
 
 
 def __check_linux_kernel_version_is_at_least_6() -> bool:
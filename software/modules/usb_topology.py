@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+
+# pyudev is only needed for monitoring and imported on first use
+from __future__ import annotations
+
+import threading
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Sequence, Tuple, TYPE_CHECKING
+from loguru import logger
+
+if TYPE_CHECKING:
+    import pyudev
+
+SYSFS_ROOT = Path("/sys")
+DEV_ROOT = Path("/dev")
+
+MONITORED_SUBSYSTEMS = ["usb", "tty"]
+
+
+class TtyEntry(NamedTuple):
+    """Defines a tty node provided by a USB device.
+
+    Attributes:
+        device_node (str): The path of the tty node, e.g. /dev/ttyUSB0.
+        bus         (int): The USB bus number.
+        port_chain  (Tuple[int, ...]): The ports from the root hub to the
+                                       device, one per hub level.
+        devnum      (int): The dynamic device number on the bus.
+        serial      (str | None): The serial number of the device.
+    """
+
+    device_node: str
+    bus: int
+    port_chain: Tuple[int, ...]
+    devnum: int
+    serial: str | None
+
+    @property
+    def location(self) -> str:
+        """The location of the device as used by sysfs and uhubctl, e.g.
+        1-1.4.2."""
+        return f"{self.bus}-{'.'.join(str(port) for port in self.port_chain)}"
+
+
+def parse_port_chain(devpath: str) -> Tuple[int, ...]:
+    """Parse the port chain of a USB device.
+
+    :param devpath: The devpath attribute of the device, e.g. 1.4.2.
+    :type devpath: str
+    :return: The ports from the root hub to the device.
+    :rtype: Tuple[int, ...]
+    """
+    return tuple(int(port) for port in devpath.split(".") if port)
+
+
+def __read_attribute(path: Path) -> str | None:
+    """Read a sysfs attribute.
+
+    :param path: The path of the attribute.
+    :type path: Path
+    :return: The stripped value, or None if the attribute does not exist.
+    :rtype: str | None
+    """
+    try:
+        return path.read_text().strip()
+    except OSError:
+        return None
+
+
+def read_device_attribute(
+    location: str, attribute: str, sysfs_root: Path = SYSFS_ROOT
+) -> str | None:
+    """Read a sysfs attribute of the USB device at a location.
+
+    :param location: The location of the USB device, e.g. 1-1.2.
+    :type location: str
+    :param attribute: The name of the attribute, e.g. serial.
+    :type attribute: str
+    :param sysfs_root: The root of the sysfs tree.
+    :type sysfs_root: Path
+    :return: The stripped value, or None if the device or attribute does not
+    exist.
+    :rtype: str | None
+    """
+    device_directory = sysfs_root / "bus" / "usb" / "devices" / location
+    return __read_attribute(device_directory / attribute)
+
+
+def list_devices_behind(
+    locations: Sequence[str], sysfs_root: Path = SYSFS_ROOT
+) -> List[str]:
+    """List the USB devices at a set of locations and the devices connected
+    behind them, e.g. through a hub.
+
+    :param locations: The locations of the USB devices, e.g. 1-1.2.
+    :type locations: Sequence[str]
+    :param sysfs_root: The root of the sysfs tree.
+    :type sysfs_root: Path
+    :return: The locations of the devices that exist, sorted.
+    :rtype: List[str]
+    """
+    try:
+        names = [
+            path.name for path in (sysfs_root / "bus" / "usb" / "devices").iterdir()
+        ]
+    except OSError:
+        return []
+    # Interfaces are named after their device, followed by a colon
+    return sorted(
+        name
+        for name in names
+        if ":" not in name
+        and any(
+            name == location or name.startswith(f"{location}.")
+            for location in locations
+        )
+    )
+
+
+def __find_usb_device_directory(device_directory: Path, sysfs_root: Path) -> Path | None:
+    """Find the USB device a sysfs device belongs to by walking up the tree.
+
+    This handles arbitrarily deep hub chains, since the USB device is always
+    the closest ancestor with a device number.
+
+    :param device_directory: The directory of the sysfs device.
+    :type device_directory: Path
+    :param sysfs_root: The root of the sysfs tree.
+    :type sysfs_root: Path
+    :return: The directory of the USB device, or None if it is not a USB
+    device.
+    :rtype: Path | None
+    """
+    directory = device_directory
+    while directory != sysfs_root and directory != directory.parent:
+        if (directory / "devnum").is_file() and (directory / "busnum").is_file():
+            return directory
+        directory = directory.parent
+    return None
+
+
+def scan_tty_devices(
+    sysfs_root: Path = SYSFS_ROOT, dev_root: Path = DEV_ROOT
+) -> List[TtyEntry]:
+    """Scan all tty nodes provided by USB devices in a single pass.
+
+    :param sysfs_root: The root of the sysfs tree.
+    :type sysfs_root: Path
+    :param dev_root: The directory containing the device nodes.
+    :type dev_root: Path
+    :return: The tty nodes sorted by name.
+    :rtype: List[TtyEntry]
+    """
+    entries = []
+    tty_class = sysfs_root / "class" / "tty"
+    if not tty_class.is_dir():
+        return entries
+
+    sysfs_root = sysfs_root.resolve()
+    for tty in sorted(tty_class.iterdir()):
+        device_link = tty / "device"
+        if not device_link.exists():
+            # Virtual terminals have no parent device
+            continue
+
+        usb_device = __find_usb_device_directory(device_link.resolve(), sysfs_root)
+        if usb_device is None:
+            continue
+
+        busnum = __read_attribute(usb_device / "busnum")
+        devnum = __read_attribute(usb_device / "devnum")
+        devpath = __read_attribute(usb_device / "devpath")
+        if busnum is None or devnum is None or devpath is None:
+            continue
+
+        entries.append(
+            TtyEntry(
+                str(dev_root / tty.name),
+                int(busnum),
+                parse_port_chain(devpath),
+                int(devnum),
+                __read_attribute(usb_device / "serial"),
+            )
+        )
+    return entries
+
+
+class TopologySnapshot(NamedTuple):
+    """Defines the state of the index built in one pass, it is never modified
+    once built.
+
+    Attributes:
+        entries     (Tuple[TtyEntry, ...]): All tty nodes sorted by name.
+        by_address  (Dict): The tty nodes by bus and device number.
+        by_location (Dict): The tty nodes by bus and port chain.
+        by_serial   (Dict): The tty nodes by serial number.
+    """
+
+    entries: Tuple[TtyEntry, ...]
+    by_address: Dict[Tuple[int, int], TtyEntry]
+    by_location: Dict[Tuple[int, Tuple[int, ...]], TtyEntry]
+    by_serial: Dict[str, TtyEntry]
+
+
+class UsbTopologyIndex:
+    """An index of the tty nodes of all USB devices.
+
+    The index is built in a single pass over sysfs on first use. It is kept
+    until it is invalidated, either explicitly or by a udev monitor reporting
+    a change of a USB or tty device.
+    """
+
+    def __init__(self, sysfs_root: Path = SYSFS_ROOT, dev_root: Path = DEV_ROOT):
+        """Create an empty index.
+
+        :param sysfs_root: The root of the sysfs tree.
+        :type sysfs_root: Path
+        :param dev_root: The directory containing the device nodes.
+        :type dev_root: Path
+        """
+        self.sysfs_root = Path(sysfs_root)
+        self.dev_root = Path(dev_root)
+        self.__lock = threading.Lock()
+        self.__snapshot: TopologySnapshot | None = None
+        self.__observer = None
+
+    def __ensure_built(self) -> TopologySnapshot:
+        """Build the index if it is not valid.
+
+        The lookups only read from the returned snapshot, so an invalidation
+        by the monitor thread never affects a lookup in progress.
+
+        :return: The current state of the index.
+        :rtype: TopologySnapshot
+        """
+        with self.__lock:
+            if self.__snapshot is not None:
+                return self.__snapshot
+
+            entries = scan_tty_devices(self.sysfs_root, self.dev_root)
+            by_address = {}
+            by_location = {}
+            by_serial = {}
+            # Devices with multiple interfaces are indexed by their first tty
+            for entry in reversed(entries):
+                by_address[(entry.bus, entry.devnum)] = entry
+                by_location[(entry.bus, entry.port_chain)] = entry
+                if entry.serial:
+                    by_serial[entry.serial] = entry
+
+            self.__snapshot = TopologySnapshot(
+                tuple(entries), by_address, by_location, by_serial
+            )
+            logger.debug(f"Indexed {len(entries)} USB tty devices")
+            return self.__snapshot
+
+    def invalidate(self) -> None:
+        """Invalidate the index, it is rebuilt on the next lookup."""
+        with self.__lock:
+            self.__snapshot = None
+
+    @property
+    def entries(self) -> List[TtyEntry]:
+        """All indexed tty nodes."""
+        return list(self.__ensure_built().entries)
+
+    def find_by_address(self, bus: int | None, devnum: int) -> TtyEntry | None:
+        """Find the tty node of a USB device by its address.
+
+        :param bus: The USB bus number. If not given, the first device with
+        the device number on any bus is returned.
+        :type bus: int | None
+        :param devnum: The dynamic device number.
+        :type devnum: int
+        :return: The tty node, or None if not found.
+        :rtype: TtyEntry | None
+        """
+        snapshot = self.__ensure_built()
+        if bus is not None:
+            return snapshot.by_address.get((bus, devnum))
+        for entry in snapshot.entries:
+            if entry.devnum == devnum:
+                return entry
+        return None
+
+    def find_by_location(self, bus: int, port_chain: Tuple[int, ...]) -> TtyEntry | None:
+        """Find the tty node of a USB device by its position in the hub tree.
+
+        :param bus: The USB bus number.
+        :type bus: int
+        :param port_chain: The ports from the root hub to the device.
+        :type port_chain: Tuple[int, ...]
+        :return: The tty node, or None if not found.
+        :rtype: TtyEntry | None
+        """
+        return self.__ensure_built().by_location.get((bus, tuple(port_chain)))
+
+    def find_by_serial(self, serial: str) -> TtyEntry | None:
+        """Find the tty node of a USB device by its serial number.
+
+        :param serial: The serial number of the device.
+        :type serial: str
+        :return: The tty node, or None if not found.
+        :rtype: TtyEntry | None
+        """
+        return self.__ensure_built().by_serial.get(serial)
+
+    def start_monitoring(self, context: pyudev.Context | None = None) -> None:
+        """Keep the index fresh by invalidating it on udev events.
+
+        :param context: The udev context to be used.
+        :type context: pyudev.Context | None
+        """
+        if self.__observer is not None:
+            return
+
+        import pyudev
+
+        monitor = pyudev.Monitor.from_netlink(context or pyudev.Context())
+        for subsystem in MONITORED_SUBSYSTEMS:
+            monitor.filter_by(subsystem)
+
+        self.__observer = pyudev.MonitorObserver(
+            monitor, callback=lambda device: self.invalidate(), name="usb-topology"
+        )
+        self.__observer.start()
+
+    def stop_monitoring(self) -> None:
+        """Stop invalidating the index on udev events."""
+        if self.__observer is not None:
+            self.__observer.stop()
+            self.__observer = None
+
+
+__index = None
+__index_lock = threading.Lock()
+
+
+def get_topology_index() -> UsbTopologyIndex:
+    """Get the topology index shared by the whole process.
+
+    :return: The shared topology index.
+    :rtype: UsbTopologyIndex
+    """
+    global __index
+    with __index_lock:
+        if __index is None:
+            __index = UsbTopologyIndex()
+        return __index
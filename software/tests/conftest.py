@@ -0,0 +1,99 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+from typing import Tuple
+import pytest
+
+SOFTWARE_DIRECTORY = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(SOFTWARE_DIRECTORY))
+
+# The project modules resolve the board state and the caches on import, so the
+# tests get their own cache directory before any of them is imported
+CACHE_DIRECTORY = tempfile.TemporaryDirectory(prefix="fabulous_tests_")
+os.environ["XDG_CACHE_HOME"] = CACHE_DIRECTORY.name
+
+
+class FakeSysfs:
+    """A sysfs and dev tree with USB devices added on demand.
+
+    Attributes:
+        sysfs_root (Path): The root of the sysfs tree.
+        dev_root   (Path): The directory of the device nodes.
+    """
+
+    def __init__(self, root: Path):
+        self.sysfs_root = root / "sys"
+        self.dev_root = root / "dev"
+        self.__usb = self.sysfs_root / "devices" / "pci0000:00" / "0000:00:14.0"
+        (self.sysfs_root / "class" / "tty").mkdir(parents=True)
+        (self.sysfs_root / "bus" / "usb" / "devices").mkdir(parents=True)
+        self.dev_root.mkdir()
+
+    def __get_directory(self, bus: int, port_chain: Tuple[int, ...]) -> Path:
+        directory = self.__usb / f"usb{bus}"
+        for depth in range(1, len(port_chain) + 1):
+            chain = ".".join(str(port) for port in port_chain[:depth])
+            directory = directory / f"{bus}-{chain}"
+        return directory
+
+    def add_device(
+        self,
+        bus: int,
+        port_chain: Tuple[int, ...],
+        devnum: int,
+        serial: str | None = None,
+    ) -> Path:
+        """Add a USB device, e.g. a hub, below its parent hub.
+
+        :return: The directory of the device.
+        """
+        directory = self.__get_directory(bus, port_chain)
+        directory.mkdir(parents=True)
+        devpath = ".".join(str(port) for port in port_chain) or "0"
+        (directory / "busnum").write_text(f"{bus}\n")
+        (directory / "devnum").write_text(f"{devnum}\n")
+        (directory / "devpath").write_text(f"{devpath}\n")
+        if serial is not None:
+            (directory / "serial").write_text(f"{serial}\n")
+        location = f"{bus}-{devpath}" if port_chain else f"usb{bus}"
+        (self.sysfs_root / "bus" / "usb" / "devices" / location).symlink_to(
+            directory
+        )
+        return directory
+
+    def add_peer_ports(self, first: Path, second: Path, port: int) -> None:
+        """Link a port of a USB 2 hub to the port of its USB 3 companion hub."""
+        directories = []
+        for hub in [first, second]:
+            if "-" in hub.name:
+                interface = f"{hub.name}:1.0"
+            else:
+                interface = f"{hub.name.removeprefix('usb')}-0:1.0"
+            directory = hub / interface / f"{hub.name}-port{port}"
+            directory.mkdir(parents=True)
+            directories.append(directory)
+        (directories[0] / "peer").symlink_to(directories[1])
+        (directories[1] / "peer").symlink_to(directories[0])
+
+    def add_tty(self, device: Path, name: str, interface: int = 0) -> None:
+        """Add a tty node provided by an interface of a USB device."""
+        interface_directory = device / f"{device.name}:1.{interface}" / name
+        tty_directory = interface_directory / "tty" / name
+        tty_directory.mkdir(parents=True)
+        (tty_directory / "device").symlink_to(interface_directory)
+        (self.sysfs_root / "class" / "tty" / name).symlink_to(tty_directory)
+
+    def add_virtual_tty(self, name: str) -> None:
+        """Add a tty node without a parent device, like a virtual console."""
+        tty_directory = self.sysfs_root / "devices" / "virtual" / "tty" / name
+        tty_directory.mkdir(parents=True)
+        (self.sysfs_root / "class" / "tty" / name).symlink_to(tty_directory)
+
+
+@pytest.fixture
+def fake_sysfs(tmp_path: Path) -> FakeSysfs:
+    """An empty fake sysfs tree with a root hub on bus 1."""
+    sysfs = FakeSysfs(tmp_path)
+    sysfs.add_device(1, (), 1)
+    return sysfs
@@ -0,0 +1,76 @@
+import pytest
+from modules.bitstream import (
+    Bitstream,
+    FABRICS_DIRECTORY,
+    FabricGeometry,
+    FRAME_ADDRESS_COLUMN_SHIFT,
+    get_fabric_geometry,
+    HEADER_MAGIC,
+    HEADER_SIZE,
+    InvalidBitstreamError,
+    PREAMBLE_SIZE,
+    SYNC_WORD,
+)
+
+PREAMBLE = HEADER_MAGIC + bytes(HEADER_SIZE - len(HEADER_MAGIC)) + SYNC_WORD
+
+
+def build_bitstream(geometry, fill=lambda column, frame: 0):
+    data = bytearray(PREAMBLE)
+    for column in range(geometry.columns):
+        for frame in range(geometry.max_frames_per_column):
+            address = column << FRAME_ADDRESS_COLUMN_SHIFT | 1 << frame
+            data += address.to_bytes(4, "big")
+            data += bytes([fill(column, frame)]) * geometry.frame_size
+    return data
+
+
+def test_frames_are_indexed():
+    geometry = FabricGeometry(3, 2)
+    data = build_bitstream(geometry, lambda column, frame: column * 20 + frame)
+
+    with Bitstream(memoryview(data)) as bitstream:
+        assert bitstream.layout.record_size == geometry.record_size
+        assert bitstream.layout.record_count == geometry.frame_count
+        assert bitstream.get_frame_data(2, 5) == bytes([45]) * geometry.frame_size
+        assert bitstream.get_record_index(1, 0) == 20
+
+
+@pytest.mark.parametrize("offset", [0, HEADER_SIZE], ids=["magic", "sync word"])
+def test_invalid_preamble_is_rejected(offset):
+    data = build_bitstream(FabricGeometry(2, 2))
+    data[offset] ^= 0xFF
+
+    with pytest.raises(InvalidBitstreamError):
+        Bitstream(memoryview(data))
+
+
+def test_truncated_bitstream_is_rejected():
+    with pytest.raises(InvalidBitstreamError):
+        Bitstream(memoryview(PREAMBLE[: PREAMBLE_SIZE - 1]))
+
+
+@pytest.mark.parametrize("fabric", ["mpw2", "mpw5"])
+def test_shipped_bitstreams_match_their_fabric(fabric):
+    geometry = get_fabric_geometry(fabric)
+    bitstream_file = FABRICS_DIRECTORY / fabric / f"{fabric}.bin"
+
+    with Bitstream.open(bitstream_file, geometry) as bitstream:
+        assert bitstream.layout.record_size == geometry.record_size
+        assert bitstream.layout.record_count == geometry.frame_count
+
+
+@pytest.mark.parametrize("fabric, other", [("mpw2", "mpw5"), ("mpw5", "mpw2")])
+def test_bitstream_of_another_fabric_is_rejected(fabric, other):
+    bitstream_file = FABRICS_DIRECTORY / fabric / f"{fabric}.bin"
+
+    with pytest.raises(InvalidBitstreamError):
+        Bitstream.open(bitstream_file, get_fabric_geometry(other))
+
+
+def test_missing_columns_do_not_match_the_geometry():
+    geometry = get_fabric_geometry("mpw5")
+    data = build_bitstream(geometry._replace(columns=geometry.columns - 1))
+
+    with pytest.raises(InvalidBitstreamError):
+        Bitstream(memoryview(data), geometry)
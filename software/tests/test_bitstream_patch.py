@@ -0,0 +1,104 @@
+import pytest
+from modules.bitstream import (
+    FabricGeometry,
+    FRAME_ADDRESS_COLUMN_SHIFT,
+    FRAME_ADDRESS_SIZE,
+    HEADER_MAGIC,
+    HEADER_SIZE,
+    PREAMBLE_SIZE,
+    SYNC_WORD,
+)
+from modules.bitstream_patch import (
+    check_edit,
+    FrameEdit,
+    InvalidPatchError,
+    parse_edit,
+    patch_bitstreams,
+    PatchedBitstream,
+    PatchSet,
+)
+
+GEOMETRY = FabricGeometry(columns=3, rows=4)
+
+
+@pytest.fixture
+def base_file(tmp_path):
+    data = bytearray(HEADER_MAGIC + bytes(HEADER_SIZE - len(HEADER_MAGIC)))
+    data += SYNC_WORD
+    for column in range(GEOMETRY.columns):
+        for frame in range(GEOMETRY.max_frames_per_column):
+            address = column << FRAME_ADDRESS_COLUMN_SHIFT | 1 << frame
+            data += address.to_bytes(FRAME_ADDRESS_SIZE, "big")
+            data += bytes(range(GEOMETRY.frame_size))
+    base_file = tmp_path / "base.bin"
+    base_file.write_bytes(data)
+    return base_file
+
+
+def get_record_offset(column, frame):
+    index = column * GEOMETRY.max_frames_per_column + frame
+    return PREAMBLE_SIZE + index * GEOMETRY.record_size
+
+
+def test_edit_is_parsed():
+    assert parse_edit("1,3,0,15:0,0xBEEF") == FrameEdit(1, 3, 0, 0, 15, 0xBEEF)
+    assert parse_edit("0,1,2,7,1") == FrameEdit(0, 1, 2, 7, 7, 1)
+    with pytest.raises(ValueError):
+        parse_edit("1,3,0,0:15,1")
+
+
+def test_edit_outside_of_the_fabric_is_rejected():
+    with pytest.raises(InvalidPatchError):
+        check_edit(FrameEdit(0, GEOMETRY.rows + 1, 0, 0, 0, 1), GEOMETRY)
+    with pytest.raises(InvalidPatchError):
+        check_edit(FrameEdit(0, 1, 0, 0, 3, 16), GEOMETRY)
+
+
+def test_edit_sets_the_bits_of_the_row_word(base_file):
+    with PatchedBitstream(base_file, GEOMETRY) as patched:
+        patched.apply([FrameEdit(2, 3, 5, 4, 11, 0xA5)])
+        data = bytes(patched.data)
+
+    base = base_file.read_bytes()
+    # The word of row 3 holds the bytes 8 to 11 of the frame, bit 0 being
+    # the least significant bit of the big-endian word
+    offset = get_record_offset(2, 5) + FRAME_ADDRESS_SIZE + 8
+    word = int.from_bytes(base[offset : offset + 4], "big")
+    word = word & ~0xFF0 | 0xA5 << 4
+    assert data[offset : offset + 4] == word.to_bytes(4, "big")
+    assert data[:offset] == base[:offset]
+    assert data[offset + 4 :] == base[offset + 4 :]
+
+
+def test_touched_stream_contains_only_the_edited_frames(base_file):
+    with PatchedBitstream(base_file, GEOMETRY) as patched:
+        patched.apply([FrameEdit(1, 1, 7, 0, 0, 1), FrameEdit(0, 4, 2, 31, 31, 1)])
+        stream = patched.build_touched_stream()
+        data = bytes(patched.data)
+
+    records = [get_record_offset(0, 2), get_record_offset(1, 7)]
+    expected = data[:PREAMBLE_SIZE] + b"".join(
+        data[offset : offset + GEOMETRY.record_size] for offset in records
+    )
+    assert stream == expected
+
+
+def test_base_file_is_not_modified(base_file):
+    base = base_file.read_bytes()
+    patch_sets = [
+        PatchSet("first", [FrameEdit(0, 1, 0, 0, 31, 0xFFFFFFFF)]),
+        PatchSet("second", [FrameEdit(1, 2, 3, 0, 7, 0)]),
+    ]
+
+    first = get_record_offset(0, 0)
+    for patch_set, patched in patch_bitstreams(base_file, patch_sets, GEOMETRY):
+        data = bytes(patched.data)
+        assert len(patched.touched) == 1
+        assert data != base
+        if patch_set.name == "second":
+            # Every patch set starts from the base
+            assert data[first : first + GEOMETRY.record_size] == (
+                base[first : first + GEOMETRY.record_size]
+            )
+
+    assert base_file.read_bytes() == base
@@ -0,0 +1,69 @@
+from fractions import Fraction
+from pyftdi.ftdi import UsbDeviceDescriptor
+from board import get_fabric_clock, setup_parser
+from modules.board_daemon import DEFAULT_SOCKET_PATH
+from modules.board_state import store_fabric_clock
+from modules.metrics import DEFAULT_METRICS_DIRECTORY
+
+
+def parse(monkeypatch, *arguments):
+    monkeypatch.setattr("sys.argv", ["board.py", *arguments])
+    return setup_parser()
+
+
+def test_daemon_forwarding_keeps_the_command(monkeypatch):
+    args = parse(
+        monkeypatch, "--daemon", "upload", "bitstream.bin", "--port", "loop://"
+    )
+
+    assert args.daemon
+    assert args.socket == DEFAULT_SOCKET_PATH
+    assert args.command == "upload"
+    assert args.bitstream_file == "bitstream.bin"
+
+
+def test_daemon_socket_is_given_separately(monkeypatch):
+    args = parse(monkeypatch, "-D", "--socket", "/tmp/board.sock", "upload", "x.bin")
+
+    assert args.daemon
+    assert args.socket == "/tmp/board.sock"
+    assert args.bitstream_file == "x.bin"
+
+
+def test_serve_listens_on_the_given_socket(monkeypatch):
+    args = parse(monkeypatch, "--socket", "/tmp/board.sock", "serve")
+
+    assert not args.daemon
+    assert args.socket == "/tmp/board.sock"
+
+
+def test_metrics_flag_keeps_the_command(monkeypatch):
+    args = parse(monkeypatch, "--metrics", "upload", "x.bin")
+
+    assert args.metrics
+    assert args.metrics_directory == str(DEFAULT_METRICS_DIRECTORY)
+    assert args.bitstream_file == "x.bin"
+
+
+def test_metrics_directory_is_given_separately(monkeypatch):
+    args = parse(
+        monkeypatch, "-m", "--metrics_directory", "/tmp/metrics", "upload", "x.bin"
+    )
+
+    assert args.metrics
+    assert args.metrics_directory == "/tmp/metrics"
+    assert args.bitstream_file == "x.bin"
+
+
+def test_upload_reuses_the_resolved_devices(monkeypatch):
+    def find_devices_matching_id(device_id):
+        raise AssertionError("The devices must not be enumerated again")
+
+    monkeypatch.setattr(
+        "modules.ftdi_access.find_devices_matching_id", find_devices_matching_id
+    )
+    device = UsbDeviceDescriptor(0x0403, 0x6014, 1, 5, "FT000005", 0, "FT232H")
+    store_fabric_clock("FT000005", Fraction(20_000_000))
+    args = parse(monkeypatch, "upload", "x.bin")
+
+    assert get_fabric_clock(args, [device]) == 20_000_000
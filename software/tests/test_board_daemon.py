@@ -0,0 +1,87 @@
+import serial
+import pytest
+from modules.board_daemon import BoardDaemon, JOB_POWER_CYCLE, JOB_UPLOAD
+from modules.usb_topology import UsbTopologyIndex
+
+BAUDRATE = 115200
+
+
+@pytest.fixture
+def two_boards(fake_sysfs, monkeypatch):
+    """Two boards with a tty each, on ports 1 and 2 of the root hub, whose
+    ports are loopbacks."""
+    first = fake_sysfs.add_device(1, (1,), 2, "FT000001")
+    fake_sysfs.add_tty(first, "ttyUSB0")
+    second = fake_sysfs.add_device(1, (2,), 3, "FT000002")
+    fake_sysfs.add_tty(second, "ttyUSB1")
+    index = UsbTopologyIndex(fake_sysfs.sysfs_root, fake_sysfs.dev_root)
+    monkeypatch.setattr("modules.usb_topology.get_topology_index", lambda: index)
+
+    ports = {}
+
+    def open_uart(device_path, baudrate, options):
+        ports[device_path] = serial.serial_for_url("loop://", baudrate=baudrate)
+        return ports[device_path]
+
+    monkeypatch.setattr("upload_bitstream.upload_bitstream.open_uart", open_uart)
+    yield fake_sysfs, ports
+    for port in ports.values():
+        port.close()
+
+
+def upload(daemon, device_path, bitstream_file):
+    return daemon.run_job(
+        JOB_UPLOAD,
+        {
+            "bitstream_file": str(bitstream_file),
+            "baudrate": BAUDRATE,
+            "port": device_path,
+            "options": {"pace": False},
+        },
+    )
+
+
+def test_power_cycle_only_closes_the_cycled_boards(two_boards, tmp_path, monkeypatch):
+    fake_sysfs, ports = two_boards
+    cycled = []
+    monkeypatch.setattr(
+        "modules.usb_port_power_control.power_cycle_usb_ports",
+        lambda ports, *arguments: cycled.extend(ports) or {},
+    )
+    bitstream_file = tmp_path / "bitstream.bin"
+    bitstream_file.write_bytes(bytes(64))
+    first = str(fake_sysfs.dev_root / "ttyUSB0")
+    second = str(fake_sysfs.dev_root / "ttyUSB1")
+
+    daemon = BoardDaemon()
+    upload(daemon, first, bitstream_file)
+    upload(daemon, second, bitstream_file)
+    daemon.run_job(JOB_POWER_CYCLE, {"location": "1", "port": 1})
+
+    assert [(port.location, port.port) for port in cycled] == [("1", 1)]
+    assert not ports[first].is_open
+    assert ports[second].is_open
+
+    # The cycled board gets a new port, the other one keeps its port
+    upload(daemon, first, bitstream_file)
+    upload(daemon, second, bitstream_file)
+    assert ports[first].is_open
+    daemon.close_handles()
+    assert not ports[second].is_open
+
+
+def test_failed_upload_drops_the_port(two_boards, tmp_path):
+    fake_sysfs, ports = two_boards
+    first = str(fake_sysfs.dev_root / "ttyUSB0")
+    bitstream_file = tmp_path / "bitstream.bin"
+    bitstream_file.write_bytes(bytes(64))
+
+    daemon = BoardDaemon()
+    upload(daemon, first, bitstream_file)
+    with pytest.raises(FileNotFoundError):
+        upload(daemon, first, tmp_path / "missing.bin")
+
+    assert not ports[first].is_open
+    upload(daemon, first, bitstream_file)
+    assert ports[first].is_open
+    daemon.close_handles()
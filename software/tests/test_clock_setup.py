@@ -0,0 +1,124 @@
+from pathlib import Path
+import pytest
+from clock_setup.clock_setup import (
+    configure_clock_ic,
+    CrystalError,
+    LOS_XTAL,
+    PLL_RESET_PLLA,
+    PLL_RESET_RESERVED,
+    REGISTER_CLK0_CONTROL,
+    REGISTER_CRYSTAL_INTERNAL_LOAD_CAPACITANCE,
+    REGISTER_DEVICE_STATUS,
+    REGISTER_OUTPUT_ENABLE,
+    REGISTER_PLL_RESET,
+    REGISTER_PLLA_PARAMETERS,
+    XTAL_CL,
+)
+from clock_setup.read_register_config import (
+    coalesce_registers,
+    compile_register_config,
+    read_register_config,
+    Register,
+    RegisterRun,
+)
+
+REGISTER_CONFIG = (
+    Path(__file__).resolve().parent.parent
+    / "clock_setup"
+    / "Si5351A-RevB-Registers_10_2_20.txt"
+)
+
+
+class FakeI2cPort:
+    """Holds the registers of a clock IC and records every transaction."""
+
+    def __init__(self):
+        self.registers = bytearray(256)
+        self.registers[REGISTER_CRYSTAL_INTERNAL_LOAD_CAPACITANCE] = XTAL_CL
+        self.writes = []
+        self.reads = []
+
+    def write_to(self, address: int, values: bytes) -> None:
+        self.writes.append(RegisterRun(address, bytes(values)))
+        self.registers[address : address + len(values)] = values
+
+    def read_from(self, address: int, size: int) -> bytes:
+        self.reads.append((address, size))
+        return bytes(self.registers[address : address + size])
+
+
+@pytest.fixture
+def config():
+    return compile_register_config(read_register_config(str(REGISTER_CONFIG)))
+
+
+def test_coalesce_keeps_the_order():
+    registers = [Register(address, address) for address in [3, 4, 5, 9, 10, 4]]
+
+    assert coalesce_registers(registers) == [
+        RegisterRun(3, bytes([3, 4, 5])),
+        RegisterRun(9, bytes([9, 10])),
+        RegisterRun(4, bytes([4])),
+    ]
+    assert coalesce_registers([]) == []
+
+
+def test_programming_procedure_order(config):
+    i2c_port = FakeI2cPort()
+    statistics = configure_clock_ic(i2c_port, config)
+
+    registers = config.registers
+    assert i2c_port.reads == [(REGISTER_DEVICE_STATUS, 1)]
+    assert i2c_port.writes == (
+        [
+            RegisterRun(REGISTER_OUTPUT_ENABLE, b"\xFF"),
+            RegisterRun(REGISTER_CLK0_CONTROL, b"\x80" * 8),
+            RegisterRun(registers[0].address, bytes([registers[0].value])),
+        ]
+        + config.runs
+        + [
+            RegisterRun(REGISTER_PLL_RESET, b"\xAC"),
+            RegisterRun(registers[1].address, bytes([registers[1].value])),
+        ]
+    )
+    assert statistics.transactions == len(i2c_port.writes)
+    assert statistics.transactions < len(registers)
+    assert statistics.registers == sum(len(run.values) for run in i2c_port.writes)
+    for register in registers:
+        assert i2c_port.registers[register.address] == register.value
+
+
+def test_programming_stops_on_crystal_loss(config):
+    i2c_port = FakeI2cPort()
+    i2c_port.registers[REGISTER_DEVICE_STATUS] = LOS_XTAL
+
+    with pytest.raises(CrystalError):
+        configure_clock_ic(i2c_port, config)
+    assert i2c_port.writes == []
+
+
+def test_update_of_a_configured_ic_writes_nothing(config):
+    i2c_port = FakeI2cPort()
+    configure_clock_ic(i2c_port, config)
+    i2c_port.writes.clear()
+
+    statistics = configure_clock_ic(i2c_port, config, incremental=True)
+
+    assert i2c_port.writes == []
+    assert (statistics.transactions, statistics.reads) == (0, 1)
+
+
+def test_update_resets_only_the_changed_pll(config):
+    i2c_port = FakeI2cPort()
+    configure_clock_ic(i2c_port, config)
+    i2c_port.writes.clear()
+    address = REGISTER_PLLA_PARAMETERS[4]
+    value = i2c_port.registers[address]
+    i2c_port.registers[address] = value ^ 0xFF
+
+    configure_clock_ic(i2c_port, config, incremental=True)
+
+    assert i2c_port.writes == [
+        RegisterRun(address, bytes([value])),
+        RegisterRun(REGISTER_PLL_RESET, bytes([PLL_RESET_PLLA | PLL_RESET_RESERVED])),
+    ]
@@ -0,0 +1,26 @@
+from fractions import Fraction
+import pytest
+from board import setup_parser
+from clock_setup.clock_sweep import sweep_frequencies
+
+
+def test_sweep_runs_upwards():
+    assert sweep_frequencies(Fraction(10), Fraction(20), Fraction(4)) == [10, 14, 18]
+
+
+def test_sweep_runs_downwards_from_start_to_stop():
+    assert sweep_frequencies(Fraction(20), Fraction(10), Fraction(5)) == [20, 15, 10]
+
+
+def test_sweep_rejects_a_step_that_is_not_positive():
+    with pytest.raises(ValueError):
+        sweep_frequencies(Fraction(10), Fraction(20), Fraction(0))
+
+
+def test_downward_sweep_is_parsed(monkeypatch):
+    monkeypatch.setattr("sys.argv", ["board.py", "clock_sweep", "20M", "10M", "1M"])
+    args = setup_parser()
+
+    assert args.frequencies[0] == 20_000_000
+    assert args.frequencies[-1] == 10_000_000
+    assert len(args.frequencies) == 11
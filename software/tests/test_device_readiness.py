@@ -0,0 +1,136 @@
+import asyncio
+from typing import Callable, List
+import pytest
+from modules.device_readiness import (
+    DeviceEvent,
+    DeviceNotReadyError,
+    get_port_location,
+    wait_for_device,
+    wait_for_devices,
+    wait_for_devices_async,
+)
+from modules.ftdi_access import Device
+
+FT232H = Device(0x0403, 0x6014)
+
+
+def usb_event(action: str, location: str, device: Device = FT232H) -> DeviceEvent:
+    return DeviceEvent(action, "usb", location, *device, None)
+
+
+def tty_event(action: str, location: str, device_node: str) -> DeviceEvent:
+    return DeviceEvent(action, "tty", location, None, None, device_node)
+
+
+class EventScript:
+    """Returns the scripted events one per poll and then times out, recording
+    the timeouts it was polled with."""
+
+    def __init__(self, events: List[DeviceEvent | None]):
+        self.events = list(events)
+        self.timeouts = []
+
+    def __call__(self, timeout: float) -> DeviceEvent | None:
+        self.timeouts.append(timeout)
+        if self.events:
+            return self.events.pop(0)
+        return None
+
+
+def ready_after(polls: int) -> Callable[[str], bool]:
+    """A node check answering from its given call on."""
+    calls = []
+
+    def is_ready(device_node: str) -> bool:
+        calls.append(device_node)
+        return len(calls) >= polls
+
+    return is_ready
+
+
+def test_port_location():
+    assert get_port_location("1-1", "2") == "1-1.2"
+    assert get_port_location("3", "4") == "3-4"
+
+
+def test_wait_for_the_tty_nodes_of_all_devices():
+    poll = EventScript(
+        [
+            usb_event("remove", "1-1.2"),
+            usb_event("add", "1-1.2"),
+            tty_event("add", "1-1.3", "/dev/ttyUSB1"),
+            tty_event("add", "1-1.2", "/dev/ttyUSB0"),
+        ]
+    )
+
+    ready = wait_for_devices(
+        poll, ["1-1.2", "1-1.3"], FT232H, 1.0, is_ready=lambda node: True
+    )
+
+    assert ready == {"1-1.2": "/dev/ttyUSB0", "1-1.3": "/dev/ttyUSB1"}
+    assert len(poll.timeouts) == 4
+
+
+def test_retry_a_node_that_does_not_answer_yet():
+    poll = EventScript([tty_event("add", "1-1.2", "/dev/ttyUSB0")])
+
+    device_node = wait_for_device(poll, "1-1.2", timeout=1.0, is_ready=ready_after(3))
+
+    assert device_node == "/dev/ttyUSB0"
+    # The node is rechecked after every short poll
+    assert len(poll.timeouts) == 3
+    assert max(poll.timeouts[1:]) <= 0.05
+
+
+def test_forget_a_removed_node():
+    poll = EventScript(
+        [
+            tty_event("add", "1-1.2", "/dev/ttyUSB0"),
+            tty_event("remove", "1-1.2", "/dev/ttyUSB0"),
+        ]
+    )
+
+    with pytest.raises(DeviceNotReadyError):
+        wait_for_device(poll, "1-1.2", timeout=0.2, is_ready=ready_after(3))
+
+
+def test_wait_for_the_usb_device_only():
+    poll = EventScript(
+        [
+            usb_event("add", "1-1.4"),
+            usb_event("add", "1-1.2", Device(0x1234, 0x5678)),
+            usb_event("bind", "1-1.2"),
+        ]
+    )
+
+    ready = wait_for_devices(
+        poll, ["1-1.2"], FT232H, 1.0, wait_for_tty=False, is_ready=ready_after(1)
+    )
+
+    assert ready == {"1-1.2": None}
+    assert len(poll.timeouts) == 3
+
+
+def test_time_out_without_events():
+    with pytest.raises(DeviceNotReadyError):
+        wait_for_devices(EventScript([]), ["1-1.2"], timeout=0.05)
+
+
+def test_wait_from_an_event_loop():
+    script = EventScript(
+        [
+            None,
+            usb_event("add", "2-1"),
+            tty_event("add", "2-1", "/dev/ttyUSB3"),
+        ]
+    )
+
+    async def poll(timeout: float) -> DeviceEvent | None:
+        await asyncio.sleep(0)
+        return script(timeout)
+
+    ready = asyncio.run(
+        wait_for_devices_async(poll, ["2-1"], FT232H, 1.0, is_ready=lambda node: True)
+    )
+
+    assert ready == {"2-1": "/dev/ttyUSB3"}
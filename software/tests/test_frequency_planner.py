@@ -0,0 +1,120 @@
+from fractions import Fraction
+from pathlib import Path
+import pytest
+from clock_setup.frequency_planner import (
+    CLK_INTEGER_MODE,
+    decode_output_frequency,
+    decode_parameters,
+    encode_multisynth,
+    encode_parameters,
+    MAX_DENOMINATOR,
+    MS_DIVIDE_BY_4,
+    PLL_INTEGER_MODE_REGISTERS,
+    plan_frequencies,
+    REGISTER_CLK0_CONTROL,
+    REGISTER_MS0_PARAMETERS,
+)
+from clock_setup.read_register_config import read_register_config
+
+REGISTER_CONFIG = (
+    Path(__file__).resolve().parent.parent
+    / "clock_setup"
+    / "Si5351A-RevB-Registers_10_2_20.txt"
+)
+
+
+def get_register_map(plan):
+    return {register.address: register.value for register in plan.registers}
+
+
+def test_encode_parameters_follows_the_datasheet():
+    # 40 + 1/3: P1 = 128 * 40 + 42 - 512, P2 = 128 - 3 * 42, P3 = 3
+    assert encode_parameters(Fraction(121, 3)) == bytes(
+        [0x00, 0x03, 0x00, 0x12, 0x2A, 0x00, 0x00, 0x02]
+    )
+
+
+@pytest.mark.parametrize(
+    "ratio",
+    [
+        Fraction(36),
+        Fraction(15),
+        Fraction(90),
+        Fraction(121, 3),
+        Fraction(8) + Fraction(1, MAX_DENOMINATOR),
+        Fraction(2047) + Fraction(MAX_DENOMINATOR - 1, MAX_DENOMINATOR),
+        Fraction(35) + Fraction(65537, 70001),
+    ],
+)
+def test_parameters_round_trip(ratio):
+    assert decode_parameters(encode_parameters(ratio)) == ratio
+
+
+def test_output_divider_does_not_disturb_the_parameters():
+    for r_divider in [1, 2, 4, 128]:
+        block = encode_multisynth(Fraction(121, 3), r_divider)
+
+        assert (block[2] >> 4) & 0x07 == r_divider.bit_length() - 1
+        assert decode_parameters(block) == Fraction(121, 3)
+
+
+def test_high_frequency_uses_divide_by_4():
+    plan = plan_frequencies([Fraction(160_000_000)])
+    register_map = get_register_map(plan)
+    block = [register_map[REGISTER_MS0_PARAMETERS + offset] for offset in range(8)]
+
+    assert plan.outputs[0].divider == 4
+    assert block[2] & MS_DIVIDE_BY_4 == MS_DIVIDE_BY_4
+    assert decode_parameters(block) == 4
+    assert decode_output_frequency(register_map, 0) == 160_000_000
+
+
+def test_integer_mode_bits():
+    plan = plan_frequencies(
+        [Fraction(10_000_000), Fraction(13_560_000), Fraction(33_333_333)]
+    )
+    register_map = get_register_map(plan)
+
+    outputs = [output.divider.denominator == 1 for output in plan.outputs]
+    plls = [pll.multiplier.denominator == 1 for pll in plan.plls]
+    # Both modes are covered
+    assert outputs == [True, False, True] and plls == [True, False]
+    for index, integer in enumerate(outputs):
+        control = register_map[REGISTER_CLK0_CONTROL + index]
+        assert bool(control & CLK_INTEGER_MODE) == integer
+    for address, integer in zip(PLL_INTEGER_MODE_REGISTERS, plls):
+        assert bool(register_map[address] & CLK_INTEGER_MODE) == integer
+
+
+@pytest.mark.parametrize(
+    "frequency, r_divider", [(10_000, 64), (2_500, 128), (500_000, 1)]
+)
+def test_low_frequency_uses_the_output_divider(frequency, r_divider):
+    plan = plan_frequencies([Fraction(frequency)])
+
+    assert plan.outputs[0].r_divider == r_divider
+    assert plan.outputs[0].frequency == frequency
+    assert decode_output_frequency(get_register_map(plan), 0) == frequency
+
+
+def test_plan_reproduces_the_shipped_export():
+    plan = plan_frequencies(
+        [Fraction(10_000_000), Fraction(2_000_000), Fraction(20_000_000)]
+    )
+    export = read_register_config(str(REGISTER_CONFIG))
+
+    assert [register.address for register in plan.registers] == [
+        register.address for register in export
+    ]
+    # The export leaves the integer mode bits cleared, the planner sets them
+    # for the integer dividers of the three outputs and PLLA
+    differences = {
+        planned.address: planned.value ^ exported.value
+        for planned, exported in zip(plan.registers, export)
+        if planned.value != exported.value
+    }
+    assert differences == {
+        address: CLK_INTEGER_MODE
+        for address in [REGISTER_CLK0_CONTROL + index for index in range(3)]
+        + PLL_INTEGER_MODE_REGISTERS[:1]
+    }
@@ -0,0 +1,96 @@
+import pytest
+from pyftdi.ftdi import Ftdi, UsbDeviceDescriptor
+from modules.ftdi_uart import drain_ftdi_uart, DrainTimeoutError
+from upload_bitstream.upload_bitstream import (
+    get_port_for_device,
+    open_uart,
+    TRANSPORT_FTDI,
+    UploadOptions,
+)
+
+
+# pyftdi's virtual USB backend (pyftdi.tests.backend) is only part of its source
+# tree and not of the installed package, so the Ftdi object behind the serial
+# URL is replaced instead. This covers how the transport configures the chip
+# and drains it, but not the USB traffic pyftdi generates for it.
+class FakeFtdi:
+    """Records the settings of the chip and reports the transmitter empty
+    after a number of polls."""
+
+    def __init__(self, busy_polls: int = 0):
+        self.busy_polls = busy_polls
+        self.polls = 0
+        self.latency_timer = None
+        self.chunksize = None
+        self.timeouts = (5000, 5000)
+
+    def set_latency_timer(self, latency: int) -> None:
+        self.latency_timer = latency
+
+    def write_data_set_chunksize(self, chunksize: int) -> None:
+        self.chunksize = chunksize
+
+    def write_data_get_chunksize(self) -> int:
+        return self.chunksize or 512
+
+    def poll_modem_status(self) -> int:
+        self.polls += 1
+        if self.polls > self.busy_polls:
+            return Ftdi.MODEM_TEMT | Ftdi.MODEM_THRE
+        return 0
+
+
+class FakePort:
+    def __init__(self, url: str, baudrate: int, ftdi: FakeFtdi):
+        self.url = url
+        self.baudrate = baudrate
+        self.ftdi = ftdi
+
+
+def test_ftdi_transport_uses_the_device_url():
+    device = UsbDeviceDescriptor(0x0403, 0x6014, 3, 12, "FT000001", 0, "FT232H")
+
+    assert get_port_for_device(device, TRANSPORT_FTDI) == (
+        "ftdi://0x0403:0x6014:0x3:0xc/1"
+    )
+
+
+def test_open_uart_configures_the_chip(monkeypatch):
+    ftdi = FakeFtdi()
+    monkeypatch.setattr(
+        "pyftdi.serialext.serial_for_url",
+        lambda url, baudrate: FakePort(url, baudrate, ftdi),
+    )
+    options = UploadOptions(transport=TRANSPORT_FTDI, latency_timer=2, transfer_size=64)
+
+    port = open_uart("ftdi://0x0403:0x6014/1", 115200, options)
+
+    assert (port.url, port.baudrate) == ("ftdi://0x0403:0x6014/1", 115200)
+    assert (ftdi.latency_timer, ftdi.chunksize) == (2, 64)
+    assert ftdi.timeouts == (5000, 5000)
+
+
+def test_open_uart_bounds_the_usb_writes(monkeypatch):
+    ftdi = FakeFtdi()
+    monkeypatch.setattr(
+        "pyftdi.serialext.serial_for_url",
+        lambda url, baudrate: FakePort(url, baudrate, ftdi),
+    )
+    options = UploadOptions(transport=TRANSPORT_FTDI, write_timeout=1.5)
+
+    open_uart("ftdi://0x0403:0x6014/1", 115200, options)
+
+    assert ftdi.timeouts == (5000, 1500)
+
+
+def test_drain_waits_for_the_transmitter():
+    ftdi = FakeFtdi(busy_polls=3)
+    drain_ftdi_uart(FakePort("", 0, ftdi))
+
+    assert ftdi.polls == 4
+
+
+def test_drain_times_out():
+    ftdi = FakeFtdi(busy_polls=1 << 30)
+    with pytest.raises(DrainTimeoutError):
+        drain_ftdi_uart(FakePort("", 0, ftdi), timeout=0.01)
@@ -0,0 +1,40 @@
+import shutil
+import threading
+from modules.metrics import MetricsRecorder, JSONL_FILE_NAME, TEXTFILE_FILE_NAME
+
+
+def test_concurrent_flushes_replace_the_textfile(tmp_path):
+    recorder = MetricsRecorder(tmp_path, "serve")
+    errors = []
+
+    def flush():
+        for _ in range(200):
+            recorder.count("bytes_transmitted", 1, {})
+            try:
+                recorder.flush()
+            except Exception as error:
+                errors.append(error)
+
+    threads = [threading.Thread(target=flush) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    recorder.close()
+
+    assert errors == []
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        JSONL_FILE_NAME,
+        TEXTFILE_FILE_NAME,
+    ]
+    textfile = (tmp_path / TEXTFILE_FILE_NAME).read_text()
+    assert 'fabulous_board_bytes_transmitted{command="serve"} 800.0' in textfile
+
+
+def test_failed_flush_is_not_raised(tmp_path):
+    directory = tmp_path / "metrics"
+    recorder = MetricsRecorder(directory, "serve")
+    shutil.rmtree(directory)
+
+    recorder.flush()
+    recorder.close()
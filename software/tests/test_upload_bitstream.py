@@ -0,0 +1,216 @@
+import threading
+import time
+import serial
+import pytest
+from modules.bitstream_store import get_bitstream_store, hash_bitstream
+from modules.board_state import load_last_digest, store_last_digest
+from modules.ftdi_uart import DrainTimeoutError
+from upload_bitstream.upload_bitstream import (
+    iterate_chunks,
+    stream_bitstream,
+    upload_and_capture,
+    upload_bitstream_to_all,
+    UART_BITS_PER_BYTE,
+    upload_to_open_port,
+    UploadOptions,
+)
+
+BAUDRATE = 96000
+BYTES_PER_SECOND = BAUDRATE / UART_BITS_PER_BYTE
+
+
+@pytest.fixture
+def loop_port():
+    ser = serial.serial_for_url("loop://", baudrate=BAUDRATE, timeout=0)
+    yield ser
+    ser.close()
+
+
+def test_iterate_chunks_without_copy():
+    data = memoryview(bytearray(range(10)))
+    chunks = list(iterate_chunks(data, 4))
+
+    assert [chunk.tobytes() for chunk in chunks] == [
+        bytes([0, 1, 2, 3]),
+        bytes([4, 5, 6, 7]),
+        bytes([8, 9]),
+    ]
+    assert all(chunk.obj is data.obj for chunk in chunks)
+    with pytest.raises(ValueError):
+        next(iterate_chunks(data, 0))
+
+
+def test_stream_records_every_chunk(loop_port):
+    data = memoryview(bytes(1000))
+    statistics = stream_bitstream(loop_port, data, 256, pace=False)
+
+    assert statistics.total_bytes == 1000
+    assert [(chunk.offset, chunk.size) for chunk in statistics.chunks] == [
+        (0, 256),
+        (256, 256),
+        (512, 256),
+        (768, 232),
+    ]
+    assert statistics.wall_time >= statistics.transmit_time
+    assert statistics.throughput > 0
+
+
+def test_stream_discards_the_echo(loop_port):
+    stream_bitstream(loop_port, memoryview(bytes(range(256)) * 4), 128, pace=False)
+
+    assert loop_port.in_waiting == 0
+
+
+def test_stream_leaves_the_input_to_a_capture(loop_port):
+    data = memoryview(bytes(range(256)) * 4)
+    stream_bitstream(loop_port, data, 128, pace=False, discard_input=False)
+
+    assert loop_port.read(len(data)) == data
+
+
+def test_upload_and_capture_keeps_the_echo():
+    data = memoryview(bytes(range(256)) * 16)
+    options = UploadOptions(chunk_size=128, pace=False)
+
+    with upload_and_capture(data, "loop://", "capture", BAUDRATE, options) as (
+        statistics,
+        capture,
+    ):
+        deadline = time.monotonic() + 5
+        while capture.received < len(data) and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+    assert statistics.total_bytes == len(data)
+    assert capture.get_data() == data
+
+
+def test_stream_paces_against_the_baudrate(loop_port):
+    chunk_size = 960
+    data = memoryview(bytes(5 * chunk_size))
+    statistics = stream_bitstream(loop_port, data, chunk_size)
+
+    # The writes stay at most one chunk ahead of the wire
+    minimum = (len(data) - chunk_size) / BYTES_PER_SECOND
+    assert statistics.transmit_time >= minimum * 0.95
+
+    unpaced = stream_bitstream(loop_port, data, chunk_size, pace=False)
+    assert unpaced.transmit_time < minimum / 2
+
+
+def test_stream_drains_after_the_last_chunk(loop_port):
+    written = []
+    drained = []
+
+    write = loop_port.write
+    loop_port.write = lambda chunk: written.append(len(chunk)) or write(chunk)
+
+    def drain():
+        drained.append(sum(written))
+
+    statistics = stream_bitstream(
+        loop_port, memoryview(bytes(300)), 100, pace=False, drain=drain
+    )
+
+    assert drained == [300]
+    assert statistics.drain_time >= 0
+
+
+def test_plain_upload_does_not_store_the_bitstream(loop_port, monkeypatch):
+    def hash_bitstream(data):
+        raise AssertionError("A plain upload must not hash the bitstream")
+
+    monkeypatch.setattr(
+        "upload_bitstream.upload_bitstream.hash_bitstream", hash_bitstream
+    )
+    store_last_digest("plain", "0" * 64)
+
+    statistics = upload_to_open_port(loop_port, memoryview(bytes(100)), "plain")
+
+    assert statistics.total_bytes == 100
+    assert load_last_digest("plain") is None
+
+
+def test_diff_upload_records_the_bitstream(loop_port):
+    data = memoryview(bytes(range(100)))
+    options = UploadOptions(pace=False, diff=True)
+
+    upload_to_open_port(loop_port, data, "diff", options)
+
+    digest = load_last_digest("diff")
+    assert digest == hash_bitstream(data)
+    assert get_bitstream_store().read(digest) == data.tobytes()
+    assert upload_to_open_port(
+        loop_port, data, "diff", options._replace(skip_loaded=True)
+    ).total_bytes == 0
+
+
+class HangingPort:
+    """A port whose writes block until it is closed, like a stalled board."""
+
+    baudrate = BAUDRATE
+    in_waiting = 0
+    out_waiting = 0
+
+    def __init__(self):
+        self.closed = threading.Event()
+        self.aborted = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def write(self, data):
+        self.closed.wait()
+        self.aborted.set()
+        raise serial.SerialException("The port was closed.")
+
+    def close(self):
+        self.closed.set()
+
+
+def test_fan_out_aborts_a_hanging_upload(tmp_path, monkeypatch):
+    bitstream_file = tmp_path / "bitstream.bin"
+    bitstream_file.write_bytes(bytes(range(256)))
+    hanging = HangingPort()
+
+    def open_uart(device_path, baudrate, options):
+        if device_path == "hanging":
+            return hanging
+        return serial.serial_for_url("loop://", baudrate=baudrate, timeout=0)
+
+    module = "upload_bitstream.upload_bitstream"
+    monkeypatch.setattr(
+        f"{module}.find_devices_matching_id", lambda name: ["good", "hanging"]
+    )
+    monkeypatch.setattr(f"{module}.get_board_key", lambda device: f"fan_out_{device}")
+    monkeypatch.setattr(f"{module}.get_port_for_device", lambda device, _: device)
+    monkeypatch.setattr(f"{module}.open_uart", open_uart)
+
+    options = UploadOptions(pace=False, diff=True)
+    results = upload_bitstream_to_all(
+        str(bitstream_file), BAUDRATE, "0403:6014", options, timeout=0.5
+    )
+
+    good, timed_out = results
+    assert good.error is None and good.statistics.total_bytes == 256
+    assert timed_out.error == "Timed out"
+    assert timed_out.wall_time >= 0.5
+    # The port was closed, so the upload does not keep running
+    assert hanging.aborted.wait(5)
+    digest = hash_bitstream(bitstream_file.read_bytes())
+    assert load_last_digest("fan_out_good") == digest
+    assert load_last_digest("fan_out_hanging") is None
+
+
+def test_drain_is_bounded_by_the_write_timeout():
+    class StalledPort(HangingPort):
+        out_waiting = 64
+
+        def write(self, data):
+            return len(data)
+
+    options = UploadOptions(pace=False, write_timeout=0.05)
+    with pytest.raises(DrainTimeoutError):
+        upload_to_open_port(StalledPort(), memoryview(bytes(64)), "stalled", options)
@@ -0,0 +1,195 @@
+import asyncio
+from types import SimpleNamespace
+from typing import Tuple
+import pytest
+import usb.backend
+import usb.core
+from modules.ftdi_access import Device
+from modules.usb_hub import (
+    add_companion_ports,
+    find_companion_port,
+    find_device_ports,
+    find_hub,
+    HUB_DEVICE_CLASS,
+    HUB_PORT_REQUEST_TYPE,
+    HubAccessError,
+    HubNotFoundError,
+    HubPort,
+    PORT_POWER,
+    power_cycle_ports,
+    power_cycle_ports_async,
+    SET_FEATURE,
+)
+
+FT232H = Device(0x0403, 0x6014)
+
+
+class FakeBackend(usb.backend.IBackend):
+    """A pyusb backend of a device tree, recording the port power requests of
+    the hubs as (hub location, port, power)."""
+
+    def __init__(self):
+        self.devices = []
+        self.requests = []
+        self.failing = set()
+
+    def add_device(
+        self, bus: int, port_chain: Tuple[int, ...], device_class: int, device: Device
+    ) -> None:
+        self.devices.append(
+            SimpleNamespace(
+                bLength=18,
+                bDescriptorType=1,
+                bcdUSB=0x200,
+                bDeviceClass=device_class,
+                bDeviceSubClass=0,
+                bDeviceProtocol=0,
+                bMaxPacketSize0=64,
+                idVendor=device.vendor_id,
+                idProduct=device.product_id,
+                bcdDevice=0x900,
+                iManufacturer=0,
+                iProduct=0,
+                iSerialNumber=0,
+                bNumConfigurations=1,
+                address=len(self.devices) + 1,
+                bus=bus,
+                port_number=port_chain[-1] if port_chain else None,
+                port_numbers=port_chain,
+                speed=None,
+                location=f"{bus}-{'.'.join(str(port) for port in port_chain)}",
+            )
+        )
+
+    def add_hub(self, bus: int, port_chain: Tuple[int, ...]) -> None:
+        self.add_device(bus, port_chain, HUB_DEVICE_CLASS, Device(0x1D6B, 0x0002))
+
+    def enumerate_devices(self):
+        return iter(self.devices)
+
+    def get_device_descriptor(self, dev):
+        return dev
+
+    def get_port_numbers(self, dev):
+        return dev.port_numbers
+
+    def open_device(self, dev):
+        return dev
+
+    def close_device(self, dev_handle):
+        pass
+
+    def ctrl_transfer(
+        self, dev_handle, bmRequestType, bRequest, wValue, wIndex, data, timeout
+    ):
+        assert (bmRequestType, wValue) == (HUB_PORT_REQUEST_TYPE, PORT_POWER)
+        request = (dev_handle.location, wIndex, bRequest == SET_FEATURE)
+        if request in self.failing:
+            raise usb.core.USBError("Pipe error")
+        self.requests.append(request)
+        return 0
+
+
+@pytest.fixture
+def backend():
+    backend = FakeBackend()
+    backend.add_hub(1, ())
+    backend.add_hub(1, (1,))
+    backend.add_hub(1, (1, 4))
+    backend.add_device(1, (1, 2), 0, FT232H)
+    backend.add_device(1, (1, 4, 3), 0, FT232H)
+    backend.add_device(1, (1, 4, 1), 0, FT232H)
+    backend.add_device(1, (1, 3), 0, Device(0x1234, 0x5678))
+    return backend
+
+
+PORTS = [HubPort("1-1", 2), HubPort("1-1.4", 1), HubPort("1-1.4", 3)]
+
+
+def test_find_the_ports_of_devices(backend):
+    assert find_device_ports(FT232H, backend) == PORTS
+    assert find_hub("1-1.4", backend).port_numbers == (1, 4)
+    assert find_hub("1", backend).port_numbers == ()
+    with pytest.raises(HubNotFoundError):
+        find_hub("1-1.2", backend)
+
+
+def test_power_cycle_waits_one_off_time(backend):
+    sleeps = []
+    power_cycle_ports(PORTS, 1.5, backend, sleeps.append)
+
+    assert sleeps == [1.5]
+    assert backend.requests == [
+        ("1-1", 2, False),
+        ("1-1.4", 1, False),
+        ("1-1.4", 3, False),
+        ("1-1", 2, True),
+        ("1-1.4", 1, True),
+        ("1-1.4", 3, True),
+    ]
+
+
+def test_power_cycle_restores_ports_if_a_later_one_fails(backend):
+    backend.failing.add(("1-1.4", 3, False))
+    sleeps = []
+
+    with pytest.raises(HubAccessError):
+        power_cycle_ports(PORTS, 1.5, backend, sleeps.append)
+
+    assert sleeps == []
+    assert backend.requests == [
+        ("1-1", 2, False),
+        ("1-1.4", 1, False),
+        ("1-1", 2, True),
+        ("1-1.4", 1, True),
+    ]
+
+
+def test_power_cycle_tries_every_port_when_switching_on(backend):
+    backend.failing.add(("1-1", 2, True))
+
+    with pytest.raises(HubAccessError):
+        power_cycle_ports(PORTS, 0, backend, lambda seconds: None)
+
+    assert backend.requests[-2:] == [("1-1.4", 1, True), ("1-1.4", 3, True)]
+
+
+def test_power_cycle_of_a_missing_hub_switches_nothing(backend):
+    with pytest.raises(HubNotFoundError):
+        power_cycle_ports([HubPort("2", 1)] + PORTS, 0, backend, lambda seconds: None)
+
+    assert backend.requests == []
+
+
+def test_cancelled_power_cycle_switches_the_ports_on(backend):
+    async def cancel_during_off_time():
+        with pytest.raises(TimeoutError):
+            async with asyncio.timeout(0.05):
+                await power_cycle_ports_async(PORTS, 10, backend)
+
+    asyncio.run(cancel_during_off_time())
+
+    assert [power for _, _, power in backend.requests] == [False] * 3 + [True] * 3
+
+
+def test_companion_ports_are_switched_as_well(fake_sysfs):
+    # A USB 3 hub on 1-1 with its SuperSpeed half on 2-1, and the root hubs
+    usb2_hub = fake_sysfs.add_device(1, (1,), 2)
+    fake_sysfs.add_device(2, (), 1)
+    usb3_hub = fake_sysfs.add_device(2, (1,), 2)
+    fake_sysfs.add_peer_ports(usb2_hub, usb3_hub, 3)
+    fake_sysfs.add_peer_ports(usb2_hub.parent, usb3_hub.parent, 1)
+    root = fake_sysfs.sysfs_root
+
+    assert find_companion_port(HubPort("1-1", 3), root) == HubPort("2-1", 3)
+    assert find_companion_port(HubPort("1", 1), root) == HubPort("2", 1)
+    assert find_companion_port(HubPort("1-1", 2), root) is None
+    assert add_companion_ports(
+        [HubPort("1-1", 2), HubPort("1-1", 3), HubPort("2-1", 3)], root
+    ) == [HubPort("1-1", 2), HubPort("1-1", 3), HubPort("2-1", 3)]
+    assert add_companion_ports([HubPort("1-1", 3), HubPort("1", 1)], root) == [
+        HubPort("1-1", 3),
+        HubPort("1", 1),
+        HubPort("2-1", 3),
+        HubPort("2", 1),
+    ]
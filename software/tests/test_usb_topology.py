@@ -0,0 +1,104 @@
+import pytest
+from modules.board_state import forget_boards_at, load_last_digest, store_last_digest
+from modules.usb_topology import (
+    read_device_attribute,
+    scan_tty_devices,
+    TtyEntry,
+    UsbTopologyIndex,
+)
+
+
+@pytest.fixture
+def nested_hubs(fake_sysfs):
+    """Two boards behind a chain of three hubs, one directly at the root hub
+    without serial number and one with two UART interfaces."""
+    fake_sysfs.add_device(1, (1,), 2)
+    fake_sysfs.add_device(1, (1, 4), 3)
+    fake_sysfs.add_device(1, (1, 4, 2), 4)
+    deep = fake_sysfs.add_device(1, (1, 4, 2, 3), 5, "FT000001")
+    fake_sysfs.add_tty(deep, "ttyUSB1")
+    shallow = fake_sysfs.add_device(1, (2,), 6)
+    fake_sysfs.add_tty(shallow, "ttyUSB0")
+    dual = fake_sysfs.add_device(1, (1, 1), 7, "FT000002")
+    fake_sysfs.add_tty(dual, "ttyUSB2", 0)
+    fake_sysfs.add_tty(dual, "ttyUSB3", 1)
+    fake_sysfs.add_virtual_tty("tty0")
+    return fake_sysfs
+
+
+def test_scan_finds_usb_ttys_at_any_depth(nested_hubs):
+    entries = scan_tty_devices(nested_hubs.sysfs_root, nested_hubs.dev_root)
+
+    dev = nested_hubs.dev_root
+    assert entries == [
+        TtyEntry(str(dev / "ttyUSB0"), 1, (2,), 6, None),
+        TtyEntry(str(dev / "ttyUSB1"), 1, (1, 4, 2, 3), 5, "FT000001"),
+        TtyEntry(str(dev / "ttyUSB2"), 1, (1, 1), 7, "FT000002"),
+        TtyEntry(str(dev / "ttyUSB3"), 1, (1, 1), 7, "FT000002"),
+    ]
+    assert entries[1].location == "1-1.4.2.3"
+
+
+def test_scan_without_tty_class(tmp_path):
+    assert scan_tty_devices(tmp_path / "sys", tmp_path / "dev") == []
+
+
+def test_index_lookups(nested_hubs):
+    index = UsbTopologyIndex(nested_hubs.sysfs_root, nested_hubs.dev_root)
+    dev = nested_hubs.dev_root
+
+    assert index.find_by_address(1, 5).device_node == str(dev / "ttyUSB1")
+    assert index.find_by_address(None, 6).device_node == str(dev / "ttyUSB0")
+    assert index.find_by_address(2, 5) is None
+    assert index.find_by_location(1, (1, 4, 2, 3)).device_node == str(
+        dev / "ttyUSB1"
+    )
+    assert index.find_by_location(1, (1, 4, 2)) is None
+    assert index.find_by_serial("FT000001").device_node == str(dev / "ttyUSB1")
+    assert index.find_by_serial("unknown") is None
+
+
+def test_index_uses_first_tty_of_a_device(nested_hubs):
+    index = UsbTopologyIndex(nested_hubs.sysfs_root, nested_hubs.dev_root)
+    ttyUSB2 = str(nested_hubs.dev_root / "ttyUSB2")
+
+    assert index.find_by_address(1, 7).device_node == ttyUSB2
+    assert index.find_by_location(1, (1, 1)).device_node == ttyUSB2
+    assert index.find_by_serial("FT000002").device_node == ttyUSB2
+
+
+def test_index_is_rebuilt_after_invalidation(nested_hubs):
+    index = UsbTopologyIndex(nested_hubs.sysfs_root, nested_hubs.dev_root)
+    assert index.find_by_address(1, 8) is None
+
+    device = nested_hubs.add_device(1, (3,), 8, "FT000003")
+    nested_hubs.add_tty(device, "ttyUSB4")
+    assert index.find_by_address(1, 8) is None
+
+    index.invalidate()
+    assert index.find_by_serial("FT000003").device_node == str(
+        nested_hubs.dev_root / "ttyUSB4"
+    )
+
+
+def test_read_device_attribute(nested_hubs):
+    root = nested_hubs.sysfs_root
+    assert read_device_attribute("1-1.4.2.3", "serial", root) == "FT000001"
+    assert read_device_attribute("1-2", "serial", root) is None
+    assert read_device_attribute("1-9", "devnum", root) is None
+
+
+def test_forget_boards_at_drops_all_keys(nested_hubs, tmp_path, monkeypatch):
+    index = UsbTopologyIndex(nested_hubs.sysfs_root, nested_hubs.dev_root)
+    monkeypatch.setattr("modules.board_state.get_topology_index", lambda: index)
+    state = tmp_path / "state"
+    tty = str(nested_hubs.dev_root / "ttyUSB0")
+    for board_key in ["FT000001", "1-6", tty, "FT000002"]:
+        store_last_digest(board_key, "0" * 64, state)
+
+    forget_boards_at(["1-1.4.2.3", "1-2"], state, nested_hubs.sysfs_root)
+
+    assert load_last_digest("FT000001", state) is None
+    assert load_last_digest("1-6", state) is None
+    assert load_last_digest(tty, state) is None
+    assert load_last_digest("FT000002", state) == "0" * 64
@@ -1,22 +1,170 @@
 #!/usr/bin/env python3
 
+# pyftdi and NumPy are imported on first use, so that an upload through the
+# tty driver does not pay for loading them
+from __future__ import annotations
+
 import serial
 import serial.tools.list_ports
 import argparse
+import asyncio
+import concurrent.futures
+import contextlib
+import mmap
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Callable, Dict, Iterator, List, NamedTuple, Tuple, TYPE_CHECKING
 from loguru import logger
-from modules.ftdi_access import DEFAULT_FTDI_ID, get_device_path_for_device_id
+from modules import metrics
+from modules.async_io import BlockingRunner, run_to_completion, write_all
+from modules.baudrate import DEFAULT_FABRIC, FABRIC_PROFILES
+from modules.bitstream_store import get_bitstream_store, hash_bitstream
+from modules.board_state import (
+    forget_last_bitstream,
+    get_board_key,
+    load_last_digest,
+    store_last_digest,
+)
+from modules.ftdi_access import (
+    DEFAULT_FTDI_ID,
+    find_devices_matching_id,
+    get_path_for_address,
+    get_single_device,
+    get_url_for_device,
+)
+from modules.ftdi_uart import (
+    DEFAULT_LATENCY_TIMER,
+    DEFAULT_TRANSFER_SIZE,
+    drain_ftdi_uart,
+    open_ftdi_uart,
+    DrainTimeoutError,
+)
+from modules.uart_capture import capture_after_upload, CaptureOptions, UartCapture
 
-DEFAULT_BAUDRATE = 57600
+if TYPE_CHECKING:
+    from pyftdi.ftdi import UsbDeviceDescriptor
 
+# The baud rate of the eFPGA at its reference clock of 10 MHz
+DEFAULT_BAUDRATE = FABRIC_PROFILES[DEFAULT_FABRIC].reference_baudrate
+DEFAULT_CHUNK_SIZE = 256
 
-def read_bitstream_data(bitstream_file: str) -> bytearray:
-    """Read the bitstream data from the specified file.
+# The kernel tty driver found through udev
+TRANSPORT_TTY = "tty"
+# Direct USB access to the FTDI chip through pyftdi
+TRANSPORT_FTDI = "ftdi"
+TRANSPORTS = [TRANSPORT_TTY, TRANSPORT_FTDI]
 
-    :param bitstream_file: The bitstream file to be read.
+DEFAULT_BOARD_TIMEOUT = 60.0
+
+# One start bit, eight data bits and one stop bit per transmitted byte
+UART_BITS_PER_BYTE = 10
+
+# The shortest wait between two checks of the output buffer
+DRAIN_POLL_INTERVAL = 0.001
+
+
+class ChunkStatistics(NamedTuple):
+    """Timing of a single chunk written to the serial port.
+
+    Attributes:
+        offset  (int): The offset of the chunk in the bitstream.
+        size    (int): The number of bytes in the chunk.
+        latency (float): The time in seconds the write call blocked.
+    """
+
+    offset: int
+    size: int
+    latency: float
+
+
+class UploadStatistics(NamedTuple):
+    """Telemetry of a bitstream upload.
+
+    Attributes:
+        total_bytes   (int): The number of bytes transmitted.
+        chunks        (List[ChunkStatistics]): The timing of every chunk.
+        transmit_time (float): The time in seconds spent writing the chunks.
+        drain_time    (float): The time in seconds spent waiting for the
+                               output buffer to drain.
+        wall_time     (float): The total time in seconds of the upload.
+    """
+
+    total_bytes: int
+    chunks: List[ChunkStatistics]
+    transmit_time: float
+    drain_time: float
+    wall_time: float
+
+    @property
+    def throughput(self) -> float:
+        """The effective throughput of the upload in bytes per second."""
+        if self.wall_time <= 0:
+            return 0.0
+        return self.total_bytes / self.wall_time
+
+
+class UploadOptions(NamedTuple):
+    """Defines how a bitstream is transmitted.
+
+    Attributes:
+        chunk_size    (int): The maximum size of a single write in bytes.
+        pace          (bool): Pace the writes against the baudrate.
+        transport     (str): The transport to be used, one of TRANSPORTS.
+        latency_timer (int): The FTDI latency timer in milliseconds (ftdi
+                             transport only).
+        transfer_size (int): The size of a single USB write transfer in bytes
+                             (ftdi transport only).
+        diff          (bool): Only transmit the frames changed since the last
+                              upload.
+        sparse        (bool): Only transmit the frames differing from the
+                              power-on state.
+        write_timeout (float | None): The timeout of a single write and of
+                                      the drain in seconds.
+        skip_loaded   (bool): Skip the upload if the board already holds the
+                              bitstream since its last power cycle.
+        capturing     (bool): The port is read by a capture during the upload,
+                              so its input is left to the capture.
+    """
+
+    chunk_size: int = DEFAULT_CHUNK_SIZE
+    pace: bool = True
+    transport: str = TRANSPORT_TTY
+    latency_timer: int = DEFAULT_LATENCY_TIMER
+    transfer_size: int = DEFAULT_TRANSFER_SIZE
+    diff: bool = False
+    sparse: bool = False
+    write_timeout: float | None = None
+    skip_loaded: bool = False
+    capturing: bool = False
+
+
+class BoardUploadResult(NamedTuple):
+    """The result of an upload to one board of a fan-out.
+
+    Attributes:
+        board_key   (str): The key of the board.
+        device_path (str | None): The port used for the upload.
+        statistics  (UploadStatistics | None): The telemetry of the upload, if
+                                               it succeeded.
+        error       (str | None): The reason of the failure, if it failed.
+        wall_time   (float): The time in seconds spent on the board.
+    """
+
+    board_key: str
+    device_path: str | None
+    statistics: UploadStatistics | None
+    error: str | None
+    wall_time: float
+
+
+def __check_bitstream_file(bitstream_file: str) -> None:
+    """Check that the bitstream file exists.
+
+    :param bitstream_file: The bitstream file to be checked.
     :type bitstream_file: str
-    :return: The bitstream data read from the file.
-    :rtype: bytearray
+    :raises FileNotFoundError: If the file does not exist.
     """
     file = Path(bitstream_file)
     if not file.is_file():
@@ -26,41 +174,979 @@ def read_bitstream_data(bitstream_file: str) -> bytearray:
         )
         raise FileNotFoundError
 
+
+def read_bitstream_data(bitstream_file: str) -> bytearray:
+    """Read the bitstream data from the specified file.
+
+    :param bitstream_file: The bitstream file to be read.
+    :type bitstream_file: str
+    :return: The bitstream data read from the file.
+    :rtype: bytearray
+    """
+    __check_bitstream_file(bitstream_file)
+
     with open(bitstream_file, "rb") as f:
         data = bytearray(f.read())
 
     return data
 
 
+@contextmanager
+def open_bitstream(bitstream_file: str) -> Iterator[memoryview]:
+    """Memory-map the bitstream file without copying it.
+
+    :param bitstream_file: The bitstream file to be mapped.
+    :type bitstream_file: str
+    :return: A read-only view of the bitstream data, valid inside the context.
+    :rtype: Iterator[memoryview]
+    """
+    __check_bitstream_file(bitstream_file)
+
+    with open(bitstream_file, "rb") as f:
+        if Path(bitstream_file).stat().st_size == 0:
+            # Empty files cannot be mapped
+            yield memoryview(b"")
+            return
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                yield view
+            finally:
+                view.release()
+
+
+def iterate_chunks(data: memoryview, chunk_size: int) -> Iterator[memoryview]:
+    """Iterate over the data in chunks without copying it.
+
+    :param data: The data to be split into chunks.
+    :type data: memoryview
+    :param chunk_size: The maximum size of a chunk in bytes.
+    :type chunk_size: int
+    :return: The chunks as views into the data.
+    :rtype: Iterator[memoryview]
+    :raises ValueError: If the chunk size is not positive.
+    """
+    if chunk_size <= 0:
+        raise ValueError("The chunk size has to be positive.")
+
+    for offset in range(0, len(data), chunk_size):
+        yield data[offset : offset + chunk_size]
+
+
+def stream_bitstream(
+    ser: serial.SerialBase,
+    data: memoryview,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    pace: bool = True,
+    drain: Callable[[], None] | None = None,
+    discard_input: bool = True,
+) -> UploadStatistics:
+    """Stream the data to an open serial port in chunks.
+
+    If pacing is enabled, the writes are kept at most one chunk ahead of the
+    UART so that the latency of every chunk reflects the wire and not the
+    output buffer of the driver. After the last chunk, the output buffer is
+    drained. Input received during the transmission is discarded since the
+    fabric is not configured yet, this also keeps loopback ports from
+    blocking. A port read by a capture keeps its input, as the capture
+    thread reads it concurrently.
+
+    :param ser: The open serial port to write to.
+    :type ser: serial.SerialBase
+    :param data: The data to be transmitted.
+    :type data: memoryview
+    :param chunk_size: The maximum size of a single write in bytes.
+    :type chunk_size: int
+    :param pace: Pace the writes against the baudrate of the port.
+    :type pace: bool
+    :param drain: Waits until the output buffer is drained. Defaults to
+    flushing the port.
+    :type drain: Callable[[], None] | None
+    :param discard_input: Discard the input received during the transmission.
+    :type discard_input: bool
+    :return: The telemetry of the transmission.
+    :rtype: UploadStatistics
+    """
+    bytes_per_second = ser.baudrate / UART_BITS_PER_BYTE
+    chunks = []
+    sent = 0
+
+    start = time.perf_counter()
+    for chunk in iterate_chunks(data, chunk_size):
+        chunk_start = time.perf_counter()
+        ser.write(chunk)
+        chunk_end = time.perf_counter()
+
+        if discard_input and ser.in_waiting:
+            ser.reset_input_buffer()
+
+        chunks.append(ChunkStatistics(sent, len(chunk), chunk_end - chunk_start))
+        sent += len(chunk)
+
+        if pace:
+            ahead = (sent - chunk_size) / bytes_per_second - (chunk_end - start)
+            if ahead > 0:
+                time.sleep(ahead)
+
+    transmit_end = time.perf_counter()
+    if drain is not None:
+        drain()
+    else:
+        ser.flush()
+    end = time.perf_counter()
+
+    metrics.observe(metrics.SPAN_TRANSMIT, transmit_end - start)
+    metrics.observe(metrics.SPAN_DRAIN, end - transmit_end)
+    metrics.count(metrics.COUNTER_BYTES_TRANSMITTED, sent)
+
+    return UploadStatistics(
+        sent, chunks, transmit_end - start, end - transmit_end, end - start
+    )
+
+
+def __drain(ser: serial.SerialBase, timeout: float) -> None:
+    """Wait until the output buffer of a port is drained, unlike flush with a
+    timeout.
+
+    :param ser: The open serial port.
+    :type ser: serial.SerialBase
+    :param timeout: The maximum time to wait in seconds.
+    :type timeout: float
+    :raises DrainTimeoutError: If the buffer is not drained in time.
+    """
+    bytes_per_second = ser.baudrate / UART_BITS_PER_BYTE
+    deadline = time.perf_counter() + timeout
+    while pending := ser.out_waiting:
+        if time.perf_counter() > deadline:
+            logger.error("The output buffer did not drain in time.")
+            raise DrainTimeoutError
+        time.sleep(max(pending / bytes_per_second, DRAIN_POLL_INTERVAL))
+
+
+async def __drain_async(ser: serial.SerialBase, bytes_per_second: float) -> None:
+    """Wait until the output buffer of a port is drained without blocking the
+    event loop.
+
+    :param ser: The open serial port.
+    :type ser: serial.SerialBase
+    :param bytes_per_second: The rate the buffer drains at.
+    :type bytes_per_second: float
+    """
+    while pending := ser.out_waiting:
+        await asyncio.sleep(max(pending / bytes_per_second, DRAIN_POLL_INTERVAL))
+
+
+async def stream_bitstream_async(
+    ser: serial.SerialBase,
+    data: memoryview,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    pace: bool = True,
+    discard_input: bool = True,
+) -> UploadStatistics:
+    """Stream the data to an open tty in chunks without blocking the event
+    loop.
+
+    The chunks are written to the non-blocking file descriptor of the port,
+    and the pacing and the drain are awaited, so that many boards can be
+    programmed from a single event loop. Otherwise, the same as
+    stream_bitstream.
+
+    :param ser: The open serial port, it has to provide a file descriptor.
+    :type ser: serial.SerialBase
+    :param data: The data to be transmitted.
+    :type data: memoryview
+    :param chunk_size: The maximum size of a single write in bytes.
+    :type chunk_size: int
+    :param pace: Pace the writes against the baudrate of the port.
+    :type pace: bool
+    :param discard_input: Discard the input received during the transmission.
+    :type discard_input: bool
+    :return: The telemetry of the transmission.
+    :rtype: UploadStatistics
+    """
+    fileno = ser.fileno()
+    bytes_per_second = ser.baudrate / UART_BITS_PER_BYTE
+    chunks = []
+    sent = 0
+
+    start = time.perf_counter()
+    for chunk in iterate_chunks(data, chunk_size):
+        chunk_start = time.perf_counter()
+        # Released even if the upload is cancelled, so that the bitstream can
+        # be unmapped
+        with chunk:
+            await write_all(fileno, chunk)
+            size = len(chunk)
+        chunk_end = time.perf_counter()
+
+        if discard_input and ser.in_waiting:
+            ser.reset_input_buffer()
+
+        chunks.append(ChunkStatistics(sent, size, chunk_end - chunk_start))
+        sent += size
+
+        if pace:
+            ahead = (sent - chunk_size) / bytes_per_second - (chunk_end - start)
+            if ahead > 0:
+                await asyncio.sleep(ahead)
+
+    transmit_end = time.perf_counter()
+    await __drain_async(ser, bytes_per_second)
+    end = time.perf_counter()
+
+    metrics.observe(metrics.SPAN_TRANSMIT, transmit_end - start)
+    metrics.observe(metrics.SPAN_DRAIN, end - transmit_end)
+    metrics.count(metrics.COUNTER_BYTES_TRANSMITTED, sent)
+
+    return UploadStatistics(
+        sent, chunks, transmit_end - start, end - transmit_end, end - start
+    )
+
+
+def log_upload_statistics(statistics: UploadStatistics) -> None:
+    """Log the telemetry of an upload.
+
+    :param statistics: The telemetry to be logged.
+    :type statistics: UploadStatistics
+    """
+    logger.info(
+        f"Transmitted {statistics.total_bytes} bytes in"
+        + f" {statistics.wall_time:.3f} s ({statistics.throughput:.0f} B/s)"
+    )
+    logger.debug(
+        f"Transmit: {statistics.transmit_time:.3f} s,"
+        + f" drain: {statistics.drain_time:.3f} s"
+    )
+
+    if statistics.chunks:
+        latencies = [chunk.latency for chunk in statistics.chunks]
+        slowest = max(statistics.chunks, key=lambda chunk: chunk.latency)
+        logger.debug(
+            f"{len(latencies)} chunks, latency min/avg/max:"
+            + f" {min(latencies) * 1000:.2f}/"
+            + f"{sum(latencies) / len(latencies) * 1000:.2f}/"
+            + f"{max(latencies) * 1000:.2f} ms"
+            + f" (slowest at offset {slowest.offset})"
+        )
+
+
+def get_port_for_device(device: UsbDeviceDescriptor, transport: str) -> str | None:
+    """Get the port to be opened for a device.
+
+    :param device: The FTDI device of the board.
+    :type device: UsbDeviceDescriptor
+    :param transport: The transport to be used, one of TRANSPORTS.
+    :type transport: str
+    :return: The FTDI URL for the ftdi transport, else the tty device path.
+    :rtype: str | None
+    """
+    if transport == TRANSPORT_FTDI:
+        return get_url_for_device(device)
+    return get_path_for_address(device.address, device.bus)
+
+
+def __check_transport(transport: str) -> None:
+    """Check that the transport is known.
+
+    :param transport: The transport to be checked.
+    :type transport: str
+    :raises ValueError: If the transport is unknown.
+    """
+    if transport not in TRANSPORTS:
+        logger.error(f"Transport {transport} is unknown.")
+        raise ValueError
+
+
+def resolve_port(
+    ftdi_name: str,
+    port: str,
+    transport: str,
+    device: UsbDeviceDescriptor | None = None,
+) -> Tuple[str, str]:
+    """Resolve the port to be opened and the key of the board.
+
+    :param ftdi_name: The name of the FTDI chip to be used.
+    :type ftdi_name: str
+    :param port: The explicitly given port, if any.
+    :type port: str
+    :param transport: The transport to be used, one of TRANSPORTS.
+    :type transport: str
+    :param device: The device if it was already resolved, else it is looked
+    up by its name.
+    :type device: UsbDeviceDescriptor | None
+    :return: The port and the key of the board. An explicitly given port is
+    its own key.
+    :rtype: Tuple[str, str]
+    """
+    if port:
+        return port, port
+
+    if device is None:
+        logger.info("Checking device...")
+        device = get_single_device(ftdi_name)
+    return get_port_for_device(device, transport), get_board_key(device)
+
+
+def __select_payload(
+    data: memoryview, digest: str, board_key: str, diff: bool, sparse: bool
+) -> memoryview:
+    """Select the data to be transmitted to the board.
+
+    :param data: The full bitstream.
+    :type data: memoryview
+    :param digest: The digest of the bitstream in the store.
+    :type digest: str
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param diff: Only transmit the frames changed since the last upload.
+    :type diff: bool
+    :param sparse: Only transmit the frames differing from the power-on state.
+    :type sparse: bool
+    :return: The reduced stream if possible, else the full bitstream.
+    :rtype: memoryview
+    """
+    if not sparse and not diff:
+        return data
+
+    store = get_bitstream_store()
+    if sparse:
+        stream = store.get_sparse_stream(data, digest)
+        if stream is None:
+            logger.warning("The bitstream cannot be reduced, sending all frames.")
+            return data
+        return memoryview(stream)
+
+    previous_digest = load_last_digest(board_key)
+    previous = store.read(previous_digest) if previous_digest else None
+    if previous is None:
+        logger.info("No previous upload recorded for the board, sending all frames.")
+        return data
+
+    from modules.bitstream import build_differential_stream
+
+    stream = build_differential_stream(memoryview(previous), data)
+    if stream is None:
+        logger.warning(
+            "The previous bitstream cannot be compared to the new one,"
+            + " sending all frames."
+        )
+        return data
+
+    return memoryview(stream)
+
+
+def __begin_upload(
+    data: memoryview, board_key: str, options: UploadOptions, source: str | None
+) -> Tuple[str | None, memoryview | None]:
+    """Prepare the upload of a bitstream to a board.
+
+    The record of the board is removed, since it is invalid until the upload
+    completed. The bitstream is only hashed and added to the store if an
+    option needs it, a plain upload leaves the board without a record.
+
+    :param data: The bitstream data.
+    :type data: memoryview
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param options: Defines how the bitstream is transmitted.
+    :type options: UploadOptions
+    :param source: The bitstream file, if known.
+    :type source: str | None
+    :return: The digest of the bitstream, None if it was not stored, and the
+    data to be transmitted, None if the board already holds the bitstream.
+    :rtype: Tuple[str | None, memoryview | None]
+    """
+    if not options.diff and not options.skip_loaded and not options.sparse:
+        forget_last_bitstream(board_key)
+        return None, data
+
+    digest = hash_bitstream(data)
+    if (
+        options.skip_loaded
+        and not options.sparse
+        and load_last_digest(board_key) == digest
+    ):
+        logger.info(f"Board {board_key} already holds the bitstream, skipping it.")
+        return digest, None
+
+    get_bitstream_store().add(data, source, digest)
+    payload = __select_payload(data, digest, board_key, options.diff, options.sparse)
+    forget_last_bitstream(board_key)
+    return digest, payload
+
+
+def open_uart(
+    device_path: str, baudrate: int, options: UploadOptions = UploadOptions()
+) -> serial.SerialBase:
+    """Open the UART of a board with the configured transport.
+
+    :param device_path: The port to be opened.
+    :type device_path: str
+    :param baudrate: The baudrate to be used.
+    :type baudrate: int
+    :param options: Defines the transport and its settings.
+    :type options: UploadOptions
+    :return: The opened port.
+    :rtype: serial.SerialBase
+    """
+    with metrics.span(metrics.SPAN_PORT_OPEN, transport=options.transport):
+        if options.transport == TRANSPORT_FTDI:
+            return open_ftdi_uart(
+                device_path,
+                baudrate,
+                options.latency_timer,
+                options.transfer_size,
+                options.write_timeout,
+            )
+        return serial.serial_for_url(
+            device_path, baudrate, write_timeout=options.write_timeout
+        )
+
+
+def __transmit(
+    ser: serial.SerialBase,
+    data: memoryview,
+    board_key: str,
+    options: UploadOptions,
+    source: str | None = None,
+) -> Tuple[str | None, UploadStatistics]:
+    """Transmit a bitstream through an opened UART without recording it for
+    the board.
+
+    :param ser: The port opened with open_uart.
+    :type ser: serial.SerialBase
+    :param data: The bitstream data.
+    :type data: memoryview
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param options: Defines how the bitstream is transmitted.
+    :type options: UploadOptions
+    :param source: The bitstream file, kept as metadata in the store.
+    :type source: str | None
+    :return: The digest to be recorded for the board once the upload
+    succeeded, None if nothing is recorded, and the telemetry of the upload.
+    :rtype: Tuple[str | None, UploadStatistics]
+    """
+    digest, payload = __begin_upload(data, board_key, options, source)
+    if payload is None:
+        return None, UploadStatistics(0, [], 0.0, 0.0, 0.0)
+
+    # The drain is bounded by the write timeout if one is given
+    if options.transport == TRANSPORT_FTDI:
+        if options.write_timeout is not None:
+            drain = lambda: drain_ftdi_uart(ser, options.write_timeout)
+        else:
+            drain = lambda: drain_ftdi_uart(ser)
+    elif options.write_timeout is not None:
+        drain = lambda: __drain(ser, options.write_timeout)
+    else:
+        drain = None
+
+    statistics = stream_bitstream(
+        ser,
+        payload,
+        options.chunk_size,
+        options.pace,
+        drain,
+        not options.capturing,
+    )
+    return digest, statistics
+
+
+def upload_to_open_port(
+    ser: serial.SerialBase,
+    data: memoryview,
+    board_key: str,
+    options: UploadOptions = UploadOptions(),
+    source: str | None = None,
+) -> UploadStatistics:
+    """Transmit a bitstream to the board through an opened UART.
+
+    With diff, sparse or skip_loaded enabled, the uploaded bitstream is kept
+    in the bitstream store and recorded for the board by its digest, so that
+    the next upload with diff enabled only has to transmit the changed
+    frames, and one with skip_loaded enabled nothing at all if the bitstream
+    did not change.
+
+    :param ser: The port opened with open_uart.
+    :type ser: serial.SerialBase
+    :param data: The bitstream data.
+    :type data: memoryview
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param options: Defines how the bitstream is transmitted.
+    :type options: UploadOptions
+    :param source: The bitstream file, kept as metadata in the store.
+    :type source: str | None
+    :return: The telemetry of the upload, without any bytes if the upload was
+    skipped.
+    :rtype: UploadStatistics
+    """
+    digest, statistics = __transmit(ser, data, board_key, options, source)
+    if digest is not None:
+        store_last_digest(board_key, digest)
+    return statistics
+
+
+def upload_to_port(
+    data: memoryview,
+    device_path: str,
+    board_key: str,
+    baudrate: int,
+    options: UploadOptions = UploadOptions(),
+    source: str | None = None,
+) -> UploadStatistics:
+    """Transmit a bitstream to the board at an already resolved port.
+
+    :param data: The bitstream data.
+    :type data: memoryview
+    :param device_path: The port to be opened.
+    :type device_path: str
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param baudrate: The baudrate to be used for the upload.
+    :type baudrate: int
+    :param options: Defines how the bitstream is transmitted.
+    :type options: UploadOptions
+    :param source: The bitstream file, kept as metadata in the store.
+    :type source: str | None
+    :return: The telemetry of the upload.
+    :rtype: UploadStatistics
+    """
+    with open_uart(device_path, baudrate, options) as ser:
+        return upload_to_open_port(ser, data, board_key, options, source)
+
+
+@contextmanager
+def upload_and_capture(
+    data: memoryview,
+    device_path: str,
+    board_key: str,
+    baudrate: int,
+    options: UploadOptions = UploadOptions(),
+    capture_options: CaptureOptions = CaptureOptions(),
+    source: str | None = None,
+) -> Iterator[Tuple[UploadStatistics, UartCapture]]:
+    """Transmit a bitstream and keep capturing what the design sends back.
+
+    The port is read from before the transmission until the context is left,
+    so no output of the design is lost. The port is closed on leaving.
+
+    :param data: The bitstream data.
+    :type data: memoryview
+    :param device_path: The port to be opened.
+    :type device_path: str
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param baudrate: The baudrate to be used for the upload and the capture.
+    :type baudrate: int
+    :param options: Defines how the bitstream is transmitted.
+    :type options: UploadOptions
+    :param capture_options: Defines the tee file and the buffer size.
+    :type capture_options: CaptureOptions
+    :param source: The bitstream file, kept as metadata in the store.
+    :type source: str | None
+    :return: The telemetry of the upload and the running capture.
+    :rtype: Iterator[Tuple[UploadStatistics, UartCapture]]
+    """
+    with contextlib.ExitStack() as stack:
+        ser = stack.enter_context(open_uart(device_path, baudrate, options))
+        tee = None
+        if capture_options.tee_file:
+            tee = stack.enter_context(open(capture_options.tee_file, "wb"))
+        capture = stack.enter_context(
+            UartCapture(ser, capture_options.buffer_size, tee)
+        )
+
+        options = options._replace(capturing=True)
+        yield upload_to_open_port(ser, data, board_key, options, source), capture
+
+
 def upload_bitstream(
-    bitstream_file: str, baudrate: int, ftdi_name: str, port: str
-) -> None:
+    bitstream_file: str,
+    baudrate: int,
+    ftdi_name: str,
+    port: str,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    pace: bool = True,
+    transport: str = TRANSPORT_TTY,
+    latency_timer: int = DEFAULT_LATENCY_TIMER,
+    transfer_size: int = DEFAULT_TRANSFER_SIZE,
+    diff: bool = False,
+    sparse: bool = False,
+    capture: CaptureOptions | None = None,
+    skip_loaded: bool = False,
+    device: UsbDeviceDescriptor | None = None,
+) -> UploadStatistics:
     """Upload the bitstream to the eFPGA.
 
+    The uploaded bitstream is recorded for the board, so that the next upload
+    with diff enabled only has to transmit the changed frames, and one with
+    skip_loaded enabled is skipped if the bitstream did not change. The record
+    is only valid as long as the board keeps its configuration. It is dropped
+    by the power cycle of this tool, but not if the board lost its power
+    otherwise. Directly after a power cycle, sparse can be used instead to
+    skip all frames that equal the power-on state.
+
     :param bitstream_file: The bitstream file to be uploaded.
     :type bitstream_file: str
     :param baudrate: The baudrate to be used for the upload.
+    :type baudrate: int
+    :param ftdi_name: The name of the FTDI chip to be used.
+    :type ftdi_name: str
+    :param port: The serial port or pyserial URL (e.g. loop://) to be used,
+    or the FTDI URL if the ftdi transport is used. If not given, the port of
+    the FTDI chip is looked up.
+    :type port: str
+    :param chunk_size: The maximum size of a single write in bytes.
+    :type chunk_size: int
+    :param pace: Pace the writes against the baudrate.
+    :type pace: bool
+    :param transport: The transport to be used, one of TRANSPORTS.
+    :type transport: str
+    :param latency_timer: The FTDI latency timer in milliseconds (ftdi
+    transport only).
+    :type latency_timer: int
+    :param transfer_size: The size of a single USB write transfer in bytes
+    (ftdi transport only).
+    :type transfer_size: int
+    :param diff: Only transmit the frames changed since the last upload.
+    :type diff: bool
+    :param sparse: Only transmit the frames differing from the power-on state.
+    Must only be used directly after a power cycle. Takes precedence over
+    diff.
+    :type sparse: bool
+    :param capture: Capture the output of the design after the upload, over
+    the same port.
+    :type capture: CaptureOptions | None
+    :param skip_loaded: Skip the upload if the board already holds the
+    bitstream since its last power cycle. Ignored with sparse.
+    :type skip_loaded: bool
+    :param device: The FTDI chip if it was already resolved, else it is
+    looked up by its name.
+    :type device: UsbDeviceDescriptor | None
+    :return: The telemetry of the upload.
+    :rtype: UploadStatistics
+    :raises ValueError: If the transport is unknown.
+    :raises TriggerTimeoutError: If the captured output did not match the
+    trigger in time.
+    """
+    options = UploadOptions(
+        chunk_size,
+        pace,
+        transport,
+        latency_timer,
+        transfer_size,
+        diff,
+        sparse,
+        skip_loaded=skip_loaded,
+    )
+    __check_transport(options.transport)
+
+    device_path, board_key = resolve_port(ftdi_name, port, transport, device)
+
+    logger.info(f"Using device at {device_path}")
+
+    with open_bitstream(bitstream_file) as data:
+        logger.info("Uploading bitstream...")
+        if capture is None:
+            statistics = upload_to_port(
+                data, device_path, board_key, baudrate, options, bitstream_file
+            )
+        else:
+            with upload_and_capture(
+                data, device_path, board_key, baudrate, options, capture, bitstream_file
+            ) as (statistics, uart_capture):
+                upload_end = time.perf_counter()
+                logger.info("Bitstream transmitted!")
+                log_upload_statistics(statistics)
+                capture_after_upload(uart_capture, capture, upload_end)
+                return statistics
+
+    logger.info("Bitstream transmitted!")
+    log_upload_statistics(statistics)
+
+    return statistics
+
+
+def __get_fileno(ser: serial.SerialBase) -> int | None:
+    """Get the file descriptor of a port.
+
+    :param ser: The open serial port.
+    :type ser: serial.SerialBase
+    :return: The file descriptor, or None if the port has none, e.g. for
+    loop:// or the ftdi transport.
+    :rtype: int | None
+    """
+    try:
+        return ser.fileno()
+    except (AttributeError, OSError):
+        return None
+
+
+async def upload_bitstream_async(
+    bitstream_file: str,
+    baudrate: int,
+    ftdi_name: str,
+    port: str | None = None,
+    options: UploadOptions = UploadOptions(),
+    run_blocking: BlockingRunner = asyncio.to_thread,
+) -> UploadStatistics:
+    """Upload the bitstream to the eFPGA without blocking the event loop.
+
+    A tty is written through its non-blocking file descriptor on the event
+    loop itself. The device lookup, opening the port and transports without a
+    file descriptor, like the ftdi transport, run through run_blocking. If
+    the upload is cancelled, the port is closed and the board is recorded as
+    unknown, so that the next upload with diff enabled transmits all frames.
+
+    :param bitstream_file: The bitstream file to be uploaded.
     :type bitstream_file: str
+    :param baudrate: The baudrate to be used for the upload.
+    :type baudrate: int
     :param ftdi_name: The name of the FTDI chip to be used.
+    :type ftdi_name: str
+    :param port: The serial port, pyserial URL or FTDI URL to be used. If not
+    given, the port of the FTDI chip is looked up.
+    :type port: str | None
+    :param options: Defines how the bitstream is transmitted.
+    :type options: UploadOptions
+    :param run_blocking: Runs the blocking calls, e.g. in a thread.
+    :type run_blocking: BlockingRunner
+    :return: The telemetry of the upload.
+    :rtype: UploadStatistics
+    :raises ValueError: If the transport is unknown.
+    """
+    __check_transport(options.transport)
+
+    device_path, board_key = await run_blocking(
+        resolve_port, ftdi_name, port, options.transport
+    )
+    logger.info(f"Using device at {device_path}")
+
+    with open_bitstream(bitstream_file) as data:
+        ser = await run_to_completion(
+            run_blocking(open_uart, device_path, baudrate, options)
+        )
+        try:
+            if options.transport == TRANSPORT_FTDI or __get_fileno(ser) is None:
+                statistics = await run_to_completion(
+                    run_blocking(
+                        upload_to_open_port,
+                        ser,
+                        data,
+                        board_key,
+                        options,
+                        bitstream_file,
+                    )
+                )
+            else:
+                digest, payload = await run_to_completion(
+                    run_blocking(
+                        __begin_upload, data, board_key, options, bitstream_file
+                    )
+                )
+                if payload is None:
+                    return UploadStatistics(0, [], 0.0, 0.0, 0.0)
+                statistics = await stream_bitstream_async(
+                    ser,
+                    payload,
+                    options.chunk_size,
+                    options.pace,
+                    not options.capturing,
+                )
+                if digest is not None:
+                    store_last_digest(board_key, digest)
+        finally:
+            ser.close()
+
+    logger.info(f"Bitstream transmitted to {device_path}!")
+    log_upload_statistics(statistics)
+    return statistics
+
+
+def __upload_to_device(
+    data: memoryview,
+    board_key: str,
+    device_path: str,
+    baudrate: int,
+    options: UploadOptions,
+    source: str | None,
+    open_ports: Dict[str, serial.SerialBase],
+) -> Tuple[BoardUploadResult, str | None]:
+    """Upload a bitstream to a single device of a fan-out.
+
+    Any failure is reported in the result, so that it does not affect the
+    uploads to the other boards. The bitstream is not recorded for the board,
+    since the upload may still be reported as timed out.
+
+    :param data: The bitstream data.
+    :type data: memoryview
+    :param board_key: The key of the board.
+    :type board_key: str
+    :param device_path: The port of the board.
+    :type device_path: str
+    :param baudrate: The baudrate to be used for the upload.
+    :type baudrate: int
+    :param options: Defines how the bitstream is transmitted.
+    :type options: UploadOptions
+    :param source: The bitstream file, kept as metadata in the store.
+    :type source: str | None
+    :param open_ports: The open port is added by the key of the board while
+    the upload runs, so that a timed out upload can be aborted.
+    :type open_ports: Dict[str, serial.SerialBase]
+    :return: The result of the upload, and the digest to be recorded for the
+    board if it succeeded.
+    :rtype: Tuple[BoardUploadResult, str | None]
+    """
+    start = time.perf_counter()
+    try:
+        with open_uart(device_path, baudrate, options) as ser:
+            open_ports[board_key] = ser
+            try:
+                digest, statistics = __transmit(ser, data, board_key, options, source)
+            finally:
+                open_ports.pop(board_key, None)
+    except Exception as error:
+        result = BoardUploadResult(
+            board_key,
+            device_path,
+            None,
+            str(error) or type(error).__name__,
+            time.perf_counter() - start,
+        )
+        return result, None
+    result = BoardUploadResult(
+        board_key, device_path, statistics, None, time.perf_counter() - start
+    )
+    return result, digest
+
+
+def upload_bitstream_to_all(
+    bitstream_file: str,
+    baudrate: int,
+    ftdi_name: str,
+    options: UploadOptions = UploadOptions(),
+    timeout: float = DEFAULT_BOARD_TIMEOUT,
+    devices: List[UsbDeviceDescriptor] | None = None,
+) -> List[BoardUploadResult]:
+    """Upload the bitstream concurrently to every board matching the device ID.
+
+    Every write and drain of an upload is bounded by the timeout, and the
+    port of an upload still running at the timeout is closed, which aborts
+    it. Only the boards of the uploads reported as successful are recorded
+    to hold the bitstream. The bitstream is read into memory instead of being
+    mapped, since an aborted upload may still hold views of the data when the
+    results are returned.
+
+    :param bitstream_file: The bitstream file to be uploaded.
     :type bitstream_file: str
+    :param baudrate: The baudrate to be used for the uploads.
+    :type baudrate: int
+    :param ftdi_name: The name of the FTDI chips to be used.
+    :type ftdi_name: str
+    :param options: Defines how the bitstream is transmitted.
+    :type options: UploadOptions
+    :param timeout: The time in seconds after which an upload is aborted and
+    reported as failed.
+    :type timeout: float
+    :param devices: The devices if they were already resolved, else they are
+    looked up by their name.
+    :type devices: List[UsbDeviceDescriptor] | None
+    :return: The result of the upload for every board.
+    :rtype: List[BoardUploadResult]
+    :raises ValueError: If the transport is unknown.
+    :raises NoDeviceFoundError: If no matching device was found.
     """
-    if not port:
-        logger.info("Checking device...")
+    __check_transport(options.transport)
+    if options.write_timeout is None:
+        options = options._replace(write_timeout=timeout)
 
-        device_path = get_device_path_for_device_id(ftdi_name)
-    else:
-        device_path = port
+    if devices is None:
+        devices = find_devices_matching_id(ftdi_name)
+    logger.info(f"Uploading bitstream to {len(devices)} boards...")
 
-    logger.info(f"Using device at {device_path}")
+    data = memoryview(read_bitstream_data(bitstream_file))
+    executor = ThreadPoolExecutor(max_workers=len(devices))
+    open_ports: Dict[str, serial.SerialBase] = {}
+    start = time.perf_counter()
+    uploads = []
+    for device in devices:
+        board_key = get_board_key(device)
+        device_path = get_port_for_device(device, options.transport)
+        future = None
+        if device_path is not None:
+            future = executor.submit(
+                __upload_to_device,
+                data,
+                board_key,
+                device_path,
+                baudrate,
+                options,
+                bitstream_file,
+                open_ports,
+            )
+        uploads.append((board_key, device_path, future))
 
-    data = read_bitstream_data(bitstream_file)
+    results = []
+    deadline = start + timeout
+    for board_key, device_path, future in uploads:
+        if future is None:
+            results.append(
+                BoardUploadResult(
+                    board_key, None, None, "No port found for the device.", 0.0
+                )
+            )
+            continue
+        try:
+            result, digest = future.result(
+                timeout=max(deadline - time.perf_counter(), 0)
+            )
+        except concurrent.futures.TimeoutError:
+            # Its digest is never recorded, even if it finishes in the end
+            ser = open_ports.get(board_key)
+            if ser is not None:
+                ser.close()
+            results.append(
+                BoardUploadResult(
+                    board_key,
+                    device_path,
+                    None,
+                    "Timed out",
+                    time.perf_counter() - start,
+                )
+            )
+            continue
+        if digest is not None:
+            store_last_digest(board_key, digest)
+        results.append(result)
+    executor.shutdown(wait=False, cancel_futures=True)
 
-    logger.info("Uploading bitstream...")
+    return results
 
-    with serial.Serial(device_path, baudrate) as ser:
-        ser.write(data)
 
-    logger.info("Bitstream transmitted!")
+def log_upload_results(results: List[BoardUploadResult]) -> None:
+    """Log the results of a fan-out upload as a table.
+
+    :param results: The results to be logged.
+    :type results: List[BoardUploadResult]
+    """
+    logger.info(
+        f"{'Board':<20} {'Device':<24} {'Bytes':>8} {'Time [s]':>9}"
+        + f" {'B/s':>9}  Status"
+    )
+    for result in results:
+        if result.statistics is not None:
+            transmitted = f"{result.statistics.total_bytes:>8}"
+            throughput = f"{result.statistics.throughput:>9.0f}"
+        else:
+            transmitted = f"{'-':>8}"
+            throughput = f"{'-':>9}"
+        logger.info(
+            f"{result.board_key:<20} {str(result.device_path):<24} {transmitted}"
+            + f" {result.wall_time:>9.3f} {throughput}  {result.error or 'OK'}"
+        )
 
 
 def __parse_arguments() -> argparse.Namespace:
@@ -78,7 +1164,7 @@ def __parse_arguments() -> argparse.Namespace:
         "-b",
         "--baudrate",
         help=f"Specifies the baudrate. Defaults to {DEFAULT_BAUDRATE} which is the eFPGAs"
-        + " baud rate at 10 MHz in MPW-2.",
+        + " baud rate at 10 MHz.",
         type=int,
         default=DEFAULT_BAUDRATE,
     )
@@ -95,6 +1181,47 @@ def __parse_arguments() -> argparse.Namespace:
         help="The serial port to use for uploading the bitstream.",
         type=str,
     )
+    parser.add_argument(
+        "-c",
+        "--chunk_size",
+        help="The maximum number of bytes written to the serial port at once."
+        + f" Defaults to {DEFAULT_CHUNK_SIZE}.",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+    )
+    parser.add_argument(
+        "--no_pacing",
+        help="Do not pace the writes against the baudrate.",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-t",
+        "--transport",
+        help="Use the kernel tty driver or access the FTDI chip directly."
+        + f" Defaults to {TRANSPORT_TTY}.",
+        choices=TRANSPORTS,
+        default=TRANSPORT_TTY,
+    )
+    parser.add_argument(
+        "--latency_timer",
+        help="The FTDI latency timer in milliseconds (ftdi transport only)."
+        + f" Defaults to {DEFAULT_LATENCY_TIMER}.",
+        type=int,
+        default=DEFAULT_LATENCY_TIMER,
+    )
+    parser.add_argument(
+        "--transfer_size",
+        help="The size of a USB write transfer in bytes (ftdi transport only)."
+        + " Defaults to the FIFO size of the chip.",
+        type=int,
+        default=DEFAULT_TRANSFER_SIZE,
+    )
+    parser.add_argument(
+        "-d",
+        "--diff",
+        help="Only transmit the frames changed since the last upload to the board.",
+        action="store_true",
+    )
     args = parser.parse_args()
     return args
 
@@ -102,7 +1229,18 @@ def __parse_arguments() -> argparse.Namespace:
 def main() -> None:
     """The main function containing the application logic"""
     args = __parse_arguments()
-    upload_bitstream(args.bitstream_file, args.baudrate, args.device_id, args.port)
+    upload_bitstream(
+        args.bitstream_file,
+        args.baudrate,
+        args.device_id,
+        args.port,
+        args.chunk_size,
+        not args.no_pacing,
+        args.transport,
+        args.latency_timer,
+        args.transfer_size,
+        args.diff,
+    )
 
 
 if __name__ == "__main__":